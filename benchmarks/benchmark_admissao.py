@@ -0,0 +1,217 @@
+"""
+Benchmark do controle de admissão e do single-flight sob sobrecarga
+
+A API (um processo uvicorn por configuração) recebe uma rajada de um cliente "pesado" e, logo
+depois, algumas requisições de um cliente "leve" (cabeçalho X-Client-Id), com o Azure OpenAI
+falso respondendo em `--latencia` segundos. Cada requisição tem uma descrição diferente, para
+que nenhuma seja coalescida. Configurações:
+
+- sem_controle: STRIDE_ADMISSAO_MAX_ANDAMENTO=0 (tudo é aceito e espera no semáforo do cliente)
+- admissao:     poucas vagas, fila limitada por cliente e 503 com Retry-After acima disso
+
+Para cada uma: respostas 200/503 por cliente, latência das aceitas, tempo até o 503 (o corpo
+ainda nem foi lido), Retry-After sugerido e pico de RSS da API durante a rajada.
+
+Depois, `--identicas` requisições iguais (mesma imagem e formulário, cache desligado) com e sem
+STRIDE_COALESCER_HABILITADO: chamadas que chegaram ao modelo falso e X-Cache das respostas.
+
+Uso:
+    python benchmarks/benchmark_admissao.py --pesado 100 --leve 8 --identicas 40
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import httpx
+from PIL import Image
+
+from fake_azure_openai import DIRETORIO_BACKEND, FORMULARIO_PADRAO, criar_app_fake, iniciar_servidor, porta_livre
+
+ADMISSAO = {
+    "STRIDE_ADMISSAO_MAX_ANDAMENTO": "8",
+    "STRIDE_ADMISSAO_MAX_FILA": "24",
+    "STRIDE_ADMISSAO_MAX_FILA_CLIENTE": "16",
+    "STRIDE_ADMISSAO_ESPERA_MAXIMA": "20",
+    "STRIDE_ADMISSAO_CABECALHO_CLIENTE": "X-Client-Id",
+}
+
+CONFIGURACOES = {
+    "sem_controle": {"STRIDE_ADMISSAO_MAX_ANDAMENTO": "0", "STRIDE_COALESCER_HABILITADO": "false"},
+    "admissao": {**ADMISSAO, "STRIDE_COALESCER_HABILITADO": "false"},
+}
+
+
+def criar_imagem_ruidosa(semente=0) -> bytes:
+    """PNG de ~1,4 MB (ruído não comprime): o upload pesa na memória de quem o aceita"""
+    import io
+    import random
+
+    rng = random.Random(semente)
+    img = Image.frombytes("RGB", (800, 600), bytes(rng.getrandbits(8) for _ in range(800 * 600 * 3)))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def iniciar_api(porta_fake, extras):
+    porta = porta_livre()
+    ambiente = {
+        **os.environ,
+        "AZURE_OPENAI_API_KEY": "fake-key",
+        "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{porta_fake}",
+        "AZURE_OPENAI_API_VERSION": "2024-02-01",
+        "AZURE_OPENAI_DEPLOYMENT_NAME": "gpt-4o-fake",
+        "STRIDE_CACHE_HABILITADO": "false",
+        **extras
+    }
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(porta),
+         "--log-level", "warning"],
+        cwd=DIRETORIO_BACKEND, env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    inicio = time.monotonic()
+    while time.monotonic() - inicio < 60:
+        try:
+            if httpx.get(f"http://127.0.0.1:{porta}/health/ready", timeout=1).status_code == 200:
+                return processo, porta
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    processo.kill()
+    raise RuntimeError("A API não ficou pronta em 60s")
+
+
+def memoria_mb(pid, campo):
+    """VmRSS (atual) ou VmHWM (pico desde o início) do processo; None fora do Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linha in f:
+                if linha.startswith(f"{campo}:"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+async def enviar(cliente, imagem, cliente_id, descricao):
+    inicio = time.perf_counter()
+    resposta = await cliente.post(
+        "/analisar_ameacas", files={"imagem": ("diagrama.png", imagem, "image/png")},
+        data={**FORMULARIO_PADRAO, "descricao_aplicacao": descricao}, headers={"X-Client-Id": cliente_id}
+    )
+    return {
+        "cliente": cliente_id,
+        "status": resposta.status_code,
+        "segundos": time.perf_counter() - inicio,
+        "retry_after": resposta.headers.get("retry-after"),
+        "x_cache": resposta.headers.get("x-cache"),
+    }
+
+
+async def rajada(porta, imagem, pesado, leve, atraso_leve):
+    limites = httpx.Limits(max_connections=pesado + leve, max_keepalive_connections=pesado + leve)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta}", timeout=None, limits=limites) as cliente:
+        async def clientes_leves():
+            await asyncio.sleep(atraso_leve)
+            return await asyncio.gather(*(enviar(cliente, imagem, "leve", f"Aplicação leve {i}") for i in range(leve)))
+
+        inicio = time.perf_counter()
+        pesados, leves = await asyncio.gather(
+            asyncio.gather(*(enviar(cliente, imagem, "pesado", f"Aplicação pesada {i}") for i in range(pesado))),
+            clientes_leves()
+        )
+        return list(pesados) + list(leves), time.perf_counter() - inicio
+
+
+def percentil(valores, p):
+    if not valores:
+        return float("nan")
+    ordenados = sorted(valores)
+    return ordenados[min(int(p * len(ordenados)), len(ordenados) - 1)]
+
+
+def cenario_sobrecarga(porta_fake, args):
+    print(f"1. Rajada: {args.pesado} requisições do cliente pesado + {args.leve} do leve "
+          f"(modelo falso: {args.latencia}s por chamada)")
+    imagem = criar_imagem_ruidosa()
+    print(f"   imagem de {len(imagem) / 1e6:.1f} MB por requisição")
+    for nome, extras in CONFIGURACOES.items():
+        processo, porta = iniciar_api(porta_fake, extras)
+        try:
+            base = memoria_mb(processo.pid, "VmRSS")
+            registros, duracao = asyncio.run(rajada(porta, imagem, args.pesado, args.leve, args.atraso_leve))
+            pico = memoria_mb(processo.pid, "VmHWM")
+        finally:
+            processo.terminate()
+            processo.wait()
+
+        print(f"   {nome} (rajada concluída em {duracao:.1f}s"
+              + (f", RSS {base:.0f} MB -> pico {pico:.0f} MB)" if base is not None else ")"))
+        for cliente_id in ("pesado", "leve"):
+            proprios = [r for r in registros if r["cliente"] == cliente_id]
+            status = Counter(r["status"] for r in proprios)
+            aceitas = [r["segundos"] for r in proprios if r["status"] == 200]
+            recusadas = [r["segundos"] for r in proprios if r["status"] == 503]
+            linha = (f"      {cliente_id:<7} 200: {status.get(200, 0):>3}  503: {status.get(503, 0):>3}"
+                     f"  outros: {sum(n for s, n in status.items() if s not in (200, 503)):>2}")
+            if aceitas:
+                linha += f" | aceitas p50 {percentil(aceitas, 0.5):5.2f}s p95 {percentil(aceitas, 0.95):5.2f}s"
+            if recusadas:
+                sugestoes = sorted({int(r["retry_after"]) for r in proprios if r["retry_after"]})
+                linha += (f" | 503 em p50 {percentil(recusadas, 0.5) * 1000:4.0f} ms "
+                          f"(Retry-After {sugestoes[0]}-{sugestoes[-1]}s)")
+            print(linha)
+
+
+async def identicas(porta, imagem, quantidade):
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta}", timeout=None) as cliente:
+        return await asyncio.gather(*(
+            enviar(cliente, imagem, f"cliente-{i}", FORMULARIO_PADRAO["descricao_aplicacao"]) for i in range(quantidade)
+        ))
+
+
+def cenario_coalescimento(app_fake, porta_fake, args):
+    print(f"\n2. {args.identicas} análises idênticas simultâneas (cache de resultados desligado)")
+    imagem = criar_imagem_ruidosa(semente=1)
+    for nome, habilitado in (("sem single-flight", "false"), ("single-flight", "true")):
+        processo, porta = iniciar_api(porta_fake, {**ADMISSAO, "STRIDE_ADMISSAO_MAX_ANDAMENTO": "64",
+                                                   "STRIDE_COALESCER_HABILITADO": habilitado})
+        try:
+            antes = app_fake.state.contadores["requisicoes"]
+            inicio = time.perf_counter()
+            registros = asyncio.run(identicas(porta, imagem, args.identicas))
+            duracao = time.perf_counter() - inicio
+        finally:
+            processo.terminate()
+            processo.wait()
+        chamadas = app_fake.state.contadores["requisicoes"] - antes
+        x_cache = Counter(r["x_cache"] for r in registros if r["status"] == 200)
+        print(f"   {nome:<18} chamadas ao modelo: {chamadas:>3} | X-Cache {dict(x_cache)} | "
+              f"latência mediana {statistics.median(r['segundos'] for r in registros):.2f}s | total {duracao:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pesado", type=int, default=100, help="Requisições simultâneas do cliente pesado")
+    parser.add_argument("--leve", type=int, default=8, help="Requisições do cliente leve")
+    parser.add_argument("--atraso-leve", type=float, default=0.5, help="Atraso do cliente leve (s)")
+    parser.add_argument("--identicas", type=int, default=40, help="Requisições idênticas do cenário 2")
+    parser.add_argument("--latencia", type=float, default=1.0, help="Latência do modelo falso (s)")
+    args = parser.parse_args()
+
+    porta_fake = porta_livre()
+    app_fake = criar_app_fake(latencia=args.latencia)
+    iniciar_servidor(app_fake, porta_fake)
+
+    cenario_sobrecarga(porta_fake, args)
+    cenario_coalescimento(app_fake, porta_fake, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark do roteamento entre vários deployments: throughput agregado e p99 com backends
+falsos de latências e taxas de throttling diferentes.
+
+Cenários:
+- unico: só o deployment mais rápido (com a cota dele), como antes do roteador
+- menor_carga / latencia: os três deployments atrás do RoteadorModelos
+
+Uso:
+    python benchmarks/benchmark_balanceamento.py --requisicoes 300 --concorrencia 60
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from openai import AsyncAzureOpenAI
+
+from fake_azure_openai import DIRETORIO_BACKEND, criar_app_fake, iniciar_servidor, porta_livre
+
+sys.path.insert(0, str(DIRETORIO_BACKEND))
+from cliente_openai import ClienteResiliente, FalhaModelo  # noqa: E402
+from roteador import Backend, RoteadorModelos  # noqa: E402
+
+MENSAGENS = [{"role": "user", "content": "Gere o modelo de ameaças STRIDE do diagrama."}]
+
+# nome: (latência em s, cota RPM, fração de 429 aleatórios, fração de 500)
+BACKENDS_FALSOS = {
+    "ptu-brazilsouth": (0.3, 1200, 0.0, 0.0),
+    "payg-eastus": (0.6, 0, 0.10, 0.0),
+    "payg-swedencentral": (1.0, 0, 0.0, 0.05),
+}
+
+CENARIOS = {
+    "unico": (["ptu-brazilsouth"], "menor_carga"),
+    "menor_carga": (list(BACKENDS_FALSOS), "menor_carga"),
+    "latencia": (list(BACKENDS_FALSOS), "latencia"),
+}
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(int(len(ordenados) * p), len(ordenados) - 1)]
+
+
+def subir_backends():
+    portas = {}
+    for semente, (nome, (latencia, rpm, taxa_429, taxa_500)) in enumerate(BACKENDS_FALSOS.items()):
+        portas[nome] = porta_livre()
+        app = criar_app_fake(latencia=latencia, limite_rpm=rpm or None, taxa_429=taxa_429,
+                             taxa_500=taxa_500, semente=semente)
+        iniciar_servidor(app, portas[nome])
+    return portas
+
+
+async def executar_cenario(nome, portas, args):
+    nomes, estrategia = CENARIOS[nome]
+    multiplos = len(nomes) > 1
+    backends = []
+    for nome_backend in nomes:
+        client = AsyncAzureOpenAI(
+            api_key="fake-key", azure_endpoint=f"http://127.0.0.1:{portas[nome_backend]}",
+            api_version="2024-02-01", azure_deployment="gpt-4o-fake", max_retries=0, timeout=30
+        )
+        cliente = ClienteResiliente(
+            client, "gpt-4o-fake", max_concorrencia=args.concorrencia_backend,
+            max_tentativas=0 if multiplos else 6, backoff_base=0.5, backoff_max=10, prazo=args.prazo
+        )
+        backends.append(Backend(nome=nome_backend, cliente=cliente))
+    roteador = RoteadorModelos(backends, estrategia=estrategia, max_tentativas=6 if multiplos else 0,
+                               prazo=args.prazo)
+
+    latencias, falhas = [], 0
+    pendentes = asyncio.Semaphore(args.concorrencia)
+
+    async def chamar():
+        nonlocal falhas
+        async with pendentes:
+            inicio = time.perf_counter()
+            try:
+                await roteador.criar(MENSAGENS, max_tokens=100)
+                latencias.append(time.perf_counter() - inicio)
+            except FalhaModelo:
+                falhas += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(chamar() for _ in range(args.requisicoes)))
+    duracao = time.perf_counter() - inicio
+    distribuicao = {b.nome: b.contadores["sucessos"] for b in backends}
+    await roteador.fechar()
+
+    return {
+        "cenario": nome,
+        "ok": len(latencias),
+        "falhas": falhas,
+        "failovers": roteador.failovers,
+        "throughput_rps": round(len(latencias) / duracao, 2),
+        "p50_s": round(percentil(latencias, 0.5), 2),
+        "p99_s": round(percentil(latencias, 0.99), 2),
+        "distribuicao": distribuicao,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requisicoes", type=int, default=300)
+    parser.add_argument("--concorrencia", type=int, default=60, help="Requisições simultâneas dos clientes")
+    parser.add_argument("--concorrencia-backend", type=int, default=16, help="Chamadas simultâneas por deployment")
+    parser.add_argument("--prazo", type=float, default=60.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    portas = subir_backends()
+    print(f"{args.requisicoes} requisições, concorrência {args.concorrencia}, "
+          f"{args.concorrencia_backend} chamadas simultâneas por deployment")
+    for nome, (latencia, rpm, taxa_429, taxa_500) in BACKENDS_FALSOS.items():
+        print(f"  {nome}: latência {latencia}s, cota {rpm or '-'} RPM, {taxa_429:.0%} de 429, {taxa_500:.0%} de 500")
+    print(f"{'cenário':<12} {'ok':>4} {'falhas':>6} {'failovers':>9} {'throughput':>11} {'p50':>6} {'p99':>6}  distribuição")
+    for nome in CENARIOS:
+        r = asyncio.run(executar_cenario(nome, portas, args))
+        print(f"{r['cenario']:<12} {r['ok']:>4} {r['falhas']:>6} {r['failovers']:>9} {r['throughput_rps']:>9}/s "
+              f"{r['p50_s']:>5}s {r['p99_s']:>5}s  {r['distribuicao']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""
+Teste de carga da API com o Azure OpenAI falso, sem credenciais nem rede
+
+O servidor falso e a API (uvicorn main:app) sobem em processos separados; o gerador de carga
+mantém `--concorrencia` requisições em andamento até completar `--requisicoes`. Ao final, mostra
+e grava em JSON:
+
+  - throughput (requisições/s) e latência p50/p95/p99 (no stream, também até a primeira ameaça)
+  - status HTTP e X-Cache de cada resposta
+  - taxa de falha do parse (stride_parse_total no /metrics da API: ok, reparado, falha)
+  - memória da API: RSS antes da carga, pico durante a carga e (pico - base) / concorrência
+  - contadores do servidor falso (429, 500 e respostas com JSON corrompido)
+
+Com `--comparar` o resultado é confrontado com um JSON anterior, e o script sai com código 1
+se throughput, latência, memória ou falhas de parse piorarem além de `--tolerancia`.
+
+Uso:
+    python benchmarks/benchmark_carga.py --concorrencia 32 --requisicoes 500 --latencia 2 \\
+        --latencia-sigma 0.5 --taxa-json-invalido 0.1 --saida resultados/carga.json
+    python benchmarks/benchmark_carga.py --endpoint stream --gravacoes examples/results
+    python benchmarks/benchmark_carga.py --comparar resultados/carga.json --tolerancia 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from fake_azure_openai import DIRETORIO_BACKEND, FORMULARIO_PADRAO, RAIZ_PROJETO, criar_imagem_diagrama, porta_livre
+
+ENDPOINTS = {"sync": "/analisar_ameacas", "stream": "/analisar_ameacas/stream"}
+
+# Métrica -> (caminho no JSON, sentido em que melhora, tolerância relativa ou em pontos)
+COMPARACOES = {
+    "throughput_rps": (("throughput_rps",), "maior", "relativa"),
+    "latencia p50": (("latencia_ms", "p50"), "menor", "relativa"),
+    "latencia p95": (("latencia_ms", "p95"), "menor", "relativa"),
+    "latencia p99": (("latencia_ms", "p99"), "menor", "relativa"),
+    "memoria por requisição": (("memoria_mb", "por_requisicao"), "menor", "relativa"),
+    "taxa de falha do parse": (("parse", "taxa_falha"), "menor", "absoluta"),
+}
+
+
+def percentil(valores, p):
+    """Percentil pelo método nearest-rank"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[max(math.ceil(p / 100 * len(ordenados)) - 1, 0)]
+
+
+def resumo_latencias(segundos):
+    if not segundos:
+        return None
+    return {
+        "p50": round(percentil(segundos, 50) * 1000, 1),
+        "p95": round(percentil(segundos, 95) * 1000, 1),
+        "p99": round(percentil(segundos, 99) * 1000, 1),
+        "max": round(max(segundos) * 1000, 1),
+        "media": round(sum(segundos) / len(segundos) * 1000, 1)
+    }
+
+
+def rss_mb(pid):
+    """RSS atual do processo (Linux); None em sistemas sem /proc"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linha in f:
+                if linha.startswith("VmRSS:"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def commit_atual():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ_PROJETO,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        alterado = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=RAIZ_PROJETO,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if alterado else commit
+
+
+def iniciar_processo(comando, porta, caminho_pronto, cwd=None, env=None, logs=False, limite=30):
+    """Sobe o processo e espera `caminho_pronto` responder 200"""
+    saida = None if logs else subprocess.DEVNULL
+    processo = subprocess.Popen(comando, cwd=cwd, env=env, stdout=saida, stderr=saida)
+    inicio = time.monotonic()
+    while time.monotonic() - inicio < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f"Processo encerrou ao iniciar: {' '.join(comando)}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{porta}{caminho_pronto}", timeout=1).status_code == 200:
+                return processo
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    processo.kill()
+    raise RuntimeError(f"Processo não respondeu em {limite}s: {' '.join(comando)}")
+
+
+def iniciar_servidores(args):
+    porta_fake = porta_livre()
+    comando_fake = [
+        sys.executable, str(Path(__file__).with_name("fake_azure_openai.py")), "--porta", str(porta_fake),
+        "--latencia", str(args.latencia), "--latencia-sigma", str(args.latencia_sigma),
+        "--primeiro-token", str(args.primeiro_token), "--tempo-por-caractere", str(args.tempo_por_caractere),
+        "--taxa-429", str(args.taxa_429), "--taxa-500", str(args.taxa_500),
+        "--taxa-json-invalido", str(args.taxa_json_invalido), "--semente", str(args.semente)
+    ]
+    if args.limite_rpm:
+        comando_fake += ["--limite-rpm", str(args.limite_rpm)]
+    if args.gravacoes:
+        comando_fake += ["--gravacoes", str(Path(args.gravacoes).resolve())]
+    fake = iniciar_processo(comando_fake, porta_fake, "/contadores", logs=args.logs)
+
+    porta_api = porta_livre()
+    ambiente = {
+        **os.environ,
+        "AZURE_OPENAI_API_KEY": "fake-key",
+        "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{porta_fake}",
+        "AZURE_OPENAI_API_VERSION": "2024-02-01",
+        "AZURE_OPENAI_DEPLOYMENT_NAME": "gpt-4o-fake",
+        "STRIDE_CACHE_HABILITADO": "true" if args.cache else "false",
+        # Todas as requisições enviam a mesma imagem: com o single-flight ligado, as simultâneas
+        # virariam uma só chamada ao modelo e a carga mediria o coalescing, não o pipeline
+        "STRIDE_COALESCER_HABILITADO": "true" if args.cache else "false",
+    }
+    for variavel in args.env:
+        chave, _, valor = variavel.partition("=")
+        ambiente[chave] = valor
+    try:
+        api = iniciar_processo(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(porta_api),
+             "--log-level", "warning"],
+            porta_api, "/", cwd=DIRETORIO_BACKEND, env=ambiente, logs=args.logs
+        )
+    except RuntimeError:
+        fake.terminate()
+        raise
+    return fake, porta_fake, api, porta_api
+
+
+async def contadores_parse(cliente):
+    texto = (await cliente.get("/metrics")).text
+    return {rotulo: float(valor) for rotulo, valor in
+            re.findall(r'stride_parse_total\{resultado="(\w+)"\} ([0-9.e+]+)', texto)}
+
+
+async def enviar(cliente, endpoint, imagem):
+    """Uma análise; devolve (status, x-cache, segundos, segundos até a primeira ameaça, raw_response?)"""
+    inicio = time.perf_counter()
+    arquivos = {"imagem": ("diagrama.png", imagem, "image/png")}
+    if endpoint == "sync":
+        resposta = await cliente.post(ENDPOINTS[endpoint], files=arquivos, data=FORMULARIO_PADRAO)
+        duracao = time.perf_counter() - inicio
+        sem_json = resposta.status_code == 200 and "raw_response" in resposta.json()
+        return resposta.status_code, resposta.headers.get("x-cache"), duracao, None, sem_json
+
+    primeira_ameaca, sem_json = None, False
+    async with cliente.stream("POST", ENDPOINTS[endpoint], files=arquivos, data=FORMULARIO_PADRAO) as resposta:
+        async for linha in resposta.aiter_lines():
+            if not linha:
+                continue
+            evento = json.loads(linha)["event"]
+            if evento == "threat" and primeira_ameaca is None:
+                primeira_ameaca = time.perf_counter() - inicio
+            elif evento == "warning":
+                sem_json = True
+    return resposta.status_code, resposta.headers.get("x-cache"), time.perf_counter() - inicio, primeira_ameaca, sem_json
+
+
+async def executar(args, porta_api, pid_api, porta_fake):
+    imagem = criar_imagem_diagrama()
+    limites = httpx.Limits(max_connections=args.concorrencia, max_keepalive_connections=args.concorrencia)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta_api}", timeout=None, limits=limites) as cliente:
+        if args.aquecimento:
+            await asyncio.gather(*(enviar(cliente, args.endpoint, imagem) for _ in range(args.aquecimento)))
+        base_mb = rss_mb(pid_api)
+        parse_antes = await contadores_parse(cliente)
+
+        registros = []
+        pendentes = iter(range(args.requisicoes))
+        pico = {"mb": base_mb}
+        em_andamento = {"ativo": True}
+
+        async def amostrar_memoria():
+            while em_andamento["ativo"]:
+                atual = rss_mb(pid_api)
+                if atual is not None:
+                    pico["mb"] = max(pico["mb"] or 0, atual)
+                await asyncio.sleep(0.05)
+
+        async def trabalhador():
+            for _ in pendentes:
+                try:
+                    registros.append(await enviar(cliente, args.endpoint, imagem))
+                except httpx.HTTPError as e:
+                    registros.append((type(e).__name__, None, None, None, False))
+
+        amostrador = asyncio.create_task(amostrar_memoria())
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabalhador() for _ in range(args.concorrencia)))
+        duracao = time.perf_counter() - inicio
+        em_andamento["ativo"] = False
+        await amostrador
+
+        parse_depois = await contadores_parse(cliente)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta_fake}") as cliente_fake:
+        servidor_falso = (await cliente_fake.get("/contadores")).json()
+
+    parse = {rotulo: int(parse_depois.get(rotulo, 0) - parse_antes.get(rotulo, 0)) for rotulo in ("ok", "reparado", "falha")}
+    total_parse = sum(parse.values())
+    parse["taxa_falha"] = round(parse["falha"] / total_parse, 4) if total_parse else 0.0
+    parse["taxa_reparo"] = round(parse["reparado"] / total_parse, 4) if total_parse else 0.0
+    parse["respostas_sem_json"] = sum(1 for registro in registros if registro[4])
+
+    sucesso = [registro[2] for registro in registros if registro[0] == 200]
+    memoria = None
+    if base_mb is not None:
+        memoria = {
+            "base": round(base_mb, 1),
+            "pico": round(pico["mb"], 1),
+            "por_requisicao": round((pico["mb"] - base_mb) / args.concorrencia, 3)
+        }
+    return {
+        "commit": commit_atual(),
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "configuracao": {chave: valor for chave, valor in vars(args).items() if chave not in ("saida", "comparar", "tolerancia", "tolerancia_parse", "logs")},
+        "requisicoes": len(registros),
+        "duracao_s": round(duracao, 3),
+        "throughput_rps": round(len(sucesso) / duracao, 2),
+        "latencia_ms": resumo_latencias(sucesso),
+        "primeira_ameaca_ms": resumo_latencias([registro[3] for registro in registros if registro[3] is not None]),
+        "status": dict(Counter(str(registro[0]) for registro in registros)),
+        "x_cache": dict(Counter(registro[1] for registro in registros if registro[1])),
+        "parse": parse,
+        "memoria_mb": memoria,
+        "servidor_falso": servidor_falso
+    }
+
+
+def valor_em(resultado, caminho):
+    for chave in caminho:
+        if not isinstance(resultado, dict):
+            return None
+        resultado = resultado.get(chave)
+    return resultado
+
+
+def comparar(anterior, atual, tolerancia, tolerancia_parse):
+    """Tabela de variações; devolve as métricas que pioraram além da tolerância"""
+    print(f"\nComparação com {anterior.get('commit')} ({anterior.get('data')}), tolerância {tolerancia:.0%} "
+          f"(parse: {tolerancia_parse:.1%})")
+    diferentes = sorted(
+        chave for chave in set(anterior.get("configuracao", {})) | set(atual["configuracao"])
+        if anterior.get("configuracao", {}).get(chave) != atual["configuracao"].get(chave)
+    )
+    if diferentes:
+        print(f"   atenção: configurações diferentes ({', '.join(diferentes)})")
+    regressoes = []
+    for nome, (caminho, melhora, tipo) in COMPARACOES.items():
+        antes, depois = valor_em(anterior, caminho), valor_em(atual, caminho)
+        if antes is None or depois is None:
+            continue
+        piora = (antes - depois) if melhora == "maior" else (depois - antes)
+        if tipo == "relativa":
+            relativa = piora / antes if antes else 0.0
+            variacao = f"{(depois - antes) / antes:+.1%}" if antes else "-"
+            regrediu = relativa > tolerancia
+        else:
+            variacao = f"{depois - antes:+.4f}"
+            regrediu = piora > tolerancia_parse
+        if regrediu:
+            regressoes.append(nome)
+        print(f"   {nome:<24} {antes:>10} -> {depois:<10} {variacao:>8} {'REGRESSÃO' if regrediu else ''}")
+    return regressoes
+
+
+def imprimir(resultado):
+    print(f"commit {resultado['commit']} | {resultado['requisicoes']} requisições em {resultado['duracao_s']}s "
+          f"| {resultado['throughput_rps']} req/s")
+    print(f"   latência (ms): {resultado['latencia_ms']}")
+    if resultado["primeira_ameaca_ms"]:
+        print(f"   primeira ameaça (ms): {resultado['primeira_ameaca_ms']}")
+    print(f"   status: {resultado['status']} | X-Cache: {resultado['x_cache']}")
+    print(f"   parse: {resultado['parse']}")
+    print(f"   memória da API (MB): {resultado['memoria_mb']}")
+    print(f"   servidor falso: {resultado['servidor_falso']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="sync")
+    parser.add_argument("--concorrencia", type=int, default=16, help="Requisições simultâneas")
+    parser.add_argument("--requisicoes", type=int, default=200, help="Total de requisições medidas")
+    parser.add_argument("--aquecimento", type=int, default=4, help="Requisições antes da medição (não contam)")
+    parser.add_argument("--latencia", type=float, default=1.0, help="Latência mediana do modelo falso (s)")
+    parser.add_argument("--latencia-sigma", type=float, default=0.0, help="Sigma da latência log-normal (0 = fixa)")
+    parser.add_argument("--primeiro-token", type=float, default=0.3, help="Tempo até o primeiro pedaço no stream (s)")
+    parser.add_argument("--tempo-por-caractere", type=float, default=0.0)
+    parser.add_argument("--limite-rpm", type=int, default=None, help="Cota do deployment falso (429 acima dela)")
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    parser.add_argument("--taxa-500", type=float, default=0.0)
+    parser.add_argument("--taxa-json-invalido", type=float, default=0.0, help="Fração de respostas com JSON corrompido")
+    parser.add_argument("--gravacoes", help="Respostas gravadas (.json/.jsonl ou diretório) no lugar do exemplo")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--cache", action="store_true",
+                        help="Mantém o cache de resultados e o single-flight (STRIDE_COALESCER_HABILITADO) ligados")
+    parser.add_argument("--env", action="append", default=[], metavar="CHAVE=VALOR",
+                        help="Variável de ambiente extra para a API (pode repetir)")
+    parser.add_argument("--logs", action="store_true", help="Mostra os logs da API e do servidor falso")
+    parser.add_argument("--saida", help="Arquivo JSON com o resultado")
+    parser.add_argument("--comparar", help="Resultado anterior (JSON) para detectar regressões")
+    parser.add_argument("--tolerancia", type=float, default=0.1,
+                        help="Piora relativa aceita em latência, throughput e memória")
+    parser.add_argument("--tolerancia-parse", type=float, default=0.01,
+                        help="Aumento aceito na taxa de falha do parse (0.01 = 1 ponto percentual)")
+    args = parser.parse_args()
+
+    fake, porta_fake, api, porta_api = iniciar_servidores(args)
+    try:
+        resultado = asyncio.run(executar(args, porta_api, api.pid, porta_fake))
+    finally:
+        api.terminate()
+        fake.terminate()
+        api.wait()
+        fake.wait()
+
+    imprimir(resultado)
+    if args.saida:
+        Path(args.saida).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.saida).write_text(json.dumps(resultado, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"resultado gravado em {args.saida}")
+    if args.comparar:
+        regressoes = comparar(json.loads(Path(args.comparar).read_text(encoding="utf-8")), resultado, args.tolerancia,
+                              args.tolerancia_parse)
+        if regressoes:
+            print(f"Regressões: {', '.join(regressoes)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
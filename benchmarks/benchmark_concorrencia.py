@@ -0,0 +1,71 @@
+"""
+Benchmark de concorrência do endpoint /analisar_ameacas
+
+Dispara N análises simultâneas contra um Azure OpenAI falso com latência fixa e
+mede o tempo total. Com o cliente assíncrono o total fica próximo de uma latência
+do modelo, e não de N. Também mede o /health enquanto as análises estão em curso.
+
+Uso:
+    python benchmarks/benchmark_concorrencia.py --requisicoes 16 --latencia 2
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from fake_azure_openai import (
+    FORMULARIO_PADRAO, configurar_ambiente, criar_app_fake, criar_imagem_diagrama,
+    importar_api, iniciar_servidor, porta_livre
+)
+
+
+async def executar(requisicoes, latencia):
+    main = importar_api()
+    imagem = criar_imagem_diagrama()
+    transporte = httpx.ASGITransport(app=main.app)
+
+    # O ASGITransport não dispara o lifespan, que cria os clientes do worker
+    async with main.app.router.lifespan_context(main.app), \
+            httpx.AsyncClient(transport=transporte, base_url="http://api", timeout=None) as cliente:
+        async def analisar():
+            resposta = await cliente.post(
+                "/analisar_ameacas",
+                files={"imagem": ("diagrama.png", imagem, "image/png")},
+                data=FORMULARIO_PADRAO
+            )
+            return resposta.status_code
+
+        inicio = time.perf_counter()
+        tarefas = [asyncio.create_task(analisar()) for _ in range(requisicoes)]
+
+        await asyncio.sleep(latencia / 4)
+        inicio_health = time.perf_counter()
+        await cliente.get("/health")
+        tempo_health = time.perf_counter() - inicio_health
+
+        status = await asyncio.gather(*tarefas)
+        total = time.perf_counter() - inicio
+
+    sucesso = sum(1 for s in status if s == 200)
+    print(f"Requisições: {requisicoes} | Sucesso: {sucesso}")
+    print(f"Latência do modelo falso: {latencia:.2f}s")
+    print(f"Tempo total: {total:.2f}s ({total / latencia:.2f}x a latência do modelo)")
+    print(f"Tempo do /health durante a carga: {tempo_health * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requisicoes", type=int, default=16)
+    parser.add_argument("--latencia", type=float, default=2.0)
+    args = parser.parse_args()
+
+    porta = porta_livre()
+    iniciar_servidor(criar_app_fake(latencia=args.latencia), porta)
+    configurar_ambiente(porta, AZURE_OPENAI_MAX_CONCURRENCY=max(args.requisicoes, 1))
+    asyncio.run(executar(args.requisicoes, args.latencia))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Benchmark de respostas cortadas por max_tokens: orçamento fixo x adaptativo x continuação
+
+Diagramas sintéticos com 3 a 40 componentes são analisados pela API (um processo uvicorn por
+configuração) contra o Azure OpenAI falso, que corta a resposta em max_tokens e lista mais
+ameaças para diagramas maiores. Configurações:
+
+- fixo:             max_tokens=2000 em toda análise, sem continuação (comportamento anterior)
+- fixo+continuacao: max_tokens=2000 e até STRIDE_CONTINUACOES_MAX continuações
+- adaptativo:       max_tokens estimado pela densidade de bordas e pela descrição, com continuação
+
+Para cada uma: ameaças recuperadas em relação à resposta completa, análises incompletas (que o
+usuário teria de refazer), chamadas ao modelo, max_tokens reservado (conta no limitador de TPM)
+e os tokens das continuações informados no /metrics.
+
+Uso:
+    python benchmarks/benchmark_continuacao.py --repeticoes 3
+"""
+
+import argparse
+import io
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+import httpx
+from PIL import Image, ImageDraw
+
+from fake_azure_openai import DIRETORIO_BACKEND, FORMULARIO_PADRAO, criar_app_fake, iniciar_servidor, porta_livre
+
+COMPONENTES = (3, 6, 10, 15, 25, 40)
+
+CONFIGURACOES = {
+    "fixo": {"STRIDE_ORCAMENTO_ADAPTATIVO": "false", "STRIDE_CONTINUACOES_MAX": "0"},
+    "fixo+continuacao": {"STRIDE_ORCAMENTO_ADAPTATIVO": "false"},
+    "adaptativo": {},
+    # Orçamento folgado o bastante para nunca cortar: dá o número de ameaças da resposta completa
+    "referencia": {"STRIDE_MAX_TOKENS_MIN": "16000", "STRIDE_MAX_TOKENS_MAX": "16000"},
+}
+
+
+def criar_diagrama(componentes: int, semente=0) -> bytes:
+    """Diagrama PNG com `componentes` caixas rotuladas ligadas por linhas"""
+    rng = random.Random(semente)
+    img = Image.new("RGB", (1600, 1000), color="white")
+    draw = ImageDraw.Draw(img)
+    colunas = max(1, int(componentes ** 0.5 * 1.5))
+    centros = []
+    for i in range(componentes):
+        x = 60 + (i % colunas) * (1500 // colunas)
+        y = 60 + (i // colunas) * 170
+        draw.rectangle([x, y, x + 120, y + 70], outline=rng.choice(["blue", "green", "red", "black"]), width=3)
+        draw.text((x + 10, y + 28), f"Serviço {i}", fill="black")
+        centros.append((x + 60, y + 35))
+    for i in range(1, componentes):
+        draw.line([centros[i - 1], centros[rng.randrange(i)]], fill="black", width=2)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def iniciar_api(porta_fake, configuracao):
+    porta = porta_livre()
+    ambiente = {
+        **os.environ,
+        "AZURE_OPENAI_API_KEY": "fake-key",
+        "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{porta_fake}",
+        "AZURE_OPENAI_API_VERSION": "2024-02-01",
+        "AZURE_OPENAI_DEPLOYMENT_NAME": "gpt-4o-fake",
+        "STRIDE_CACHE_HABILITADO": "false",
+        **CONFIGURACOES[configuracao]
+    }
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(porta),
+         "--log-level", "warning"],
+        cwd=DIRETORIO_BACKEND, env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    inicio = time.monotonic()
+    while time.monotonic() - inicio < 60:
+        try:
+            if httpx.get(f"http://127.0.0.1:{porta}/health/ready", timeout=1).status_code == 200:
+                return processo, porta
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    processo.kill()
+    raise RuntimeError("A API não ficou pronta em 60s")
+
+
+def metricas(cliente) -> dict:
+    texto = cliente.get("/metrics").text
+    valores = {}
+    for nome, rotulo, valor in re.findall(r'(stride_continuacao_tokens_total|stride_continuacoes_total)'
+                                          r'\{\w+="(\w+)"\} ([0-9.e+]+)', texto):
+        valores[f"{nome}:{rotulo}"] = float(valor)
+    return valores
+
+
+def executar(configuracao, app_fake, porta_fake, diagramas, repeticoes):
+    processo, porta = iniciar_api(porta_fake, configuracao)
+    antes = dict(app_fake.state.contadores)
+    ameacas, orcamentos, continuacoes = {}, {}, 0
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{porta}", timeout=None) as cliente:
+            for componentes, imagem in diagramas.items():
+                for _ in range(repeticoes):
+                    reservado = app_fake.state.contadores["max_tokens"]
+                    resposta = cliente.post(
+                        "/analisar_ameacas", files={"imagem": ("diagrama.png", imagem, "image/png")},
+                        data=FORMULARIO_PADRAO
+                    )
+                    resposta.raise_for_status()
+                    dados = resposta.json()
+                    ameacas.setdefault(componentes, []).append(len(dados.get("threat_model") or []))
+                    orcamentos.setdefault(componentes, []).append(app_fake.state.contadores["max_tokens"] - reservado)
+                    continuacoes += (dados.get("continuation") or {}).get("continuations", 0)
+            valores = metricas(cliente)
+    finally:
+        processo.terminate()
+        processo.wait()
+    depois = app_fake.state.contadores
+    return {
+        "ameacas": ameacas,
+        "orcamentos": orcamentos,
+        "chamadas": depois["requisicoes"] - antes["requisicoes"],
+        "cortadas": depois["cortadas"] - antes["cortadas"],
+        "continuacoes": continuacoes,
+        "tokens_gastos": valores.get("stride_continuacao_tokens_total:gastos", 0),
+        "tokens_economizados": valores.get("stride_continuacao_tokens_total:economizados", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticoes", type=int, default=3, help="Análises de cada diagrama por configuração")
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latência do modelo falso (s)")
+    args = parser.parse_args()
+
+    porta_fake = porta_livre()
+    app_fake = criar_app_fake(latencia=args.latencia, respeitar_max_tokens=True, ameacas_por_imagem=True,
+                              cache_prefixo=True)
+    iniciar_servidor(app_fake, porta_fake)
+    diagramas = {componentes: criar_diagrama(componentes) for componentes in COMPONENTES}
+
+    resultados = {nome: executar(nome, app_fake, porta_fake, diagramas, args.repeticoes) for nome in CONFIGURACOES}
+    referencia = {componentes: max(valores) for componentes, valores in resultados.pop("referencia")["ameacas"].items()}
+    total_analises = len(COMPONENTES) * args.repeticoes
+
+    print("Ameaças recuperadas por diagrama (média) / resposta completa")
+    print(f"   {'componentes':<18}" + "".join(f"{c:>8}" for c in COMPONENTES))
+    print(f"   {'completa':<18}" + "".join(f"{referencia[c]:>8}" for c in COMPONENTES))
+    for nome, resultado in resultados.items():
+        medias = [sum(resultado["ameacas"][c]) / len(resultado["ameacas"][c]) for c in COMPONENTES]
+        print(f"   {nome:<18}" + "".join(f"{media:>8.1f}" for media in medias))
+
+    print("\nmax_tokens reservado por análise, somando as continuações (média)")
+    for nome, resultado in resultados.items():
+        medias = [sum(resultado["orcamentos"][c]) / len(resultado["orcamentos"][c]) for c in COMPONENTES]
+        print(f"   {nome:<18}" + "".join(f"{media:>8.0f}" for media in medias))
+
+    print(f"\nPor configuração ({total_analises} análises)")
+    for nome, resultado in resultados.items():
+        incompletas = sum(1 for c in COMPONENTES for n in resultado["ameacas"][c] if n < referencia[c])
+        print(f"   {nome:<18} incompletas {incompletas:>3} | chamadas {resultado['chamadas']:>3} "
+              f"(cortadas {resultado['cortadas']:>3}, continuações {resultado['continuacoes']:>3}) | "
+              f"tokens das continuações: gastos {resultado['tokens_gastos']:>7.0f}, "
+              f"economizados {resultado['tokens_economizados']:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
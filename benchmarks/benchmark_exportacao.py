@@ -0,0 +1,153 @@
+"""
+Benchmark das exportações em fluxo (CSV, SARIF, XLSX, Markdown e zip por análise)
+
+1. Em processo, para cada tamanho em `--ameacas`: vazão (ameaças/s e MB/s) e pico de memória
+   Python (tracemalloc) de cada formato em fluxo, lendo o repositório em lotes, contra a mesma
+   exportação materializada (todas as análises em uma lista e o arquivo inteiro em memória antes
+   de gravar, como os scripts que salvavam o JSON em disco)
+2. Ponta a ponta na API (uvicorn em outro processo): download de cada formato em
+   /ameacas/exportar e do zip em /ameacas/exportar/arquivo, com o RSS de pico do servidor
+
+Uso:
+    python benchmarks/benchmark_exportacao.py --ameacas 20000 100000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+
+from benchmark_admissao import iniciar_api, memoria_mb
+from benchmark_repositorio import resultado_sintetico
+from fake_azure_openai import DIRETORIO_BACKEND, criar_app_fake, iniciar_servidor, porta_livre
+
+sys.path.insert(0, str(DIRETORIO_BACKEND))
+from exportacao import FORMATOS, exportar_analises, exportar_arquivo  # noqa: E402
+from repositorio import RepositorioAmeacas  # noqa: E402
+
+SUGESTOES = ["Habilitar MFA para contas administrativas", "Registrar trilhas de auditoria imutáveis",
+             "Aplicar rate limiting no API Gateway", "Rotacionar segredos no Key Vault",
+             "Validar entradas no backend", "Criptografar dados sensíveis em repouso"]
+
+
+def popular(caminho, ameacas):
+    """Análises sintéticas (~20 ameaças e 4 sugestões cada) até somar `ameacas` ameaças"""
+    rng = random.Random(42)
+    repositorio = RepositorioAmeacas(caminho)
+    total = 0
+    while total < ameacas:
+        resultado = resultado_sintetico(rng)
+        resultado["threat_model"] = resultado["threat_model"][:ameacas - total]
+        resultado["improvement_suggestions"] = rng.sample(SUGESTOES, 4)
+        resultado["summary"] = {"total_threats": len(resultado["threat_model"]), "application_type": "Web App",
+                                "has_internet_access": "Sim", "authentication_method": "OAuth 2.0"}
+        repositorio.registrar({"tipo_aplicacao": "Web App", "acesso_internet": "Sim", "autenticacao": "OAuth 2.0"},
+                              resultado, projeto=f"projeto-{total % 7}")
+        total += len(resultado["threat_model"])
+    return repositorio
+
+
+def em_fluxo(repositorio, formato):
+    """Grava a exportação bloco a bloco (em /dev/null); devolve os bytes gravados"""
+    analises = repositorio.iterar_analises()
+    blocos = exportar_arquivo(["csv", "sarif", "md"], analises) if formato == "zip" else exportar_analises(formato, analises)
+    tamanho = 0
+    with open(os.devnull, "wb") as destino:
+        for bloco in blocos:
+            destino.write(bloco)
+            tamanho += len(bloco)
+    return tamanho
+
+
+def materializada(repositorio, formato):
+    """Todas as análises em memória e o arquivo inteiro montado antes de gravar"""
+    analises = list(repositorio.iterar_analises(tamanho_lote=1_000_000))
+    if formato == "zip":
+        conteudo = b"".join(exportar_arquivo(["csv", "sarif", "md"], analises))
+    else:
+        conteudo = b"".join(exportar_analises(formato, analises))
+    with open(os.devnull, "wb") as destino:
+        destino.write(conteudo)
+    return len(conteudo)
+
+
+def medir(funcao, repositorio, formato):
+    inicio = time.perf_counter()
+    tamanho = funcao(repositorio, formato)
+    duracao = time.perf_counter() - inicio
+    # Segunda execução só para o pico de memória (o tracemalloc deixa tudo mais lento)
+    tracemalloc.start()
+    funcao(repositorio, formato)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duracao, tamanho, pico
+
+
+def benchmark_processo(lista_ameacas):
+    print("1. Exportação em processo: em fluxo x materializada")
+    for ameacas in lista_ameacas:
+        with tempfile.TemporaryDirectory() as diretorio:
+            repositorio = popular(os.path.join(diretorio, "ameacas.db"), ameacas)
+            print(f"   {ameacas} ameaças ({repositorio.estatisticas()['analises']} análises)")
+            for formato in [*FORMATOS, "zip"]:
+                duracao, tamanho, pico = medir(em_fluxo, repositorio, formato)
+                duracao_mat, _, pico_mat = medir(materializada, repositorio, formato)
+                print(f"      {formato:<6} {tamanho / 1e6:7.1f} MB | em fluxo {duracao:5.2f}s "
+                      f"({ameacas / duracao:8.0f} ameaças/s, {tamanho / 1e6 / duracao:5.1f} MB/s), pico "
+                      f"{pico / 1e6:6.1f} MB | materializada {duracao_mat:5.2f}s, pico {pico_mat / 1e6:6.1f} MB")
+            repositorio.fechar()
+
+
+async def baixar(porta, caminho, parametros):
+    inicio = time.perf_counter()
+    tamanho = 0
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta}", timeout=None) as cliente:
+        async with cliente.stream("GET", caminho, params=parametros) as resposta:
+            resposta.raise_for_status()
+            async for bloco in resposta.aiter_raw():
+                tamanho += len(bloco)
+    return time.perf_counter() - inicio, tamanho
+
+
+def benchmark_api(ameacas):
+    print(f"2. API: /ameacas/exportar com {ameacas} ameaças")
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho = os.path.join(diretorio, "ameacas.db")
+        popular(caminho, ameacas).fechar()
+        porta_fake = porta_livre()
+        iniciar_servidor(criar_app_fake(latencia=0.05), porta_fake)
+        processo, porta = iniciar_api(porta_fake, {"STRIDE_REPOSITORIO_HABILITADO": "true",
+                                                   "STRIDE_REPOSITORIO_SQLITE": caminho})
+        try:
+            base = memoria_mb(processo.pid, "VmRSS")
+            downloads = [(formato, "/ameacas/exportar", {"formato": formato}) for formato in FORMATOS]
+            downloads.append(("zip", "/ameacas/exportar/arquivo", {"formatos": "csv,sarif,md"}))
+            for formato, rota, parametros in downloads:
+                duracao, tamanho = asyncio.run(baixar(porta, rota, parametros))
+                print(f"   {formato:<6} {tamanho / 1e6:7.1f} MB em {duracao:5.2f}s ({ameacas / duracao:8.0f} ameaças/s, "
+                      f"{tamanho / 1e6 / duracao:5.1f} MB/s)")
+            pico = memoria_mb(processo.pid, "VmHWM")
+        finally:
+            processo.terminate()
+            processo.wait()
+    if base is not None:
+        print(f"   RSS do servidor: {base:.0f} MB depois de iniciar, pico de {pico:.0f} MB durante as exportações")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ameacas", type=int, nargs="+", default=[20000, 100000])
+    args = parser.parse_args()
+
+    benchmark_processo(args.ameacas)
+    benchmark_api(max(args.ameacas))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark do fan-out por categoria STRIDE: tempo total da chamada única x sete chamadas
+menores em paralelo (seis categorias + sugestões de melhoria)
+
+O Azure OpenAI falso gera a resposta "token a token": a latência é um tempo fixo mais um
+custo por caractere devolvido, e no fan-out cada chamada recebe só a parte que pediu.
+Com --falhar, as categorias informadas respondem 500 para exercitar o resultado parcial.
+
+Uso:
+    python benchmarks/benchmark_fanout.py --latencia 0.5 --tempo-por-caractere 0.002
+    python benchmarks/benchmark_fanout.py --falhar Repudiation
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+import httpx
+
+from fake_azure_openai import (
+    FORMULARIO_PADRAO, configurar_ambiente, criar_app_fake, criar_imagem_diagrama,
+    importar_api, iniciar_servidor, porta_livre
+)
+
+
+async def analisar(cliente, imagem, fanout, repeticao):
+    # Campos diferentes a cada chamada para não responder pelo cache
+    formulario = {**FORMULARIO_PADRAO, "descricao_aplicacao": f"benchmark fan-out {fanout} {repeticao}",
+                  "fanout": str(fanout).lower()}
+    inicio = time.perf_counter()
+    resposta = await cliente.post(
+        "/analisar_ameacas", files={"imagem": ("diagrama.png", imagem, "image/png")}, data=formulario
+    )
+    return time.perf_counter() - inicio, resposta
+
+
+async def executar(porta_api, repeticoes):
+    imagem = criar_imagem_diagrama()
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta_api}", timeout=None) as cliente:
+        for fanout in (False, True):
+            tempos, ultima = [], None
+            for repeticao in range(repeticoes):
+                duracao, ultima = await analisar(cliente, imagem, fanout, repeticao)
+                tempos.append(duracao)
+            dados = ultima.json()
+            nome = "fan-out" if fanout else "única"
+            if ultima.status_code != 200:
+                print(f"{nome:<8} HTTP {ultima.status_code}: {dados}")
+                continue
+            print(f"{nome:<8} mediana {statistics.median(tempos):6.2f}s | "
+                  f"{dados['summary']['total_threats']} ameaças, {len(dados['improvement_suggestions'])} sugestões")
+            if fanout:
+                relatorio = dados["fan_out"]
+                print(f"         parcial: {relatorio['partial']}")
+                for parte, info in relatorio["requests"].items():
+                    print(f"         {parte:<26} {info['status']:<12} {info['latency_s']:6.2f}s "
+                          f"{info['threats']:>2} ameaças {info['suggestions']:>2} sugestões")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.5, help="Tempo fixo de cada chamada (s)")
+    parser.add_argument("--tempo-por-caractere", type=float, default=0.002,
+                        help="Custo de geração por caractere da resposta (s)")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--falhar", nargs="*", default=[], help="Categorias que respondem 500")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    porta_fake = porta_livre()
+    iniciar_servidor(criar_app_fake(
+        latencia=args.latencia, tempo_por_caractere=args.tempo_por_caractere,
+        conteudo_por_prompt=True, falhar_categorias=tuple(args.falhar)
+    ), porta_fake)
+    configurar_ambiente(porta_fake, AZURE_OPENAI_MAX_RETRIES=0, STRIDE_PREPROCESSAMENTO_HABILITADO="false")
+    porta_api = porta_livre()
+    iniciar_servidor(importar_api().app, porta_api)
+    asyncio.run(executar(porta_api, args.repeticoes))
+
+
+if __name__ == "__main__":
+    main()
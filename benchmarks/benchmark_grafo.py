@@ -0,0 +1,150 @@
+"""
+Benchmark do grafo de ameaças montado no servidor (layout pronto, formato compacto e chunks)
+
+1. Grafo de uma análise (~20 ameaças): tempo de construção + layout e tamanho do campo graph
+2. Portfólio com N análises: leitura do repositório, construção + layout (uma vez por versão),
+   tempo de cada chunk depois disso e tamanho do formato compacto x elementos do Cytoscape
+   (o JSON que o front-end montaria com {data, position} por nó)
+3. Ponta a ponta na API: primeiro chunk de /ameacas/grafo (frio e com o grafo já montado) e
+   todos os chunks em sequência, como o front-end faz
+
+Uso:
+    python benchmarks/benchmark_grafo.py --analises 100 500 2000 --tamanho-chunk 2000
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+import orjson
+
+from benchmark_repositorio import resultado_sintetico
+from fake_azure_openai import DIRETORIO_BACKEND, configurar_ambiente, criar_app_fake, importar_api, iniciar_servidor, porta_livre
+
+sys.path.insert(0, str(DIRETORIO_BACKEND))
+from grafo import construir_grafo, montar_portfolio  # noqa: E402
+from repositorio import RepositorioAmeacas  # noqa: E402
+
+
+def elementos_cytoscape(chunk: dict) -> list:
+    """O mesmo grafo no formato de elementos do Cytoscape, para comparar o tamanho"""
+    nos = [{"data": {"id": id_no, "kind": tipo, "label": rotulo, "group": grupo}, "position": {"x": x, "y": y}}
+           for id_no, tipo, rotulo, x, y, grupo in chunk["nodes"]]
+    arestas = [{"data": {"source": origem, "target": destino, "kind": tipo, "label": rotulo}}
+               for origem, destino, tipo, rotulo in chunk["edges"]]
+    return nos + arestas
+
+
+def popular(caminho, analises):
+    rng = random.Random(42)
+    repositorio = RepositorioAmeacas(caminho)
+    for i in range(analises):
+        repositorio.registrar(
+            {"tipo_aplicacao": "Web App", "acesso_internet": rng.choice(["Sim", "Não"])},
+            resultado_sintetico(rng), projeto=f"projeto-{i}" if i % 4 == 0 else None
+        )
+    return repositorio
+
+
+def benchmark_analise(repeticoes):
+    print("1. Grafo de uma análise")
+    rng = random.Random(7)
+    resultados = [resultado_sintetico(rng) for _ in range(repeticoes)]
+    tempos, tamanhos = [], []
+    for resultado in resultados:
+        inicio = time.perf_counter()
+        chunk = construir_grafo(resultado["threat_model"], "Sim").chunk()
+        tempos.append(time.perf_counter() - inicio)
+        tamanhos.append(len(orjson.dumps(chunk)))
+    print(f"   construção + layout: mediana {statistics.median(tempos) * 1000:.2f} ms | "
+          f"campo graph: {statistics.median(tamanhos) / 1024:.1f} KB "
+          f"(~{statistics.median(len(r['threat_model']) for r in resultados):.0f} ameaças)")
+
+
+def benchmark_portfolio(lista_analises, tamanho_chunk):
+    print("2. Portfólio")
+    for analises in lista_analises:
+        with tempfile.TemporaryDirectory() as diretorio:
+            repositorio = popular(os.path.join(diretorio, "ameacas.db"), analises)
+            inicio = time.perf_counter()
+            lista = repositorio.listar_analises(versao=repositorio.versao(), limite=analises)
+            leitura = time.perf_counter() - inicio
+            inicio = time.perf_counter()
+            grafo = montar_portfolio(lista)
+            montagem = time.perf_counter() - inicio
+            tempos, compacto, cytoscape = [], 0, 0
+            chunks = math.ceil(len(grafo.nos) / tamanho_chunk)
+            for indice in range(chunks):
+                inicio = time.perf_counter()
+                chunk = grafo.chunk(indice, tamanho_chunk)
+                corpo = orjson.dumps(chunk)
+                tempos.append(time.perf_counter() - inicio)
+                compacto += len(corpo)
+                cytoscape += len(orjson.dumps(elementos_cytoscape(chunk)))
+            repositorio.fechar()
+        print(f"   {analises:>5} análises: {len(grafo.nos):>6} nós, {len(grafo.arestas):>6} arestas | leitura "
+              f"{leitura * 1000:6.0f} ms, construção + layout {montagem * 1000:6.0f} ms | {chunks:>3} chunks, "
+              f"{statistics.median(tempos) * 1000:5.1f} ms cada | {compacto / 1e6:5.1f} MB compacto x "
+              f"{cytoscape / 1e6:5.1f} MB em elementos do Cytoscape")
+
+
+async def percorrer_chunks(cliente, tamanho_chunk, analises):
+    parametros = {"tamanho_chunk": tamanho_chunk, "limite_analises": analises}
+    inicio = time.perf_counter()
+    primeiro = (await cliente.get("/ameacas/grafo", params=parametros)).json()
+    tempo_primeiro = time.perf_counter() - inicio
+    for indice in range(1, primeiro["chunks"]):
+        resposta = await cliente.get("/ameacas/grafo", params={
+            **parametros, "chunk": indice, "versao": primeiro["version"]
+        })
+        resposta.raise_for_status()
+    return tempo_primeiro, time.perf_counter() - inicio, primeiro
+
+
+def benchmark_api(analises, tamanho_chunk):
+    print(f"3. /ameacas/grafo na API ({analises} análises)")
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho = os.path.join(diretorio, "ameacas.db")
+        popular(caminho, analises).fechar()
+        porta_fake = porta_livre()
+        iniciar_servidor(criar_app_fake(latencia=0.05), porta_fake)
+        configurar_ambiente(porta_fake, STRIDE_REPOSITORIO_HABILITADO="true", STRIDE_REPOSITORIO_SQLITE=caminho)
+        main = importar_api()
+        porta = porta_livre()
+        iniciar_servidor(main.app, porta)
+
+        async def executar():
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta}", timeout=None) as cliente:
+                frio = await percorrer_chunks(cliente, tamanho_chunk, analises)
+                quente = await percorrer_chunks(cliente, tamanho_chunk, analises)
+            return frio, quente
+
+        (primeiro_frio, total_frio, chunk), (primeiro_quente, total_quente, _) = asyncio.run(executar())
+    print(f"   {chunk['total_nodes']} nós em {chunk['chunks']} chunks | primeiro chunk: {primeiro_frio * 1000:.0f} ms "
+          f"(montando o grafo), {primeiro_quente * 1000:.0f} ms (já montado) | todos os chunks: "
+          f"{total_frio * 1000:.0f} ms / {total_quente * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--analises", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--tamanho-chunk", type=int, default=2000)
+    parser.add_argument("--repeticoes", type=int, default=200)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    benchmark_analise(args.repeticoes)
+    benchmark_portfolio(args.analises, args.tamanho_chunk)
+    benchmark_api(max(args.analises), args.tamanho_chunk)
+
+
+if __name__ == "__main__":
+    main()
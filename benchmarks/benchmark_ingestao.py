@@ -0,0 +1,110 @@
+"""
+Micro-benchmark de memória/latência da ingestão de imagens
+
+Compara o caminho antigo (read + arquivo temporário + releitura + b64encode) com a
+leitura em blocos do módulo imagem.py. Cada medição roda em um subprocesso próprio
+para que o pico de RSS (ru_maxrss) reflita apenas uma requisição.
+
+Uso:
+    python benchmarks/benchmark_ingestao.py --tamanhos 1 10 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_azure_openai import DIRETORIO_BACKEND
+
+ASSINATURA_PNG = b"\x89PNG\r\n\x1a\n"
+
+
+def criar_upload(caminho):
+    """UploadFile equivalente ao criado pelo parser multipart (spool em disco acima de 1 MB)"""
+    from starlette.datastructures import Headers, UploadFile
+
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    with open(caminho, "rb") as origem:
+        while bloco := origem.read(1024 * 1024):
+            spool.write(bloco)
+    tamanho = spool.tell()
+    spool.seek(0)
+    return UploadFile(file=spool, size=tamanho, filename="diagrama.png",
+                      headers=Headers({"content-type": "image/png"}))
+
+
+async def ingestao_antiga(upload):
+    import base64
+    content = await upload.read()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as temp_file:
+        temp_file.write(content)
+        temp_file_path = temp_file.name
+    with open(temp_file_path, "rb") as image_file:
+        encoded_string = base64.b64encode(image_file.read()).decode('ascii')
+    url = f"data:image/png;base64,{encoded_string}"
+    os.remove(temp_file_path)
+    return len(url)
+
+
+async def ingestao_nova(upload):
+    from imagem import ler_imagem
+    recebida = await ler_imagem(upload, 64 * 1024 * 1024)
+    return len(recebida.data_url())
+
+
+def rss_atual_kb():
+    """RSS corrente do processo (ru_maxrss guarda apenas o pico desde o início)"""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def medir(modo, caminho):
+    """Executado no subprocesso: mede pico de RSS e tempo de uma ingestão"""
+    sys.path.insert(0, str(DIRETORIO_BACKEND))
+    import imagem  # noqa: F401 - importado antes da medição
+    upload = criar_upload(caminho)
+    funcao = ingestao_antiga if modo == "antigo" else ingestao_nova
+
+    rss_inicial = rss_atual_kb()
+    inicio = time.perf_counter()
+    asyncio.run(funcao(upload))
+    duracao = time.perf_counter() - inicio
+    rss_final = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(json.dumps({"pico_rss_kb": rss_final - rss_inicial, "duracao_ms": duracao * 1000}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[1, 10, 20], help="Tamanhos em MB")
+    parser.add_argument("--medir", nargs=2, metavar=("MODO", "ARQUIVO"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        medir(*args.medir)
+        return
+
+    print(f"{'Tamanho':>8} | {'Modo':>6} | {'Pico RSS (MB)':>13} | {'Tempo (ms)':>10}")
+    for tamanho_mb in args.tamanhos:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as arquivo:
+            arquivo.write(ASSINATURA_PNG + os.urandom(tamanho_mb * 1024 * 1024 - len(ASSINATURA_PNG)))
+        try:
+            for modo in ("antigo", "novo"):
+                saida = subprocess.run(
+                    [sys.executable, __file__, "--medir", modo, arquivo.name],
+                    capture_output=True, text=True, check=True
+                ).stdout
+                resultado = json.loads(saida.strip().splitlines()[-1])
+                print(f"{tamanho_mb:>6}MB | {modo:>6} | {resultado['pico_rss_kb'] / 1024:>13.1f} | "
+                      f"{resultado['duracao_ms']:>10.1f}")
+        finally:
+            os.remove(arquivo.name)
+
+
+if __name__ == "__main__":
+    main()
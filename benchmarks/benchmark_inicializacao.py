@@ -0,0 +1,159 @@
+"""
+Benchmark de inicialização: importação do módulo e cold start dos workers
+
+1. Importação de main.py em um processo novo (mediana de --repeticoes) e os imports diretos
+   mais lentos (python -X importtime). A importação não cria clientes nem abre bancos
+2. Cold start de `python servidor.py` com cada quantidade de workers: tempo até o primeiro
+   /health/ready 200 e até todos os workers responderem, e tempo de encerramento
+3. Primeira análise depois do ready x as seguintes, com o Azure OpenAI falso (o que ainda
+   sobra de inicialização preguiçosa para a primeira requisição)
+
+Uso:
+    python benchmarks/benchmark_inicializacao.py --workers 1 2 4 --repeticoes 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from fake_azure_openai import (
+    DIRETORIO_BACKEND, FORMULARIO_PADRAO, criar_app_fake, criar_imagem_diagrama, iniciar_servidor, porta_livre
+)
+
+
+def ambiente_api(porta_fake, **extras):
+    return {
+        **os.environ,
+        "AZURE_OPENAI_API_KEY": "fake-key",
+        "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{porta_fake}",
+        "AZURE_OPENAI_API_VERSION": "2024-02-01",
+        "AZURE_OPENAI_DEPLOYMENT_NAME": "gpt-4o-fake",
+        "STRIDE_CACHE_HABILITADO": "false",
+        "STRIDE_LOG_LEVEL": "warning",
+        **{chave: str(valor) for chave, valor in extras.items()}
+    }
+
+
+def benchmark_importacao(ambiente, repeticoes):
+    print("1. Importação de main.py (processo novo)")
+    codigo = "import time; inicio = time.perf_counter(); import main; print(time.perf_counter() - inicio)"
+    tempos = []
+    for _ in range(repeticoes):
+        saida = subprocess.run([sys.executable, "-c", codigo], cwd=DIRETORIO_BACKEND, env=ambiente,
+                               capture_output=True, text=True, check=True)
+        tempos.append(float(saida.stdout.strip().splitlines()[-1]))
+    print(f"   import main: mediana {statistics.median(tempos) * 1000:.0f} ms "
+          f"(mín {min(tempos) * 1000:.0f} ms, máx {max(tempos) * 1000:.0f} ms)")
+
+    saida = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=DIRETORIO_BACKEND,
+                           env=ambiente, capture_output=True, text=True, check=True)
+    diretos = []
+    for linha in saida.stderr.splitlines():
+        if not linha.startswith("import time:") or "cumulative" in linha:
+            continue
+        proprio, acumulado, nome = linha.removeprefix("import time:").split("|")
+        nome = nome[1:]
+        # Depois do espaço separador, imports feitos diretamente por main.py têm dois espaços de recuo
+        if nome.startswith("  ") and not nome.startswith("   "):
+            diretos.append((int(acumulado), nome.strip()))
+        elif nome.strip() == "main":
+            diretos.append((int(proprio), "main (corpo do módulo)"))
+    for acumulado, nome in sorted(diretos, reverse=True)[:8]:
+        print(f"   {nome:<28} {acumulado / 1000:7.1f} ms")
+
+
+def esperar_pronto(porta, processo, limite=60):
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < limite:
+        if processo.poll() is not None:
+            raise RuntimeError("servidor.py encerrou durante o startup")
+        try:
+            resposta = httpx.get(f"http://127.0.0.1:{porta}/health/ready", timeout=1)
+            if resposta.status_code == 200:
+                return resposta.json()["worker"]
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"/health/ready não respondeu em {limite}s")
+
+
+def benchmark_cold_start(porta_fake, lista_workers):
+    print("2. Cold start de servidor.py")
+    for workers in lista_workers:
+        porta = porta_livre()
+        inicio = time.perf_counter()
+        processo = subprocess.Popen(
+            [sys.executable, "servidor.py"], cwd=DIRETORIO_BACKEND,
+            env=ambiente_api(porta_fake, STRIDE_WORKERS=workers, STRIDE_PORTA=porta, STRIDE_HOST="127.0.0.1"),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            vistos = {esperar_pronto(porta, processo)}
+            primeiro = time.perf_counter() - inicio
+            # Conexões novas a cada chamada: o kernel distribui entre os workers que já aceitam
+            while len(vistos) < workers and time.perf_counter() - inicio < 60:
+                try:
+                    resposta = httpx.get(f"http://127.0.0.1:{porta}/health/ready", timeout=1)
+                    if resposta.status_code == 200:
+                        vistos.add(resposta.json()["worker"])
+                except httpx.TransportError:
+                    pass
+            todos = time.perf_counter() - inicio
+        finally:
+            inicio_parada = time.perf_counter()
+            processo.terminate()
+            processo.wait()
+            parada = time.perf_counter() - inicio_parada
+        print(f"   {workers} worker(s): primeiro ready {primeiro:.2f}s | {len(vistos)}/{workers} workers em "
+              f"{todos:.2f}s | encerramento {parada:.2f}s")
+
+
+def benchmark_primeira_analise(porta_fake, analises):
+    print("3. Primeira análise depois do ready (1 worker)")
+    porta = porta_livre()
+    processo = subprocess.Popen(
+        [sys.executable, "servidor.py"], cwd=DIRETORIO_BACKEND,
+        env=ambiente_api(porta_fake, STRIDE_WORKERS=1, STRIDE_PORTA=porta, STRIDE_HOST="127.0.0.1"),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    imagem = criar_imagem_diagrama()
+    try:
+        esperar_pronto(porta, processo)
+        tempos = []
+        with httpx.Client(base_url=f"http://127.0.0.1:{porta}", timeout=None) as cliente:
+            for _ in range(analises):
+                inicio = time.perf_counter()
+                resposta = cliente.post("/analisar_ameacas", files={"imagem": ("diagrama.png", imagem, "image/png")},
+                                        data=FORMULARIO_PADRAO)
+                resposta.raise_for_status()
+                tempos.append(time.perf_counter() - inicio)
+    finally:
+        processo.terminate()
+        processo.wait()
+    print(f"   primeira: {tempos[0] * 1000:.0f} ms | seguintes (mediana): "
+          f"{statistics.median(tempos[1:]) * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--analises", type=int, default=6)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latência do modelo falso (s)")
+    args = parser.parse_args()
+
+    porta_fake = porta_livre()
+    iniciar_servidor(criar_app_fake(latencia=args.latencia), porta_fake)
+
+    benchmark_importacao(ambiente_api(porta_fake), args.repeticoes)
+    benchmark_cold_start(porta_fake, args.workers)
+    benchmark_primeira_analise(porta_fake, args.analises)
+
+
+if __name__ == "__main__":
+    main()
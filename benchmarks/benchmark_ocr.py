@@ -0,0 +1,201 @@
+"""
+Benchmark do OCR local do diagrama (texto no prompt + imagem em detail low)
+
+1. Extração em processo, em diagramas de N componentes em grade (rótulos de uma ou duas linhas,
+   setas com ponta na horizontal e na vertical): tempo por diagrama e acerto dos componentes e
+   dos fluxos com sentido contra o que foi desenhado
+2. Vazão da extração: em sequência x no pool de processos usado pela API
+3. Ponta a ponta na API (uvicorn em outro processo, cache de resultados desligado): tokens de
+   prompt por análise e latência no caminho atual (imagem em detail high) x OCR + detail low,
+   com diagramas novos (OCR executado) e reenviados (extração servida do cache por hash)
+
+O backend padrão é o "teste", que lê os rótulos gravados no PNG e deixa a detecção de setas
+com o ocr.py; com o Tesseract instalado use --backend tesseract para medir o OCR de verdade.
+
+Uso:
+    python benchmarks/benchmark_ocr.py --componentes 4 9 16 30 --requisicoes 20
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+from PIL import Image, ImageDraw, PngImagePlugin
+
+from benchmark_admissao import iniciar_api
+from fake_azure_openai import DIRETORIO_BACKEND, FORMULARIO_PADRAO, criar_app_fake, iniciar_servidor, porta_livre
+
+sys.path.insert(0, str(DIRETORIO_BACKEND))
+from ocr import CHAVE_METADADOS, extrair_diagrama  # noqa: E402
+
+NOMES = ["Frontend", "API Gateway", "Auth Service", "Orders API", "Payments", "Database", "Cache Redis", "Queue",
+         "Worker", "Storage", "CDN", "Admin Portal", "Search", "Notifications", "Billing", "Reports"]
+LARGURA_CAIXA, ALTURA_CAIXA, ESPACO = 150, 90, 80
+
+
+def desenhar_seta(draw, origem, destino):
+    """Linha entre as bordas de duas caixas vizinhas, com a ponta triangular no destino"""
+    (ax0, ay0, ax1, ay1), (bx0, by0, bx1, by1) = origem, destino
+    if bx0 > ax1 or ax0 > bx1:
+        y = (max(ay0, by0) + min(ay1, by1)) // 2
+        inicio, fim = ((ax1, y), (bx0, y)) if bx0 > ax1 else ((ax0, y), (bx1, y))
+    else:
+        x = (max(ax0, bx0) + min(ax1, bx1)) // 2 + 30
+        inicio, fim = ((x, ay1), (x, by0)) if by0 > ay1 else ((x, ay0), (x, by1))
+    draw.line([inicio, fim], fill="black", width=2)
+    dx, dy = (fim[0] > inicio[0]) - (fim[0] < inicio[0]), (fim[1] > inicio[1]) - (fim[1] < inicio[1])
+    bx, by = fim[0] - dx * 10, fim[1] - dy * 10
+    draw.polygon([fim, (bx - dy * 6, by - dx * 6), (bx + dy * 6, by + dx * 6)], fill="black")
+
+
+def criar_diagrama(componentes, semente):
+    """PNG com os componentes em grade e setas entre vizinhos; devolve (bytes, nomes, fluxos desenhados)"""
+    rng = random.Random(semente)
+    colunas = max(2, round(componentes ** 0.5))
+    linhas = -(-componentes // colunas)
+    img = Image.new("RGB", (colunas * (LARGURA_CAIXA + ESPACO) + ESPACO, linhas * (ALTURA_CAIXA + ESPACO) + ESPACO),
+                    "white")
+    draw = ImageDraw.Draw(img)
+    rotulos, caixas, nomes = [], [], []
+    for i in range(componentes):
+        linha, coluna = divmod(i, colunas)
+        x0, y0 = ESPACO + coluna * (LARGURA_CAIXA + ESPACO), ESPACO + linha * (ALTURA_CAIXA + ESPACO)
+        caixa = (x0, y0, x0 + LARGURA_CAIXA, y0 + ALTURA_CAIXA)
+        draw.rectangle(caixa, outline=rng.choice(["black", "blue", "green", "red"]), width=2)
+        nome = NOMES[i % len(NOMES)] + (f" {i // len(NOMES) + 1}" if i >= len(NOMES) else "")
+        partes = nome.split(" ", 1) if " " in nome and rng.random() < 0.3 else [nome]
+        for j, parte in enumerate(partes):
+            posicao = (x0 + 20, y0 + 30 + j * 14)
+            draw.text(posicao, parte, fill="black")
+            rotulos.append([parte, *draw.textbbox(posicao, parte)])
+        caixas.append(caixa)
+        nomes.append(nome)
+
+    fluxos = set()
+    for i in range(componentes):
+        vizinhos = [j for j in (i + 1, i + colunas) if j < componentes and (j != i + 1 or (i + 1) % colunas)]
+        for j in vizinhos:
+            if rng.random() < 0.6:
+                origem, destino = (i, j) if rng.random() < 0.5 else (j, i)
+                desenhar_seta(draw, caixas[origem], caixas[destino])
+                fluxos.add((nomes[origem], nomes[destino]))
+
+    info = PngImagePlugin.PngInfo()
+    info.add_text(CHAVE_METADADOS, json.dumps({"largura": img.width, "rotulos": rotulos}))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", pnginfo=info)
+    return buffer.getvalue(), nomes, fluxos
+
+
+def benchmark_extracao(lista_componentes, backend, repeticoes):
+    print(f"1. Extração em processo (backend {backend})")
+    for componentes in lista_componentes:
+        tempos, acertos_componentes, acertos_fluxos, desenhados, falsos = [], 0, 0, 0, 0
+        for semente in range(repeticoes):
+            conteudo, nomes, fluxos = criar_diagrama(componentes, semente)
+            inicio = time.perf_counter()
+            extracao = extrair_diagrama(conteudo, backend)
+            tempos.append(time.perf_counter() - inicio)
+            acertos_componentes += len(set(extracao.componentes) & set(nomes))
+            lidos = {(origem, destino) for origem, destino, direcionado in extracao.fluxos if direcionado}
+            acertos_fluxos += len(lidos & fluxos)
+            desenhados += len(fluxos)
+            falsos += len(lidos - fluxos)
+        print(f"   {componentes:>3} componentes: {statistics.median(tempos) * 1000:6.1f} ms por diagrama | componentes "
+              f"{acertos_componentes / (componentes * repeticoes):6.1%} | fluxos com sentido "
+              f"{acertos_fluxos / max(desenhados, 1):6.1%} ({falsos} falsos)")
+
+
+def benchmark_pool(componentes, backend, diagramas, workers):
+    print(f"2. Vazão da extração ({diagramas} diagramas de {componentes} componentes, {os.cpu_count()} CPUs)")
+    conteudos = [criar_diagrama(componentes, semente)[0] for semente in range(diagramas)]
+    inicio = time.perf_counter()
+    for conteudo in conteudos:
+        extrair_diagrama(conteudo, backend)
+    sequencial = time.perf_counter() - inicio
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(extrair_diagrama, conteudos[:workers], [backend] * workers))  # aquece os processos
+        inicio = time.perf_counter()
+        list(executor.map(extrair_diagrama, conteudos, [backend] * diagramas))
+        pool = time.perf_counter() - inicio
+    print(f"   em sequência: {diagramas / sequencial:6.1f} diagramas/s | pool de {workers} processos: "
+          f"{diagramas / pool:6.1f} diagramas/s")
+
+
+async def analisar(cliente, conteudo):
+    inicio = time.perf_counter()
+    resposta = await cliente.post(
+        "/analisar_ameacas", data=FORMULARIO_PADRAO, files={"imagem": ("diagrama.png", conteudo, "image/png")}
+    )
+    resposta.raise_for_status()
+    return time.perf_counter() - inicio, resposta.json().get("image_processing", {})
+
+
+async def rodada(porta, conteudos, app_fake):
+    """Análises em sequência; devolve latências, tokens de prompt por análise e o último image_processing"""
+    tokens_antes = app_fake.state.contadores["tokens_prompt"]
+    latencias = []
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta}", timeout=None) as cliente:
+        for conteudo in conteudos:
+            latencia, estatisticas = await analisar(cliente, conteudo)
+            latencias.append(latencia)
+    tokens = (app_fake.state.contadores["tokens_prompt"] - tokens_antes) / len(conteudos)
+    return latencias, tokens, estatisticas
+
+
+def benchmark_api(componentes, requisicoes, backend, latencia, tempo_por_token):
+    print(f"3. API: {requisicoes} análises de diagramas com {componentes} componentes "
+          f"({tempo_por_token * 1000:.2f} ms por token de prompt)")
+    conteudos = [criar_diagrama(componentes, 1000 + semente)[0] for semente in range(requisicoes)]
+    configuracoes = {
+        "detail high": {"STRIDE_IMAGEM_DETAIL": "high"},
+        "OCR + low": {"STRIDE_IMAGEM_DETAIL": "high", "STRIDE_OCR_BACKEND": backend, "STRIDE_OCR_DETAIL": "low"},
+    }
+    referencia = None
+    for nome, extras in configuracoes.items():
+        app_fake = criar_app_fake(latencia=latencia, tempo_por_token_prompt=tempo_por_token)
+        porta_fake = porta_livre()
+        iniciar_servidor(app_fake, porta_fake)
+        processo, porta = iniciar_api(porta_fake, extras)
+        try:
+            novos, tokens, estatisticas = asyncio.run(rodada(porta, conteudos, app_fake))
+            reenviados, _, _ = asyncio.run(rodada(porta, conteudos, app_fake))
+        finally:
+            processo.terminate()
+            processo.wait()
+        economia = f" ({1 - tokens / referencia:.0%} menos)" if referencia else ""
+        referencia = referencia or tokens
+        texto = estatisticas.get("diagram_text")
+        lidos = f" | OCR: {texto['components']} componentes, {texto['flows']} fluxos" if texto else ""
+        print(f"   {nome:<12} detail {estatisticas.get('detail')}: {tokens:6.0f} tokens de prompt por análise{economia} | "
+              f"latência p50 {statistics.median(novos) * 1000:5.0f} ms (diagramas novos), "
+              f"{statistics.median(reenviados) * 1000:5.0f} ms (reenviados){lidos}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--componentes", type=int, nargs="+", default=[4, 9, 16, 30])
+    parser.add_argument("--backend", default="teste", choices=["teste", "tesseract"])
+    parser.add_argument("--repeticoes", type=int, default=10, help="Diagramas por tamanho na extração em processo")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requisicoes", type=int, default=20)
+    parser.add_argument("--latencia", type=float, default=0.3, help="Latência fixa de cada chamada ao modelo (s)")
+    parser.add_argument("--tempo-por-token", type=float, default=0.0005,
+                        help="Tempo de processamento de cada token de prompt (s)")
+    args = parser.parse_args()
+
+    benchmark_extracao(args.componentes, args.backend, args.repeticoes)
+    benchmark_pool(max(args.componentes), args.backend, 40, args.workers)
+    benchmark_api(9, args.requisicoes, args.backend, args.latencia, args.tempo_por_token)
+
+
+if __name__ == "__main__":
+    main()
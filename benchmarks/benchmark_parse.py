@@ -0,0 +1,121 @@
+"""
+Benchmark do parse da resposta do modelo: fence-splitting + json.loads (antigo) x
+analisar_resposta (validação Pydantic em uma passada + reparo tolerante)
+
+O corpus padrão é gerado a partir de examples/results/web-app-example-result.json com as
+variações que aparecem em respostas reais: cercas Markdown, texto antes/depois do JSON,
+vírgulas sobrando, comentários copiados do exemplo do prompt, quebras de linha cruas em
+strings e respostas cortadas por max_tokens. Com --corpus, lê respostas gravadas (.txt/.json).
+
+Uso:
+    python benchmarks/benchmark_parse.py --repeticoes 200
+    python benchmarks/benchmark_parse.py --corpus respostas_gravadas/
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from fake_azure_openai import DIRETORIO_BACKEND, carregar_resposta_exemplo
+
+sys.path.insert(0, str(DIRETORIO_BACKEND))
+from esquema import analisar_resposta  # noqa: E402
+
+
+def extrair_json_antigo(response_content: str) -> dict:
+    """Lógica anterior de main.extrair_json"""
+    if "```json" in response_content:
+        response_content = response_content.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_content:
+        response_content = response_content.split("```")[1].split("```")[0].strip()
+    return json.loads(response_content)
+
+
+def gerar_corpus() -> dict:
+    limpo = carregar_resposta_exemplo()
+    indentado = json.dumps(json.loads(limpo), ensure_ascii=False, indent=2)
+    corpus = {
+        "limpo": limpo,
+        "indentado": indentado,
+        "cerca_json": f"```json\n{indentado}\n```",
+        "cerca_sem_linguagem": f"```\n{indentado}\n```",
+        "texto_antes_e_depois": f"Segue o modelo de ameaças solicitado:\n\n{indentado}\n\nEspero que ajude!",
+        "virgulas_sobrando": indentado.replace('"\n    }', '",\n    }').replace("}\n  ]", "},\n  ]"),
+        "comentarios_do_exemplo": indentado.replace("}\n  ],", "},\n    // ... mais ameaças\n  ],", 1),
+        "quebra_de_linha_crua": indentado.replace("tokens JWT", "tokens\nJWT", 1),
+        "categoria_em_portugues": indentado.replace('"Threat Type": "Repudiation"', '"Threat Type": "Repúdio"'),
+    }
+    for fracao in (0.5, 0.75, 0.9, 0.97):
+        corpus[f"cortado_{int(fracao * 100)}%"] = indentado[:int(len(indentado) * fracao)]
+    return corpus
+
+
+def carregar_corpus(diretorio) -> dict:
+    return {
+        caminho.name: caminho.read_text(encoding="utf-8")
+        for caminho in sorted(Path(diretorio).iterdir()) if caminho.suffix in (".txt", ".json")
+    }
+
+
+def medir(funcao, texto, repeticoes):
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        try:
+            resultado = funcao(texto)
+        except Exception:
+            resultado = None
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, statistics.median(tempos) * 1e6
+
+
+def ameacas_antigo(texto):
+    return len(extrair_json_antigo(texto).get("threat_model", []))
+
+
+def ameacas_novo(texto):
+    resposta, reparada = analisar_resposta(texto)
+    return len(resposta.threat_model), reparada
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Diretório com respostas gravadas (.txt/.json)")
+    parser.add_argument("--repeticoes", type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = carregar_corpus(args.corpus) if args.corpus else gerar_corpus()
+    falhas_antigo = falhas_novo = 0
+    tempos_antigo, tempos_novo, tempos_validos = [], [], []
+
+    print(f"{'resposta':<26} {'antigo':>14} {'novo':>22}")
+    for nome, texto in corpus.items():
+        antigo, t_antigo = medir(ameacas_antigo, texto, args.repeticoes)
+        novo, t_novo = medir(ameacas_novo, texto, args.repeticoes)
+        tempos_antigo.append(t_antigo)
+        tempos_novo.append(t_novo)
+        falhas_antigo += antigo is None
+        falhas_novo += novo is None
+        if antigo is not None:
+            tempos_validos.append((t_antigo, t_novo))
+
+        desc_antigo = "falha" if antigo is None else f"{antigo} ameaças"
+        desc_novo = "falha" if novo is None else f"{novo[0]} ameaças" + (" (reparo)" if novo[1] else "")
+        print(f"{nome:<26} {desc_antigo:>9} {t_antigo:>6.0f}µs {desc_novo:>17} {t_novo:>6.0f}µs")
+
+    total = len(corpus)
+    print()
+    print(f"Taxa de falha:  antigo {falhas_antigo / total:.0%} | novo {falhas_novo / total:.0%} ({total} respostas)")
+    print(f"Tempo mediano:  antigo {statistics.median(tempos_antigo):.0f}µs | novo {statistics.median(tempos_novo):.0f}µs")
+    if tempos_validos:
+        print(f"Só respostas que o antigo aceita (novo valida e calcula o summary): "
+              f"antigo {statistics.median(t for t, _ in tempos_validos):.0f}µs | "
+              f"novo {statistics.median(t for _, t in tempos_validos):.0f}µs")
+
+
+if __name__ == "__main__":
+    main()
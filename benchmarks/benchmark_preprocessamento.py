@@ -0,0 +1,86 @@
+"""
+Benchmark do pré-processamento de diagramas (redução + recodificação)
+
+Gera um corpus de diagramas sintéticos no estilo de create_test_image (test_api.py),
+em resoluções de exportação típicas do draw.io/Visio, e mede para cada configuração
+o tempo de processamento contra o tamanho do payload base64 enviado ao modelo.
+
+Uso:
+    python benchmarks/benchmark_preprocessamento.py --lado-maximo 2048
+"""
+
+import argparse
+import io
+import random
+import statistics
+import time
+
+from PIL import Image, ImageDraw
+
+from fake_azure_openai import DIRETORIO_BACKEND
+
+RESOLUCOES = [(800, 600), (1920, 1080), (3840, 2160), (6000, 4000)]
+CORES = ['blue', 'green', 'red', 'purple', 'orange', 'black']
+
+
+def gerar_diagrama(largura, altura, semente):
+    """Diagrama sintético: caixas com rótulos ligadas por linhas, proporcional à resolução"""
+    aleatorio = random.Random(semente)
+    img = Image.new('RGB', (largura, altura), color='white')
+    draw = ImageDraw.Draw(img)
+    escala = largura / 800
+    caixa_l, caixa_a = int(150 * escala), int(100 * escala)
+    centros = []
+
+    for _ in range(max(3, int(6 * escala))):
+        x = aleatorio.randint(0, largura - caixa_l)
+        y = aleatorio.randint(0, altura - caixa_a)
+        cor = aleatorio.choice(CORES)
+        draw.rectangle([x, y, x + caixa_l, y + caixa_a], outline=cor, width=max(3, int(3 * escala)))
+        draw.text((x + 30, y + caixa_a // 2), f"Componente {len(centros)}", fill=cor)
+        centros.append((x + caixa_l // 2, y + caixa_a // 2))
+
+    for origem, destino in zip(centros, centros[1:]):
+        draw.line([*origem, *destino], fill='black', width=max(2, int(2 * escala)))
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lado-maximo", type=int, default=2048)
+    parser.add_argument("--amostras", type=int, default=3, help="Diagramas por resolução")
+    args = parser.parse_args()
+
+    import sys
+    sys.path.insert(0, str(DIRETORIO_BACKEND))
+    from imagem import tamanho_base64
+    from preprocessamento import preprocessar_imagem
+
+    # (formato, qualidade do WebP, cores da paleta PNG)
+    configuracoes = [("png", 90, 256), ("png", 90, 0), ("webp", 90, 0)]
+    print(f"{'Resolução':>10} | {'Formato':>8} | {'Original (KB)':>13} | {'Payload (KB)':>12} | "
+          f"{'Redução':>7} | {'Tempo (ms)':>10}")
+
+    for largura, altura in RESOLUCOES:
+        corpus = [gerar_diagrama(largura, altura, semente) for semente in range(args.amostras)]
+        original = statistics.mean(tamanho_base64(len(d)) for d in corpus)
+
+        for formato, qualidade, cores in configuracoes:
+            tempos, payloads = [], []
+            for diagrama in corpus:
+                inicio = time.perf_counter()
+                processada = preprocessar_imagem(io.BytesIO(diagrama), args.lado_maximo, formato, qualidade, cores)
+                tempos.append((time.perf_counter() - inicio) * 1000)
+                payloads.append(tamanho_base64(min(len(processada.conteudo), len(diagrama))))
+
+            payload = statistics.mean(payloads)
+            nome = f"{formato}-{cores}" if cores else formato
+            print(f"{largura}x{altura:<5} | {nome:>8} | {original / 1024:>13.1f} | {payload / 1024:>12.1f} | "
+                  f"{(1 - payload / original) * 100:>6.1f}% | {statistics.mean(tempos):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
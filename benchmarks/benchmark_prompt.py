@@ -0,0 +1,206 @@
+"""
+Benchmark do layout do prompt: tokens de entrada e tempo até o primeiro token com o prompt
+antigo (campos do formulário no meio das instruções, tudo na mensagem do usuário) x o novo
+(prefixo estático na mensagem de sistema, campos e imagem depois dele)
+
+O Azure OpenAI falso imita o prompt caching (prefixos idênticos de 1024+ tokens) e soma um
+custo por token de prompt fora do cache ao tempo até o primeiro token. As mesmas requisições
+(formulários diferentes, sem repetição) são enviadas nos dois layouts. O custo efetivo conta
+os tokens em cache pela metade, como no preço padrão do Azure OpenAI.
+
+Uso:
+    python benchmarks/benchmark_prompt.py --requisicoes 12 --tempo-por-token 0.0005
+"""
+
+import argparse
+import asyncio
+import base64
+import statistics
+import sys
+import time
+
+from openai import AsyncAzureOpenAI
+
+from fake_azure_openai import DIRETORIO_BACKEND, criar_app_fake, criar_imagem_diagrama, iniciar_servidor, porta_livre
+
+sys.path.insert(0, str(DIRETORIO_BACKEND))
+from cliente_openai import _codificador, contar_tokens, estimar_tokens_mensagens  # noqa: E402
+from prompt import PREFIXO_ESTATICO, criar_prompt_modelo_ameacas, montar_mensagens_chat  # noqa: E402
+
+APLICACOES = [
+    ("Web App", "OAuth 2.0 + JWT", "Sim", "Dados pessoais", "Portal do cliente com React, API .NET e SQL Server"),
+    ("API", "API Key", "Sim", "Cartões", "API de pagamentos em Node.js com PostgreSQL e fila SQS"),
+    ("Mobile", "Entra ID", "Sim", "Dados de saúde", "App Flutter com backend em Azure Functions e Cosmos DB"),
+    ("Web App", "SAML", "Não", "Dados financeiros", "Sistema interno de contabilidade em Django e Oracle"),
+    ("API", "mTLS", "Não", "Segredos", "Serviço de emissão de certificados em Go com Vault"),
+    ("Web App", "Login e senha", "Sim", "E-mails", "Loja virtual em PHP com MySQL e gateway de pagamento"),
+]
+
+
+def criar_prompt_antigo(tipo_aplicacao, autenticacao, acesso_internet, dados_sensiveis, descricao_aplicacao):
+    """Prompt anterior de main.criar_prompt_modelo_ameacas (campos no meio, parágrafo de formato repetido)"""
+    prompt = f"""Aja como um especialista em cibersegurança com mais de 20 anos de experiência
+    utilizando a metodologia de modelagem de ameaças STRIDE para produzir modelos de ameaças
+    abrangentes para uma ampla gama de aplicações. Sua tarefa é analisar o resumo do código,
+    o conteúdo do README e a descrição da aplicação fornecidos para produzir uma lista de
+    ameaças específicas para essa aplicação.
+
+    Presta atenção na descrição da aplicação e nos detalhes técnicos fornecidos.
+
+    Para cada uma das categorias do STRIDE (Falsificação de Identidade - Spoofing,
+    Violação de Integridade - Tampering,
+    Repúdio - Repudiation,
+    Divulgação de Informações - Information Disclosure,
+    Negação de Serviço - Denial of Service, e
+    Elevação de Privilégio - Elevation of Privilege), liste múltiplas (3 ou 4) ameaças reais,
+    se aplicável. Cada cenário de ameaça deve apresentar uma situação plausível em que a ameaça
+    poderia ocorrer no contexto da aplicação.
+
+    A lista de ameaças deve ser apresentada em formato de tabela,
+    com as seguintes colunas:Ao fornecer o modelo de ameaças, utilize uma resposta formatada em JSON
+    com as chaves "threat_model" e "improvement_suggestions". Em "threat_model", inclua um array de
+    objetos com as chaves "Threat Type" (Tipo de Ameaça), "Scenario" (Cenário), e
+    "Potential Impact" (Impacto Potencial).
+
+    Ao fornecer o modelo de ameaças, utilize uma resposta formatada em JSON com as chaves
+    "threat_model" e "improvement_suggestions".
+    Em "threat_model", inclua um array de objetos com as chaves "Threat Type" (Tipo de Ameaça),
+    "Scenario" (Cenário), e "Potential Impact" (Impacto Potencial).
+
+    Em "improvement_suggestions", inclua um array de strings que sugerem quais informações adicionais
+    poderiam ser fornecidas para tornar o modelo de ameaças mais completo e preciso na próxima iteração.
+    Foque em identificar lacunas na descrição da aplicação que, se preenchidas, permitiriam uma
+    análise mais detalhada e precisa, como por exemplo:
+    - Detalhes arquiteturais ausentes que ajudariam a identificar ameaças mais específicas
+    - Fluxos de autenticação pouco claros que precisam de mais detalhes
+    - Descrição incompleta dos fluxos de dados
+    - Informações técnicas da stack não informadas
+    - Fronteiras ou zonas de confiança do sistema não especificadas
+    - Descrição incompleta do tratamento de dados sensíveis
+    - Detalhes sobre
+    Não forneça recomendações de segurança genéricas — foque apenas no que ajudaria a criar um
+    modelo de ameaças mais eficiente.
+
+    TIPO DE APLICAÇÃO: {tipo_aplicacao}
+    MÉTODOS DE AUTENTICAÇÃO: {autenticacao}
+    EXPOSTA NA INTERNET: {acesso_internet}
+    DADOS SENSÍVEIS: {dados_sensiveis}
+    RESUMO DE CÓDIGO, CONTEÚDO DO README E DESCRIÇÃO DA APLICAÇÃO: {descricao_aplicacao}
+
+    Exemplo de formato esperado em JSON:
+
+    {{
+      "threat_model": [
+        {{
+          "Threat Type": "Spoofing",
+          "Scenario": "Cenário de exemplo 1",
+          "Potential Impact": "Impacto potencial de exemplo 1"
+        }},
+        {{
+          "Threat Type": "Spoofing",
+          "Scenario": "Cenário de exemplo 2",
+          "Potential Impact": "Impacto potencial de exemplo 2"
+        }}
+        // ... mais ameaças
+      ],
+      "improvement_suggestions": [
+        "Por favor, forneça mais detalhes sobre o fluxo de autenticação entre os componentes para permitir uma análise melhor de possíveis falhas de autenticação.",
+        "Considere adicionar informações sobre como os dados sensíveis são armazenados e transmitidos para permitir uma análise mais precisa de exposição de dados.",
+        // ... mais sugestões para melhorar o modelo de ameaças
+      ]
+    }}"""
+    return prompt
+
+
+def mensagens_antigas(campos, image_url):
+    return [
+        {
+            "role": "system",
+            "content": "Você é uma IA especialista em cibersegurança, que analisa desenhos de arquitetura e aplica a metodologia STRIDE para identificar ameaças."
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": criar_prompt_antigo(*campos)},
+                {"type": "image_url", "image_url": image_url},
+                {"type": "text", "text": "Por favor, analise a imagem do diagrama de arquitetura e o texto acima e forneça um modelo de ameaças detalhado em formato JSON conforme especificado."}
+            ]
+        }
+    ]
+
+
+def mensagens_novas(campos, image_url):
+    return montar_mensagens_chat(criar_prompt_modelo_ameacas(*campos), image_url)
+
+
+LAYOUTS = {"antigo": mensagens_antigas, "novo": mensagens_novas}
+
+
+async def executar_layout(client, montar, requisicoes, image_url):
+    tokens_locais, prompt, em_cache, ttft = [], [], [], []
+    # Primeira chamada de cada layout só aquece o cache de prefixo e não entra nas médias
+    await client.chat.completions.create(model="gpt-4o-fake", messages=montar(("-",) * 5, image_url))
+    for i in range(requisicoes):
+        tipo, autenticacao, internet, dados, descricao = APLICACOES[i % len(APLICACOES)]
+        campos = (tipo, autenticacao, internet, dados, f"{descricao} (versão {i // len(APLICACOES) + 1})")
+        mensagens = montar(campos, image_url)
+        tokens_locais.append(estimar_tokens_mensagens(mensagens, 800, 600))
+        inicio = time.perf_counter()
+        primeiro = None
+        stream = await client.chat.completions.create(
+            model="gpt-4o-fake", messages=mensagens, stream=True, stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if primeiro is None and chunk.choices and chunk.choices[0].delta.content:
+                primeiro = time.perf_counter() - inicio
+            if chunk.usage is not None:
+                prompt.append(chunk.usage.prompt_tokens)
+                em_cache.append(chunk.usage.prompt_tokens_details.cached_tokens)
+        ttft.append(primeiro)
+    return {
+        "tokens_locais": statistics.mean(tokens_locais),
+        "prompt": statistics.mean(prompt),
+        "em_cache": statistics.mean(em_cache),
+        "fora_do_cache": statistics.mean(p - c for p, c in zip(prompt, em_cache)),
+        "custo_efetivo": statistics.mean(p - c / 2 for p, c in zip(prompt, em_cache)),
+        "ttft_mediana": statistics.median(ttft),
+    }
+
+
+async def executar(porta, args):
+    image_url = {"url": "data:image/png;base64," + base64.b64encode(criar_imagem_diagrama()).decode(), "detail": "high"}
+    client = AsyncAzureOpenAI(
+        api_key="fake-key", azure_endpoint=f"http://127.0.0.1:{porta}",
+        api_version="2024-10-21", azure_deployment="gpt-4o-fake", max_retries=0
+    )
+    print(f"{'layout':<8} {'tokens (local)':>15} {'prompt':>8} {'em cache':>9} {'fora do cache':>14} "
+          f"{'custo efetivo':>14} {'TTFT mediana':>13}")
+    for nome, montar in LAYOUTS.items():
+        r = await executar_layout(client, montar, args.requisicoes, image_url)
+        print(f"{nome:<8} {r['tokens_locais']:>15.0f} {r['prompt']:>8.0f} {r['em_cache']:>9.0f} "
+              f"{r['fora_do_cache']:>14.0f} {r['custo_efetivo']:>14.0f} {r['ttft_mediana']:>12.2f}s")
+    await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requisicoes", type=int, default=12, help="Requisições por layout")
+    parser.add_argument("--primeiro-token", type=float, default=0.2, help="Tempo fixo até o primeiro token (s)")
+    parser.add_argument("--tempo-por-token", type=float, default=0.0005,
+                        help="Tempo de processamento de cada token de prompt fora do cache (s)")
+    args = parser.parse_args()
+
+    contagem = "tiktoken" if _codificador() is not None else "estimativa de ~4 caracteres por token"
+    print(f"Prefixo estático: {contar_tokens(PREFIXO_ESTATICO)} tokens ({contagem}); "
+          "o Azure só usa o cache a partir de 1024 tokens idênticos")
+
+    porta = porta_livre()
+    iniciar_servidor(criar_app_fake(
+        latencia=args.primeiro_token + 0.1, primeiro_token=args.primeiro_token, pedacos_stream=5,
+        cache_prefixo=True, tempo_por_token_prompt=args.tempo_por_token
+    ), porta)
+    asyncio.run(executar(porta, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Benchmark do repositório de ameaças (SQLite + FTS5 + rollups)
+
+1. Carga: análises sintéticas com ~20 ameaças cada, gravadas pelo mesmo RepositorioAmeacas.registrar
+   usado pela API (ameaças, índice FTS5 e rollups na mesma transação)
+2. Busca paginada: filtros indexados, texto livre e páginas profundas (cursor)
+3. Agregações: tabelas de rollup x GROUP BY direto sobre a tabela de ameaças
+4. Ponta a ponta na API com o Azure OpenAI falso: uma análise e as consultas em /ameacas
+
+Uso:
+    python benchmarks/benchmark_repositorio.py --analises 50000 --consultas 200
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+from fake_azure_openai import (
+    DIRETORIO_BACKEND, FORMULARIO_PADRAO, configurar_ambiente, criar_app_fake, criar_imagem_diagrama,
+    importar_api, iniciar_servidor, porta_livre
+)
+
+sys.path.insert(0, str(DIRETORIO_BACKEND))
+from esquema import CATEGORIAS_STRIDE  # noqa: E402
+from repositorio import RepositorioAmeacas  # noqa: E402
+
+TIPOS_APLICACAO = ["Web App", "API", "Mobile", "Desktop", "Microsserviço", "Data Pipeline"]
+COMPONENTES = ["API Gateway", "banco SQL", "fila de mensagens", "bucket de arquivos", "serviço de login",
+               "painel administrativo", "cache Redis", "webhook", "função serverless", "CDN"]
+ATAQUES = ["injeção de SQL", "token JWT forjado", "sessão sequestrada", "credenciais vazadas", "XSS armazenado",
+           "negação de serviço por volume", "escalonamento via IAM", "log adulterado", "SSRF", "CSRF"]
+IMPACTOS = ["vazamento de dados pessoais", "indisponibilidade do serviço", "fraude financeira",
+            "perda de rastreabilidade", "controle total da conta"]
+
+
+def resultado_sintetico(rng: random.Random) -> dict:
+    ameacas = [
+        {
+            "Threat Type": rng.choice(CATEGORIAS_STRIDE),
+            "Scenario": f"Atacante explora {rng.choice(ATAQUES)} no {rng.choice(COMPONENTES)} "
+                        f"para alcançar o {rng.choice(COMPONENTES)}",
+            "Potential Impact": rng.choice(IMPACTOS).capitalize()
+        }
+        for _ in range(rng.randint(15, 25))
+    ]
+    return {"threat_model": ameacas, "improvement_suggestions": [], "summary": {"total_threats": len(ameacas)}}
+
+
+def percentis(tempos):
+    ordenados = sorted(tempos)
+    return statistics.median(ordenados) * 1000, ordenados[max(int(len(ordenados) * 0.99) - 1, 0)] * 1000
+
+
+def medir(nome, consulta, consultas):
+    tempos = []
+    for _ in range(consultas):
+        inicio = time.perf_counter()
+        resultado = consulta()
+        tempos.append(time.perf_counter() - inicio)
+    p50, p99 = percentis(tempos)
+    print(f"   {nome:<42} p50 {p50:8.2f} ms | p99 {p99:8.2f} ms")
+    return resultado
+
+
+def carregar(repositorio, analises):
+    print(f"1. Carga de {analises} análises")
+    rng = random.Random(42)
+    fim = time.time()
+    inicio_periodo = fim - 365 * 86400
+    inicio = time.perf_counter()
+    for i in range(analises):
+        formulario = {
+            **FORMULARIO_PADRAO,
+            "tipo_aplicacao": rng.choice(TIPOS_APLICACAO),
+            "acesso_internet": rng.choice(["Sim", "Não"])
+        }
+        repositorio.registrar(formulario, resultado_sintetico(rng), f"projeto-{i % 500}",
+                              criado_em=inicio_periodo + (fim - inicio_periodo) * i / analises)
+    duracao = time.perf_counter() - inicio
+    total = repositorio.estatisticas()["ameacas"]
+    print(f"   {total} ameaças em {duracao:.1f}s ({analises / duracao:.0f} análises/s, "
+          f"{total / duracao:.0f} ameaças/s)")
+
+
+def benchmark_busca(repositorio, consultas):
+    print("2. Busca paginada (50 por página)")
+    medir("tipo", lambda: repositorio.buscar(tipo=random.choice(CATEGORIAS_STRIDE)), consultas)
+    medir("tipo + aplicação + internet", lambda: repositorio.buscar(
+        tipo=random.choice(CATEGORIAS_STRIDE), tipo_aplicacao=random.choice(TIPOS_APLICACAO), acesso_internet="Sim"
+    ), consultas)
+    medir("projeto", lambda: repositorio.buscar(projeto=f"projeto-{random.randrange(500)}"), consultas)
+    medir("texto (1 termo)", lambda: repositorio.buscar(texto="SSRF"), consultas)
+    medir("texto (2 termos) + tipo", lambda: repositorio.buscar(
+        texto="jwt webhook", tipo=random.choice(CATEGORIAS_STRIDE)
+    ), consultas)
+
+    pagina = repositorio.buscar(tipo="Spoofing")
+    for _ in range(200):
+        pagina = repositorio.buscar(tipo="Spoofing", cursor=pagina["next_cursor"])
+    cursor = pagina["next_cursor"]
+    medir("tipo, página 200 (cursor)", lambda: repositorio.buscar(tipo="Spoofing", cursor=cursor), consultas)
+
+
+def benchmark_agregacoes(repositorio, caminho, consultas):
+    print("3. Agregações")
+    medir("rollup: por tipo", lambda: repositorio.agregar(["tipo"]), consultas)
+    medir("rollup: mes x tipo (tendência)", lambda: repositorio.agregar(["mes", "tipo"]), consultas)
+    resultado = medir("rollup: aplicação x internet, último trimestre", lambda: repositorio.agregar(
+        ["tipo_aplicacao", "acesso_internet"], desde=time.strftime("%Y-%m-%d", time.gmtime(time.time() - 90 * 86400))
+    ), consultas)
+    print(f"   ({resultado['total_threats']} ameaças em {resultado['total_analyses']} análises no trimestre)")
+
+    # Mesmas perguntas direto na tabela de ameaças, sem os rollups
+    db = sqlite3.connect(caminho)
+    repeticoes = max(consultas // 20, 3)
+    medir("GROUP BY direto: por tipo", lambda: db.execute(
+        "SELECT tipo, COUNT(*) FROM ameacas GROUP BY tipo"
+    ).fetchall(), repeticoes)
+    medir("GROUP BY direto: mes x tipo", lambda: db.execute(
+        "SELECT substr(dia, 1, 7), tipo, COUNT(*) FROM ameacas GROUP BY 1, 2"
+    ).fetchall(), repeticoes)
+    db.close()
+
+
+async def benchmark_api(porta_api):
+    print("4. Ponta a ponta na API")
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta_api}", timeout=None) as cliente:
+        resposta = await cliente.post(
+            "/analisar_ameacas", files={"imagem": ("diagrama.png", criar_imagem_diagrama(), "image/png")},
+            data=FORMULARIO_PADRAO
+        )
+        print(f"   análise: HTTP {resposta.status_code}, {resposta.json()['summary']['total_threats']} ameaças")
+        for caminho, parametros in [
+            ("/ameacas", {"limite": 3}),
+            ("/ameacas", {"texto": "dados", "limite": 5}),
+            ("/ameacas/agregados", {"agrupar": "tipo"}),
+            ("/ameacas/agregados", {"agrupar": "dia,acesso_internet"}),
+        ]:
+            inicio = time.perf_counter()
+            resposta = await cliente.get(caminho, params=parametros)
+            duracao = (time.perf_counter() - inicio) * 1000
+            dados = resposta.json()
+            print(f"   GET {caminho} {parametros}: HTTP {resposta.status_code} em {duracao:.1f} ms, "
+                  f"{len(dados.get('items', []))} itens")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--analises", type=int, default=50_000, help="Análises sintéticas (~20 ameaças cada)")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--latencia", type=float, default=0.2, help="Latência do modelo falso (s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    random.seed(42)
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho = os.path.join(diretorio, "ameacas.db")
+        repositorio = RepositorioAmeacas(caminho)
+        carregar(repositorio, args.analises)
+        benchmark_busca(repositorio, args.consultas)
+        benchmark_agregacoes(repositorio, caminho, args.consultas)
+        repositorio.fechar()
+
+        porta_fake = porta_livre()
+        iniciar_servidor(criar_app_fake(latencia=args.latencia), porta_fake)
+        configurar_ambiente(porta_fake, STRIDE_CACHE_HABILITADO="false", STRIDE_REPOSITORIO_HABILITADO="true",
+                            STRIDE_REPOSITORIO_SQLITE=os.path.join(diretorio, "api.db"))
+        porta_api = porta_livre()
+        iniciar_servidor(importar_api().app, porta_api)
+        asyncio.run(benchmark_api(porta_api))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark de goodput sob throttling: chamadas ao Azure OpenAI falso com cota (429 + Retry-After)
+e falhas intermitentes (500), comparando três políticas do ClienteResiliente:
+
+- sem_politica: nenhuma retentativa e nenhum limitador (o que o SDK faria com max_retries=0)
+- retentativas: backoff exponencial com jitter respeitando Retry-After
+- retentativas_e_limitador: o mesmo, mais o token bucket de RPM dimensionado pela cota
+
+Uso:
+    python benchmarks/benchmark_resiliencia.py --requisicoes 150 --concorrencia 50 --rpm 600
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import sys
+import time
+
+from openai import AsyncAzureOpenAI
+
+from fake_azure_openai import DIRETORIO_BACKEND, criar_app_fake, iniciar_servidor, porta_livre
+
+sys.path.insert(0, str(DIRETORIO_BACKEND))
+from cliente_openai import ClienteResiliente, FalhaModelo  # noqa: E402
+
+MENSAGENS = [{"role": "user", "content": "Gere o modelo de ameaças STRIDE do diagrama."}]
+
+POLITICAS = {
+    "sem_politica": {"max_tentativas": 0},
+    "retentativas": {"max_tentativas": 6},
+    "retentativas_e_limitador": {"max_tentativas": 6, "usar_rpm": True},
+}
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(int(len(ordenados) * p), len(ordenados) - 1)]
+
+
+async def executar_politica(nome, args):
+    politica = POLITICAS[nome]
+    app = criar_app_fake(latencia=args.latencia, limite_rpm=args.rpm, taxa_500=args.taxa_500, semente=42)
+    porta = porta_livre()
+    servidor = iniciar_servidor(app, porta)
+
+    client = AsyncAzureOpenAI(
+        api_key="fake-key", azure_endpoint=f"http://127.0.0.1:{porta}", api_version="2024-02-01",
+        azure_deployment="gpt-4o-fake", max_retries=0, timeout=30
+    )
+    cliente = ClienteResiliente(
+        client, "gpt-4o-fake", max_concorrencia=args.concorrencia,
+        rpm=args.rpm if politica.get("usar_rpm") else 0,
+        max_tentativas=politica["max_tentativas"], backoff_base=0.5, backoff_max=10,
+        prazo=args.prazo, limiar_falhas=50
+    )
+
+    latencias, falhas = [], {}
+
+    async def chamar():
+        inicio = time.perf_counter()
+        try:
+            await cliente.criar(MENSAGENS, tokens_estimados=0, max_tokens=100)
+            latencias.append(time.perf_counter() - inicio)
+        except FalhaModelo as fm:
+            falhas[fm.status_code] = falhas.get(fm.status_code, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(chamar() for _ in range(args.requisicoes)))
+    duracao = time.perf_counter() - inicio
+    await client.close()
+    servidor.should_exit = True
+
+    return {
+        "politica": nome,
+        "ok": len(latencias),
+        "falhas": falhas,
+        "chamadas_upstream": app.state.contadores["requisicoes"],
+        "respostas_429": app.state.contadores["429"],
+        "duracao_s": round(duracao, 2),
+        "goodput_rps": round(len(latencias) / duracao, 2),
+        "p50_s": round(statistics.median(latencias), 2) if latencias else 0.0,
+        "p95_s": round(percentil(latencias, 0.95), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requisicoes", type=int, default=150)
+    parser.add_argument("--concorrencia", type=int, default=50)
+    parser.add_argument("--rpm", type=int, default=600, help="Cota simulada do deployment")
+    parser.add_argument("--taxa-500", type=float, default=0.05, help="Fração de respostas 500 injetadas")
+    parser.add_argument("--latencia", type=float, default=0.2, help="Latência de cada chamada (s)")
+    parser.add_argument("--prazo", type=float, default=60.0, help="Prazo por requisição (s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    print(f"{args.requisicoes} requisições, concorrência {args.concorrencia}, cota {args.rpm} RPM, "
+          f"{args.taxa_500:.0%} de erros 500")
+    print(f"{'política':<26} {'ok':>4} {'falhas':>14} {'upstream':>9} {'429':>5} {'duração':>8} "
+          f"{'goodput':>8} {'p50':>6} {'p95':>6}")
+    for nome in POLITICAS:
+        r = asyncio.run(executar_politica(nome, args))
+        print(f"{r['politica']:<26} {r['ok']:>4} {str(r['falhas']):>14} {r['chamadas_upstream']:>9} "
+              f"{r['respostas_429']:>5} {r['duracao_s']:>7}s {r['goodput_rps']:>6}/s {r['p50_s']:>5}s {r['p95_s']:>5}s")
+
+
+if __name__ == "__main__":
+    main()
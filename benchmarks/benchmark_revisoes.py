@@ -0,0 +1,120 @@
+"""
+Benchmark das revisões incrementais: tokens e latência de uma edição pequena analisada do zero
+x analisada como delta sobre a revisão anterior do projeto
+
+O Azure OpenAI falso gera a resposta "token a token" (custo por caractere devolvido) e soma um
+custo por token de prompt fora do cache de prefixo. Os tokens de cada chamada são lidos de
+stride_tokens_total no /metrics da API.
+
+Edições:
+  descrição  - um trecho da descrição muda (o diagrama é o mesmo: a imagem não é reenviada)
+  diagrama   - uma caixa nova em um canto do diagrama (a imagem vai junto, com as regiões alteradas)
+  nenhuma    - mesmo diagrama e formulário (devolve a revisão salva)
+
+Uso:
+    python benchmarks/benchmark_revisoes.py --latencia 0.3 --tempo-por-caractere 0.002
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import re
+import time
+
+import httpx
+from PIL import Image, ImageDraw
+
+from fake_azure_openai import (
+    FORMULARIO_PADRAO, configurar_ambiente, criar_app_fake, importar_api, iniciar_servidor, porta_livre
+)
+from benchmark_similaridade import desenhar_diagrama
+
+DESCRICAO = "Portal do cliente em React. API em .NET com SQL Server. Login com OAuth 2.0 e JWT."
+DESCRICAO_EDITADA = "Portal do cliente em React. API em .NET com SQL Server e cache Redis. Login com OAuth 2.0 e JWT."
+
+
+def diagrama_com_caixa_nova(base: bytes) -> bytes:
+    img = Image.open(io.BytesIO(base)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([900, 500, 1120, 620], outline="orange", width=4)
+    draw.text((930, 550), "Cache", fill="orange")
+    draw.line([700, 560, 900, 560], fill="black", width=3)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def tokens(cliente):
+    texto = (await cliente.get("/metrics")).text
+    valores = dict(re.findall(r'stride_tokens_total\{tipo="(\w+)"\} ([0-9.e+]+)', texto))
+    return {tipo: float(valor) for tipo, valor in valores.items()}
+
+
+async def analisar(cliente, imagem, descricao, projeto=None):
+    formulario = {**FORMULARIO_PADRAO, "descricao_aplicacao": descricao}
+    if projeto:
+        formulario["projeto"] = projeto
+    antes = await tokens(cliente)
+    inicio = time.perf_counter()
+    resposta = await cliente.post(
+        "/analisar_ameacas", files={"imagem": ("diagrama.png", imagem, "image/png")}, data=formulario
+    )
+    duracao = time.perf_counter() - inicio
+    depois = await tokens(cliente)
+    uso = {tipo: int(depois.get(tipo, 0) - antes.get(tipo, 0)) for tipo in ("prompt", "prompt_cache", "completion")}
+    return duracao, uso, resposta
+
+
+async def executar(porta_api):
+    base = desenhar_diagrama()
+    editado = diagrama_com_caixa_nova(base)
+    edicoes = [
+        ("descrição", base, DESCRICAO_EDITADA),
+        ("diagrama", editado, DESCRICAO_EDITADA),
+        ("nenhuma", editado, DESCRICAO_EDITADA),
+    ]
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta_api}", timeout=None) as cliente:
+        duracao, uso, resposta = await analisar(cliente, base, DESCRICAO, projeto="benchmark")
+        print(f"revisão 1 (completa): {duracao:.2f}s, {uso}, "
+              f"{resposta.json()['summary']['total_threats']} ameaças")
+        print(f"{'edição':<10} {'modo':<9} {'tempo':>7} {'prompt':>7} {'em cache':>9} {'saída':>6}  alterações")
+        for nome, imagem, descricao in edicoes:
+            # Do zero: mesmo envio sem projeto (o cache de resultados está desligado)
+            duracao, uso, _ = await analisar(cliente, imagem, descricao)
+            print(f"{nome:<10} {'do zero':<9} {duracao:>6.2f}s {uso['prompt']:>7} {uso['prompt_cache']:>9} "
+                  f"{uso['completion']:>6}")
+            duracao, uso, resposta = await analisar(cliente, imagem, descricao, projeto="benchmark")
+            dados = resposta.json()
+            revisao = dados["revision"]
+            modo = "sem mud." if revisao.get("unchanged") else revisao["mode"]
+            print(f"{'':<10} {modo:<9} {duracao:>6.2f}s {uso['prompt']:>7} {uso['prompt_cache']:>9} "
+                  f"{uso['completion']:>6}  {revisao['changes']} -> {dados['summary']['total_threats']} ameaças")
+        historico = (await cliente.get("/projetos/benchmark/revisoes")).json()
+        print(f"histórico: {[(r['revision'], r['mode']) for r in historico['revisions']]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.3, help="Tempo fixo de cada chamada (s)")
+    parser.add_argument("--tempo-por-caractere", type=float, default=0.002,
+                        help="Custo de geração por caractere da resposta (s)")
+    parser.add_argument("--tempo-por-token", type=float, default=0.0005,
+                        help="Tempo de processamento de cada token de prompt fora do cache (s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    porta_fake = porta_livre()
+    iniciar_servidor(criar_app_fake(
+        latencia=args.latencia, tempo_por_caractere=args.tempo_por_caractere,
+        cache_prefixo=True, tempo_por_token_prompt=args.tempo_por_token
+    ), porta_fake)
+    configurar_ambiente(porta_fake, STRIDE_CACHE_HABILITADO="false", AZURE_OPENAI_MAX_RETRIES=0,
+                        STRIDE_REVISOES_SQLITE=":memory:")
+    porta_api = porta_livre()
+    iniciar_servidor(importar_api().app, porta_api)
+    asyncio.run(executar(porta_api))
+
+
+if __name__ == "__main__":
+    main()
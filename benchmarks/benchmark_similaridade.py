@@ -0,0 +1,194 @@
+"""
+Benchmark do índice de diagramas semelhantes
+
+1. Busca por distância de Hamming com 100 mil hashes: multi-index hashing x varredura linear
+2. IndiceDiagramas (SQLite + índice em memória) com 100 mil análises armazenadas
+3. Distância do pHash entre o diagrama base e variações (DPI, carimbo de data, tema escuro) e
+   um diagrama com outro layout
+4. Ponta a ponta na API com o Azure OpenAI falso: MISS, SIMILAR, semente e opt-out
+
+Uso:
+    python benchmarks/benchmark_similaridade.py --diagramas 100000 --consultas 2000
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import random
+import statistics
+import sys
+import time
+
+import httpx
+from PIL import Image, ImageDraw, ImageOps
+
+from fake_azure_openai import (
+    DIRETORIO_BACKEND, FORMULARIO_PADRAO, configurar_ambiente, criar_app_fake, importar_api,
+    iniciar_servidor, porta_livre
+)
+
+sys.path.insert(0, str(DIRETORIO_BACKEND))
+from similaridade import IndiceDiagramas, IndiceHamming, calcular_phash, distancia_hamming  # noqa: E402
+
+RESULTADO_EXEMPLO = {"threat_model": [], "improvement_suggestions": [], "summary": {"total_threats": 0}}
+
+
+def desenhar_diagrama(escala=1.0, carimbo=None, escuro=False, layout="padrao") -> bytes:
+    """Diagrama de exemplo; as variações imitam reexportações do mesmo desenho"""
+    traco = "black"
+    img = Image.new("RGB", (int(1200 * escala), int(800 * escala)), color="white")
+    draw = ImageDraw.Draw(img)
+
+    def caixa(x, y, texto, cor):
+        draw.rectangle([x * escala, y * escala, (x + 220) * escala, (y + 120) * escala], outline=cor,
+                       width=max(int(4 * escala), 1))
+        draw.text(((x + 30) * escala, (y + 50) * escala), texto, fill=cor)
+
+    if layout == "padrao":
+        caixa(60, 80, "Frontend", "blue")
+        caixa(480, 80, "Backend API", "green")
+        caixa(900, 80, "Database", "red")
+        caixa(480, 500, "Fila", "purple")
+        draw.line([280 * escala, 140 * escala, 480 * escala, 140 * escala], fill=traco, width=max(int(3 * escala), 1))
+        draw.line([700 * escala, 140 * escala, 900 * escala, 140 * escala], fill=traco, width=max(int(3 * escala), 1))
+        draw.line([590 * escala, 200 * escala, 590 * escala, 500 * escala], fill=traco, width=max(int(3 * escala), 1))
+    else:
+        caixa(60, 560, "Gateway", "blue")
+        caixa(60, 80, "Auth", "orange")
+        caixa(900, 320, "Storage", "red")
+        draw.line([170 * escala, 200 * escala, 170 * escala, 560 * escala], fill=traco, width=max(int(3 * escala), 1))
+        draw.line([280 * escala, 620 * escala, 900 * escala, 380 * escala], fill=traco, width=max(int(3 * escala), 1))
+    if carimbo:
+        draw.text((1000 * escala, 760 * escala), carimbo, fill="gray")
+    if escuro:
+        img = ImageOps.invert(img)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def percentis(tempos):
+    ordenados = sorted(tempos)
+    return statistics.median(ordenados) * 1000, ordenados[int(len(ordenados) * 0.99) - 1] * 1000
+
+
+def vizinho(valor, bits):
+    for posicao in random.sample(range(64), bits):
+        valor ^= 1 << posicao
+    return valor
+
+
+def benchmark_hamming(diagramas, consultas):
+    print(f"1. Busca por distância de Hamming ({diagramas} hashes)")
+    indice = IndiceHamming()
+    hashes = [random.getrandbits(64) for _ in range(diagramas)]
+    for identificador, valor in enumerate(hashes):
+        indice.adicionar(valor, identificador)
+    alvos = [vizinho(random.choice(hashes), random.randint(0, 4)) for _ in range(consultas)]
+
+    for raio in (4, 7, 10):
+        tempos = []
+        for alvo in alvos:
+            inicio = time.perf_counter()
+            indice.buscar(alvo, raio)
+            tempos.append(time.perf_counter() - inicio)
+        p50, p99 = percentis(tempos)
+        print(f"   multi-index raio {raio:>2}: p50 {p50:.3f} ms | p99 {p99:.3f} ms")
+
+    tempos = []
+    for alvo in alvos[:50]:
+        inicio = time.perf_counter()
+        [i for i, valor in enumerate(hashes) if distancia_hamming(valor, alvo) <= 10]
+        tempos.append(time.perf_counter() - inicio)
+    p50, p99 = percentis(tempos)
+    print(f"   varredura linear      : p50 {p50:.3f} ms | p99 {p99:.3f} ms")
+
+
+def benchmark_indice(diagramas, consultas):
+    print(f"2. IndiceDiagramas com {diagramas} análises (SQLite em memória)")
+    indice = IndiceDiagramas()
+    hashes = [random.getrandbits(64) for _ in range(diagramas)]
+    inicio = time.perf_counter()
+    for valor in hashes:
+        indice.adicionar(valor, FORMULARIO_PADRAO, RESULTADO_EXEMPLO)
+    print(f"   carga: {time.perf_counter() - inicio:.1f}s")
+
+    tempos, encontrados = [], 0
+    for _ in range(consultas):
+        alvo = vizinho(random.choice(hashes), random.randint(0, 4))
+        inicio = time.perf_counter()
+        encontrados += indice.buscar(alvo, FORMULARIO_PADRAO, 7, 0.9) is not None
+        tempos.append(time.perf_counter() - inicio)
+    p50, p99 = percentis(tempos)
+    print(f"   consulta (raio 7 + formulário): p50 {p50:.3f} ms | p99 {p99:.3f} ms | "
+          f"{encontrados}/{consultas} encontrados")
+    indice.fechar()
+
+
+def benchmark_phash():
+    print("3. Distância do pHash em relação ao diagrama base")
+    base = desenhar_diagrama()
+    inicio = time.perf_counter()
+    hash_base = calcular_phash(io.BytesIO(base))
+    print(f"   cálculo do pHash (1200x800 PNG): {(time.perf_counter() - inicio) * 1000:.1f} ms")
+    variacoes = {
+        "DPI 2x": desenhar_diagrama(escala=2.0),
+        "DPI 0,5x": desenhar_diagrama(escala=0.5),
+        "carimbo de data": desenhar_diagrama(carimbo="2024-06-01 10:32"),
+        "tema escuro": desenhar_diagrama(escuro=True),
+        "outro layout": desenhar_diagrama(layout="outro"),
+    }
+    for nome, dados in variacoes.items():
+        print(f"   {nome:<16} {distancia_hamming(hash_base, calcular_phash(io.BytesIO(dados))):>2} bits")
+
+
+async def benchmark_api(porta_api):
+    print("4. Ponta a ponta na API")
+    formulario_semente = {**FORMULARIO_PADRAO, "descricao_aplicacao": FORMULARIO_PADRAO["descricao_aplicacao"] + " v2"}
+    casos = [
+        ("diagrama base", desenhar_diagrama(), FORMULARIO_PADRAO),
+        ("DPI 2x", desenhar_diagrama(escala=2.0), FORMULARIO_PADRAO),
+        ("tema escuro (semente)", desenhar_diagrama(escuro=True), {**FORMULARIO_PADRAO, "reutilizar_similar": "false"}),
+        ("carimbo + descrição v2", desenhar_diagrama(carimbo="2024-06-01"), formulario_semente),
+        ("outro layout", desenhar_diagrama(layout="outro"), FORMULARIO_PADRAO),
+    ]
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta_api}", timeout=None) as cliente:
+        for nome, imagem, formulario in casos:
+            inicio = time.perf_counter()
+            resposta = await cliente.post(
+                "/analisar_ameacas", files={"imagem": ("diagrama.png", imagem, "image/png")}, data=formulario
+            )
+            duracao = time.perf_counter() - inicio
+            dados = resposta.json()
+            print(f"   {nome:<24} HTTP {resposta.status_code} X-Cache {resposta.headers.get('x-cache'):<8} "
+                  f"{duracao:6.3f}s {dados.get('similar_match') or ''}")
+        estatisticas = (await cliente.get("/cache/estatisticas")).json()
+        print(f"   índice: {estatisticas['indice_similaridade']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--diagramas", type=int, default=100_000)
+    parser.add_argument("--consultas", type=int, default=2000)
+    parser.add_argument("--latencia", type=float, default=1.0, help="Latência do modelo falso (s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    random.seed(42)
+
+    benchmark_hamming(args.diagramas, args.consultas)
+    benchmark_indice(args.diagramas, args.consultas)
+    benchmark_phash()
+
+    porta_fake = porta_livre()
+    iniciar_servidor(criar_app_fake(latencia=args.latencia), porta_fake)
+    configurar_ambiente(porta_fake, STRIDE_SIMILAR_HABILITADO="true", STRIDE_CACHE_HABILITADO="true",
+                        STRIDE_SIMILAR_SQLITE=":memory:")
+    porta_api = porta_livre()
+    iniciar_servidor(importar_api().app, porta_api)
+    asyncio.run(benchmark_api(porta_api))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark de tempo até a primeira ameaça: /analisar_ameacas x /analisar_ameacas/stream
+
+A API e o Azure OpenAI falso rodam em servidores uvicorn locais (o transporte ASGI do
+httpx acumula a resposta inteira e esconderia o efeito do streaming).
+
+Uso:
+    python benchmarks/benchmark_streaming.py --latencia 10 --primeiro-token 1
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from fake_azure_openai import (
+    FORMULARIO_PADRAO, configurar_ambiente, criar_app_fake, criar_imagem_diagrama,
+    importar_api, iniciar_servidor, porta_livre
+)
+
+
+async def executar(porta_api):
+    imagem = criar_imagem_diagrama()
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{porta_api}", timeout=None) as cliente:
+        # Campos diferentes a cada chamada para não responder pelo cache
+        formulario = {**FORMULARIO_PADRAO, "descricao_aplicacao": "benchmark síncrono"}
+        inicio = time.perf_counter()
+        resposta = await cliente.post(
+            "/analisar_ameacas", files={"imagem": ("diagrama.png", imagem, "image/png")}, data=formulario
+        )
+        total_sincrono = time.perf_counter() - inicio
+        ameacas = len(resposta.json().get("threat_model", []))
+        print(f"Síncrono:  primeira ameaça em {total_sincrono:.2f}s | total {total_sincrono:.2f}s | {ameacas} ameaças")
+
+        formulario = {**FORMULARIO_PADRAO, "descricao_aplicacao": "benchmark streaming"}
+        primeira, ameacas = None, 0
+        inicio = time.perf_counter()
+        async with cliente.stream(
+            "POST", "/analisar_ameacas/stream",
+            files={"imagem": ("diagrama.png", imagem, "image/png")}, data=formulario
+        ) as resposta:
+            async for linha in resposta.aiter_lines():
+                if json.loads(linha)["event"] == "threat":
+                    ameacas += 1
+                    if primeira is None:
+                        primeira = time.perf_counter() - inicio
+        total_stream = time.perf_counter() - inicio
+        print(f"Streaming: primeira ameaça em {primeira:.2f}s | total {total_stream:.2f}s | {ameacas} ameaças")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=10.0, help="Latência total da geração (s)")
+    parser.add_argument("--primeiro-token", type=float, default=1.0, help="Tempo até o primeiro token (s)")
+    args = parser.parse_args()
+
+    porta_fake = porta_livre()
+    iniciar_servidor(criar_app_fake(latencia=args.latencia, primeiro_token=args.primeiro_token), porta_fake)
+    configurar_ambiente(porta_fake)
+    porta_api = porta_livre()
+    iniciar_servidor(importar_api().app, porta_api)
+    asyncio.run(executar(porta_api))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""
+Servidor falso do Azure OpenAI (chat completions) para benchmarks locais
+
+Responde no mesmo caminho usado pelo SDK (/openai/deployments/{deployment}/chat/completions)
+com o JSON de exemplo em examples/results (ou com respostas gravadas), após uma latência
+configurável. Pode simular a cota do deployment (429 com Retry-After), falhas intermitentes
+(500) e respostas com JSON malformado.
+
+Também pode rodar sozinho, para apontar uma API iniciada à parte:
+    python benchmarks/fake_azure_openai.py --porta 8900 --latencia 2 --latencia-sigma 0.4 --taxa-json-invalido 0.1
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import socket
+import threading
+import time
+from collections import deque
+from itertools import cycle
+from pathlib import Path
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+RAIZ_PROJETO = Path(__file__).resolve().parent.parent
+DIRETORIO_BACKEND = RAIZ_PROJETO / "module-1" / "01-introducao-backend"
+RESULTADO_EXEMPLO = RAIZ_PROJETO / "examples" / "results" / "web-app-example-result.json"
+
+
+def carregar_resposta_exemplo():
+    """Conteúdo devolvido pelo modelo falso (sem o bloco summary, que é calculado pela API)"""
+    with open(RESULTADO_EXEMPLO, encoding="utf-8") as f:
+        dados = json.load(f)
+    dados.pop("summary", None)
+    return json.dumps(dados, ensure_ascii=False)
+
+
+def carregar_gravacoes(caminho) -> list:
+    """Respostas gravadas, na ordem do arquivo: [(conteúdo, latência em segundos ou None)]
+
+    `caminho` é um arquivo .json/.jsonl ou um diretório com eles. Cada registro pode ser
+    {"content": ..., "latency_s": ...}, o corpo de um chat.completion (choices[0].message.content)
+    ou o próprio resultado da análise (como os de examples/results, sem o summary).
+    """
+    caminho = Path(caminho)
+    arquivos = sorted(caminho.glob("*.json*")) if caminho.is_dir() else [caminho]
+    registros = []
+    for arquivo in arquivos:
+        texto = arquivo.read_text(encoding="utf-8")
+        if arquivo.suffix == ".jsonl":
+            registros.extend(json.loads(linha) for linha in texto.splitlines() if linha.strip())
+        else:
+            registros.append(json.loads(texto))
+
+    gravacoes = []
+    for registro in registros:
+        latencia = registro.pop("latency_s", None)
+        if "content" in registro:
+            conteudo = registro["content"]
+        elif "choices" in registro:
+            conteudo = registro["choices"][0]["message"]["content"]
+        else:
+            registro.pop("summary", None)
+            conteudo = registro
+        if not isinstance(conteudo, str):
+            conteudo = json.dumps(conteudo, ensure_ascii=False)
+        gravacoes.append((conteudo, latencia))
+    if not gravacoes:
+        raise ValueError(f"Nenhuma resposta gravada em {caminho}")
+    return gravacoes
+
+
+def corromper_json(conteudo: str, modo: str) -> str:
+    """Formas comuns de JSON inválido devolvido pelo modelo
+
+    cortado - resposta interrompida no meio (max_tokens), recuperável pelo reparo
+    cercas   - JSON dentro de cercas Markdown com texto em volta, recuperável
+    texto    - recusa em texto livre, sem JSON: vira raw_response
+    """
+    if modo == "cortado":
+        return conteudo[:int(len(conteudo) * 0.6)]
+    if modo == "cercas":
+        return f"Segue a análise solicitada:\n```json\n{conteudo}\n```\nQualquer dúvida, estou à disposição."
+    return "Desculpe, não consigo identificar os componentes deste diagrama com segurança."
+
+
+MODOS_JSON_INVALIDO = ("cortado", "cercas", "texto")
+
+# Trecho do pedido de continuação (prompt.INSTRUCAO_CONTINUACAO) depois de uma resposta cortada
+MARCADOR_CONTINUACAO = "interrompida pelo limite de tamanho"
+
+
+def chunk_stream(deployment, delta, finish_reason=None):
+    dados = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": deployment,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+def criar_app_fake(latencia=1.0, primeiro_token=0.3, pedacos_stream=60, limite_rpm=None,
+                   taxa_429=0.0, taxa_500=0.0, semente=None, tempo_por_caractere=0.0,
+                   conteudo_por_prompt=False, falhar_categorias=(), cache_prefixo=False,
+                   tempo_por_token_prompt=0.0, latencia_sigma=0.0, taxa_json_invalido=0.0, gravacoes=None,
+                   respeitar_max_tokens=False, ameacas_por_imagem=False):
+    """Cria a aplicação falsa com latência fixa por chamada (em segundos)
+
+    Com `latencia_sigma` a latência de cada chamada é sorteada de uma distribuição log-normal
+    com mediana `latencia` (sigma 0.5 dá p99 ~3x a mediana, parecido com o Azure sob carga).
+
+    Em modo stream o primeiro pedaço chega após `primeiro_token` segundos e o restante do
+    conteúdo é distribuído em `pedacos_stream` pedaços até completar a latência total.
+
+    `limite_rpm` imita a cota do Azure (avaliada em janelas de 10s): acima dela responde 429
+    com retry-after até a janela liberar. `taxa_429` e `taxa_500` injetam falhas aleatórias.
+    Os contadores de cada resposta ficam em `app.state.contadores` (e em GET /contadores).
+
+    `taxa_json_invalido` corrompe essa fração das respostas (ver corromper_json). `gravacoes`
+    (caminho aceito por carregar_gravacoes) troca o JSON de exemplo pelas respostas gravadas,
+    devolvidas em rodízio e com a latência registrada em cada uma, quando houver.
+
+    Com `tempo_por_caractere` a latência cresce com o tamanho da resposta, como na geração
+    token a token. Prompts de revisão incremental (que pedem "retire_threats") recebem um delta
+    pequeno. Com `conteudo_por_prompt` a resposta traz só as categorias STRIDE citadas
+    no prompt (e as sugestões se "improvement_suggestions" aparecer nele), imitando as chamadas
+    do fan-out; categorias em `falhar_categorias` respondem 500.
+
+    Os tokens de prompt são estimados em ~4 caracteres por token (765 por imagem, 85 em detail
+    "low"; o total fica em GET /contadores, campo tokens_prompt), e cada token
+    fora do cache soma `tempo_por_token_prompt` ao tempo até o primeiro token. `cache_prefixo`
+    imita o prompt caching do Azure: prefixos idênticos de 1024 tokens ou mais, em incrementos
+    de 128, são servidos do cache e informados em usage.prompt_tokens_details.cached_tokens.
+
+    Com `respeitar_max_tokens` a resposta é cortada em max_tokens (~4 caracteres por token) com
+    finish_reason "length"; pedidos de continuação recebem só as ameaças e sugestões que ainda
+    não aparecem nas respostas anteriores da conversa. `ameacas_por_imagem` imita diagramas mais
+    ricos: o número de ameaças cresce com o tamanho da imagem enviada (6 + 1 a cada 800 bytes
+    do base64), repetindo as do exemplo com o número do componente no cenário.
+    """
+    app = FastAPI()
+    conteudo = carregar_resposta_exemplo()
+    sorteio = random.Random(semente)
+    janela = deque()
+    app.state.contadores = {
+        "requisicoes": 0, "ok": 0, "429": 0, "500": 0, "cortadas": 0, "max_tokens": 0, "tokens_prompt": 0,
+        **{f"json_{modo}": 0 for modo in MODOS_JSON_INVALIDO}
+    }
+    rodizio = cycle(carregar_gravacoes(gravacoes)) if gravacoes else None
+    completo = json.loads(conteudo)
+    # Revisão incremental: inclui uma ameaça, atualiza a primeira e retira a segunda
+    conteudo_delta = json.dumps({
+        "add_threats": [{
+            "Threat Type": "Information Disclosure",
+            "Scenario": "O novo cache Redis fica acessível sem autenticação na rede interna e expõe sessões.",
+            "Potential Impact": "Sequestro de sessões e vazamento de dados pessoais armazenados no cache."
+        }],
+        "update_threats": [{**completo["threat_model"][0], "id": 0,
+                            "Scenario": completo["threat_model"][0]["Scenario"] + " O MFA reduz, mas não elimina, o risco."}],
+        "retire_threats": [1],
+        "improvement_suggestions": completo["improvement_suggestions"][:3]
+    }, ensure_ascii=False)
+    prefixos_em_cache = set()
+
+    def texto_usuario(corpo):
+        # O escopo de cada chamada vai na mensagem do usuário; o prefixo de sistema cita todas as categorias
+        return json.dumps(corpo["messages"][-1], ensure_ascii=False)
+
+    def conteudo_por_imagem(corpo):
+        url = next((parte["image_url"]["url"] for mensagem in corpo["messages"]
+                    if isinstance(mensagem["content"], list)
+                    for parte in mensagem["content"] if parte["type"] == "image_url"), "")
+        ameacas = [
+            {**ameaca, "Scenario": f"{ameaca['Scenario']} (componente {i // len(completo['threat_model']) + 1})"}
+            for i, ameaca in zip(range(6 + len(url) // 800), cycle(completo["threat_model"]))
+        ]
+        return json.dumps({"threat_model": ameacas, "improvement_suggestions": completo["improvement_suggestions"]},
+                          ensure_ascii=False)
+
+    def conteudo_continuacao(corpo):
+        """Só o que falta da resposta completa, comparando com as respostas cortadas da conversa"""
+        original = {**corpo, "messages": [m for m in corpo["messages"] if m["role"] != "assistant"][:2]}
+        dados = json.loads(conteudo_para(original))
+        anteriores = "".join(m["content"] for m in corpo["messages"] if m["role"] == "assistant")
+
+        def ja_enviado(texto):
+            return json.dumps(texto, ensure_ascii=False) in anteriores
+
+        return json.dumps({
+            "threat_model": [a for a in dados.get("threat_model", []) if not ja_enviado(a["Scenario"])],
+            "improvement_suggestions": [s for s in dados.get("improvement_suggestions", []) if not ja_enviado(s)]
+        }, ensure_ascii=False)
+
+    def conteudo_para(corpo):
+        if MARCADOR_CONTINUACAO in texto_usuario(corpo):
+            return conteudo_continuacao(corpo)
+        if "retire_threats" in texto_usuario(corpo):
+            return conteudo_delta
+        if ameacas_por_imagem:
+            return conteudo_por_imagem(corpo)
+        if not conteudo_por_prompt:
+            return conteudo
+        texto = texto_usuario(corpo)
+        ameacas = [a for a in completo["threat_model"] if a["Threat Type"] in texto]
+        if not ameacas and "improvement_suggestions" not in texto:
+            return conteudo
+        dados = {}
+        if ameacas:
+            dados["threat_model"] = ameacas
+        if "improvement_suggestions" in texto:
+            dados["improvement_suggestions"] = completo["improvement_suggestions"]
+        return json.dumps(dados, ensure_ascii=False)
+
+    def categoria_com_falha(corpo):
+        texto = texto_usuario(corpo)
+        return any(categoria in texto for categoria in falhar_categorias)
+
+    def texto_prompt(corpo):
+        """Prompt serializado na ordem em que o modelo o lê; cada imagem vale ~765 tokens (85 em detail low)"""
+        partes = []
+        for mensagem in corpo["messages"]:
+            partes.append(f"<|{mensagem['role']}|>")
+            conteudo_mensagem = mensagem["content"]
+            if isinstance(conteudo_mensagem, str):
+                partes.append(conteudo_mensagem)
+                continue
+            for parte in conteudo_mensagem:
+                if parte["type"] == "text":
+                    partes.append(parte["text"])
+                else:
+                    marca = hashlib.sha256(parte["image_url"]["url"].encode()).hexdigest() * 48
+                    partes.append(marca[:85 * 4] if parte["image_url"].get("detail") == "low" else marca)
+        return "".join(partes)
+
+    def contabilizar_prompt(corpo):
+        """Devolve (tokens de prompt, tokens servidos pelo cache de prefixo)"""
+        texto = texto_prompt(corpo)
+        tokens = len(texto) // 4
+        if not cache_prefixo or tokens < 1024:
+            return tokens, 0
+        limites = range(1024, tokens + 1, 128)
+        em_cache = 0
+        for limite in limites:
+            chave = hashlib.sha256(texto[:limite * 4].encode()).digest()
+            if chave not in prefixos_em_cache:
+                break
+            em_cache = limite
+        for limite in limites:
+            prefixos_em_cache.add(hashlib.sha256(texto[:limite * 4].encode()).digest())
+        return tokens, em_cache
+
+    def usage(tokens_prompt, em_cache, resposta):
+        tokens_resposta = len(resposta) // 4
+        return {
+            "prompt_tokens": tokens_prompt,
+            "completion_tokens": tokens_resposta,
+            "total_tokens": tokens_prompt + tokens_resposta,
+            "prompt_tokens_details": {"cached_tokens": em_cache}
+        }
+
+    def falha_injetada():
+        agora = time.monotonic()
+        if limite_rpm:
+            while janela and agora - janela[0] >= 10:
+                janela.popleft()
+            if len(janela) >= max(limite_rpm // 6, 1):
+                espera = 10 - (agora - janela[0])
+                return 429, espera
+            janela.append(agora)
+        if sorteio.random() < taxa_429:
+            return 429, 1.0
+        if sorteio.random() < taxa_500:
+            return 500, None
+        return None
+
+    def resposta_erro(status, espera):
+        app.state.contadores[str(status)] += 1
+        if status == 429:
+            return JSONResponse(
+                {"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit."}},
+                status_code=429,
+                headers={"retry-after": str(math.ceil(espera)), "retry-after-ms": str(int(espera * 1000))}
+            )
+        return JSONResponse({"error": {"code": "500", "message": "Internal server error"}}, status_code=500)
+
+    def sortear_latencia():
+        if latencia_sigma <= 0:
+            return latencia
+        return latencia * math.exp(sorteio.gauss(0, latencia_sigma))
+
+    def escolher_resposta(corpo):
+        """Conteúdo, latência e finish_reason desta chamada, já com a corrupção de JSON e o corte por max_tokens"""
+        if rodizio is not None and "retire_threats" not in texto_usuario(corpo) \
+                and MARCADOR_CONTINUACAO not in texto_usuario(corpo):
+            resposta, latencia_gravada = next(rodizio)
+        else:
+            resposta, latencia_gravada = conteudo_para(corpo), None
+        if taxa_json_invalido and sorteio.random() < taxa_json_invalido:
+            modo = sorteio.choice(MODOS_JSON_INVALIDO)
+            app.state.contadores[f"json_{modo}"] += 1
+            resposta = corromper_json(resposta, modo)
+        motivo = "stop"
+        if respeitar_max_tokens and corpo.get("max_tokens") and len(resposta) > corpo["max_tokens"] * 4:
+            app.state.contadores["cortadas"] += 1
+            resposta, motivo = resposta[:corpo["max_tokens"] * 4], "length"
+        return resposta, sortear_latencia() if latencia_gravada is None else latencia_gravada, motivo
+
+    async def gerar_stream(deployment, resposta, latencia_chamada, atraso_prompt, uso, motivo):
+        yield "data: " + json.dumps({"id": "", "object": "", "created": 0, "model": "", "choices": []}) + "\n\n"
+        await asyncio.sleep(primeiro_token + atraso_prompt)
+        yield chunk_stream(deployment, {"role": "assistant", "content": ""})
+        tamanho = max(-(-len(resposta) // pedacos_stream), 1)
+        intervalo = max(latencia_chamada - primeiro_token, 0) / pedacos_stream
+        for inicio in range(0, len(resposta), tamanho):
+            yield chunk_stream(deployment, {"content": resposta[inicio:inicio + tamanho]})
+            await asyncio.sleep(intervalo)
+        yield chunk_stream(deployment, {}, finish_reason=motivo)
+        if uso is not None:
+            yield "data: " + json.dumps({
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": deployment, "choices": [], "usage": uso
+            }) + "\n\n"
+        yield "data: [DONE]\n\n"
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        corpo = await request.json()
+        app.state.contadores["requisicoes"] += 1
+        app.state.contadores["max_tokens"] += corpo.get("max_tokens") or 0
+        falha = falha_injetada()
+        if falha is not None:
+            return resposta_erro(*falha)
+        resposta, latencia_chamada, motivo = escolher_resposta(corpo)
+        if falhar_categorias and categoria_com_falha(corpo):
+            await asyncio.sleep(latencia_chamada)
+            return resposta_erro(500, None)
+        app.state.contadores["ok"] += 1
+        tokens_prompt, em_cache = contabilizar_prompt(corpo)
+        app.state.contadores["tokens_prompt"] += tokens_prompt
+        atraso_prompt = tempo_por_token_prompt * (tokens_prompt - em_cache)
+        if corpo.get("stream"):
+            incluir_uso = (corpo.get("stream_options") or {}).get("include_usage")
+            return StreamingResponse(
+                gerar_stream(deployment, resposta, latencia_chamada, atraso_prompt,
+                             usage(tokens_prompt, em_cache, resposta) if incluir_uso else None, motivo),
+                media_type="text/event-stream"
+            )
+        await asyncio.sleep(latencia_chamada + atraso_prompt + tempo_por_caractere * len(resposta))
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [{
+                "index": 0,
+                "finish_reason": motivo,
+                "message": {"role": "assistant", "content": resposta}
+            }],
+            "usage": usage(tokens_prompt, em_cache, resposta)
+        }
+
+    @app.get("/contadores")
+    async def contadores():
+        return app.state.contadores
+
+    return app
+
+
+def porta_livre():
+    """Reserva uma porta TCP livre em localhost"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def iniciar_servidor(app, porta):
+    """Sobe o app em uma thread separada e espera ficar pronto"""
+    config = uvicorn.Config(app, host="127.0.0.1", port=porta, log_level="warning")
+    servidor = uvicorn.Server(config)
+    thread = threading.Thread(target=servidor.run, daemon=True)
+    thread.start()
+    while not servidor.started:
+        time.sleep(0.05)
+    return servidor
+
+
+def configurar_ambiente(porta, **extras):
+    """Aponta a API para o servidor falso via variáveis de ambiente"""
+    import os
+    os.environ["AZURE_OPENAI_API_KEY"] = "fake-key"
+    os.environ["AZURE_OPENAI_ENDPOINT"] = f"http://127.0.0.1:{porta}"
+    os.environ["AZURE_OPENAI_API_VERSION"] = "2024-02-01"
+    os.environ["AZURE_OPENAI_DEPLOYMENT_NAME"] = "gpt-4o-fake"
+    for chave, valor in extras.items():
+        os.environ[chave] = str(valor)
+
+
+def importar_api():
+    """Importa o módulo main da API (o diretório do backend não é um pacote)"""
+    import sys
+    if str(DIRETORIO_BACKEND) not in sys.path:
+        sys.path.insert(0, str(DIRETORIO_BACKEND))
+    import main
+    return main
+
+
+def criar_imagem_diagrama(rotulos_ocr=False):
+    """Diagrama PNG simples, no mesmo formato de create_test_image do test_api.py
+
+    Com `rotulos_ocr` os textos e suas posições vão no chunk "stride-ocr" do PNG, lido pelo
+    backend de OCR "teste" (ver ocr.py).
+    """
+    import io
+    import json
+    from PIL import Image, ImageDraw, PngImagePlugin
+
+    img = Image.new('RGB', (800, 600), color='white')
+    draw = ImageDraw.Draw(img)
+    rotulos = []
+
+    def texto(posicao, conteudo, cor):
+        draw.text(posicao, conteudo, fill=cor)
+        rotulos.append([conteudo, *draw.textbbox(posicao, conteudo)])
+
+    draw.rectangle([50, 50, 200, 150], outline='blue', width=3)
+    texto((80, 90), "Frontend", 'blue')
+    draw.rectangle([300, 50, 450, 150], outline='green', width=3)
+    texto((330, 90), "Backend API", 'green')
+    draw.rectangle([550, 50, 700, 150], outline='red', width=3)
+    texto((580, 90), "Database", 'red')
+    draw.line([200, 100, 300, 100], fill='black', width=2)
+    draw.line([450, 100, 550, 100], fill='black', width=2)
+
+    info = None
+    if rotulos_ocr:
+        info = PngImagePlugin.PngInfo()
+        info.add_text("stride-ocr", json.dumps({"largura": img.width, "rotulos": rotulos}))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", pnginfo=info)
+    return buffer.getvalue()
+
+
+FORMULARIO_PADRAO = {
+    'tipo_aplicacao': 'Aplicação Web de Teste',
+    'autenticacao': 'OAuth 2.0 + JWT',
+    'acesso_internet': 'Sim',
+    'dados_sensiveis': 'Dados de teste',
+    'descricao_aplicacao': 'Aplicação de teste para validação da API'
+}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Servidor falso do Azure OpenAI")
+    parser.add_argument("--porta", type=int, default=8900)
+    parser.add_argument("--latencia", type=float, default=1.0, help="Latência (mediana) de cada chamada (s)")
+    parser.add_argument("--latencia-sigma", type=float, default=0.0, help="Sigma da latência log-normal (0 = fixa)")
+    parser.add_argument("--primeiro-token", type=float, default=0.3, help="Tempo até o primeiro pedaço no stream (s)")
+    parser.add_argument("--tempo-por-caractere", type=float, default=0.0)
+    parser.add_argument("--limite-rpm", type=int, default=None, help="Cota do deployment (429 acima dela)")
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    parser.add_argument("--taxa-500", type=float, default=0.0)
+    parser.add_argument("--taxa-json-invalido", type=float, default=0.0)
+    parser.add_argument("--gravacoes", help="Arquivo .json/.jsonl (ou diretório) com respostas gravadas")
+    parser.add_argument("--respeitar-max-tokens", action="store_true",
+                        help="Corta a resposta em max_tokens (finish_reason=length)")
+    parser.add_argument("--ameacas-por-imagem", action="store_true",
+                        help="Número de ameaças proporcional ao tamanho da imagem")
+    parser.add_argument("--semente", type=int, default=None)
+    args = parser.parse_args()
+    uvicorn.run(criar_app_fake(
+        latencia=args.latencia, latencia_sigma=args.latencia_sigma, primeiro_token=args.primeiro_token,
+        tempo_por_caractere=args.tempo_por_caractere, limite_rpm=args.limite_rpm, taxa_429=args.taxa_429,
+        taxa_500=args.taxa_500, taxa_json_invalido=args.taxa_json_invalido, gravacoes=args.gravacoes,
+        respeitar_max_tokens=args.respeitar_max_tokens, ameacas_por_imagem=args.ameacas_por_imagem,
+        semente=args.semente
+    ), host="127.0.0.1", port=args.porta, log_level="warning")
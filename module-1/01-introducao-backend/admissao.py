@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+
+from starlette.responses import JSONResponse
+
+from metricas import ADMISSAO, ESPERA_ADMISSAO, FILA_ADMISSAO
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissaoRecusada(Exception):
+    """Fila de espera cheia (ou espera esgotada): a requisição deve ser recusada com 503"""
+
+    def __init__(self, mensagem, retry_after=1):
+        super().__init__(mensagem)
+        self.retry_after = retry_after
+
+
+class ControleAdmissao:
+    """Limita as análises em andamento e mantém uma fila de espera limitada e justa entre clientes
+
+    Até `max_em_andamento` requisições executam ao mesmo tempo; as demais esperam em uma fila por
+    cliente, atendidas em rodízio quando uma vaga abre, para que um cliente com muitos envios não
+    atrase os outros. Acima de `max_fila` (ou de `max_fila_cliente` para o mesmo cliente) e depois
+    de `espera_maxima` segundos na fila a requisição é recusada. O Retry-After sugerido vem da
+    duração média das análises e do tamanho da fila.
+    """
+
+    def __init__(self, max_em_andamento=32, max_fila=64, max_fila_cliente=16, espera_maxima=30.0,
+                 duracao_inicial=10.0):
+        self.max_em_andamento = max_em_andamento
+        self.max_fila = max_fila
+        self.max_fila_cliente = max_fila_cliente
+        self.espera_maxima = espera_maxima
+        self.em_andamento = 0
+        self.aguardando = 0
+        self.duracao_media = duracao_inicial
+        self._filas = OrderedDict()
+        self.contadores = {"admitidas": 0, "enfileiradas": 0, "recusadas": 0, "expiradas": 0}
+
+    def sugerir_retry_after(self) -> int:
+        return min(max(math.ceil(self.duracao_media * (self.aguardando + 1) / self.max_em_andamento), 1), 60)
+
+    async def admitir(self, cliente: str):
+        if self.em_andamento < self.max_em_andamento and not self.aguardando:
+            self.em_andamento += 1
+            self.contadores["admitidas"] += 1
+            ADMISSAO.labels("admitida").inc()
+            return
+
+        fila = self._filas.get(cliente)
+        if self.aguardando >= self.max_fila or (fila is not None and len(fila) >= self.max_fila_cliente):
+            self.contadores["recusadas"] += 1
+            ADMISSAO.labels("recusada").inc()
+            raise AdmissaoRecusada("Servidor sobrecarregado: fila de análises cheia", self.sugerir_retry_after())
+
+        futuro = asyncio.get_running_loop().create_future()
+        if fila is None:
+            fila = self._filas[cliente] = deque()
+        fila.append(futuro)
+        self.aguardando += 1
+        self.contadores["enfileiradas"] += 1
+        FILA_ADMISSAO.inc()
+        inicio = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(futuro), self.espera_maxima)
+        except asyncio.TimeoutError:
+            # A vaga pode ter sido entregue no mesmo instante em que o prazo esgotou
+            if not futuro.done():
+                self._desistir(cliente, futuro)
+                self.contadores["expiradas"] += 1
+                ADMISSAO.labels("expirada").inc()
+                raise AdmissaoRecusada("Servidor sobrecarregado: tempo de espera na fila esgotado",
+                                       self.sugerir_retry_after())
+        except asyncio.CancelledError:
+            if futuro.done():
+                self.liberar()
+            else:
+                self._desistir(cliente, futuro)
+            raise
+        ESPERA_ADMISSAO.observe(time.monotonic() - inicio)
+        self.contadores["admitidas"] += 1
+        ADMISSAO.labels("enfileirada").inc()
+
+    def liberar(self, duracao: float = None):
+        """Devolve a vaga; se houver fila, ela passa direto ao próximo cliente do rodízio"""
+        if duracao is not None:
+            self.duracao_media += 0.1 * (duracao - self.duracao_media)
+        while self._filas:
+            cliente, fila = next(iter(self._filas.items()))
+            futuro = fila.popleft()
+            if fila:
+                self._filas.move_to_end(cliente)
+            else:
+                del self._filas[cliente]
+            self.aguardando -= 1
+            FILA_ADMISSAO.dec()
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self.em_andamento -= 1
+
+    def estatisticas(self) -> dict:
+        return {
+            **self.contadores,
+            "em_andamento": self.em_andamento,
+            "aguardando": self.aguardando,
+            "clientes_aguardando": len(self._filas),
+            "max_em_andamento": self.max_em_andamento,
+            "max_fila": self.max_fila,
+            "duracao_media_s": round(self.duracao_media, 3)
+        }
+
+    def _desistir(self, cliente, futuro):
+        fila = self._filas.get(cliente)
+        if fila is None or futuro not in fila:
+            return
+        fila.remove(futuro)
+        if not fila:
+            del self._filas[cliente]
+        self.aguardando -= 1
+        FILA_ADMISSAO.dec()
+
+
+class ChamadasEmAndamento:
+    """Single-flight: análises idênticas simultâneas compartilham a mesma chamada ao modelo
+
+    A primeira requisição de uma chave executa a análise em uma tarefa própria; as que chegam
+    enquanto ela não termina apenas aguardam o mesmo resultado (ou a mesma exceção). A tarefa não
+    é cancelada se quem a iniciou desconectar, para não derrubar os demais que aguardam.
+    """
+
+    def __init__(self):
+        self._em_voo = {}
+        self.contadores = {"executadas": 0, "coalescidas": 0}
+
+    async def executar(self, chave: str, funcao) -> tuple:
+        """Devolve (resultado, coalescida); `funcao()` é a corrotina que faz a análise"""
+        tarefa = self._em_voo.get(chave)
+        if tarefa is not None:
+            self.contadores["coalescidas"] += 1
+            resultado = await asyncio.shield(tarefa)
+            # Cópia rasa: quem recebe pode acrescentar campos sem afetar os demais
+            return dict(resultado), True
+
+        tarefa = asyncio.ensure_future(funcao())
+        self._em_voo[chave] = tarefa
+        self.contadores["executadas"] += 1
+        tarefa.add_done_callback(lambda t: self._concluir(chave, t))
+        return await asyncio.shield(tarefa), False
+
+    def estatisticas(self) -> dict:
+        return {**self.contadores, "em_voo": len(self._em_voo)}
+
+    def _concluir(self, chave, tarefa):
+        if self._em_voo.get(chave) is tarefa:
+            del self._em_voo[chave]
+        # Marca a exceção como lida caso todos os interessados tenham desconectado
+        if not tarefa.cancelled():
+            tarefa.exception()
+
+
+def identificar_cliente(scope, cabecalho: bytes = None) -> str:
+    """Cliente da requisição: valor do cabeçalho configurado ou o IP (já resolvido pelo proxy_headers)"""
+    if cabecalho:
+        for nome, valor in scope["headers"]:
+            if nome == cabecalho:
+                return valor.decode("latin-1")
+    cliente = scope.get("client")
+    return cliente[0] if cliente else "desconhecido"
+
+
+class MiddlewareAdmissao:
+    """Aplica o ControleAdmissao antes de o corpo da requisição ser lido
+
+    Como middleware ASGI, a espera e a recusa acontecem antes de o FastAPI ler o upload: as
+    requisições na fila não ocupam memória com a imagem, e o 503 sai sem esperar o envio terminar.
+    A vaga só é devolvida quando a resposta termina (inclusive no streaming).
+    """
+
+    def __init__(self, app, obter_controle, caminhos, cabecalho_cliente=None):
+        self.app = app
+        self.obter_controle = obter_controle
+        self.caminhos = set(caminhos)
+        self.cabecalho_cliente = cabecalho_cliente.lower().encode("latin-1") if cabecalho_cliente else None
+
+    async def __call__(self, scope, receive, send):
+        controle = self.obter_controle()
+        if controle is None or scope["type"] != "http" or scope["method"] != "POST" \
+                or scope["path"] not in self.caminhos:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await controle.admitir(identificar_cliente(scope, self.cabecalho_cliente))
+        except AdmissaoRecusada as ar:
+            logger.warning(f"Requisição recusada: {str(ar)}")
+            resposta = JSONResponse({"detail": str(ar)}, status_code=503,
+                                    headers={"Retry-After": str(ar.retry_after)})
+            await resposta(scope, receive, send)
+            return
+
+        inicio = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controle.liberar(time.monotonic() - inicio)
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def calcular_chave(hash_imagem: str, prompt: str, parametros_modelo: dict) -> str:
+    """Chave de conteúdo: hash da imagem + prompt normalizado + parâmetros do modelo"""
+    prompt_normalizado = " ".join(prompt.split())
+    parametros = json.dumps(parametros_modelo, sort_keys=True, separators=(",", ":"))
+
+    h = hashlib.sha256()
+    h.update(hash_imagem.encode("ascii"))
+    h.update(prompt_normalizado.encode("utf-8"))
+    h.update(parametros.encode("utf-8"))
+    return h.hexdigest()
+
+
+class CacheResultados:
+    """Cache de análises em duas camadas: LRU em memória com TTL e SQLite opcional em disco"""
+
+    def __init__(self, max_itens=256, max_bytes=64 * 1024 * 1024, ttl=86400, caminho_sqlite=None):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._bytes_em_memoria = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self.contadores = {"hits_memoria": 0, "hits_disco": 0, "misses": 0, "armazenados": 0, "removidos": 0}
+
+        if caminho_sqlite:
+            self._db = sqlite3.connect(caminho_sqlite, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS resultados ("
+                "chave TEXT PRIMARY KEY, expira_em REAL NOT NULL, valor BLOB NOT NULL)"
+            )
+            self._db.execute("DELETE FROM resultados WHERE expira_em < ?", (time.time(),))
+            self._db.commit()
+            logger.info(f"Cache em disco habilitado: {caminho_sqlite}")
+
+    def obter(self, chave: str) -> Optional[dict]:
+        agora = time.time()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None:
+                expira_em, valor = item
+                if expira_em >= agora:
+                    self._itens.move_to_end(chave)
+                    self.contadores["hits_memoria"] += 1
+                    return json.loads(valor)
+                self._remover(chave)
+
+            if self._db is not None:
+                linha = self._db.execute(
+                    "SELECT expira_em, valor FROM resultados WHERE chave = ?", (chave,)
+                ).fetchone()
+                if linha is not None and linha[0] >= agora:
+                    self._inserir_memoria(chave, linha[0], linha[1])
+                    self.contadores["hits_disco"] += 1
+                    return json.loads(linha[1])
+
+            self.contadores["misses"] += 1
+            return None
+
+    def armazenar(self, chave: str, resultado: dict):
+        valor = json.dumps(resultado, ensure_ascii=False).encode("utf-8")
+        expira_em = time.time() + self.ttl
+        with self._lock:
+            self._inserir_memoria(chave, expira_em, valor)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO resultados (chave, expira_em, valor) VALUES (?, ?, ?)",
+                    (chave, expira_em, valor)
+                )
+                self._db.commit()
+            self.contadores["armazenados"] += 1
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            hits = self.contadores["hits_memoria"] + self.contadores["hits_disco"]
+            consultas = hits + self.contadores["misses"]
+            return {
+                **self.contadores,
+                "itens_em_memoria": len(self._itens),
+                "bytes_em_memoria": self._bytes_em_memoria,
+                "disco_habilitado": self._db is not None,
+                "taxa_acerto": round(hits / consultas, 4) if consultas else 0.0
+            }
+
+    def fechar(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _inserir_memoria(self, chave, expira_em, valor):
+        if len(valor) > self.max_bytes:
+            return
+        if chave in self._itens:
+            self._remover(chave)
+        self._itens[chave] = (expira_em, valor)
+        self._bytes_em_memoria += len(valor)
+        while len(self._itens) > self.max_itens or self._bytes_em_memoria > self.max_bytes:
+            antiga, _ = next(iter(self._itens.items()))
+            self._remover(antiga)
+            self.contadores["removidos"] += 1
+
+    def _remover(self, chave):
+        _, valor = self._itens.pop(chave)
+        self._bytes_em_memoria -= len(valor)
@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+from limites import BaldeTokens
+from metricas import observar_etapa, registrar_uso
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Codificação do GPT-4o / GPT-4o-mini
+CODIFICACAO_TOKENS = "o200k_base"
+
+# Tokens fixos que a API acrescenta a cada mensagem do chat (papel e delimitadores)
+TOKENS_POR_MENSAGEM = 3
+
+
+class FalhaModelo(Exception):
+    """Falha definitiva na chamada ao modelo, já com o status HTTP a devolver ao cliente"""
+
+    def __init__(self, mensagem, status_code=502, retry_after=None):
+        super().__init__(mensagem)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@lru_cache(maxsize=1)
+def _codificador():
+    if tiktoken is None:
+        logger.info("tiktoken não instalado: tokens estimados em ~4 caracteres por token")
+        return None
+    try:
+        return tiktoken.get_encoding(CODIFICACAO_TOKENS)
+    except Exception as e:
+        # Sem acesso à internet o tiktoken só funciona com TIKTOKEN_CACHE_DIR já populado
+        logger.warning(f"Não foi possível carregar a codificação {CODIFICACAO_TOKENS} do tiktoken: {str(e)}")
+        return None
+
+
+def carregar_codificador() -> bool:
+    """Carrega a codificação do tiktoken (que pode precisar de download); chamado no startup, fora do event loop"""
+    return _codificador() is not None
+
+
+@lru_cache(maxsize=512)
+def contar_tokens(texto: str) -> int:
+    """Tokens do texto pelo tiktoken; o cache evita recontar o prefixo estático do prompt"""
+    codificador = _codificador()
+    if codificador is None:
+        return estimar_tokens_texto(texto)
+    return len(codificador.encode(texto))
+
+
+def estimar_tokens_texto(texto: str) -> int:
+    """Estimativa rápida (~4 caracteres por token) quando o tiktoken não está disponível"""
+    return len(texto) // 4 + 1
+
+
+def estimar_tokens_imagem(largura=None, altura=None, detail="auto") -> int:
+    """Custo em tokens de uma imagem na visão do GPT-4o (85 base + 170 por bloco de 512px)"""
+    if detail == "low":
+        return 85
+    if not largura or not altura:
+        return 765
+    escala = min(1.0, 2048 / max(largura, altura))
+    largura, altura = largura * escala, altura * escala
+    escala = min(1.0, 768 / min(largura, altura))
+    largura, altura = largura * escala, altura * escala
+    return 85 + 170 * math.ceil(largura / 512) * math.ceil(altura / 512)
+
+
+def estimar_tokens_mensagens(mensagens: list, largura=None, altura=None) -> int:
+    total = 0
+    for mensagem in mensagens:
+        total += TOKENS_POR_MENSAGEM
+        conteudo = mensagem["content"]
+        if isinstance(conteudo, str):
+            total += contar_tokens(conteudo)
+            continue
+        for parte in conteudo:
+            if parte["type"] == "text":
+                total += contar_tokens(parte["text"])
+            elif parte["type"] == "image_url":
+                total += estimar_tokens_imagem(largura, altura, parte["image_url"].get("detail", "auto"))
+    return total
+
+
+def ler_retry_after(erro: APIStatusError):
+    """Tempo de espera sugerido pelo Azure (retry-after-ms, retry-after em segundos ou data HTTP)"""
+    cabecalhos = erro.response.headers
+    try:
+        if "retry-after-ms" in cabecalhos:
+            return float(cabecalhos["retry-after-ms"]) / 1000
+        if "retry-after" in cabecalhos:
+            valor = cabecalhos["retry-after"]
+            try:
+                return float(valor)
+            except ValueError:
+                return max(parsedate_to_datetime(valor).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class CircuitBreaker:
+    """Abre após `limiar_falhas` falhas consecutivas e deixa passar uma chamada de teste após `tempo_aberto`
+
+    Falhas são 5xx, timeouts e erros de conexão. Um 4xx (exceto 429) mostra que o deployment
+    respondeu e conta como sucesso; um 429 não decide nada. A chamada de teste que termina sem
+    sucesso nem falha registrados (429, prazo, cancelamento) devolve a vaga com `liberar_teste`.
+    """
+
+    def __init__(self, limiar_falhas=5, tempo_aberto=30.0):
+        self.limiar_falhas = limiar_falhas
+        self.tempo_aberto = tempo_aberto
+        self.estado = "fechado"
+        self.falhas_consecutivas = 0
+        self._aberto_em = 0.0
+        self._teste_em_andamento = False
+
+    def permitir(self) -> bool:
+        if self.estado == "fechado":
+            return True
+        if self.estado == "aberto" and time.monotonic() - self._aberto_em >= self.tempo_aberto:
+            self.estado = "meio_aberto"
+        if self.estado == "meio_aberto" and not self._teste_em_andamento:
+            self._teste_em_andamento = True
+            return True
+        return False
+
+    def liberar_teste(self):
+        """Devolve a vaga da chamada de teste sem mudar o estado: a próxima chamada testa de novo"""
+        if self.estado == "meio_aberto":
+            self._teste_em_andamento = False
+
+    def restante_aberto(self) -> float:
+        return max(self.tempo_aberto - (time.monotonic() - self._aberto_em), 0)
+
+    def registrar_sucesso(self):
+        self.estado = "fechado"
+        self.falhas_consecutivas = 0
+        self._teste_em_andamento = False
+
+    def registrar_falha(self):
+        self.falhas_consecutivas += 1
+        self._teste_em_andamento = False
+        if self.estado == "meio_aberto" or self.falhas_consecutivas >= self.limiar_falhas:
+            if self.estado != "aberto":
+                logger.warning(f"Circuit breaker aberto após {self.falhas_consecutivas} falhas consecutivas")
+            self.estado = "aberto"
+            self._aberto_em = time.monotonic()
+
+
+class ClienteResiliente:
+    """Envolve o AsyncAzureOpenAI com a política de chamadas ao deployment
+
+    - limite de chamadas simultâneas
+    - token buckets de RPM e TPM (tokens estimados de prompt + imagem + max_tokens)
+    - retentativas com backoff exponencial e jitter, respeitando Retry-After
+    - prazo total por requisição (fila + tentativas)
+    - circuit breaker que falha rápido quando o deployment está instável
+
+    O cliente OpenAI deve ser criado com max_retries=0 para não duplicar as retentativas.
+    """
+
+    def __init__(self, client, deployment, max_concorrencia=16, rpm=0, tpm=0, max_tentativas=4,
+                 backoff_base=1.0, backoff_max=30.0, prazo=90.0, limiar_falhas=5, tempo_circuito=30.0):
+        self.client = client
+        self.deployment = deployment
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.prazo = prazo
+        self.max_concorrencia = max_concorrencia
+        self._semaforo = asyncio.Semaphore(max_concorrencia)
+        # O Azure avalia a cota em janelas curtas (1s/10s), então a rajada de requisições fica
+        # em um segundo de cota; no TPM a rajada precisa comportar ao menos uma análise inteira
+        self._rpm = BaldeTokens(taxa=rpm / 60, capacidade=max(rpm / 60, 1)) if rpm else None
+        self._tpm = BaldeTokens(taxa=tpm / 60, capacidade=max(tpm / 6, 1)) if tpm else None
+        self.circuito = CircuitBreaker(limiar_falhas, tempo_circuito)
+        self.contadores = {"chamadas": 0, "sucessos": 0, "retentativas": 0, "throttled": 0,
+                           "falhas": 0, "rejeitadas_circuito": 0, "prazos_esgotados": 0}
+
+    async def criar(self, messages, tokens_estimados=0, prazo=None, **parametros):
+        """Chamada não-streaming com toda a política aplicada"""
+        inicio = time.monotonic()
+        limite = inicio + (prazo or self.prazo)
+        teste = self._admitir()
+        tokens = tokens_estimados + parametros.get("max_tokens", 0)
+        try:
+            async with self._semaforo:
+                resposta, inicio_chamada = await self._com_retentativas(messages, parametros, tokens, limite, inicio)
+        finally:
+            if teste:
+                self.circuito.liberar_teste()
+        observar_etapa("modelo", time.monotonic() - inicio_chamada)
+        registrar_uso(resposta.usage)
+        return resposta
+
+    async def criar_stream(self, messages, tokens_estimados=0, prazo=None, **parametros):
+        """Gerador de chunks: o prazo e as retentativas valem até o stream começar"""
+        inicio = time.monotonic()
+        limite = inicio + (prazo or self.prazo)
+        teste = self._admitir()
+        tokens = tokens_estimados + parametros.get("max_tokens", 0)
+        async with self._semaforo:
+            try:
+                stream, inicio_chamada = await self._com_retentativas(
+                    messages, {**parametros, "stream": True, "stream_options": {"include_usage": True}},
+                    tokens, limite, inicio
+                )
+            finally:
+                if teste:
+                    self.circuito.liberar_teste()
+            async for chunk in stream:
+                # O usage vem em um último chunk, sem choices (stream_options.include_usage)
+                registrar_uso(getattr(chunk, "usage", None))
+                yield chunk
+        observar_etapa("modelo", time.monotonic() - inicio_chamada)
+
+    def estado(self) -> dict:
+        return {
+            "circuito": self.circuito.estado,
+            "falhas_consecutivas": self.circuito.falhas_consecutivas,
+            **self.contadores
+        }
+
+    def _admitir(self) -> bool:
+        """Falha rápido com o circuito aberto; devolve True se esta é a chamada de teste do meio-aberto"""
+        if not self.circuito.permitir():
+            self.contadores["rejeitadas_circuito"] += 1
+            raise FalhaModelo(
+                "Deployment do Azure OpenAI indisponível no momento (circuit breaker aberto)",
+                status_code=503, retry_after=math.ceil(self.circuito.restante_aberto()) or 1
+            )
+        return self.circuito.estado == "meio_aberto"
+
+    async def _aguardar_cota(self, tokens, limite):
+        # Cada tentativa consome cota no Azure, inclusive as retentativas
+        try:
+            if self._rpm is not None:
+                await asyncio.wait_for(self._rpm.adquirir(1), timeout=self._restante(limite))
+            if self._tpm is not None and tokens:
+                await asyncio.wait_for(self._tpm.adquirir(tokens), timeout=self._restante(limite))
+        except asyncio.TimeoutError:
+            self.contadores["prazos_esgotados"] += 1
+            raise FalhaModelo("Cota de requisições/tokens esgotada: prazo excedido aguardando o limitador",
+                              status_code=429, retry_after=5)
+
+    def _restante(self, limite):
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            self.contadores["prazos_esgotados"] += 1
+            raise FalhaModelo("Prazo da análise excedido", status_code=504)
+        return restante
+
+    def _backoff(self, tentativa):
+        # Full jitter: espera aleatória entre 0 e o teto exponencial
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** tentativa))
+
+    async def _com_retentativas(self, messages, parametros, tokens, limite, inicio):
+        """Devolve a resposta e o instante em que começou a tentativa bem-sucedida"""
+        tentativa = 0
+        while True:
+            await self._aguardar_cota(tokens, limite)
+            inicio_chamada = time.monotonic()
+            if tentativa == 0:
+                observar_etapa("fila", inicio_chamada - inicio)
+            self.contadores["chamadas"] += 1
+            try:
+                resposta = await self.client.chat.completions.create(
+                    messages=messages, model=self.deployment, timeout=self._restante(limite), **parametros
+                )
+                self.circuito.registrar_sucesso()
+                self.contadores["sucessos"] += 1
+                return resposta, inicio_chamada
+            except APIStatusError as e:
+                if e.status_code == 429:
+                    self.contadores["throttled"] += 1
+                    espera = ler_retry_after(e)
+                    status_final = 429
+                elif e.status_code >= 500:
+                    self.circuito.registrar_falha()
+                    espera = ler_retry_after(e)
+                    status_final = 502
+                else:
+                    # Erro do pedido (400, 401, 404...): o deployment respondeu, não conta contra o circuito
+                    self.circuito.registrar_sucesso()
+                    raise
+                mensagem = f"Azure OpenAI respondeu {e.status_code}"
+            except (APITimeoutError, APIConnectionError) as e:
+                self.circuito.registrar_falha()
+                espera, status_final = None, 504 if isinstance(e, APITimeoutError) else 502
+                mensagem = f"Falha de comunicação com o Azure OpenAI: {type(e).__name__}"
+
+            if espera is None:
+                espera = self._backoff(tentativa)
+            restante = limite - time.monotonic()
+            if tentativa >= self.max_tentativas or espera >= restante:
+                self.contadores["falhas"] += 1
+                raise FalhaModelo(mensagem, status_code=status_final, retry_after=math.ceil(espera) or 1)
+
+            tentativa += 1
+            self.contadores["retentativas"] += 1
+            logger.warning(f"{mensagem}; nova tentativa ({tentativa}/{self.max_tentativas}) em {espera:.2f}s")
+            await asyncio.sleep(espera)
@@ -0,0 +1,169 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+import orjson
+
+from cliente_openai import FalhaModelo
+from esquema import RespostaModelo, RespostaParcial, analisar_resposta
+from fanout import normalizar_texto
+from metricas import CONTINUACOES, TOKENS_CONTINUACAO, tokens_em_cache
+from prompt import montar_mensagens_continuacao
+
+logger = logging.getLogger(__name__)
+
+# Densidade de bordas assumida quando a imagem não passa pelo pré-processamento (~6 componentes)
+DENSIDADE_PADRAO = 0.05
+
+
+class OrcamentoSaida:
+    """max_tokens de cada análise a partir da complexidade do diagrama e do tamanho da descrição
+
+    O número de ameaças esperado cresce com a densidade de bordas da imagem (caixas, setas e
+    rótulos) e com os tokens da descrição. Os tokens por ameaça (sugestões incluídas) começam em
+    `tokens_por_ameaca` e seguem uma média móvel das respostas completas recebidas pelo worker.
+    """
+
+    def __init__(self, minimo=1000, maximo=4096, margem=1.2, tokens_por_ameaca=90.0, peso_observacao=0.1):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.margem = margem
+        self.tokens_por_ameaca = tokens_por_ameaca
+        self.peso_observacao = peso_observacao
+
+    @staticmethod
+    def ameacas_esperadas(densidade_bordas: Optional[float], tokens_descricao: int) -> float:
+        densidade = DENSIDADE_PADRAO if densidade_bordas is None else densidade_bordas
+        return min(8 + 150 * densidade + tokens_descricao / 50, 60)
+
+    def estimar(self, densidade_bordas: Optional[float], tokens_descricao: int) -> int:
+        tokens = self.margem * self.ameacas_esperadas(densidade_bordas, tokens_descricao) * self.tokens_por_ameaca
+        return int(min(max(tokens, self.minimo), self.maximo))
+
+    def observar(self, tokens_completion: Optional[int], ameacas: int):
+        """Atualiza os tokens por ameaça com uma resposta que terminou sem corte"""
+        if not tokens_completion or not ameacas:
+            return
+        self.tokens_por_ameaca += self.peso_observacao * (tokens_completion / ameacas - self.tokens_por_ameaca)
+
+
+class JuncaoResposta:
+    """Junta a resposta cortada e as continuações em um único modelo de ameaças, sem repetições"""
+
+    def __init__(self):
+        self._ameacas = {}
+        self._sugestoes = {}
+
+    def adicionar(self, texto: str) -> int:
+        """Aproveita as ameaças e sugestões completas do texto; devolve quantas eram novas"""
+        try:
+            # Continuações trazem só o que faltava, às vezes sem threat_model
+            resposta, _ = analisar_resposta(texto, RespostaParcial)
+        except ValueError:
+            return 0
+        novas = 0
+        for ameaca in resposta.threat_model:
+            chave = (ameaca.threat_type, normalizar_texto(ameaca.scenario))
+            if chave not in self._ameacas:
+                self._ameacas[chave] = ameaca
+                novas += 1
+        for sugestao in resposta.improvement_suggestions:
+            chave = normalizar_texto(sugestao)
+            if chave not in self._sugestoes:
+                self._sugestoes[chave] = sugestao
+                novas += 1
+        return novas
+
+    def contagens(self) -> tuple:
+        return len(self._ameacas), len(self._sugestoes)
+
+    def texto(self) -> str:
+        resposta = RespostaModelo(
+            threat_model=list(self._ameacas.values()), improvement_suggestions=list(self._sugestoes.values())
+        )
+        return orjson.dumps(resposta.para_dict()).decode()
+
+
+@dataclass
+class RespostaContinuada:
+    texto: str
+    continuacoes: int = 0
+    resultado: Optional[str] = None
+    tokens_gastos: int = 0
+    tokens_economizados: int = 0
+    # Ameaças e sugestões já aproveitadas da resposta cortada (no streaming, já emitidas)
+    ameacas_iniciais: int = 0
+    sugestoes_iniciais: int = 0
+
+    @property
+    def completa(self) -> bool:
+        return self.resultado in (None, "completa")
+
+    def relatorio(self) -> Optional[dict]:
+        if self.resultado is None:
+            return None
+        return {
+            "continuations": self.continuacoes,
+            "complete": self.completa,
+            "tokens_spent": self.tokens_gastos,
+            "tokens_saved": self.tokens_economizados
+        }
+
+
+async def continuar_resposta(chamar, mensagens: list, texto: str, motivo: Optional[str], uso,
+                             max_continuacoes: int) -> RespostaContinuada:
+    """Se a resposta foi cortada por max_tokens (finish_reason "length"), pede a continuação
+
+    `chamar(mensagens)` faz a chamada ao modelo e devolve o ChatCompletion. Cada continuação
+    reenvia a conversa com as respostas cortadas e pede só o que falta, no mesmo formato JSON;
+    as partes são juntadas descartando ameaças repetidas. Se uma continuação falhar, fica o que
+    já foi aproveitado (o mesmo que o reparo da resposta cortada daria).
+    """
+    if motivo != "length" or max_continuacoes <= 0:
+        return RespostaContinuada(texto)
+
+    juncao = JuncaoResposta()
+    juncao.adicionar(texto)
+    ameacas_iniciais, sugestoes_iniciais = juncao.contagens()
+    logger.warning(f"Resposta cortada por max_tokens com {ameacas_iniciais} ameaças completas; pedindo continuação")
+
+    parciais = [texto]
+    continuacoes = gastos = prompt_continuacao = 0
+    resultado = "cortada"
+    while continuacoes < max_continuacoes:
+        continuacoes += 1
+        try:
+            resposta = await chamar(montar_mensagens_continuacao(mensagens, parciais))
+        except FalhaModelo as fm:
+            logger.warning(f"Continuação {continuacoes} falhou ({fm.status_code}): {str(fm)}")
+            resultado = "falha"
+            break
+        if resposta.usage is not None:
+            sem_cache = (resposta.usage.prompt_tokens or 0) - tokens_em_cache(resposta.usage)
+            prompt_continuacao += sem_cache
+            gastos += sem_cache + (resposta.usage.completion_tokens or 0)
+        escolha = resposta.choices[0]
+        parcial = escolha.message.content or ""
+        novas = juncao.adicionar(parcial)
+        parciais.append(parcial)
+        logger.info(f"Continuação {continuacoes}: {novas} itens novos (finish_reason={escolha.finish_reason})")
+        if escolha.finish_reason != "length":
+            resultado = "completa"
+            break
+
+    # Uma nova análise pagaria de novo o prompt e a parte já gerada; a continuação paga só o
+    # prompt fora do cache (a resposta cortada reenviada). O restante da saída sai igual nos dois casos.
+    economizados = 0
+    if resultado == "completa" and uso is not None:
+        economizados = max((uso.prompt_tokens or 0) + (uso.completion_tokens or 0) - prompt_continuacao, 0)
+
+    CONTINUACOES.labels(resultado).inc()
+    TOKENS_CONTINUACAO.labels("gastos").inc(gastos)
+    TOKENS_CONTINUACAO.labels("economizados").inc(economizados)
+    ameacas, sugestoes = juncao.contagens()
+    if ameacas or sugestoes:
+        texto = juncao.texto()
+    return RespostaContinuada(
+        texto=texto, continuacoes=continuacoes, resultado=resultado, tokens_gastos=gastos,
+        tokens_economizados=economizados, ameacas_iniciais=ameacas_iniciais, sugestoes_iniciais=sugestoes_iniciais
+    )
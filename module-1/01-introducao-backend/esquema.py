@@ -0,0 +1,353 @@
+import copy
+from typing import List, Optional
+
+import orjson
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, ValidationError, field_validator, model_validator
+
+CATEGORIAS_STRIDE = [
+    "Spoofing", "Tampering", "Repudiation", "Information Disclosure", "Denial of Service", "Elevation of Privilege"
+]
+
+NOMES_CATEGORIAS = {
+    "Spoofing": "Falsificação de Identidade",
+    "Tampering": "Violação de Integridade",
+    "Repudiation": "Repúdio",
+    "Information Disclosure": "Divulgação de Informações",
+    "Denial of Service": "Negação de Serviço",
+    "Elevation of Privilege": "Elevação de Privilégio"
+}
+
+# Nomes em português (e variações comuns) que o modelo às vezes devolve no lugar da categoria em inglês
+SINONIMOS_CATEGORIA = {
+    "falsificação de identidade": "Spoofing",
+    "falsificacao de identidade": "Spoofing",
+    "violação de integridade": "Tampering",
+    "violacao de integridade": "Tampering",
+    "adulteração": "Tampering",
+    "repúdio": "Repudiation",
+    "repudio": "Repudiation",
+    "divulgação de informações": "Information Disclosure",
+    "divulgacao de informacoes": "Information Disclosure",
+    "negação de serviço": "Denial of Service",
+    "negacao de servico": "Denial of Service",
+    "dos": "Denial of Service",
+    "elevação de privilégio": "Elevation of Privilege",
+    "elevacao de privilegio": "Elevation of Privilege",
+    **{categoria.lower(): categoria for categoria in CATEGORIAS_STRIDE}
+}
+
+
+def normalizar_categoria(valor: str) -> str:
+    """Converte variações ("spoofing", "Repúdio", "Tampering (Violação de Integridade)") na categoria STRIDE"""
+    if valor in CATEGORIAS_STRIDE:
+        return valor
+    chave = valor.strip().lower()
+    if chave in SINONIMOS_CATEGORIA:
+        return SINONIMOS_CATEGORIA[chave]
+    for sinonimo, categoria in SINONIMOS_CATEGORIA.items():
+        if chave.startswith(sinonimo):
+            return categoria
+    return valor.strip()
+
+
+class Ameaca(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    threat_type: str = Field(alias="Threat Type", json_schema_extra={"enum": CATEGORIAS_STRIDE})
+    scenario: str = Field(alias="Scenario")
+    potential_impact: str = Field(alias="Potential Impact")
+
+    @field_validator("threat_type")
+    @classmethod
+    def _normalizar_categoria(cls, valor):
+        return normalizar_categoria(valor)
+
+
+class Resumo(BaseModel):
+    total_threats: int
+    threats_by_type: dict
+    application_type: str
+    has_internet_access: str
+    authentication_method: str
+
+
+class RespostaParcial(BaseModel):
+    """Trecho de resposta em que nenhuma das listas é obrigatória (continuações de uma resposta cortada)"""
+
+    threat_model: List[Ameaca] = []
+    improvement_suggestions: List[str] = []
+
+
+class RespostaSugestoes(RespostaParcial):
+    """Resposta da chamada de sugestões do fan-out: só improvement_suggestions é obrigatória"""
+
+    improvement_suggestions: List[str]
+
+
+class RespostaModelo(RespostaParcial):
+    """Formato que o modelo deve devolver; também gera o JSON schema da saída estruturada
+
+    threat_model é obrigatório: um objeto sem ele ({} ou chaves trocadas) é falha de parse, não
+    uma análise vazia.
+    """
+
+    threat_model: List[Ameaca]
+
+    _por_tipo: dict = PrivateAttr(default_factory=dict)
+
+    @model_validator(mode="after")
+    def _contar_por_tipo(self):
+        # Contagem feita na validação, para o summary não percorrer as ameaças de novo
+        por_tipo = {}
+        for ameaca in self.threat_model:
+            por_tipo[ameaca.threat_type] = por_tipo.get(ameaca.threat_type, 0) + 1
+        self._por_tipo = por_tipo
+        return self
+
+    def resumo(self, formulario) -> dict:
+        return {
+            "total_threats": len(self.threat_model),
+            "threats_by_type": dict(self._por_tipo),
+            "application_type": formulario.tipo_aplicacao,
+            "has_internet_access": formulario.acesso_internet,
+            "authentication_method": formulario.autenticacao
+        }
+
+    def para_dict(self) -> dict:
+        return self.model_dump(by_alias=True)
+
+
+class AtualizacaoAmeaca(Ameaca):
+    id: int
+
+
+class RespostaDelta(BaseModel):
+    """Formato da revisão incremental: só o que muda no modelo de ameaças da revisão anterior"""
+
+    add_threats: List[Ameaca] = []
+    update_threats: List[AtualizacaoAmeaca] = []
+    retire_threats: List[int] = []
+    improvement_suggestions: List[str] = []
+
+
+class ThreatAnalysisResponse(RespostaModelo):
+    summary: Optional[Resumo] = None
+    image_processing: Optional[dict] = None
+    # Status e latência de cada chamada quando a análise usa fan-out por categoria
+    fan_out: Optional[dict] = None
+    # Análise reaproveitada de um diagrama quase idêntico (X-Cache: SIMILAR)
+    similar_match: Optional[dict] = None
+    # Número da revisão e o que mudou, quando a análise pertence a um projeto
+    revision: Optional[dict] = None
+    # Continuações pedidas quando a resposta foi cortada por max_tokens
+    continuation: Optional[dict] = None
+    # Componentes, fluxos e ameaças com posições calculadas no servidor (formato stride-graph/1)
+    graph: Optional[dict] = None
+    # Preenchidos apenas quando a resposta do modelo não pôde ser aproveitada
+    raw_response: Optional[str] = None
+    warning: Optional[str] = None
+
+
+def _tornar_estrito(no):
+    """Ajusta o schema do Pydantic às regras do modo strict (todas as chaves obrigatórias, sem extras)"""
+    if isinstance(no, dict):
+        no.pop("title", None)
+        no.pop("default", None)
+        if no.get("type") == "object" and "properties" in no:
+            no["additionalProperties"] = False
+            no["required"] = list(no["properties"])
+        for valor in no.values():
+            _tornar_estrito(valor)
+    elif isinstance(no, list):
+        for valor in no:
+            _tornar_estrito(valor)
+    return no
+
+
+def esquema_saida(categorias=None, incluir_sugestoes=True) -> dict:
+    """response_format json_schema (saída estruturada) gerado a partir de RespostaModelo
+
+    `categorias` restringe o enum de "Threat Type" (lista vazia remove o threat_model) e
+    `incluir_sugestoes=False` remove improvement_suggestions; usados nas chamadas do fan-out.
+    """
+    esquema = copy.deepcopy(RespostaModelo.model_json_schema(by_alias=True))
+    esquema.pop("description", None)
+    if categorias is not None:
+        if categorias:
+            esquema["$defs"]["Ameaca"]["properties"]["Threat Type"]["enum"] = list(categorias)
+        else:
+            esquema["properties"].pop("threat_model")
+            esquema.pop("$defs")
+    if not incluir_sugestoes:
+        esquema["properties"].pop("improvement_suggestions")
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "modelo_ameacas_stride", "strict": True, "schema": _tornar_estrito(esquema)}
+    }
+
+
+def esquema_delta() -> dict:
+    """response_format json_schema das revisões incrementais, gerado a partir de RespostaDelta"""
+    esquema = copy.deepcopy(RespostaDelta.model_json_schema(by_alias=True))
+    esquema.pop("description", None)
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "revisao_modelo_ameacas_stride", "strict": True, "schema": _tornar_estrito(esquema)}
+    }
+
+
+def reparar_json(texto: str) -> Optional[str]:
+    """Reconstrói JSON quase válido em uma varredura
+
+    Ignora texto antes do primeiro "{" e depois do objeto raiz (cercas Markdown), remove
+    comentários // e /* */ e vírgulas antes de } ou ], escapa quebras de linha dentro de
+    strings, corrige fechamentos trocados e, se a resposta foi cortada (max_tokens), descarta
+    o item incompleto e fecha os arrays e objetos abertos. Devolve None se não houver o que salvar.
+    """
+    inicio = texto.find("{")
+    if inicio < 0:
+        return None
+
+    saida = []
+    pilha = []
+    em_string = escape = False
+    seguro = None
+    i, n = inicio, len(texto)
+    while i < n:
+        c = texto[i]
+        if em_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                em_string = False
+                if pilha[-1] == "[":
+                    saida.append(c)
+                    seguro = (len(saida), list(pilha))
+                    i += 1
+                    continue
+            elif c in "\n\r\t":
+                c = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}[c]
+            saida.append(c)
+            i += 1
+            continue
+
+        if c == '"':
+            em_string = True
+        elif c == "/" and texto.startswith("//", i):
+            fim = texto.find("\n", i)
+            i = n if fim < 0 else fim
+            continue
+        elif c == "/" and texto.startswith("/*", i):
+            fim = texto.find("*/", i + 2)
+            i = n if fim < 0 else fim + 2
+            continue
+        elif c in "{[":
+            pilha.append(c)
+        elif c in "}]":
+            while saida and saida[-1] in " \t\r\n":
+                saida.pop()
+            if saida and saida[-1] == ",":
+                saida.pop()
+            if not pilha:
+                break
+            c = "}" if pilha.pop() == "{" else "]"
+            saida.append(c)
+            if not pilha:
+                return "".join(saida)
+            seguro = (len(saida), list(pilha))
+            i += 1
+            continue
+        saida.append(c)
+        i += 1
+
+    # Resposta cortada: volta até o último valor completo e fecha o que ficou aberto
+    if seguro is None:
+        return None
+    corpo = "".join(saida[:seguro[0]]).rstrip().rstrip(",")
+    return corpo + "".join("}" if aberto == "{" else "]" for aberto in reversed(seguro[1]))
+
+
+def analisar_resposta(texto: str, modelo=RespostaModelo):
+    """Converte a resposta do modelo em `modelo` (RespostaModelo por padrão); devolve (resposta, reparada)
+
+    O caminho normal faz parse e validação em uma única passada (pydantic-core). Só quando
+    ele falha o texto passa por reparar_json, e itens inválidos são descartados em vez de
+    invalidar a resposta inteira. Levanta ValueError se nada puder ser aproveitado ou se
+    faltar uma chave obrigatória do `modelo`.
+    """
+    try:
+        return modelo.model_validate_json(texto), False
+    except ValidationError:
+        pass
+
+    # Cercas Markdown ou texto em volta do objeto: tenta só o trecho entre as chaves
+    inicio, fim = texto.find("{"), texto.rfind("}")
+    if 0 <= inicio < fim and (inicio > 0 or fim < len(texto) - 1):
+        try:
+            return modelo.model_validate_json(texto[inicio:fim + 1]), False
+        except ValidationError:
+            pass
+
+    reparado = reparar_json(texto)
+    if reparado is None:
+        raise ValueError("Nenhum objeto JSON encontrado na resposta")
+    try:
+        dados = orjson.loads(reparado)
+    except orjson.JSONDecodeError as e:
+        raise ValueError(f"JSON irrecuperável: {str(e)}")
+    if not isinstance(dados, dict):
+        raise ValueError("A resposta não é um objeto JSON")
+    faltando = [nome for nome, campo in modelo.model_fields.items() if campo.is_required() and nome not in dados]
+    if faltando:
+        raise ValueError(f"A resposta não contém {', '.join(faltando)}")
+
+    ameacas = []
+    for item in dados.get("threat_model") or []:
+        try:
+            ameacas.append(Ameaca.model_validate(item))
+        except ValidationError:
+            continue
+    sugestoes = [s for s in dados.get("improvement_suggestions") or [] if isinstance(s, str)]
+    if not ameacas and not sugestoes:
+        raise ValueError("A resposta não contém ameaças nem sugestões válidas")
+    return modelo(threat_model=ameacas, improvement_suggestions=sugestoes), True
+
+
+def analisar_resposta_delta(texto: str):
+    """Converte a resposta de uma revisão incremental em RespostaDelta; devolve (resposta, reparada)
+
+    Mesmo caminho de analisar_resposta: validação em uma passada e, se falhar, reparo do JSON
+    descartando os itens inválidos. Levanta ValueError se nada puder ser aproveitado.
+    """
+    try:
+        return RespostaDelta.model_validate_json(texto), False
+    except ValidationError:
+        pass
+
+    reparado = reparar_json(texto)
+    if reparado is None:
+        raise ValueError("Nenhum objeto JSON encontrado na resposta")
+    try:
+        dados = orjson.loads(reparado)
+    except orjson.JSONDecodeError as e:
+        raise ValueError(f"JSON irrecuperável: {str(e)}")
+    if not isinstance(dados, dict):
+        raise ValueError("A resposta não é um objeto JSON")
+
+    def validos(chave, modelo):
+        itens = []
+        for item in dados.get(chave) or []:
+            try:
+                itens.append(modelo.model_validate(item))
+            except ValidationError:
+                continue
+        return itens
+
+    return RespostaDelta(
+        add_threats=validos("add_threats", Ameaca),
+        update_threats=validos("update_threats", AtualizacaoAmeaca),
+        retire_threats=[i for i in dados.get("retire_threats") or [] if isinstance(i, int)],
+        improvement_suggestions=[s for s in dados.get("improvement_suggestions") or [] if isinstance(s, str)]
+    ), True
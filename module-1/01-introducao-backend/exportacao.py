@@ -0,0 +1,500 @@
+"""
+Exportação dos modelos de ameaças em CSV, SARIF, XLSX e Markdown, em fluxo
+
+Cada formato é um gerador de blocos de bytes que consome um iterável de análises no formato de
+RepositorioAmeacas.iterar_analises (id, created_at, project, summary, threat_model e
+improvement_suggestions) sem montar o arquivo em memória: o consumo fica em um lote de análises
+e um bloco de saída, não importa quantas ameaças a exportação tenha.
+
+Uso pela linha de comando (a partir de module-1/01-introducao-backend), com um resultado JSON da
+API ou o JSONL de resultados do lote.py:
+    python exportacao.py --entrada resultados.jsonl --formato xlsx --saida ameacas.xlsx
+    python exportacao.py --entrada resultados.jsonl --formato zip --formatos csv,md --saida ameacas.zip
+"""
+
+import csv
+import hashlib
+import json
+import logging
+import re
+import time
+import zipfile
+from collections import Counter
+from dataclasses import dataclass
+from itertools import chain, islice
+from xml.sax.saxutils import escape
+
+import orjson
+
+from esquema import CATEGORIAS_STRIDE, NOMES_CATEGORIAS, normalizar_categoria
+from metricas import EXPORTACAO_BYTES, EXPORTACOES
+
+logger = logging.getLogger(__name__)
+
+# Tamanho aproximado de cada bloco entregue à resposta: poucos writes e pouca memória por exportação
+TAMANHO_BLOCO = 64 * 1024
+
+# Colunas do CSV e da planilha: uma linha por ameaça e uma por sugestão de melhoria
+COLUNAS = [
+    "analysis_id", "created_at", "project", "application_type", "has_internet_access", "authentication_method",
+    "record", "threat_type", "scenario", "potential_impact", "suggestion"
+]
+LARGURAS_COLUNAS = [12, 21, 18, 18, 12, 18, 11, 22, 80, 50, 80]
+
+LIMITE_LINHAS_XLSX = 1_048_576
+LIMITE_CELULA_XLSX = 32_767
+# Caracteres de controle não são permitidos em XML (e o modelo às vezes os devolve)
+CARACTERES_INVALIDOS_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+REGRAS_SARIF = [
+    {
+        "id": f"STRIDE-{categoria[0]}",
+        "name": categoria.replace(" ", ""),
+        "shortDescription": {"text": categoria},
+        "fullDescription": {"text": NOMES_CATEGORIAS[categoria]},
+        "defaultConfiguration": {"level": "warning"}
+    }
+    for categoria in CATEGORIAS_STRIDE
+]
+INDICE_REGRAS = {categoria: indice for indice, categoria in enumerate(CATEGORIAS_STRIDE)}
+
+
+def analise_de_resultado(resultado: dict, id_analise=None, projeto=None, criado_em=None) -> dict:
+    """Resultado da API (/analisar_ameacas, jobs, lotes) no formato de iterar_analises"""
+    return {
+        "id": id_analise,
+        "created_at": criado_em,
+        "project": projeto,
+        "summary": resultado.get("summary") or {},
+        "threat_model": resultado.get("threat_model") or [],
+        "improvement_suggestions": resultado.get("improvement_suggestions") or []
+    }
+
+
+def data_iso(instante) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(instante)) if instante else None
+
+
+def campos_analise(analise: dict) -> list:
+    """Primeiras COLUNAS, iguais em todas as linhas da análise (cada formato as converte uma vez só)"""
+    resumo = analise["summary"]
+    return [analise.get("id"), data_iso(analise.get("created_at")), analise.get("project"),
+            resumo.get("application_type"), resumo.get("has_internet_access"), resumo.get("authentication_method")]
+
+
+def registros_analise(analise: dict):
+    """Demais COLUNAS: um registro por ameaça e um por sugestão"""
+    for ameaca in analise["threat_model"]:
+        yield ["threat", ameaca.get("Threat Type"), ameaca.get("Scenario"), ameaca.get("Potential Impact"), None]
+    for sugestao in analise["improvement_suggestions"]:
+        yield ["suggestion", None, None, None, sugestao]
+
+
+def em_blocos(partes):
+    """Junta pedaços pequenos de bytes em blocos de ~TAMANHO_BLOCO"""
+    buffer, tamanho = [], 0
+    for parte in partes:
+        buffer.append(parte)
+        tamanho += len(parte)
+        if tamanho >= TAMANHO_BLOCO:
+            yield b"".join(buffer)
+            buffer, tamanho = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+# CSV
+
+class _DevolverLinha:
+    """Destino do csv.writer que devolve a linha formatada (writerow retorna o que write retornar)"""
+
+    def write(self, texto):
+        return texto
+
+
+# Planilhas executam células que começam com estes caracteres (injeção de fórmula)
+INICIOS_FORMULA = ("=", "+", "-", "@", "\t", "\r")
+
+
+def celula_csv(valor):
+    if isinstance(valor, str) and valor[:1] in INICIOS_FORMULA:
+        return "'" + valor
+    return valor
+
+
+def gerar_csv(analises):
+    escritor = csv.writer(_DevolverLinha())
+
+    def partes():
+        # BOM para o Excel abrir em UTF-8
+        yield ("\ufeff" + escritor.writerow(COLUNAS)).encode("utf-8")
+        for analise in analises:
+            # Campos da análise já formatados (com a vírgula final) e só os do registro linha a linha
+            prefixo = escritor.writerow([celula_csv(valor) for valor in campos_analise(analise)])[:-2] + ","
+            yield "".join(
+                prefixo + escritor.writerow([celula_csv(valor) for valor in registro])
+                for registro in registros_analise(analise)
+            ).encode("utf-8")
+
+    return em_blocos(partes())
+
+
+# SARIF 2.1.0: um run por análise, com o summary e as sugestões nas propriedades do run
+
+def resultado_sarif(ameaca: dict, resumo: dict) -> dict:
+    categoria = normalizar_categoria(ameaca.get("Threat Type") or "")
+    cenario = ameaca.get("Scenario") or ""
+    resultado = {
+        "ruleId": f"STRIDE-{categoria[0]}" if categoria in INDICE_REGRAS else "STRIDE",
+        "level": "warning",
+        "message": {"text": cenario or categoria},
+        "locations": [{"logicalLocations": [{"name": resumo.get("application_type") or "aplicação", "kind": "module"}]}],
+        "partialFingerprints": {"strideThreat/v1": hashlib.sha1(f"{categoria}|{cenario}".encode()).hexdigest()[:16]},
+        "properties": {"threatType": categoria, "potentialImpact": ameaca.get("Potential Impact")}
+    }
+    if categoria in INDICE_REGRAS:
+        resultado["ruleIndex"] = INDICE_REGRAS[categoria]
+    if ameaca.get("id") is not None:
+        resultado["properties"]["threatId"] = ameaca["id"]
+    return resultado
+
+
+def gerar_sarif(analises):
+    ferramenta = {"driver": {"name": "stride-threat-modeling", "rules": REGRAS_SARIF}}
+
+    def partes():
+        yield b'{"version":"2.1.0","$schema":"https://json.schemastore.org/sarif-2.1.0.json","runs":['
+        for posicao, analise in enumerate(analises):
+            resumo = analise["summary"]
+            run = {"tool": ferramenta, "properties": {
+                "analysisId": analise.get("id"),
+                "project": analise.get("project"),
+                "createdAt": data_iso(analise.get("created_at")),
+                "summary": resumo,
+                "improvementSuggestions": analise["improvement_suggestions"]
+            }}
+            if analise.get("id") is not None:
+                run["automationDetails"] = {"id": f"stride/{analise['id']}"}
+            # O run sem o "}" final, para os resultados entrarem um a um
+            yield (b"," if posicao else b"") + orjson.dumps(run)[:-1] + b',"results":['
+            for indice, ameaca in enumerate(analise["threat_model"]):
+                yield (b"," if indice else b"") + orjson.dumps(resultado_sarif(ameaca, resumo))
+            yield b"]}"
+        yield b"]}"
+
+    return em_blocos(partes())
+
+
+# Markdown
+
+def celula_markdown(texto) -> str:
+    return " ".join(str(texto or "").split()).replace("|", "\\|")
+
+
+def secao_markdown(analise: dict, posicao: int) -> str:
+    resumo = analise["summary"]
+    titulo = f"Análise {analise['id'] if analise.get('id') is not None else posicao}"
+    if resumo.get("application_type"):
+        titulo += f" · {resumo['application_type']}"
+    por_tipo = Counter(normalizar_categoria(a.get("Threat Type") or "") for a in analise["threat_model"])
+    linhas = [f"## {celula_markdown(titulo)}", ""]
+    for rotulo, valor in (("Projeto", analise.get("project")), ("Data", data_iso(analise.get("created_at"))),
+                          ("Acesso à internet", resumo.get("has_internet_access")),
+                          ("Autenticação", resumo.get("authentication_method"))):
+        if valor:
+            linhas.append(f"- **{rotulo}:** {celula_markdown(valor)}")
+    linhas.append(f"- **Ameaças:** {len(analise['threat_model'])}"
+                  + (f" ({', '.join(f'{tipo}: {total}' for tipo, total in por_tipo.most_common())})" if por_tipo else ""))
+    linhas.append("")
+    if analise["threat_model"]:
+        linhas += ["| Categoria | Cenário | Impacto potencial |", "| --- | --- | --- |"]
+        linhas += [
+            f"| {celula_markdown(a.get('Threat Type'))} | {celula_markdown(a.get('Scenario'))} "
+            f"| {celula_markdown(a.get('Potential Impact'))} |"
+            for a in analise["threat_model"]
+        ]
+        linhas.append("")
+    if analise["improvement_suggestions"]:
+        linhas += ["**Sugestões de melhoria**", ""]
+        linhas += [f"- {celula_markdown(sugestao)}" for sugestao in analise["improvement_suggestions"]]
+        linhas.append("")
+    return "\n".join(linhas) + "\n"
+
+
+def gerar_markdown(analises):
+    def partes():
+        yield "# Relatório de ameaças STRIDE\n\n".encode("utf-8")
+        for posicao, analise in enumerate(analises, start=1):
+            yield secao_markdown(analise, posicao).encode("utf-8")
+
+    return em_blocos(partes())
+
+
+# ZIP em fluxo (para o XLSX e para o arquivo com várias análises)
+
+class _SaidaZip:
+    """Destino do ZipFile sem seek/tell: o zipfile passa a gravar um descritor de dados depois de
+    cada membro, e os bytes comprimidos ficam aqui até o gerador entregá-los"""
+
+    def __init__(self):
+        self.partes = []
+        self.tamanho = 0
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        self.tamanho += len(dados)
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def retirar(self) -> bytes:
+        dados = b"".join(self.partes)
+        self.partes, self.tamanho = [], 0
+        return dados
+
+
+def zip_em_fluxo(membros):
+    """Gerador dos bytes de um zip com os membros (nome, iterável de bytes), na ordem dada
+
+    Cada membro é consumido por inteiro antes do próximo ser pedido. Só o diretório central
+    (um registro por membro) fica em memória até o fim.
+    """
+    saida = _SaidaZip()
+    with zipfile.ZipFile(saida, "w", compression=zipfile.ZIP_DEFLATED) as arquivo:
+        for nome, conteudo in membros:
+            # Com só o nome, o zipfile data o membro em 1980
+            membro = zipfile.ZipInfo(nome, time.localtime()[:6])
+            membro.compress_type = zipfile.ZIP_DEFLATED
+            with arquivo.open(membro, "w") as destino:
+                for bloco in conteudo:
+                    destino.write(bloco)
+                    if saida.tamanho >= TAMANHO_BLOCO:
+                        yield saida.retirar()
+    yield saida.retirar()
+
+
+# XLSX: SpreadsheetML escrito à mão com strings inline (sem tabela de strings compartilhadas, que
+# exigiria conhecer todos os textos antes da primeira planilha)
+
+CONTENT_TYPES_XLSX = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '{planilhas}</Types>'
+)
+RELS_XLSX = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+STYLES_XLSX = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+INICIO_PLANILHA_XLSX = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+    '<cols>' + "".join(
+        f'<col min="{indice}" max="{indice}" width="{largura}" customWidth="1"/>'
+        for indice, largura in enumerate(LARGURAS_COLUNAS, start=1)
+    ) + '</cols><sheetData>'
+)
+
+
+def celula_xlsx(valor, estilo="") -> str:
+    """Célula sem referência (o Excel as posiciona em sequência); vazia como <c/> para manter as colunas"""
+    if valor is None:
+        return "<c/>"
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return f"<c{estilo}><v>{valor}</v></c>"
+    texto = CARACTERES_INVALIDOS_XML.sub("", str(valor))[:LIMITE_CELULA_XLSX]
+    return f'<c t="inlineStr"{estilo}><is><t xml:space="preserve">{escape(texto)}</t></is></c>'
+
+
+def linhas_xlsx(analise: dict):
+    """Células de cada linha da análise; as da análise são montadas uma vez só"""
+    prefixo = "".join(celula_xlsx(valor) for valor in campos_analise(analise))
+    for registro in registros_analise(analise):
+        yield prefixo + "".join(celula_xlsx(valor) for valor in registro)
+
+
+def planilha_xlsx(linhas):
+    def partes():
+        yield INICIO_PLANILHA_XLSX.encode("utf-8")
+        yield ('<row r="1">' + "".join(celula_xlsx(coluna, ' s="1"') for coluna in COLUNAS) + "</row>").encode("utf-8")
+        for numero, celulas in enumerate(linhas, start=2):
+            yield f'<row r="{numero}">{celulas}</row>'.encode("utf-8")
+        yield b"</sheetData></worksheet>"
+
+    return em_blocos(partes())
+
+
+def gerar_xlsx(analises):
+    """Planilha "Ameacas" com as COLUNAS; acima do limite de linhas do Excel continua em "Ameacas 2", ..."""
+    nomes = []
+
+    def membros():
+        linhas = chain.from_iterable(linhas_xlsx(analise) for analise in analises)
+        while True:
+            primeira = next(linhas, None)
+            if primeira is None and nomes:
+                break
+            nomes.append("Ameacas" if not nomes else f"Ameacas {len(nomes) + 1}")
+            restantes = islice(linhas, LIMITE_LINHAS_XLSX - 2)
+            yield f"xl/worksheets/sheet{len(nomes)}.xml", planilha_xlsx(
+                chain([primeira], restantes) if primeira is not None else []
+            )
+            if primeira is None:
+                break
+
+        # Partes que dependem do número de planilhas, gravadas depois delas
+        yield "xl/workbook.xml", [(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+            + "".join(f'<sheet name="{nome}" sheetId="{indice}" r:id="rId{indice}"/>'
+                      for indice, nome in enumerate(nomes, start=1))
+            + "</sheets></workbook>"
+        ).encode("utf-8")]
+        yield "xl/_rels/workbook.xml.rels", [(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + "".join(
+                f'<Relationship Id="rId{indice}" '
+                'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+                f'Target="worksheets/sheet{indice}.xml"/>' for indice in range(1, len(nomes) + 1)
+            )
+            + f'<Relationship Id="rId{len(nomes) + 1}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+            'Target="styles.xml"/></Relationships>'
+        ).encode("utf-8")]
+        yield "xl/styles.xml", [STYLES_XLSX.encode("utf-8")]
+        yield "_rels/.rels", [RELS_XLSX.encode("utf-8")]
+        yield "[Content_Types].xml", [CONTENT_TYPES_XLSX.format(planilhas="".join(
+            f'<Override PartName="/xl/worksheets/sheet{indice}.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for indice in range(1, len(nomes) + 1)
+        )).encode("utf-8")]
+
+    return zip_em_fluxo(membros())
+
+
+@dataclass(frozen=True)
+class FormatoExportacao:
+    extensao: str
+    media_type: str
+    gerar: object
+
+
+FORMATOS = {
+    "csv": FormatoExportacao("csv", "text/csv; charset=utf-8", gerar_csv),
+    "sarif": FormatoExportacao("sarif", "application/sarif+json", gerar_sarif),
+    "xlsx": FormatoExportacao(
+        "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", gerar_xlsx
+    ),
+    "md": FormatoExportacao("md", "text/markdown; charset=utf-8", gerar_markdown),
+}
+
+
+def validar_formatos(formatos: list) -> list:
+    invalidos = [formato for formato in formatos if formato not in FORMATOS]
+    if invalidos or not formatos:
+        raise ValueError(f"Formato inválido: {', '.join(invalidos) or 'vazio'}. Use: {', '.join(FORMATOS)}")
+    return formatos
+
+
+def medir_exportacao(rotulo: str, blocos):
+    """Repassa os blocos contando bytes e o desfecho (concluida, interrompida pelo cliente ou falha)"""
+    desfecho = "interrompida"
+    try:
+        for bloco in blocos:
+            EXPORTACAO_BYTES.labels(rotulo).inc(len(bloco))
+            yield bloco
+        desfecho = "concluida"
+    except Exception:
+        desfecho = "falha"
+        logger.exception(f"Falha na exportação {rotulo}")
+        raise
+    finally:
+        EXPORTACOES.labels(rotulo, desfecho).inc()
+
+
+def exportar_analises(formato: str, analises):
+    """Gerador dos bytes do arquivo no formato pedido"""
+    return medir_exportacao(formato, FORMATOS[validar_formatos([formato])[0]].gerar(analises))
+
+
+def exportar_arquivo(formatos: list, analises):
+    """Zip com um arquivo por análise em cada formato (analise-<id>.csv, analise-<id>.md, ...)"""
+    validar_formatos(formatos)
+
+    def membros():
+        for posicao, analise in enumerate(analises, start=1):
+            identificador = analise.get("id") if analise.get("id") is not None else posicao
+            for formato in formatos:
+                yield f"analise-{identificador}.{FORMATOS[formato].extensao}", FORMATOS[formato].gerar([analise])
+
+    return medir_exportacao("zip", zip_em_fluxo(membros()))
+
+
+def ler_resultados(caminho: str):
+    """Análises de um resultado JSON da API (ou lista deles) ou do JSONL do lote.py, linha a linha"""
+    if not caminho.endswith(".jsonl"):
+        with open(caminho, encoding="utf-8") as f:
+            conteudo = json.load(f)
+        for posicao, resultado in enumerate(conteudo if isinstance(conteudo, list) else [conteudo], start=1):
+            yield analise_de_resultado(resultado, posicao)
+        return
+    with open(caminho, encoding="utf-8") as f:
+        for posicao, linha in enumerate(f, start=1):
+            if not linha.strip():
+                continue
+            registro = json.loads(linha)
+            if "status" in registro:
+                # Registro do lote.py: itens com erro não têm resultado
+                if registro["status"] in ("ok", "duplicado"):
+                    yield analise_de_resultado(registro["resultado"], registro["id"])
+            else:
+                yield analise_de_resultado(registro, posicao)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entrada", required=True, help="Resultado JSON da API ou JSONL do lote.py")
+    parser.add_argument("--formato", required=True, choices=[*FORMATOS, "zip"])
+    parser.add_argument("--formatos", default="csv,sarif,md", help="Formatos de cada análise no zip")
+    parser.add_argument("--saida", required=True, help="Arquivo gerado")
+    args = parser.parse_args()
+
+    analises = ler_resultados(args.entrada)
+    if args.formato == "zip":
+        blocos = exportar_arquivo([formato.strip() for formato in args.formatos.split(",")], analises)
+    else:
+        blocos = exportar_analises(args.formato, analises)
+    with open(args.saida, "wb") as saida:
+        for bloco in blocos:
+            saida.write(bloco)
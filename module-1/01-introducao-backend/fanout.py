@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from cliente_openai import FalhaModelo
+from esquema import CATEGORIAS_STRIDE, RespostaModelo, RespostaSugestoes, analisar_resposta
+from metricas import PARSE, medir
+
+logger = logging.getLogger(__name__)
+
+SUGESTOES = "improvement_suggestions"
+
+# Uma chamada por categoria STRIDE e uma para as sugestões de melhoria
+PARTES = CATEGORIAS_STRIDE + [SUGESTOES]
+
+
+def normalizar_texto(texto: str) -> str:
+    """Chave de deduplicação: ignora caixa, espaços repetidos e o ponto final"""
+    return " ".join(texto.lower().split()).rstrip(".")
+
+
+@dataclass
+class ResultadoParte:
+    parte: str
+    status: str
+    latencia: float
+    ameacas: list = field(default_factory=list)
+    sugestoes: list = field(default_factory=list)
+    erro: Optional[str] = None
+    falha: Optional[FalhaModelo] = None
+
+    def resumo(self) -> dict:
+        return {
+            "status": self.status,
+            "latency_s": round(self.latencia, 3),
+            "threats": len(self.ameacas),
+            "suggestions": len(self.sugestoes),
+            "error": self.erro
+        }
+
+
+def extrair_parte(parte: str, texto: str):
+    """Aproveita da resposta só o que a chamada pediu; devolve (ameacas, sugestoes, reparada)"""
+    if parte == SUGESTOES:
+        resposta, reparada = analisar_resposta(texto, RespostaSugestoes)
+        return [], list(resposta.improvement_suggestions), reparada
+    resposta, reparada = analisar_resposta(texto)
+    return [ameaca for ameaca in resposta.threat_model if ameaca.threat_type == parte], [], reparada
+
+
+async def executar_partes(chamar, partes=PARTES):
+    """Dispara `chamar(parte)` para todas as partes ao mesmo tempo e devolve cada ResultadoParte
+    assim que a chamada termina; a falha de uma parte não interrompe as demais"""
+
+    async def executar(parte):
+        inicio = time.perf_counter()
+        try:
+            texto = await chamar(parte)
+        except FalhaModelo as fm:
+            logger.warning(f"Fan-out: chamada de {parte} falhou ({fm.status_code}): {str(fm)}")
+            return ResultadoParte(parte, "erro", time.perf_counter() - inicio, erro=str(fm), falha=fm)
+        except Exception as e:
+            # 4xx repassado pelo ClienteResiliente, falha na continuação etc.: só esta parte se perde
+            logger.exception(f"Fan-out: chamada de {parte} falhou")
+            return ResultadoParte(parte, "erro", time.perf_counter() - inicio, erro=f"{type(e).__name__}: {str(e)}")
+        latencia = time.perf_counter() - inicio
+        with medir("parse"):
+            try:
+                ameacas, sugestoes, reparada = extrair_parte(parte, texto)
+            except ValueError as ve:
+                PARSE.labels("falha").inc()
+                logger.warning(f"Fan-out: resposta de {parte} sem JSON aproveitável: {str(ve)}")
+                return ResultadoParte(parte, "falha_parse", latencia, erro=str(ve))
+            except Exception as e:
+                PARSE.labels("falha").inc()
+                logger.exception(f"Fan-out: erro ao processar a resposta de {parte}")
+                return ResultadoParte(parte, "falha_parse", latencia, erro=f"{type(e).__name__}: {str(e)}")
+        PARSE.labels("reparado" if reparada else "ok").inc()
+        return ResultadoParte(parte, "ok", latencia, ameacas=ameacas, sugestoes=sugestoes)
+
+    tarefas = [asyncio.ensure_future(executar(parte)) for parte in partes]
+    try:
+        for proxima in asyncio.as_completed(tarefas):
+            yield await proxima
+    finally:
+        for tarefa in tarefas:
+            tarefa.cancel()
+
+
+class MesclagemFanout:
+    """Junta os resultados das chamadas do fan-out no formato da resposta única,
+    descartando ameaças e sugestões repetidas"""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.resultados = {}
+        self._ameacas = {}
+        self._sugestoes = {}
+
+    def adicionar(self, resultado: ResultadoParte):
+        """Registra o resultado e devolve só as ameaças e sugestões ainda não vistas"""
+        self.resultados[resultado.parte] = resultado
+        novas_ameacas, novas_sugestoes = [], []
+        for ameaca in resultado.ameacas:
+            chave = (ameaca.threat_type, normalizar_texto(ameaca.scenario))
+            if chave not in self._ameacas:
+                self._ameacas[chave] = ameaca
+                novas_ameacas.append(ameaca)
+        for sugestao in resultado.sugestoes:
+            chave = normalizar_texto(sugestao)
+            if chave not in self._sugestoes:
+                self._sugestoes[chave] = sugestao
+                novas_sugestoes.append(sugestao)
+        return novas_ameacas, novas_sugestoes
+
+    @property
+    def parcial(self) -> bool:
+        return any(resultado.status != "ok" for resultado in self.resultados.values())
+
+    def bem_sucedidas(self) -> int:
+        return sum(1 for resultado in self.resultados.values() if resultado.status == "ok")
+
+    def primeira_falha(self) -> Optional[FalhaModelo]:
+        return next((r.falha for r in self.resultados.values() if r.falha is not None), None)
+
+    def resposta(self) -> RespostaModelo:
+        # Ordem estável por categoria, independente da ordem em que as chamadas terminaram
+        ameacas = sorted(self._ameacas.values(), key=lambda a: CATEGORIAS_STRIDE.index(a.threat_type))
+        return RespostaModelo(threat_model=ameacas, improvement_suggestions=list(self._sugestoes.values()))
+
+    def relatorio(self) -> dict:
+        return {
+            "partial": self.parcial,
+            "wall_clock_s": round(time.perf_counter() - self.inicio, 3),
+            "requests": {parte: self.resultados[parte].resumo() for parte in PARTES if parte in self.resultados}
+        }
+
+    def para_dict(self, formulario) -> dict:
+        resposta = self.resposta()
+        dados = resposta.para_dict()
+        dados["summary"] = resposta.resumo(formulario)
+        dados["fan_out"] = self.relatorio()
+        return dados
@@ -0,0 +1,280 @@
+import bisect
+import math
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Optional
+
+from esquema import normalizar_categoria
+
+FORMATO = "stride-graph/1"
+CAMPOS_NO = ["id", "kind", "label", "x", "y", "group"]
+CAMPOS_ARESTA = ["source", "target", "kind", "label"]
+
+# Componentes reconhecidos no texto das ameaças e as palavras-chave de cada um. O texto é
+# comparado sem acentos, em minúsculas e com a pontuação trocada por espaços; um espaço na
+# palavra-chave marca início ou fim de palavra. A ordem decide o alvo principal quando o
+# cenário cita vários: o primeiro da lista que aparecer
+COMPONENTES = [
+    ("identidade", "Identidade / Autenticação",
+     ("token", "jwt", "oauth", "credencia", "senha", "login", "autentica", " mfa ", "sessao", "sessoes", " sso ",
+      "entra id", "azure ad", "easy auth", "identidade", "phishing")),
+    ("banco", "Banco de dados",
+     ("banco", " sql", "database", "cosmos", "consulta", "tabela", "postgres", "mysql", "mongo")),
+    ("cache", "Cache", ("cache", "redis")),
+    ("armazenamento", "Armazenamento", ("upload", "arquivo", "storage", " blob", "armazenamento", "bucket")),
+    ("fila", "Fila / Mensageria", (" fila", "queue", "service bus", "kafka", "event hub", "mensageria")),
+    ("logs", "Logs / Auditoria", (" log", "auditoria", "monitor", " siem ", "rastreab", "trilha")),
+    ("segredos", "Segredos / Configuração",
+     ("segredo", "key vault", "configurac", "codigo fonte", "repositorio", "variave")),
+    ("gateway", "Gateway / WAF",
+     ("gateway", " waf ", "front door", "balanceador", "load balancer", " cdn ", " apim ")),
+    ("rede", "Rede / Transporte",
+     ("em transito", "https", " tls ", " ssl ", " rede ", "man in the middle", " mitm ", " dns ")),
+    ("cliente", "Front-end / Cliente",
+     ("front end", "frontend", "navegador", "browser", " spa ", "mobile", "aplicativo", " xss ", "csrf", "cookie",
+      "no cliente")),
+    ("autorizacao", "Autorização / Privilégios",
+     ("admin", "privilegi", " rbac ", "permiss", "autoriza", " papel", " role")),
+    ("api", "API / Aplicação",
+     (" api", "endpoint", "requisic", "rate limit", "backend", "servidor", "app service", "parametro", "injec")),
+]
+ROTULOS = {"usuario": "Usuário", **{id_componente: rotulo for id_componente, rotulo, _ in COMPONENTES}}
+
+# Fluxo de dados de cada componente: vem do primeiro componente presente entre as origens
+# preferidas. "usuario" e "api" sempre existem, então o grafo é sempre conexo
+FLUXOS = {
+    "cliente": (("usuario",), "acessa"),
+    "rede": (("cliente", "usuario"), "tráfego"),
+    "gateway": (("rede", "cliente", "usuario"), "requisições"),
+    "api": (("gateway", "rede", "cliente", "usuario"), "requisições"),
+    "identidade": (("cliente", "usuario"), "autentica"),
+    "autorizacao": (("api",), "verifica acesso"),
+    "banco": (("api",), "consultas"),
+    "cache": (("api",), "leitura/escrita"),
+    "armazenamento": (("api",), "arquivos"),
+    "fila": (("api",), "mensagens"),
+    "logs": (("api",), "eventos"),
+    "segredos": (("api",), "configuração"),
+}
+# Fluxos extras quando os dois lados existem
+FLUXOS_EXTRAS = [("api", "identidade", "valida token")]
+
+# Espaçamentos do layout (px do Cytoscape)
+RAIO_COMPONENTE = 45
+RAIO_PRIMEIRO_ANEL = 95
+DISTANCIA_ANEIS = 45
+DISTANCIA_AMEACAS = 42
+MARGEM = 50
+MARGEM_CLUSTER = 150
+TAMANHO_ROTULO = 48
+
+
+def normalizar(texto: str) -> str:
+    """Sem acentos, em minúsculas e com a pontuação trocada por espaços (com um espaço nas pontas)"""
+    sem_acentos = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return f" {' '.join(re.sub(r'[^a-z0-9]+', ' ', sem_acentos.lower()).split())} "
+
+
+def identificar_componentes(texto: str) -> list:
+    """Componentes citados no texto, na ordem de prioridade de COMPONENTES"""
+    normalizado = normalizar(texto)
+    return [
+        id_componente for id_componente, _, palavras in COMPONENTES
+        if any(palavra in normalizado for palavra in palavras)
+    ]
+
+
+def resumir(texto: str, tamanho=TAMANHO_ROTULO) -> str:
+    texto = " ".join(texto.split())
+    return texto if len(texto) <= tamanho else texto[:tamanho - 1].rstrip() + "…"
+
+
+ABREVIACOES = {
+    "Spoofing": "S", "Tampering": "T", "Repudiation": "R", "Information Disclosure": "I",
+    "Denial of Service": "D", "Elevation of Privilege": "E"
+}
+
+
+@dataclass
+class Grafo:
+    """Nós e arestas com posições já calculadas; `nos` é uma lista de [id, kind, label, x, y, group]"""
+
+    nos: list = field(default_factory=list)
+    arestas: list = field(default_factory=list)
+    largura: int = 0
+    altura: int = 0
+    # Arestas ordenadas pela posição do último nó, montadas no primeiro chunk pedido
+    _arestas_ordenadas: Optional[list] = field(default=None, repr=False)
+    _posicoes_arestas: Optional[list] = field(default=None, repr=False)
+
+    def deslocar(self, dx: float, dy: float, prefixo: str = ""):
+        for no in self.nos:
+            no[0] = prefixo + no[0]
+            no[3] = round(no[3] + dx)
+            no[4] = round(no[4] + dy)
+        if prefixo:
+            for aresta in self.arestas:
+                aresta[0] = prefixo + aresta[0]
+                aresta[1] = prefixo + aresta[1]
+
+    def chunk(self, indice: int = 0, tamanho: Optional[int] = None) -> dict:
+        """Fatia `indice` do grafo com até `tamanho` nós (sem `tamanho`, o grafo inteiro)
+
+        Cada aresta vai na fatia do seu último nó, então as fatias podem ser adicionadas em
+        ordem sem arestas soltas. `bounds` é o tamanho do grafo inteiro, para o cliente
+        enquadrar a visão antes de receber tudo.
+        """
+        tamanho = tamanho or max(len(self.nos), 1)
+        chunks = max(math.ceil(len(self.nos) / tamanho), 1)
+        if indice >= chunks:
+            raise ValueError(f"Chunk {indice} inexistente: o grafo tem {chunks} chunk(s)")
+        inicio, fim = indice * tamanho, (indice + 1) * tamanho
+        if self._arestas_ordenadas is None:
+            posicao = {no[0]: i for i, no in enumerate(self.nos)}
+            ordenadas = sorted((max(posicao[aresta[0]], posicao[aresta[1]]), i) for i, aresta in enumerate(self.arestas))
+            self._posicoes_arestas = [ultimo for ultimo, _ in ordenadas]
+            self._arestas_ordenadas = [self.arestas[i] for _, i in ordenadas]
+        arestas = self._arestas_ordenadas[
+            bisect.bisect_left(self._posicoes_arestas, inicio):bisect.bisect_left(self._posicoes_arestas, fim)
+        ]
+        return {
+            "format": FORMATO,
+            "node_fields": CAMPOS_NO,
+            "edge_fields": CAMPOS_ARESTA,
+            "nodes": self.nos[inicio:fim],
+            "edges": arestas,
+            "bounds": [self.largura, self.altura],
+            "chunk": indice,
+            "chunks": chunks,
+            "total_nodes": len(self.nos),
+            "total_edges": len(self.arestas)
+        }
+
+
+def posicoes_aneis(quantidade: int) -> tuple:
+    """Posições em anéis concêntricos ao redor do componente; devolve (posições, raio externo)"""
+    posicoes = []
+    raio, anel = RAIO_PRIMEIRO_ANEL, 0
+    while len(posicoes) < quantidade:
+        capacidade = int(2 * math.pi * raio / DISTANCIA_AMEACAS)
+        no_anel = min(capacidade, quantidade - len(posicoes))
+        # Anéis ímpares começam meio passo deslocados, para os rótulos não se alinharem
+        fase = math.pi / no_anel * (anel % 2) - math.pi / 2
+        for i in range(no_anel):
+            angulo = fase + 2 * math.pi * i / no_anel
+            posicoes.append((raio * math.cos(angulo), raio * math.sin(angulo)))
+        raio, anel = raio + DISTANCIA_ANEIS, anel + 1
+    return posicoes, (raio - DISTANCIA_ANEIS if quantidade else RAIO_COMPONENTE)
+
+
+def construir_grafo(threat_model: list, acesso_internet: Optional[str] = None, ids_ameacas: Optional[list] = None) -> Grafo:
+    """Grafo de componentes, fluxos de dados e ameaças, com o layout calculado aqui
+
+    Os componentes saem do texto de cada ameaça (cenário e impacto) e cada ameaça liga-se aos
+    componentes que cita; sem nenhum, ao componente "api". Os fluxos seguem FLUXOS. O layout é
+    em camadas pela distância ao usuário, com as ameaças em anéis ao redor do alvo principal:
+    custo linear, sem simulação de forças. `ids_ameacas` substitui os ids "t<índice>" das ameaças.
+    """
+    ids = [f"t{indice}" for indice in (ids_ameacas or range(len(threat_model)))]
+    alvos = []
+    for ameaca in threat_model:
+        componentes = identificar_componentes(f"{ameaca.get('Scenario', '')} {ameaca.get('Potential Impact', '')}")
+        alvos.append(componentes or ["api"])
+
+    presentes = {"usuario", "api"} | {componente for lista in alvos for componente in lista}
+    arestas = []
+    for destino, (origens, rotulo) in FLUXOS.items():
+        if destino not in presentes:
+            continue
+        origem = next(origem for origem in origens if origem in presentes)
+        arestas.append([origem, destino, "flow", rotulo])
+    arestas += [[origem, destino, "flow", rotulo] for origem, destino, rotulo in FLUXOS_EXTRAS
+                if origem in presentes and destino in presentes]
+    if acesso_internet is not None and normalizar(acesso_internet).strip() in ("sim", "yes", "true"):
+        for aresta in arestas:
+            if aresta[0] == "usuario":
+                aresta[3] += " (internet)"
+
+    # Camadas: distância ao usuário seguindo os fluxos (todos partem de um componente anterior em FLUXOS)
+    camada = {"usuario": 0}
+    for origem, destino, _, _ in arestas:
+        camada.setdefault(destino, camada[origem] + 1)
+
+    ameacas_por_componente = {componente: [] for componente in presentes}
+    for indice, componentes in enumerate(alvos):
+        ameacas_por_componente[componentes[0]].append(indice)
+    aneis = {componente: posicoes_aneis(len(indices)) for componente, indices in ameacas_por_componente.items()}
+
+    ordem = ["usuario"] + [id_componente for id_componente, _, _ in COMPONENTES if id_componente in presentes]
+    camadas = {}
+    for componente in ordem:
+        camadas.setdefault(camada[componente], []).append(componente)
+
+    centros = {}
+    x = 0.0
+    for numero in sorted(camadas):
+        componentes = camadas[numero]
+        raio_camada = max(aneis[componente][1] for componente in componentes)
+        x += raio_camada
+        alturas = [2 * aneis[componente][1] for componente in componentes]
+        y = -(sum(alturas) + MARGEM * (len(componentes) - 1)) / 2
+        for componente, altura in zip(componentes, alturas):
+            centros[componente] = (x, y + altura / 2)
+            y += altura + MARGEM
+        x += raio_camada + MARGEM
+
+    nos = []
+    for componente in ordem:
+        cx, cy = centros[componente]
+        nos.append([componente, "external" if componente == "usuario" else "component", ROTULOS[componente],
+                    cx, cy, componente])
+        for indice, (dx, dy) in zip(ameacas_por_componente[componente], aneis[componente][0]):
+            ameaca = threat_model[indice]
+            tipo = normalizar_categoria(ameaca.get("Threat Type", ""))
+            nos.append([ids[indice], "threat", f"{ABREVIACOES.get(tipo, '?')}: {resumir(ameaca.get('Scenario', ''))}",
+                        cx + dx, cy + dy, tipo])
+    for id_ameaca, componentes in zip(ids, alvos):
+        arestas += [[id_ameaca, componente, "targets", None] for componente in componentes]
+
+    minimo_x = min(no[3] for no in nos) - RAIO_COMPONENTE
+    minimo_y = min(no[4] for no in nos) - RAIO_COMPONENTE
+    grafo = Grafo(
+        nos=nos, arestas=arestas,
+        largura=round(max(no[3] for no in nos) + RAIO_COMPONENTE - minimo_x),
+        altura=round(max(no[4] for no in nos) + RAIO_COMPONENTE - minimo_y)
+    )
+    grafo.deslocar(-minimo_x, -minimo_y)
+    return grafo
+
+
+def montar_portfolio(analises: list) -> Grafo:
+    """Junta o grafo de várias análises, cada uma em seu bloco, empacotados em prateleiras
+
+    `analises` é a saída de RepositorioAmeacas.listar_analises. Os ids ganham o prefixo
+    "<id da análise>:" e cada bloco tem um nó "analysis" com o rótulo, acima do grafo.
+    """
+    grafos = []
+    for analise in analises:
+        grafo = construir_grafo(analise["threat_model"], analise["acesso_internet"], analise["ids_ameacas"])
+        rotulo = analise["projeto"] or f"{analise['tipo_aplicacao']} #{analise['id']}"
+        grafo.nos.insert(0, ["analise", "analysis", resumir(rotulo), grafo.largura / 2, -MARGEM, analise["id"]])
+        grafos.append((analise["id"], grafo))
+
+    area = sum((g.largura + MARGEM_CLUSTER) * (g.altura + MARGEM_CLUSTER) for _, g in grafos)
+    largura_maxima = max([math.sqrt(area) * 1.5] + [g.largura for _, g in grafos])
+
+    portfolio = Grafo()
+    x = y = altura_prateleira = 0
+    for id_analise, grafo in grafos:
+        if x and x + grafo.largura > largura_maxima:
+            x, y = 0, y + altura_prateleira + MARGEM_CLUSTER
+            altura_prateleira = 0
+        grafo.deslocar(x, y + MARGEM, prefixo=f"{id_analise}:")
+        portfolio.nos += grafo.nos
+        portfolio.arestas += grafo.arestas
+        portfolio.largura = max(portfolio.largura, x + grafo.largura)
+        altura_prateleira = max(altura_prateleira, grafo.altura + MARGEM)
+        x += grafo.largura + MARGEM_CLUSTER
+    portfolio.altura = y + altura_prateleira
+    return portfolio
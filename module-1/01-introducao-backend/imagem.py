@@ -0,0 +1,121 @@
+import binascii
+import hashlib
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+
+# Espaço reservado no início do buffer para o prefixo "data:<mime>;base64," (o mime só é conhecido depois)
+RESERVA_PREFIXO = len("data:image/jpeg;base64,")
+
+# Múltiplo de 3 para que cada bloco codificado em base64 não precise de padding intermediário
+TAMANHO_BLOCO = 3 * 256 * 1024
+
+ASSINATURAS_MIME = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def detectar_mime(cabecalho: bytes):
+    """Identifica o tipo real da imagem pelos primeiros bytes do arquivo"""
+    for assinatura, mime in ASSINATURAS_MIME:
+        if cabecalho.startswith(assinatura):
+            return mime
+    if cabecalho[:4] == b"RIFF" and cabecalho[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def tamanho_base64(tamanho: int) -> int:
+    return 4 * ((tamanho + 2) // 3)
+
+
+@dataclass
+class ImagemRecebida:
+    base64: Optional[bytearray]
+    inicio_base64: int
+    mime: str
+    sha256: str
+    tamanho: int
+
+    def data_url(self) -> str:
+        """Monta a data URL: o prefixo é escrito no espaço reservado antes do base64, sem nova cópia"""
+        prefixo = f"data:{self.mime};base64,".encode("ascii")
+        inicio = self.inicio_base64 - len(prefixo)
+        self.base64[inicio:self.inicio_base64] = prefixo
+        return str(memoryview(self.base64)[inicio:], "ascii")
+
+
+def _codificar(buffer: bytearray, posicao: int, dados) -> int:
+    parte = binascii.b2a_base64(dados, newline=False)
+    fim = posicao + len(parte)
+    buffer[posicao:fim] = parte
+    return fim
+
+
+def codificar_imagem(conteudo: bytes, mime: str, sha256: str) -> ImagemRecebida:
+    """Codifica em base64 uma imagem já carregada em memória (ex: após o pré-processamento)"""
+    buffer = bytearray(RESERVA_PREFIXO + tamanho_base64(len(conteudo)))
+    posicao = RESERVA_PREFIXO
+    origem = memoryview(conteudo)
+    for inicio in range(0, len(conteudo), TAMANHO_BLOCO):
+        posicao = _codificar(buffer, posicao, origem[inicio:inicio + TAMANHO_BLOCO])
+    return ImagemRecebida(base64=buffer, inicio_base64=RESERVA_PREFIXO, mime=mime, sha256=sha256, tamanho=len(conteudo))
+
+
+async def ler_imagem(upload: UploadFile, limite_bytes: int, tamanho_bloco: int = TAMANHO_BLOCO,
+                     codificar: bool = True) -> ImagemRecebida:
+    """Lê o upload em blocos com limite de tamanho, calculando hash e base64 durante a leitura
+
+    Com codificar=False apenas valida e calcula o hash; o conteúdo continua disponível em upload.file.
+    """
+    tamanho_declarado = getattr(upload, "size", None)
+    if tamanho_declarado is not None and tamanho_declarado > limite_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Imagem excede o tamanho máximo de {limite_bytes // (1024 * 1024)} MB"
+        )
+
+    buffer = bytearray(RESERVA_PREFIXO + tamanho_base64(tamanho_declarado or 0)) if codificar else None
+    posicao = RESERVA_PREFIXO
+    h = hashlib.sha256()
+    cabecalho = b""
+    resto = b""
+    lidos = 0
+
+    while True:
+        bloco = await upload.read(tamanho_bloco)
+        if not bloco:
+            break
+        lidos += len(bloco)
+        if lidos > limite_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Imagem excede o tamanho máximo de {limite_bytes // (1024 * 1024)} MB"
+            )
+        h.update(bloco)
+        if len(cabecalho) < 16:
+            cabecalho += bloco[:16 - len(cabecalho)]
+        if not codificar:
+            continue
+
+        # Só blocos com tamanho múltiplo de 3 são codificados; a sobra vai para o próximo bloco
+        if resto:
+            bloco = resto + bloco
+        corte = len(bloco) - len(bloco) % 3
+        resto = bloco[corte:]
+        posicao = _codificar(buffer, posicao, memoryview(bloco)[:corte])
+
+    if resto:
+        posicao = _codificar(buffer, posicao, resto)
+    if buffer is not None and posicao < len(buffer):
+        del buffer[posicao:]
+
+    mime = detectar_mime(cabecalho)
+    if mime is None:
+        raise HTTPException(status_code=400, detail="Conteúdo do arquivo não é uma imagem suportada")
+
+    return ImagemRecebida(base64=buffer, inicio_base64=RESERVA_PREFIXO, mime=mime, sha256=h.hexdigest(), tamanho=lidos)
@@ -0,0 +1,423 @@
+import asyncio
+import ipaddress
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+from fastapi import HTTPException
+
+from metricas import JOBS_EM_EXECUCAO, JOBS_ESPERA, JOBS_EXECUCAO, JOBS_FILA
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    id: str
+    formulario: dict
+    nome_arquivo: str
+    webhook_url: Optional[str] = None
+    status: str = "pendente"
+    criado_em: float = field(default_factory=time.time)
+    iniciado_em: Optional[float] = None
+    concluido_em: Optional[float] = None
+    resultado: Optional[dict] = None
+    erro: Optional[str] = None
+
+    def para_resposta(self) -> dict:
+        dados = {k: v for k, v in asdict(self).items() if k not in ("formulario", "webhook_url")}
+        dados["job_id"] = dados.pop("id")
+        return dados
+
+
+async def validar_webhook(url: str, hosts_permitidos=frozenset()) -> Optional[str]:
+    """Recusa webhook_url que não seja http(s) ou que aponte para a rede interna; levanta ValueError
+
+    Com `hosts_permitidos` (STRIDE_WEBHOOK_HOSTS), só esses hosts são aceitos, sem checar o
+    endereço, o que permite webhooks internos conhecidos; devolve None. Sem a lista, o host é
+    resolvido e todos os endereços precisam ser públicos: loopback, redes privadas, link-local
+    (inclusive o endpoint de metadados 169.254.169.254), multicast e faixas reservadas são
+    recusados. Devolve o endereço conferido, no qual o envio deve conectar (ver fixar_endereco).
+    """
+    partes = urlsplit(url)
+    if partes.scheme not in ("http", "https") or not partes.hostname:
+        raise ValueError("webhook_url deve ser uma URL http(s)")
+    host = partes.hostname.rstrip(".")
+    if hosts_permitidos:
+        if host not in hosts_permitidos:
+            raise ValueError(f"Host {host} não está entre os permitidos para webhook")
+        return None
+    try:
+        enderecos = await asyncio.get_running_loop().getaddrinfo(
+            host, partes.port or (443 if partes.scheme == "https" else 80), type=socket.SOCK_STREAM
+        )
+    except socket.gaierror:
+        raise ValueError(f"Não foi possível resolver o host {host}")
+    for *_, endereco in enderecos:
+        ip = ipaddress.ip_address(endereco[0].split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"webhook_url aponta para um endereço não público ({ip})")
+    return str(ipaddress.ip_address(enderecos[0][4][0].split("%")[0]))
+
+
+def fixar_endereco(url: str, endereco: str) -> dict:
+    """Argumentos do POST ao webhook conectando direto no `endereco` já conferido
+
+    Se o httpx resolvesse o nome de novo, um DNS de TTL curto (DNS rebinding) poderia trocar o
+    endereço público validado por um interno. Host e SNI seguem com o nome original, então o
+    servidor e a verificação do certificado TLS continuam vendo o host da URL.
+    """
+    original = httpx.URL(url)
+    return {
+        "url": original.copy_with(host=endereco),
+        "headers": {"Host": original.netloc.decode("ascii")},
+        "extensions": {"sni_hostname": original.host}
+    }
+
+
+class FilaJobs(ABC):
+    """Interface dos backends de fila: a API e os workers só dependem destes métodos"""
+
+    @abstractmethod
+    async def enfileirar(self, job: Job, conteudo: bytes):
+        ...
+
+    @abstractmethod
+    async def proximo(self):
+        """Aguarda o próximo job pendente, marca como em execução e devolve (job, conteudo)"""
+
+    @abstractmethod
+    async def atualizar(self, job: Job):
+        ...
+
+    @abstractmethod
+    async def obter(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    async def tamanho(self) -> int:
+        ...
+
+    async def fechar(self):
+        pass
+
+
+class FilaMemoria(FilaJobs):
+    """Fila asyncio em processo; os jobs se perdem ao reiniciar"""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._fila = asyncio.Queue()
+        self._jobs = {}
+
+    async def enfileirar(self, job, conteudo):
+        self._expurgar()
+        self._jobs[job.id] = job
+        await self._fila.put((job.id, conteudo))
+
+    async def proximo(self):
+        job_id, conteudo = await self._fila.get()
+        job = self._jobs[job_id]
+        job.status = "executando"
+        job.iniciado_em = time.time()
+        return job, conteudo
+
+    async def atualizar(self, job):
+        self._jobs[job.id] = job
+
+    async def obter(self, job_id):
+        return self._jobs.get(job_id)
+
+    async def tamanho(self):
+        return self._fila.qsize()
+
+    def _expurgar(self):
+        limite = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.concluido_em and j.concluido_em < limite]:
+            del self._jobs[job_id]
+
+
+class FilaSQLite(FilaJobs):
+    """Fila persistente em SQLite: jobs pendentes sobrevivem a reinícios do processo
+
+    O arquivo pode ser compartilhado por vários processos (workers do uvicorn). Cada job em
+    execução guarda o dono (a instância da fila) e um lease que o dono renova enquanto está vivo;
+    só jobs com o lease vencido, de um processo que caiu ou reiniciou, voltam a ser executados.
+    """
+
+    # Pendente ou em execução com o lease vencido (NULL: gravado antes do lease existir)
+    DISPONIVEL = "(status = 'pendente' OR (status = 'executando' AND (lease_ate IS NULL OR lease_ate < ?)))"
+
+    def __init__(self, caminho, ttl=3600, intervalo_consulta=0.5, lease=60):
+        self.ttl = ttl
+        self.intervalo_consulta = intervalo_consulta
+        self.lease = lease
+        self.dono = uuid.uuid4().hex
+        self._novo_job = asyncio.Event()
+        self._renovacao = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(caminho, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, criado_em REAL NOT NULL, "
+            "dados TEXT NOT NULL, conteudo BLOB, dono TEXT, lease_ate REAL)"
+        )
+        for coluna, tipo in (("dono", "TEXT"), ("lease_ate", "REAL")):
+            if coluna not in {linha[1] for linha in self._db.execute("PRAGMA table_info(jobs)")}:
+                try:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {coluna} {tipo}")
+                except sqlite3.OperationalError:
+                    pass  # outro worker adicionou a coluna ao mesmo tempo
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_pendentes ON jobs (status, criado_em)")
+        self._db.commit()
+
+    async def enfileirar(self, job, conteudo):
+        await self._na_thread(self._inserir, job, conteudo)
+        self._novo_job.set()
+
+    async def proximo(self):
+        if self._renovacao is None:
+            self._renovacao = asyncio.create_task(self._renovar_leases())
+        while True:
+            reservado = await self._na_thread(self._reservar)
+            if reservado is not None:
+                return reservado
+
+            self._novo_job.clear()
+            try:
+                await asyncio.wait_for(self._novo_job.wait(), timeout=self.intervalo_consulta)
+            except asyncio.TimeoutError:
+                pass
+
+    async def atualizar(self, job):
+        await self._na_thread(self._gravar, job)
+
+    async def obter(self, job_id):
+        linha = await self._na_thread(
+            lambda: self._db.execute("SELECT dados FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        )
+        return Job(**json.loads(linha[0])) if linha else None
+
+    async def tamanho(self):
+        return await self._na_thread(
+            lambda: self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pendente'").fetchone()[0]
+        )
+
+    async def _renovar_leases(self):
+        """Estende o lease dos jobs desta instância a cada terço do prazo, enquanto o processo vive"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self._na_thread(self._renovar)
+            except sqlite3.Error:
+                logger.exception("Falha ao renovar o lease dos jobs em execução")
+
+    async def fechar(self):
+        if self._renovacao is not None:
+            self._renovacao.cancel()
+            await asyncio.gather(self._renovacao, return_exceptions=True)
+        await self._na_thread(self._db.close)
+
+    async def _na_thread(self, funcao, *args):
+        """Executa o acesso ao SQLite fora do event loop (o arquivo pode estar ocupado por outros
+        workers), um de cada vez na conexão compartilhada"""
+        def executar():
+            with self._lock:
+                return funcao(*args)
+        return await asyncio.to_thread(executar)
+
+    def _inserir(self, job, conteudo):
+        self._db.execute("DELETE FROM jobs WHERE status IN ('concluido', 'erro') AND criado_em < ?",
+                         (time.time() - self.ttl,))
+        self._db.execute(
+            "INSERT INTO jobs (id, status, criado_em, dados, conteudo) VALUES (?, ?, ?, ?, ?)",
+            (job.id, job.status, job.criado_em, json.dumps(asdict(job), ensure_ascii=False), conteudo)
+        )
+        self._db.commit()
+
+    def _reservar(self):
+        """Marca o job disponível mais antigo como em execução por esta instância; devolve (job, conteudo) ou None"""
+        while True:
+            agora = time.time()
+            linha = self._db.execute(
+                f"SELECT id, dados, conteudo, status FROM jobs WHERE {self.DISPONIVEL} ORDER BY criado_em LIMIT 1",
+                (agora,)
+            ).fetchone()
+            if linha is None:
+                return None
+            cursor = self._db.execute(
+                f"UPDATE jobs SET status = 'executando', dono = ?, lease_ate = ? WHERE id = ? AND {self.DISPONIVEL}",
+                (self.dono, agora + self.lease, linha[0], agora)
+            )
+            self._db.commit()
+            if cursor.rowcount != 1:
+                continue  # outro worker reservou antes
+            if linha[3] == "executando":
+                logger.warning(f"Job {linha[0]} retomado: o lease do processo que o executava venceu")
+            job = Job(**json.loads(linha[1]))
+            job.status = "executando"
+            job.iniciado_em = time.time()
+            self._gravar(job)
+            return job, linha[2]
+
+    def _gravar(self, job):
+        concluido = job.status in ("concluido", "erro")
+        self._db.execute(
+            "UPDATE jobs SET status = ?, dados = ?" + (", conteudo = NULL" if concluido else "") + " WHERE id = ?",
+            (job.status, json.dumps(asdict(job), ensure_ascii=False), job.id)
+        )
+        self._db.commit()
+
+    def _renovar(self):
+        self._db.execute("UPDATE jobs SET lease_ate = ? WHERE dono = ? AND status = 'executando'",
+                         (time.time() + self.lease, self.dono))
+        self._db.commit()
+
+
+class GerenciadorJobs:
+    """Pool de workers que consome a fila e executa o mesmo pipeline do endpoint síncrono
+
+    `analisar(conteudo, nome_arquivo, formulario)` deve devolver (resultado, status_cache).
+    """
+
+    def __init__(self, fila: FilaJobs, analisar, workers=2, timeout_webhook=10, hosts_webhook=frozenset(),
+                 intervalo_metricas=5):
+        self.fila = fila
+        self.analisar = analisar
+        self.workers = workers
+        self.timeout_webhook = timeout_webhook
+        self.hosts_webhook = hosts_webhook
+        self.intervalo_metricas = intervalo_metricas
+        self._tarefas = []
+        self._http = None
+        self.metricas = {
+            "enfileirados": 0, "concluidos": 0, "erros": 0, "em_execucao": 0,
+            "espera_total_s": 0.0, "espera_max_s": 0.0,
+            "execucao_total_s": 0.0, "execucao_max_s": 0.0,
+            "webhooks_enviados": 0, "webhooks_falhos": 0
+        }
+
+    async def iniciar(self):
+        self._http = httpx.AsyncClient(timeout=self.timeout_webhook)
+        self._tarefas = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        self._tarefas.append(asyncio.create_task(self._publicar_profundidade()))
+        logger.info(f"Fila de jobs iniciada com {self.workers} workers ({type(self.fila).__name__})")
+
+    async def parar(self):
+        for tarefa in self._tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*self._tarefas, return_exceptions=True)
+        await self._http.aclose()
+        await self.fila.fechar()
+
+    async def submeter(self, conteudo: bytes, nome_arquivo: str, formulario: dict, webhook_url=None) -> Job:
+        job = Job(id=uuid.uuid4().hex, formulario=formulario, nome_arquivo=nome_arquivo, webhook_url=webhook_url)
+        await self.fila.enfileirar(job, conteudo)
+        self.metricas["enfileirados"] += 1
+        JOBS_FILA.set(await self.fila.tamanho())
+        logger.info(f"Job {job.id} enfileirado")
+        return job
+
+    async def estatisticas(self) -> dict:
+        finalizados = self.metricas["concluidos"] + self.metricas["erros"]
+        profundidade = await self.fila.tamanho()
+        JOBS_FILA.set(profundidade)
+        return {
+            **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.metricas.items()},
+            "profundidade_fila": profundidade,
+            "espera_media_s": round(self.metricas["espera_total_s"] / finalizados, 3) if finalizados else 0.0,
+            "execucao_media_s": round(self.metricas["execucao_total_s"] / finalizados, 3) if finalizados else 0.0
+        }
+
+    async def _publicar_profundidade(self):
+        """Atualiza o gauge da profundidade da fila, que também muda pelos jobs de outros processos"""
+        while True:
+            try:
+                JOBS_FILA.set(await self.fila.tamanho())
+            except Exception:
+                logger.exception("Falha ao ler a profundidade da fila de jobs")
+            await asyncio.sleep(self.intervalo_metricas)
+
+    async def _worker(self, numero):
+        while True:
+            job = None
+            try:
+                job, conteudo = await self.fila.proximo()
+                await self._executar(job, conteudo)
+            except Exception as e:
+                # Falha fora da análise (fila, atualização do job): o worker continua consumindo
+                if job is None:
+                    logger.exception(f"Worker {numero}: falha ao obter o próximo job")
+                    await asyncio.sleep(1)
+                    continue
+                logger.exception(f"Worker {numero}: falha no job {job.id}")
+                await self._marcar_erro(job, f"Erro interno ao processar o job: {str(e)}")
+
+    async def _marcar_erro(self, job: Job, erro: str):
+        """Registra o erro no job que ficou sem status final; se a fila falhar de novo, só loga"""
+        if job.status not in ("concluido", "erro"):
+            job.status, job.erro = "erro", erro
+            job.concluido_em = time.time()
+            self.metricas["erros"] += 1
+        try:
+            await self.fila.atualizar(job)
+        except Exception:
+            logger.exception(f"Não foi possível gravar o status do job {job.id}")
+
+    async def _executar(self, job: Job, conteudo: bytes):
+        JOBS_FILA.set(await self.fila.tamanho())
+        espera = job.iniciado_em - job.criado_em
+        self.metricas["espera_total_s"] += espera
+        self.metricas["espera_max_s"] = max(self.metricas["espera_max_s"], espera)
+        self.metricas["em_execucao"] += 1
+        JOBS_ESPERA.observe(espera)
+        JOBS_EM_EXECUCAO.inc()
+        logger.info(f"Executando job {job.id} (aguardou {espera:.2f}s na fila)")
+
+        try:
+            job.resultado, _ = await self.analisar(conteudo, job.nome_arquivo, job.formulario)
+            job.status = "concluido"
+            self.metricas["concluidos"] += 1
+        except HTTPException as he:
+            job.status, job.erro = "erro", str(he.detail)
+            self.metricas["erros"] += 1
+        except Exception as e:
+            logger.error(f"Erro no job {job.id}: {str(e)}", exc_info=True)
+            job.status, job.erro = "erro", f"Erro ao processar análise: {str(e)}"
+            self.metricas["erros"] += 1
+        finally:
+            self.metricas["em_execucao"] -= 1
+            JOBS_EM_EXECUCAO.dec()
+
+        job.concluido_em = time.time()
+        execucao = job.concluido_em - job.iniciado_em
+        self.metricas["execucao_total_s"] += execucao
+        self.metricas["execucao_max_s"] = max(self.metricas["execucao_max_s"], execucao)
+        JOBS_EXECUCAO.labels(job.status).observe(execucao)
+        await self.fila.atualizar(job)
+
+        if job.webhook_url:
+            await self._notificar(job)
+
+    async def _notificar(self, job: Job):
+        try:
+            # Valida de novo no envio (o DNS pode ter mudado desde o POST /jobs) e conecta no endereço conferido
+            endereco = await validar_webhook(job.webhook_url, self.hosts_webhook)
+            destino = {"url": job.webhook_url} if endereco is None else fixar_endereco(job.webhook_url, endereco)
+            resposta = await self._http.post(**destino, json=job.para_resposta())
+            resposta.raise_for_status()
+            self.metricas["webhooks_enviados"] += 1
+        except Exception as e:
+            # URL inválida, recusa de conexão etc.: o job já está gravado, só a notificação se perde
+            logger.warning(f"Falha ao enviar webhook do job {job.id}: {str(e)}")
+            self.metricas["webhooks_falhos"] += 1
@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+
+class BaldeTokens:
+    """Token bucket assíncrono: repõe `taxa` tokens por segundo até `capacidade`"""
+
+    def __init__(self, taxa: float, capacidade: float = None):
+        self.taxa = taxa
+        self.capacidade = capacidade if capacidade is not None else max(taxa, 1)
+        self.tokens = self.capacidade
+        self._atualizado_em = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self._atualizado_em) * self.taxa)
+        self._atualizado_em = agora
+
+    def tempo_ate(self, quantidade: float = 1) -> float:
+        """Segundos até haver `quantidade` tokens disponíveis (0 se já houver)"""
+        self._repor()
+        falta = min(quantidade, self.capacidade) - self.tokens
+        return max(falta, 0) / self.taxa
+
+    async def adquirir(self, quantidade: float = 1):
+        # Pedidos maiores que a capacidade esperariam para sempre: consomem o balde cheio
+        quantidade = min(quantidade, self.capacidade)
+        async with self._lock:
+            while True:
+                espera = self.tempo_ate(quantidade)
+                if espera <= 0:
+                    self.tokens -= quantidade
+                    return
+                await asyncio.sleep(espera)
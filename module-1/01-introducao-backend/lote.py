@@ -0,0 +1,275 @@
+"""
+Análise STRIDE em lote a partir de um manifesto (JSON/CSV) e de um diretório ou zip de diagramas
+
+Uso pela linha de comando (a partir de module-1/01-introducao-backend):
+    python lote.py --manifesto portfolio.csv --diagramas diagramas.zip --saida resultados.jsonl
+
+O manifesto tem uma linha/objeto por serviço com as colunas id, imagem, tipo_aplicacao,
+autenticacao, acesso_internet, dados_sensiveis, descricao_aplicacao e, opcionalmente, tenant.
+"""
+
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import logging
+import time
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from fastapi import HTTPException
+
+from cache import calcular_chave
+from limites import BaldeTokens
+
+logger = logging.getLogger(__name__)
+
+CAMPOS_FORMULARIO = ["tipo_aplicacao", "autenticacao", "acesso_internet", "dados_sensiveis", "descricao_aplicacao"]
+
+
+@dataclass
+class ItemLote:
+    id: str
+    imagem: str
+    formulario: dict
+    tenant: str = "padrao"
+
+
+def carregar_manifesto(conteudo: bytes, nome: str) -> list:
+    """Lê o manifesto em JSON (lista de objetos) ou CSV (com cabeçalho)"""
+    texto = conteudo.decode("utf-8-sig")
+    if nome.lower().endswith(".json") or texto.lstrip().startswith("["):
+        linhas = json.loads(texto)
+    else:
+        linhas = list(csv.DictReader(io.StringIO(texto)))
+
+    itens = []
+    for posicao, linha in enumerate(linhas, start=1):
+        faltando = [c for c in ["imagem"] + CAMPOS_FORMULARIO if not linha.get(c)]
+        if faltando:
+            raise ValueError(f"Item {posicao} do manifesto sem os campos: {', '.join(faltando)}")
+        itens.append(ItemLote(
+            id=str(linha.get("id") or posicao),
+            imagem=linha["imagem"],
+            formulario={c: linha[c] for c in CAMPOS_FORMULARIO},
+            tenant=linha.get("tenant") or "padrao"
+        ))
+
+    ids = [item.id for item in itens]
+    if len(ids) != len(set(ids)):
+        raise ValueError("O manifesto contém ids repetidos")
+    return itens
+
+
+class FonteDiagramas:
+    """Acesso uniforme aos diagramas de um diretório ou de um arquivo zip"""
+
+    def __init__(self, origem):
+        self._zip = None
+        self._diretorio = None
+        if isinstance(origem, (str, Path)) and Path(origem).is_dir():
+            self._diretorio = Path(origem)
+        else:
+            self._zip = zipfile.ZipFile(origem)
+
+    def ler(self, nome: str) -> bytes:
+        if self._zip is not None:
+            return self._zip.read(nome)
+        caminho = (self._diretorio / nome).resolve()
+        if self._diretorio.resolve() not in caminho.parents:
+            raise ValueError(f"Caminho fora do diretório de diagramas: {nome}")
+        return caminho.read_bytes()
+
+    def fechar(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+def linha_incompleta(caminho) -> bool:
+    """Verdadeiro se o arquivo não termina em quebra de linha (gravação interrompida no meio)"""
+    with open(caminho, "rb") as f:
+        f.seek(0, 2)
+        if f.tell() == 0:
+            return False
+        f.seek(-1, 2)
+        return f.read(1) != b"\n"
+
+
+def ler_concluidos(caminho_saida) -> set:
+    """Ids já concluídos em uma execução anterior (para retomar sem refazer)"""
+    concluidos = set()
+    if caminho_saida is None or not Path(caminho_saida).exists():
+        return concluidos
+    with open(caminho_saida, encoding="utf-8") as f:
+        for linha in f:
+            try:
+                registro = json.loads(linha)
+            except json.JSONDecodeError:
+                # Última linha truncada por uma interrupção
+                continue
+            if registro.get("status") in ("ok", "duplicado"):
+                concluidos.add(registro["id"])
+    return concluidos
+
+
+@dataclass
+class ExecucaoLote:
+    """Executa o lote com concorrência limitada, limite de taxa por tenant e deduplicação
+
+    `analisar(conteudo, nome_arquivo, formulario)` deve devolver (resultado, status_cache).
+    """
+    itens: list
+    fonte: FonteDiagramas
+    analisar: object
+    caminho_saida: object = None
+    concorrencia: int = 4
+    limite_por_tenant: float = None
+    contadores: dict = field(default_factory=lambda: {
+        "total": 0, "retomados": 0, "ok": 0, "erros": 0, "duplicados": 0
+    })
+
+    def __post_init__(self):
+        self._semaforo = asyncio.Semaphore(self.concorrencia)
+        self._baldes = {}
+        self._em_andamento = {}
+        self._inicio = None
+        self._fim = None
+
+    async def executar(self):
+        """Gerador assíncrono de registros JSONL, na ordem em que os itens terminam"""
+        self._inicio = time.perf_counter()
+        concluidos = ler_concluidos(self.caminho_saida)
+        pendentes = [item for item in self.itens if item.id not in concluidos]
+        self.contadores["total"] = len(self.itens)
+        self.contadores["retomados"] = len(self.itens) - len(pendentes)
+        if self.contadores["retomados"]:
+            logger.info(f"Retomando lote: {self.contadores['retomados']} itens já concluídos")
+
+        saida = None
+        if self.caminho_saida:
+            saida = open(self.caminho_saida, "a", encoding="utf-8")
+            if linha_incompleta(self.caminho_saida):
+                # Fecha a linha truncada pela interrupção para o primeiro registro novo não se perder
+                saida.write("\n")
+        tarefas = [asyncio.create_task(self._processar(item)) for item in pendentes]
+        try:
+            for proxima in asyncio.as_completed(tarefas):
+                registro = await proxima
+                self.contadores[{"ok": "ok", "erro": "erros", "duplicado": "duplicados"}[registro["status"]]] += 1
+                if saida is not None:
+                    saida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                    saida.flush()
+                yield registro
+        finally:
+            for tarefa in tarefas:
+                tarefa.cancel()
+            if saida is not None:
+                saida.close()
+            self._fim = time.perf_counter()
+
+    def relatorio(self) -> dict:
+        duracao = (self._fim or time.perf_counter()) - (self._inicio or time.perf_counter())
+        processados = self.contadores["ok"] + self.contadores["erros"] + self.contadores["duplicados"]
+        return {
+            **self.contadores,
+            "duracao_s": round(duracao, 3),
+            "itens_por_minuto": round(processados / duracao * 60, 2) if duracao > 0 else 0.0
+        }
+
+    def _balde(self, tenant):
+        if not self.limite_por_tenant:
+            return None
+        if tenant not in self._baldes:
+            self._baldes[tenant] = BaldeTokens(taxa=self.limite_por_tenant / 60)
+        return self._baldes[tenant]
+
+    async def _processar(self, item: ItemLote) -> dict:
+        inicio = time.perf_counter()
+        registro = {"id": item.id, "imagem": item.imagem, "tenant": item.tenant}
+        try:
+            # O balde do tenant vem antes da vaga: um tenant limitado não ocupa vagas esperando a taxa
+            balde = self._balde(item.tenant)
+            if balde is not None:
+                await balde.adquirir()
+            # A vaga cobre a leitura do diagrama: no máximo `concorrencia` imagens em memória
+            await self._semaforo.acquire()
+            try:
+                conteudo = await asyncio.to_thread(self.fonte.ler, item.imagem)
+                chave = calcular_chave(
+                    hashlib.sha256(conteudo).hexdigest(), json.dumps(item.formulario, sort_keys=True), {}
+                )
+                original = self._em_andamento.get(chave)
+                if original is None:
+                    resultado, status_cache = await self._analisar_original(item, conteudo, chave)
+            finally:
+                conteudo = None  # duplicados não seguram a imagem enquanto esperam o original
+                self._semaforo.release()
+
+            if original is not None:
+                # Duplicado espera o original sem ocupar vaga
+                id_original, futuro = original
+                resultado = await asyncio.shield(futuro)
+                registro.update(status="duplicado", duplicado_de=id_original, resultado=resultado)
+            else:
+                registro.update(status="ok", cache=status_cache, resultado=resultado)
+        except HTTPException as he:
+            registro.update(status="erro", erro=he.detail)
+        except Exception as e:
+            logger.error(f"Erro no item {item.id} do lote: {str(e)}")
+            registro.update(status="erro", erro=str(e))
+
+        registro["duracao_s"] = round(time.perf_counter() - inicio, 3)
+        return registro
+
+    async def _analisar_original(self, item: ItemLote, conteudo: bytes, chave: str):
+        """Analisa o item e publica o resultado para os duplicados que chegarem enquanto isso"""
+        futuro = asyncio.get_running_loop().create_future()
+        self._em_andamento[chave] = (item.id, futuro)
+        try:
+            resultado, status_cache = await self.analisar(conteudo, item.imagem, item.formulario)
+            futuro.set_result(resultado)
+            return resultado, status_cache
+        except Exception as e:
+            futuro.set_exception(e)
+            futuro.exception()  # evita aviso de exceção não consumida
+            raise
+        finally:
+            if not futuro.done():
+                futuro.cancel()
+
+
+async def executar_cli(args):
+    import main
+
+    with open(args.manifesto, "rb") as f:
+        itens = carregar_manifesto(f.read(), args.manifesto)
+    fonte = FonteDiagramas(args.diagramas)
+    execucao = ExecucaoLote(
+        itens=itens, fonte=fonte, analisar=main.analisar_bytes, caminho_saida=args.saida,
+        concorrencia=args.concorrencia, limite_por_tenant=args.limite_tenant
+    )
+    # Os recursos da API (clientes, pools e caches) são criados no lifespan; sem o servidor,
+    # o lote cria os seus. A fila de jobs não é iniciada: o lote não consome jobs pendentes.
+    main.inicializar_recursos()
+    try:
+        async for registro in execucao.executar():
+            logger.info(f"[{registro['status']}] {registro['id']} ({registro['duracao_s']}s)")
+    finally:
+        fonte.fechar()
+        await main.encerrar_recursos()
+
+    print(json.dumps(execucao.relatorio(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifesto", required=True, help="Arquivo JSON ou CSV com os itens do lote")
+    parser.add_argument("--diagramas", required=True, help="Diretório ou arquivo zip com as imagens")
+    parser.add_argument("--saida", required=True, help="Arquivo JSONL de resultados (reaproveitado ao retomar)")
+    parser.add_argument("--concorrencia", type=int, default=4, help="Análises simultâneas")
+    parser.add_argument("--limite-tenant", type=float, default=None, help="Análises por minuto por tenant")
+    asyncio.run(executar_cli(parser.parse_args()))
@@ -1,16 +1,55 @@
 import os
-import base64
-import tempfile
+import io
 import json
+import mimetypes
+import zipfile
 import logging
-from openai import AzureOpenAI
+import asyncio
+import time
+import multiprocessing
+import httpx
+import orjson
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, Form, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, Form, File, HTTPException, Query
+from starlette.datastructures import Headers
+from fastapi.responses import Response, StreamingResponse
 from pathlib import Path
 from fastapi.middleware.cors import CORSMiddleware
+from datetime import date
 from typing import Optional
 from pydantic import BaseModel
+from admissao import ChamadasEmAndamento, ControleAdmissao, MiddlewareAdmissao
+from cache import CacheResultados, calcular_chave
+from cliente_openai import (
+    ClienteResiliente, FalhaModelo, carregar_codificador, contar_tokens, estimar_tokens_mensagens
+)
+from continuacao import OrcamentoSaida, RespostaContinuada, continuar_resposta
+from roteador import Backend, RoteadorModelos, carregar_configuracao
+from esquema import ThreatAnalysisResponse, analisar_resposta, analisar_resposta_delta, esquema_delta, esquema_saida
+from grafo import Grafo, construir_grafo, montar_portfolio
+from exportacao import FORMATOS, analise_de_resultado, exportar_analises, exportar_arquivo, validar_formatos
+from fanout import PARTES, SUGESTOES, MesclagemFanout, executar_partes
+from prompt import (
+    INSTRUCAO_DELTA, VERSAO_PREFIXO, criar_prompt_delta, criar_prompt_modelo_ameacas, montar_mensagens_chat
+)
+from metricas import (
+    ANALISE_SEGUNDOS, CACHE, EM_ANDAMENTO, IMAGEM_BYTES, OCR, ORCAMENTO_SAIDA, PARSE, configurar_tracing, exportar, medir
+)
+from imagem import ImagemRecebida, codificar_imagem, ler_imagem
+from parser_incremental import ParserIncremental
+from lote import ExecucaoLote, FonteDiagramas, carregar_manifesto
+from jobs import FilaMemoria, FilaSQLite, GerenciadorJobs, validar_webhook
+from preprocessamento import escolher_detail, preprocessar_imagem
+from ocr import CacheExtracoes, ExtracaoDiagrama, extrair_diagrama, verificar_backend
+from similaridade import IndiceDiagramas, calcular_miniatura, calcular_phash
+from revisoes import Revisao, RepositorioRevisoes, aplicar_delta, calcular_delta
+from repositorio import DIMENSOES, RepositorioAmeacas
+from PIL import Image, UnidentifiedImageError
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,7 +57,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-env_path = Path(__file__).resolve(strict=True).parent / ".env"
+env_path = Path(__file__).resolve().parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
 AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
@@ -26,15 +65,205 @@ AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
 AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
 
-if not all([AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_DEPLOYMENT_NAME]):
+# Limites do pool HTTP e de chamadas simultâneas ao modelo
+AZURE_OPENAI_MAX_CONCURRENCY = int(os.getenv("AZURE_OPENAI_MAX_CONCURRENCY", "16"))
+AZURE_OPENAI_MAX_CONNECTIONS = int(os.getenv("AZURE_OPENAI_MAX_CONNECTIONS", "32"))
+AZURE_OPENAI_MAX_KEEPALIVE = int(os.getenv("AZURE_OPENAI_MAX_KEEPALIVE", "16"))
+AZURE_OPENAI_TIMEOUT = float(os.getenv("AZURE_OPENAI_TIMEOUT", "120"))
+
+# Cota do deployment (0 desativa o limitador), retentativas, prazo e circuit breaker
+AZURE_OPENAI_RPM = int(os.getenv("AZURE_OPENAI_RPM", "0"))
+AZURE_OPENAI_TPM = int(os.getenv("AZURE_OPENAI_TPM", "0"))
+AZURE_OPENAI_MAX_RETRIES = int(os.getenv("AZURE_OPENAI_MAX_RETRIES", "4"))
+AZURE_OPENAI_BACKOFF_BASE = float(os.getenv("AZURE_OPENAI_BACKOFF_BASE", "1"))
+AZURE_OPENAI_BACKOFF_MAX = float(os.getenv("AZURE_OPENAI_BACKOFF_MAX", "30"))
+AZURE_OPENAI_DEADLINE = float(os.getenv("AZURE_OPENAI_DEADLINE", "180"))
+AZURE_OPENAI_CIRCUIT_FALHAS = int(os.getenv("AZURE_OPENAI_CIRCUIT_FALHAS", "5"))
+AZURE_OPENAI_CIRCUIT_TEMPO = float(os.getenv("AZURE_OPENAI_CIRCUIT_TEMPO", "30"))
+
+# Vários deployments (regiões, PTU/PAYG): lista JSON inline ou caminho de um arquivo JSON
+AZURE_OPENAI_BACKENDS = os.getenv("AZURE_OPENAI_BACKENDS")
+AZURE_OPENAI_ROTEAMENTO = os.getenv("AZURE_OPENAI_ROTEAMENTO", "menor_carga").lower()
+
+# Cache de resultados (memória + SQLite opcional)
+STRIDE_CACHE_HABILITADO = os.getenv("STRIDE_CACHE_HABILITADO", "true").lower() == "true"
+STRIDE_CACHE_MAX_ITENS = int(os.getenv("STRIDE_CACHE_MAX_ITENS", "256"))
+STRIDE_CACHE_MAX_MB = int(os.getenv("STRIDE_CACHE_MAX_MB", "64"))
+STRIDE_CACHE_TTL = int(os.getenv("STRIDE_CACHE_TTL", "86400"))
+STRIDE_CACHE_SQLITE = os.getenv("STRIDE_CACHE_SQLITE")
+
+STRIDE_MAX_UPLOAD_MB = int(os.getenv("STRIDE_MAX_UPLOAD_MB", "20"))
+
+# Pré-processamento da imagem antes do envio ao modelo
+STRIDE_PREPROCESSAMENTO_HABILITADO = os.getenv("STRIDE_PREPROCESSAMENTO_HABILITADO", "true").lower() == "true"
+STRIDE_PREPROCESSAMENTO_WORKERS = int(os.getenv("STRIDE_PREPROCESSAMENTO_WORKERS", "4"))
+STRIDE_IMAGEM_LADO_MAXIMO = int(os.getenv("STRIDE_IMAGEM_LADO_MAXIMO", "2048"))
+STRIDE_IMAGEM_FORMATO = os.getenv("STRIDE_IMAGEM_FORMATO", "png").lower()
+STRIDE_IMAGEM_QUALIDADE = int(os.getenv("STRIDE_IMAGEM_QUALIDADE", "90"))
+STRIDE_IMAGEM_CORES = int(os.getenv("STRIDE_IMAGEM_CORES", "256"))
+STRIDE_IMAGEM_DETAIL = os.getenv("STRIDE_IMAGEM_DETAIL", "auto").lower()
+
+# OCR local do diagrama (tesseract ou teste; vazio desliga): componentes e fluxos entram no prompt
+# e, com pelo menos STRIDE_OCR_MIN_COMPONENTES lidos, a imagem vai com STRIDE_OCR_DETAIL
+STRIDE_OCR_BACKEND = os.getenv("STRIDE_OCR_BACKEND", "").lower()
+STRIDE_OCR_IDIOMA = os.getenv("STRIDE_OCR_IDIOMA", "eng")
+STRIDE_OCR_WORKERS = int(os.getenv("STRIDE_OCR_WORKERS", "2"))
+STRIDE_OCR_DETAIL = os.getenv("STRIDE_OCR_DETAIL", "low").lower()
+STRIDE_OCR_MIN_COMPONENTES = int(os.getenv("STRIDE_OCR_MIN_COMPONENTES", "2"))
+STRIDE_OCR_TIMEOUT = float(os.getenv("STRIDE_OCR_TIMEOUT", "10"))
+# O processo de OCR para sozinho no prazo; a folga cobre o envio da imagem e a volta do resultado
+MARGEM_OCR = 1.0
+STRIDE_OCR_CACHE_ITENS = int(os.getenv("STRIDE_OCR_CACHE_ITENS", "512"))
+
+# Resultados dos lotes enviados via API (permite retomar um lote pelo mesmo lote_id)
+STRIDE_LOTES_DIR = Path(os.getenv("STRIDE_LOTES_DIR", "lotes"))
+
+# Modo job: fila local (memória ou SQLite) consumida por um pool de workers
+STRIDE_JOBS_BACKEND = os.getenv("STRIDE_JOBS_BACKEND", "memoria").lower()
+STRIDE_JOBS_SQLITE = os.getenv("STRIDE_JOBS_SQLITE", "jobs.db")
+STRIDE_JOBS_WORKERS = int(os.getenv("STRIDE_JOBS_WORKERS", "4"))
+STRIDE_JOBS_TTL = int(os.getenv("STRIDE_JOBS_TTL", "3600"))
+# Prazo do lease de um job em execução na fila SQLite; vencido, outro worker retoma o job
+STRIDE_JOBS_LEASE = int(os.getenv("STRIDE_JOBS_LEASE", "60"))
+# Hosts aceitos em webhook_url, separados por vírgula; sem valor, qualquer host com endereço público
+STRIDE_WEBHOOK_HOSTS = frozenset(
+    host.strip().lower().rstrip(".") for host in os.getenv("STRIDE_WEBHOOK_HOSTS", "").split(",") if host.strip()
+)
+
+# Saída estruturada: json_schema (requer API 2024-08-01-preview ou posterior), json_object ou desligada
+STRIDE_SAIDA_ESTRUTURADA = os.getenv("STRIDE_SAIDA_ESTRUTURADA", "json_schema").lower()
+
+# Fan-out: uma chamada menor por categoria STRIDE + uma para as sugestões, em paralelo
+STRIDE_FANOUT_HABILITADO = os.getenv("STRIDE_FANOUT_HABILITADO", "false").lower() == "true"
+STRIDE_FANOUT_MAX_TOKENS = int(os.getenv("STRIDE_FANOUT_MAX_TOKENS", "700"))
+
+# Índice de diagramas quase idênticos (hash perceptual + campos do formulário)
+STRIDE_SIMILAR_HABILITADO = os.getenv("STRIDE_SIMILAR_HABILITADO", "false").lower() == "true"
+STRIDE_SIMILAR_SQLITE = os.getenv("STRIDE_SIMILAR_SQLITE", "similares.db")
+STRIDE_SIMILAR_REUTILIZAR_DISTANCIA = int(os.getenv("STRIDE_SIMILAR_REUTILIZAR_DISTANCIA", "4"))
+STRIDE_SIMILAR_SEMENTE_DISTANCIA = int(os.getenv("STRIDE_SIMILAR_SEMENTE_DISTANCIA", "7"))
+STRIDE_SIMILAR_FORMULARIO_MIN = float(os.getenv("STRIDE_SIMILAR_FORMULARIO_MIN", "0.9"))
+
+# Revisões por projeto: a partir da segunda, o modelo recebe só o que mudou e devolve o delta
+# Em arquivo por padrão: em memória cada worker teria o próprio histórico, perdido ao reiniciar
+STRIDE_REVISOES_SQLITE = os.getenv("STRIDE_REVISOES_SQLITE", "revisoes.db")
+STRIDE_REVISOES_MAX_REGIOES = float(os.getenv("STRIDE_REVISOES_MAX_REGIOES", "0.5"))
+STRIDE_REVISOES_MAX_TOKENS = int(os.getenv("STRIDE_REVISOES_MAX_TOKENS", "1200"))
+
+# Histórico de todas as análises com busca textual e agregações para o portfólio
+STRIDE_REPOSITORIO_HABILITADO = os.getenv("STRIDE_REPOSITORIO_HABILITADO", "false").lower() == "true"
+STRIDE_REPOSITORIO_SQLITE = os.getenv("STRIDE_REPOSITORIO_SQLITE", "ameacas.db")
+
+# max_tokens estimado por análise (complexidade do diagrama e tamanho da descrição) e
+# continuação das respostas cortadas por max_tokens
+STRIDE_ORCAMENTO_ADAPTATIVO = os.getenv("STRIDE_ORCAMENTO_ADAPTATIVO", "true").lower() == "true"
+STRIDE_MAX_TOKENS_MIN = int(os.getenv("STRIDE_MAX_TOKENS_MIN", "1000"))
+STRIDE_MAX_TOKENS_MAX = int(os.getenv("STRIDE_MAX_TOKENS_MAX", "4096"))
+STRIDE_CONTINUACOES_MAX = int(os.getenv("STRIDE_CONTINUACOES_MAX", "2"))
+
+# Controle de admissão por worker: análises simultâneas, fila de espera (total e por cliente) e
+# espera máxima; acima disso, 503 com Retry-After. MAX_ANDAMENTO=0 desabilita. O cliente é
+# identificado pelo cabeçalho configurado (ex.: X-Client-Id) ou, sem ele, pelo IP
+STRIDE_ADMISSAO_MAX_ANDAMENTO = int(os.getenv("STRIDE_ADMISSAO_MAX_ANDAMENTO", "32"))
+STRIDE_ADMISSAO_MAX_FILA = int(os.getenv("STRIDE_ADMISSAO_MAX_FILA", "64"))
+STRIDE_ADMISSAO_MAX_FILA_CLIENTE = int(os.getenv("STRIDE_ADMISSAO_MAX_FILA_CLIENTE", "16"))
+STRIDE_ADMISSAO_ESPERA_MAXIMA = float(os.getenv("STRIDE_ADMISSAO_ESPERA_MAXIMA", "30"))
+STRIDE_ADMISSAO_CABECALHO_CLIENTE = os.getenv("STRIDE_ADMISSAO_CABECALHO_CLIENTE")
+# Single-flight: análises idênticas simultâneas compartilham uma única chamada ao modelo
+STRIDE_COALESCER_HABILITADO = os.getenv("STRIDE_COALESCER_HABILITADO", "true").lower() == "true"
+
+# Grafo de componentes, fluxos e ameaças com layout calculado no servidor (campo graph) e
+# tamanho padrão dos chunks do grafo do portfólio (/ameacas/grafo)
+STRIDE_GRAFO_HABILITADO = os.getenv("STRIDE_GRAFO_HABILITADO", "true").lower() == "true"
+STRIDE_GRAFO_TAMANHO_CHUNK = int(os.getenv("STRIDE_GRAFO_TAMANHO_CHUNK", "2000"))
+
+# Análises lidas do repositório por vez nas exportações (a memória da exportação fica em um lote)
+STRIDE_EXPORTACAO_LOTE = int(os.getenv("STRIDE_EXPORTACAO_LOTE", "500"))
+
+# Spans OpenTelemetry das etapas da análise (ex.: http://localhost:4318/v1/traces)
+STRIDE_OTEL_ENDPOINT = os.getenv("STRIDE_OTEL_ENDPOINT")
+
+PARAMETROS_MODELO = {
+    "temperature": 0.7,
+    "max_tokens": 2000,
+    "top_p": 0.95,
+    "frequency_penalty": 0,
+    "presence_penalty": 0
+}
+
+if STRIDE_SAIDA_ESTRUTURADA == "json_schema":
+    PARAMETROS_MODELO["response_format"] = esquema_saida()
+elif STRIDE_SAIDA_ESTRUTURADA == "json_object":
+    PARAMETROS_MODELO["response_format"] = {"type": "json_object"}
+
+def parametros_parte(parte: str) -> dict:
+    """Parâmetros de uma chamada do fan-out: menos max_tokens e schema restrito à parte pedida"""
+    parametros = {**PARAMETROS_MODELO, "max_tokens": STRIDE_FANOUT_MAX_TOKENS}
+    if STRIDE_SAIDA_ESTRUTURADA == "json_schema":
+        if parte == SUGESTOES:
+            parametros["response_format"] = esquema_saida(categorias=[])
+        else:
+            parametros["response_format"] = esquema_saida(categorias=[parte], incluir_sugestoes=False)
+    return parametros
+
+PARAMETROS_FANOUT = {parte: parametros_parte(parte) for parte in PARTES}
+
+PARAMETROS_DELTA = {**PARAMETROS_MODELO, "max_tokens": STRIDE_REVISOES_MAX_TOKENS}
+if STRIDE_SAIDA_ESTRUTURADA == "json_schema":
+    PARAMETROS_DELTA["response_format"] = esquema_delta()
+
+orcamento_saida = OrcamentoSaida(STRIDE_MAX_TOKENS_MIN, STRIDE_MAX_TOKENS_MAX)
+
+AZURE_OPENAI_CONFIGURADO = bool(AZURE_OPENAI_BACKENDS) or all(
+    [AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_DEPLOYMENT_NAME]
+)
+
+if not AZURE_OPENAI_CONFIGURADO:
     logger.error("Variáveis de ambiente do Azure OpenAI não configuradas corretamente")
 else:
     logger.info("Variáveis de ambiente carregadas com sucesso")
 
+if STRIDE_OTEL_ENDPOINT:
+    configurar_tracing(STRIDE_OTEL_ENDPOINT)
+
+class RespostaJSON(Response):
+    """JSON serializado pelo orjson (UTF-8 direto em bytes, sem a passagem pelo json da stdlib)"""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global pronto
+    inicio = time.perf_counter()
+    inicializar_recursos()
+    await gerenciador_jobs.iniciar()
+    # A codificação do tiktoken pode ser baixada: carrega em segundo plano, fora da primeira requisição
+    asyncio.get_running_loop().run_in_executor(executor_imagens, carregar_codificador)
+    pronto = True
+    logger.info(f"Worker {os.getpid()} pronto em {time.perf_counter() - inicio:.2f}s")
+    yield
+    pronto = False
+    await gerenciador_jobs.parar()
+    await encerrar_recursos()
+    logger.info("Cliente Azure OpenAI encerrado")
+
 app = FastAPI(
     title="STRIDE Threat Modeling API",
     description="API para análise de ameaças em diagramas de arquitetura usando Azure OpenAI e metodologia STRIDE",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=RespostaJSON
+)
+
+# Adicionado antes do CORS para que as respostas 503 também levem os cabeçalhos de CORS
+app.add_middleware(
+    MiddlewareAdmissao,
+    obter_controle=lambda: controle_admissao,
+    caminhos=("/analisar_ameacas", "/analisar_ameacas/stream"),
+    cabecalho_cliente=STRIDE_ADMISSAO_CABECALHO_CLIENTE
 )
 
 app.add_middleware(
@@ -43,101 +272,215 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Cache", "Retry-After", "Content-Disposition"],
 )
 
 logger.info("FastAPI inicializado com CORS habilitado")
 
-client = AzureOpenAI(
-    api_key=AZURE_OPENAI_API_KEY,
-    azure_endpoint= AZURE_OPENAI_ENDPOINT,
-    api_version=AZURE_OPENAI_API_VERSION,
-    azure_deployment=AZURE_OPENAI_DEPLOYMENT_NAME)
+def criar_backend(config: dict, multiplos: bool) -> Backend:
+    """Cliente assíncrono por deployment: a chamada ao modelo não bloqueia o event loop
+    e as conexões HTTP são reaproveitadas entre requisições"""
+    client = AsyncAzureOpenAI(
+        api_key=config["api_key"],
+        azure_endpoint=config["endpoint"],
+        api_version=config["api_version"],
+        azure_deployment=config["deployment"],
+        timeout=AZURE_OPENAI_TIMEOUT,
+        # As retentativas ficam a cargo do ClienteResiliente (e do roteador, com vários backends)
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=AZURE_OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=AZURE_OPENAI_MAX_KEEPALIVE
+            )
+        ))
+    cliente = ClienteResiliente(
+        client,
+        config["deployment"],
+        max_concorrencia=int(config.get("max_concorrencia", AZURE_OPENAI_MAX_CONCURRENCY)),
+        rpm=int(config.get("rpm", AZURE_OPENAI_RPM)),
+        tpm=int(config.get("tpm", AZURE_OPENAI_TPM)),
+        # Com vários backends um 429/5xx troca de deployment em vez de esperar no mesmo
+        max_tentativas=0 if multiplos else AZURE_OPENAI_MAX_RETRIES,
+        backoff_base=AZURE_OPENAI_BACKOFF_BASE,
+        backoff_max=AZURE_OPENAI_BACKOFF_MAX,
+        prazo=AZURE_OPENAI_DEADLINE,
+        limiar_falhas=AZURE_OPENAI_CIRCUIT_FALHAS,
+        tempo_circuito=AZURE_OPENAI_CIRCUIT_TEMPO
+    )
+    return Backend(nome=config["nome"], cliente=cliente, peso=config["peso"], prioridade=config["prioridade"])
+
+CONFIGURACAO_PADRAO = {
+    "nome": "principal",
+    "endpoint": AZURE_OPENAI_ENDPOINT,
+    "deployment": AZURE_OPENAI_DEPLOYMENT_NAME,
+    "api_key": AZURE_OPENAI_API_KEY,
+    "api_version": AZURE_OPENAI_API_VERSION,
+    "peso": 1.0,
+    "prioridade": 0
+}
+
+if AZURE_OPENAI_BACKENDS:
+    configs_backends = carregar_configuracao(
+        AZURE_OPENAI_BACKENDS, {k: v for k, v in CONFIGURACAO_PADRAO.items() if k != "nome" and v}
+    )
+else:
+    configs_backends = [CONFIGURACAO_PADRAO]
+
+multiplos_backends = len(configs_backends) > 1
+
+# Identifica o modelo na chave do cache (os deployments de um roteamento servem o mesmo modelo)
+MODELO_CACHE = ",".join(sorted({config["deployment"] or "" for config in configs_backends}))
+
+# Clientes, pools e bancos de cada worker: criados no lifespan (depois do fork, um conjunto por
+# processo) e não na importação do módulo
+roteador_modelos: Optional[RoteadorModelos] = None
+executor_imagens: Optional[ThreadPoolExecutor] = None
+executor_ocr: Optional[ProcessPoolExecutor] = None
+cache_ocr: Optional[CacheExtracoes] = None
+cache_resultados: Optional[CacheResultados] = None
+indice_diagramas: Optional[IndiceDiagramas] = None
+repositorio_revisoes: Optional[RepositorioRevisoes] = None
+repositorio_ameacas: Optional[RepositorioAmeacas] = None
+fila_jobs = None
+gerenciador_jobs: Optional[GerenciadorJobs] = None
+controle_admissao: Optional[ControleAdmissao] = None
+chamadas_em_andamento: Optional[ChamadasEmAndamento] = None
+# Readiness: verdadeiro entre o fim do startup e o início do shutdown
+pronto = False
 
-logger.info(f"Cliente Azure OpenAI configurado - Endpoint: {AZURE_OPENAI_ENDPOINT}")
-logger.info(f"Deployment: {AZURE_OPENAI_DEPLOYMENT_NAME}")
+# Revisões do mesmo projeto são processadas uma de cada vez, sempre sobre a última salva.
+# projeto -> [trava, envios usando ou aguardando a trava]; a entrada sai quando o contador zera
+travas_projetos = {}
+
+def inicializar_recursos():
+    global roteador_modelos, executor_imagens, cache_resultados, indice_diagramas
+    global repositorio_revisoes, repositorio_ameacas, fila_jobs, gerenciador_jobs
+    global controle_admissao, chamadas_em_andamento, executor_ocr, cache_ocr
+
+    roteador_modelos = RoteadorModelos(
+        [criar_backend(config, multiplos_backends) for config in configs_backends],
+        estrategia=AZURE_OPENAI_ROTEAMENTO,
+        max_tentativas=AZURE_OPENAI_MAX_RETRIES if multiplos_backends else 0,
+        prazo=AZURE_OPENAI_DEADLINE
+    )
+    for config in configs_backends:
+        logger.info(f"Backend Azure OpenAI configurado - {config['nome']}: {config['endpoint']} ({config['deployment']})")
+    logger.info(f"Roteamento: {AZURE_OPENAI_ROTEAMENTO} - Conexões por backend: {AZURE_OPENAI_MAX_CONNECTIONS}")
+
+    executor_imagens = ThreadPoolExecutor(
+        max_workers=STRIDE_PREPROCESSAMENTO_WORKERS, thread_name_prefix="preprocessamento"
+    )
+
+    if STRIDE_OCR_BACKEND:
+        try:
+            verificar_backend(STRIDE_OCR_BACKEND)
+        except Exception as e:
+            logger.warning(f"OCR do diagrama desabilitado: {str(e)}")
+        else:
+            # OCR e detecção de setas são CPU puro: processos (spawn, sem herdar o event loop) em vez de threads
+            executor_ocr = ProcessPoolExecutor(
+                max_workers=STRIDE_OCR_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+            cache_ocr = CacheExtracoes(STRIDE_OCR_CACHE_ITENS)
+            logger.info(f"OCR do diagrama habilitado - Backend: {STRIDE_OCR_BACKEND}, processos: {STRIDE_OCR_WORKERS}, "
+                        f"detail com texto: {STRIDE_OCR_DETAIL}")
+
+    if STRIDE_CACHE_HABILITADO:
+        cache_resultados = CacheResultados(
+            max_itens=STRIDE_CACHE_MAX_ITENS,
+            max_bytes=STRIDE_CACHE_MAX_MB * 1024 * 1024,
+            ttl=STRIDE_CACHE_TTL,
+            caminho_sqlite=STRIDE_CACHE_SQLITE
+        )
+        logger.info(f"Cache de resultados habilitado - Itens: {STRIDE_CACHE_MAX_ITENS}, TTL: {STRIDE_CACHE_TTL}s")
+
+    if STRIDE_SIMILAR_HABILITADO:
+        indice_diagramas = IndiceDiagramas(STRIDE_SIMILAR_SQLITE)
+        logger.info(f"Índice de diagramas semelhantes habilitado - Reutilizar até {STRIDE_SIMILAR_REUTILIZAR_DISTANCIA} "
+                    f"bits, semente até {STRIDE_SIMILAR_SEMENTE_DISTANCIA} bits")
+
+    repositorio_revisoes = RepositorioRevisoes(STRIDE_REVISOES_SQLITE)
+    if STRIDE_REPOSITORIO_HABILITADO:
+        repositorio_ameacas = RepositorioAmeacas(STRIDE_REPOSITORIO_SQLITE)
+
+    if STRIDE_JOBS_BACKEND == "sqlite":
+        fila_jobs = FilaSQLite(STRIDE_JOBS_SQLITE, ttl=STRIDE_JOBS_TTL, lease=STRIDE_JOBS_LEASE)
+    else:
+        fila_jobs = FilaMemoria(ttl=STRIDE_JOBS_TTL)
+    gerenciador_jobs = GerenciadorJobs(fila_jobs, analisar_bytes, workers=STRIDE_JOBS_WORKERS,
+                                       hosts_webhook=STRIDE_WEBHOOK_HOSTS)
+
+    if STRIDE_ADMISSAO_MAX_ANDAMENTO > 0:
+        controle_admissao = ControleAdmissao(
+            max_em_andamento=STRIDE_ADMISSAO_MAX_ANDAMENTO,
+            max_fila=STRIDE_ADMISSAO_MAX_FILA,
+            max_fila_cliente=STRIDE_ADMISSAO_MAX_FILA_CLIENTE,
+            espera_maxima=STRIDE_ADMISSAO_ESPERA_MAXIMA
+        )
+        logger.info(f"Controle de admissão - Em andamento: {STRIDE_ADMISSAO_MAX_ANDAMENTO}, "
+                    f"fila: {STRIDE_ADMISSAO_MAX_FILA} ({STRIDE_ADMISSAO_MAX_FILA_CLIENTE} por cliente)")
+    if STRIDE_COALESCER_HABILITADO:
+        chamadas_em_andamento = ChamadasEmAndamento()
+
+async def encerrar_recursos():
+    await roteador_modelos.fechar()
+    executor_imagens.shutdown(wait=False)
+    if executor_ocr is not None:
+        executor_ocr.shutdown(wait=False, cancel_futures=True)
+    if cache_resultados is not None:
+        cache_resultados.fechar()
+    if indice_diagramas is not None:
+        indice_diagramas.fechar()
+    repositorio_revisoes.fechar()
+    if repositorio_ameacas is not None:
+        repositorio_ameacas.fechar()
 
 class HealthResponse(BaseModel):
     status: str
     message: str
 
-class ThreatAnalysisResponse(BaseModel):
-    threat_model: list
-    improvement_suggestions: list
-    summary: Optional[dict] = None
-
-def criar_prompt_modelo_ameacas(tipo_aplicacao, autenticacao, acesso_internet, dados_sensiveis, descricao_aplicacao):
-    prompt = f"""Aja como um especialista em cibersegurança com mais de 20 anos de experiência 
-    utilizando a metodologia de modelagem de ameaças STRIDE para produzir modelos de ameaças 
-    abrangentes para uma ampla gama de aplicações. Sua tarefa é analisar o resumo do código, 
-    o conteúdo do README e a descrição da aplicação fornecidos para produzir uma lista de 
-    ameaças específicas para essa aplicação.
-
-    Presta atenção na descrição da aplicação e nos detalhes técnicos fornecidos.
-
-    Para cada uma das categorias do STRIDE (Falsificação de Identidade - Spoofing, 
-    Violação de Integridade - Tampering, 
-    Repúdio - Repudiation, 
-    Divulgação de Informações - Information Disclosure, 
-    Negação de Serviço - Denial of Service, e 
-    Elevação de Privilégio - Elevation of Privilege), liste múltiplas (3 ou 4) ameaças reais, 
-    se aplicável. Cada cenário de ameaça deve apresentar uma situação plausível em que a ameaça 
-    poderia ocorrer no contexto da aplicação.
-
-    A lista de ameaças deve ser apresentada em formato de tabela, 
-    com as seguintes colunas:Ao fornecer o modelo de ameaças, utilize uma resposta formatada em JSON 
-    com as chaves "threat_model" e "improvement_suggestions". Em "threat_model", inclua um array de 
-    objetos com as chaves "Threat Type" (Tipo de Ameaça), "Scenario" (Cenário), e 
-    "Potential Impact" (Impacto Potencial).    
-
-    Ao fornecer o modelo de ameaças, utilize uma resposta formatada em JSON com as chaves 
-    "threat_model" e "improvement_suggestions". 
-    Em "threat_model", inclua um array de objetos com as chaves "Threat Type" (Tipo de Ameaça), 
-    "Scenario" (Cenário), e "Potential Impact" (Impacto Potencial).
-
-    Em "improvement_suggestions", inclua um array de strings que sugerem quais informações adicionais 
-    poderiam ser fornecidas para tornar o modelo de ameaças mais completo e preciso na próxima iteração. 
-    Foque em identificar lacunas na descrição da aplicação que, se preenchidas, permitiriam uma 
-    análise mais detalhada e precisa, como por exemplo:
-    - Detalhes arquiteturais ausentes que ajudariam a identificar ameaças mais específicas
-    - Fluxos de autenticação pouco claros que precisam de mais detalhes
-    - Descrição incompleta dos fluxos de dados
-    - Informações técnicas da stack não informadas
-    - Fronteiras ou zonas de confiança do sistema não especificadas
-    - Descrição incompleta do tratamento de dados sensíveis
-    - Detalhes sobre
-    Não forneça recomendações de segurança genéricas — foque apenas no que ajudaria a criar um
-    modelo de ameaças mais eficiente.
-
-    TIPO DE APLICAÇÃO: {tipo_aplicacao}
-    MÉTODOS DE AUTENTICAÇÃO: {autenticacao}
-    EXPOSTA NA INTERNET: {acesso_internet}
-    DADOS SENSÍVEIS: {dados_sensiveis}
-    RESUMO DE CÓDIGO, CONTEÚDO DO README E DESCRIÇÃO DA APLICAÇÃO: {descricao_aplicacao}
-
-    Exemplo de formato esperado em JSON:
-
-    {{
-      "threat_model": [
-        {{
-          "Threat Type": "Spoofing",
-          "Scenario": "Cenário de exemplo 1",
-          "Potential Impact": "Impacto potencial de exemplo 1"
-        }},
-        {{
-          "Threat Type": "Spoofing",
-          "Scenario": "Cenário de exemplo 2",
-          "Potential Impact": "Impacto potencial de exemplo 2"
-        }}
-        // ... mais ameaças
-      ],
-      "improvement_suggestions": [
-        "Por favor, forneça mais detalhes sobre o fluxo de autenticação entre os componentes para permitir uma análise melhor de possíveis falhas de autenticação.",
-        "Considere adicionar informações sobre como os dados sensíveis são armazenados e transmitidos para permitir uma análise mais precisa de exposição de dados.",
-        // ... mais sugestões para melhorar o modelo de ameaças
-      ]
-    }}"""
-
-    return prompt
+class HealthBackendsResponse(HealthResponse):
+    backends: list = []
+
+async def preparar_imagem(imagem: UploadFile, imagem_recebida, detail: str = STRIDE_IMAGEM_DETAIL):
+    """Reduz e recodifica a imagem no pool de threads; devolve a imagem codificada e as estatísticas"""
+    loop = asyncio.get_running_loop()
+    try:
+        processada = await loop.run_in_executor(
+            executor_imagens, preprocessar_imagem, imagem.file,
+            STRIDE_IMAGEM_LADO_MAXIMO, STRIDE_IMAGEM_FORMATO, STRIDE_IMAGEM_QUALIDADE, STRIDE_IMAGEM_CORES
+        )
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Não foi possível processar a imagem: {str(e)}")
+
+    if processada.bytes_economizados > 0:
+        codificada = codificar_imagem(processada.conteudo, processada.mime, imagem_recebida.sha256)
+    else:
+        # Recodificar não compensou: envia o arquivo original
+        imagem.file.seek(0)
+        codificada = codificar_imagem(imagem.file.read(), imagem_recebida.mime, imagem_recebida.sha256)
+
+    estatisticas = {
+        "original_bytes": imagem_recebida.tamanho,
+        "processed_bytes": codificada.tamanho,
+        "bytes_saved": imagem_recebida.tamanho - codificada.tamanho,
+        "format": codificada.mime,
+        "width": processada.largura,
+        "height": processada.altura,
+        "detail": escolher_detail(processada.largura, processada.altura, detail),
+        "edge_density": round(processada.densidade_bordas, 4)
+    }
+    return codificada, estatisticas
+
+def criar_prompt_parte(formulario, parte: str, analise_anterior=None, texto_diagrama=None) -> str:
+    """Prompt de uma chamada do fan-out: uma categoria STRIDE ou só as sugestões de melhoria"""
+    if parte == SUGESTOES:
+        return criar_prompt_modelo_ameacas(**formulario.model_dump(), categorias=[], texto_diagrama=texto_diagrama)
+    return criar_prompt_modelo_ameacas(
+        **formulario.model_dump(), categorias=[parte], incluir_sugestoes=False, analise_anterior=analise_anterior,
+        texto_diagrama=texto_diagrama
+    )
 
 @app.get("/", response_model=HealthResponse)
 async def root():
@@ -147,20 +490,37 @@ async def root():
         "message": "API de Análise de Ameaças STRIDE está funcionando! Visite /docs para ver a documentação completa."
     }
 
-@app.get("/health", response_model=HealthResponse)
+@app.get("/health", response_model=HealthBackendsResponse)
 async def health_check():
     logger.info("Health check solicitado")
     try:
-        if not all([AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_DEPLOYMENT_NAME]):
+        if not AZURE_OPENAI_CONFIGURADO:
             logger.warning("Health check falhou - Variáveis de ambiente não configuradas")
             return {
                 "status": "unhealthy",
                 "message": "Variáveis de ambiente não configuradas corretamente"
             }
+        backends = roteador_modelos.estado()
+        disponiveis = roteador_modelos.disponiveis()
+        if disponiveis == 0:
+            logger.warning("Health check falhou - Nenhum backend do Azure OpenAI disponível")
+            return {
+                "status": "unhealthy",
+                "message": "Nenhum deployment do Azure OpenAI disponível no momento",
+                "backends": backends
+            }
+        if disponiveis < len(backends):
+            logger.warning(f"Health check degradado - {disponiveis}/{len(backends)} backends disponíveis")
+            return {
+                "status": "degraded",
+                "message": f"{disponiveis} de {len(backends)} deployments disponíveis",
+                "backends": backends
+            }
         logger.info("Health check passou - API está saudável")
         return {
             "status": "healthy",
-            "message": "API configurada e pronta para uso"
+            "message": "API configurada e pronta para uso",
+            "backends": backends
         }
     except Exception as e:
         logger.error(f"Health check falhou com exceção: {str(e)}")
@@ -169,122 +529,1005 @@ async def health_check():
             "message": f"Erro: {str(e)}"
         }
 
-@app.post("/analisar_ameacas")
+@app.get("/health/live")
+async def liveness():
+    """Liveness: o processo e o event loop respondem (não consulta o Azure nem os bancos)"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness: recursos do worker inicializados e credenciais configuradas
+
+    Não depende do estado dos deployments: um circuit breaker aberto afeta todas as instâncias
+    igualmente, e tirá-las do balanceador só trocaria o 503 da análise por um 503 do front-end.
+    """
+    if not pronto:
+        return RespostaJSON({"status": "not_ready", "message": "Worker iniciando ou encerrando"}, status_code=503)
+    if not AZURE_OPENAI_CONFIGURADO:
+        return RespostaJSON(
+            {"status": "not_ready", "message": "Variáveis de ambiente não configuradas corretamente"}, status_code=503
+        )
+    return {"status": "ready", "worker": os.getpid(), "backends_disponiveis": roteador_modelos.disponiveis()}
+
+@app.get("/modelo/estatisticas")
+async def modelo_estatisticas():
+    """Estado de cada backend: circuit breaker, latência média, failovers e throttling"""
+    return {
+        "estrategia": roteador_modelos.estrategia,
+        "failovers": roteador_modelos.failovers,
+        "backends": roteador_modelos.estado()
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas no formato Prometheus"""
+    corpo, content_type = exportar()
+    return Response(content=corpo, media_type=content_type)
+
+@app.get("/cache/estatisticas")
+async def cache_estatisticas():
+    """Contadores de hit/miss do cache de resultados e do índice de diagramas semelhantes"""
+    if cache_resultados is None:
+        estatisticas = {"habilitado": False}
+    else:
+        estatisticas = {"habilitado": True, **cache_resultados.estatisticas()}
+    if indice_diagramas is not None:
+        estatisticas["indice_similaridade"] = indice_diagramas.estatisticas()
+    return estatisticas
+
+@app.get("/admissao/estatisticas")
+async def admissao_estatisticas():
+    """Vagas, fila e recusas do controle de admissão e análises coalescidas (por worker)"""
+    return {
+        "admissao": controle_admissao.estatisticas() if controle_admissao is not None else {"habilitado": False},
+        "coalescimento": chamadas_em_andamento.estatisticas() if chamadas_em_andamento is not None
+        else {"habilitado": False}
+    }
+
+class FormularioAnalise(BaseModel):
+    tipo_aplicacao: str
+    autenticacao: str
+    acesso_internet: str
+    dados_sensiveis: str
+    descricao_aplicacao: str
+
+@dataclass
+class AnalisePreparada:
+    formulario: FormularioAnalise
+    prompt: str
+    imagem_recebida: ImagemRecebida
+    fanout: bool = False
+    chave_cache: Optional[str] = None
+    resultado_cache: Optional[dict] = None
+    status_cache: str = "MISS"
+    hash_perceptual: Optional[int] = None
+    analise_anterior: Optional[list] = None
+    projeto: Optional[str] = None
+    extracao: Optional[ExtracaoDiagrama] = None
+
+    @property
+    def texto_diagrama(self) -> Optional[str]:
+        """Bloco do OCR para o prompt, só com componentes suficientes (é o que permite reduzir o detail)"""
+        if self.extracao is None or len(self.extracao.componentes) < STRIDE_OCR_MIN_COMPONENTES:
+            return None
+        return self.extracao.bloco_texto()
+
+def validar_tipo_imagem(imagem: UploadFile):
+    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp"]
+    if imagem.content_type not in allowed_types:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tipo de arquivo não suportado. Use: {', '.join(allowed_types)}"
+        )
+
+async def calcular_hash_imagem(imagem: UploadFile) -> Optional[int]:
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor_imagens, calcular_phash, imagem.file)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        # A imagem inválida é rejeitada adiante, no pré-processamento
+        logger.warning(f"Não foi possível calcular o hash perceptual: {str(e)}")
+        return None
+
+async def consultar_similar(preparada: AnalisePreparada, reutilizar_similar: bool):
+    """Procura um diagrama quase idêntico já analisado: devolve o resultado dele (distância até
+    STRIDE_SIMILAR_REUTILIZAR_DISTANCIA) ou usa as ameaças dele como semente do prompt"""
+    distancia_maxima = max(STRIDE_SIMILAR_REUTILIZAR_DISTANCIA if reutilizar_similar else -1,
+                           STRIDE_SIMILAR_SEMENTE_DISTANCIA)
+    if distancia_maxima < 0:
+        return
+    # Busca de Hamming, leituras do SQLite e difflib por candidato: fora do event loop
+    correspondencia = await asyncio.get_running_loop().run_in_executor(
+        executor_imagens, indice_diagramas.buscar,
+        preparada.hash_perceptual, preparada.formulario.model_dump(), distancia_maxima, STRIDE_SIMILAR_FORMULARIO_MIN
+    )
+    if correspondencia is None:
+        return
+
+    if reutilizar_similar and correspondencia.distancia <= STRIDE_SIMILAR_REUTILIZAR_DISTANCIA:
+        logger.info(f"Diagrama semelhante já analisado (distância {correspondencia.distancia}): resultado reutilizado")
+        CACHE.labels("similar").inc()
+        preparada.resultado_cache = {**correspondencia.resultado, "similar_match": correspondencia.resumo()}
+        preparada.status_cache = "SIMILAR"
+        if preparada.chave_cache is not None:
+            await asyncio.to_thread(cache_resultados.armazenar, preparada.chave_cache, preparada.resultado_cache)
+        return
+
+    logger.info(f"Diagrama semelhante já analisado (distância {correspondencia.distancia}): usado como semente do prompt")
+    CACHE.labels("semente").inc()
+    preparada.analise_anterior = correspondencia.resultado.get("threat_model") or None
+    preparada.prompt = criar_prompt_modelo_ameacas(
+        **preparada.formulario.model_dump(), analise_anterior=preparada.analise_anterior,
+        texto_diagrama=preparada.texto_diagrama
+    )
+
+def chave_analise(hash_imagem: str, prompt: str, fanout: bool) -> str:
+    """Chave do cache exato e do single-flight: imagem, prompt e tudo o que muda a resposta do modelo"""
+    return calcular_chave(
+        hash_imagem, prompt, {
+            **PARAMETROS_MODELO,
+            "model": MODELO_CACHE,
+            "prefixo": VERSAO_PREFIXO,
+            "preprocessamento": [
+                STRIDE_PREPROCESSAMENTO_HABILITADO, STRIDE_IMAGEM_LADO_MAXIMO,
+                STRIDE_IMAGEM_FORMATO, STRIDE_IMAGEM_QUALIDADE, STRIDE_IMAGEM_CORES, STRIDE_IMAGEM_DETAIL
+            ],
+            "fanout": STRIDE_FANOUT_MAX_TOKENS if fanout else None,
+            # O texto do OCR já está no prompt; o detail usado com ele muda a resposta
+            **({"ocr": STRIDE_OCR_DETAIL} if executor_ocr is not None else {})
+        }
+    )
+
+async def extrair_texto_diagrama(imagem: UploadFile, imagem_recebida: ImagemRecebida) -> Optional[ExtracaoDiagrama]:
+    """OCR do diagrama no pool de processos, com cache pelo hash da imagem; falhas não interrompem a análise"""
+    extracao = cache_ocr.obter(imagem_recebida.sha256)
+    if extracao is not None:
+        OCR.labels("cache").inc()
+        return extracao
+
+    imagem.file.seek(0)
+    conteudo = imagem.file.read()
+    imagem.file.seek(0)
+    loop = asyncio.get_running_loop()
+    # O prazo vai junto para o processo: cancelar o future não interrompe o OCR já em andamento,
+    # e o processo precisa ficar livre para o próximo diagrama
+    prazo = time.time() + STRIDE_OCR_TIMEOUT
+    try:
+        with medir("ocr"):
+            extracao = await asyncio.wait_for(
+                loop.run_in_executor(
+                    executor_ocr, extrair_diagrama, conteudo, STRIDE_OCR_BACKEND, STRIDE_OCR_IDIOMA, prazo
+                ),
+                STRIDE_OCR_TIMEOUT + MARGEM_OCR
+            )
+    except asyncio.TimeoutError:
+        OCR.labels("falha").inc()
+        logger.warning(f"OCR do diagrama excedeu {STRIDE_OCR_TIMEOUT}s: imagem enviada sem o texto extraído")
+        return None
+    except Exception as e:
+        OCR.labels("falha").inc()
+        logger.warning(f"Não foi possível extrair o texto do diagrama: {str(e)}")
+        return None
+
+    cache_ocr.armazenar(imagem_recebida.sha256, extracao)
+    util = len(extracao.componentes) >= STRIDE_OCR_MIN_COMPONENTES
+    OCR.labels("extraida" if util else "vazia").inc()
+    logger.info(f"OCR do diagrama: {len(extracao.componentes)} componentes, {len(extracao.fluxos)} fluxos")
+    return extracao
+
+async def preparar_analise(imagem: UploadFile, formulario: FormularioAnalise, fanout: bool = False,
+                           reutilizar_similar: bool = True, consultar_cache: bool = True,
+                           projeto: Optional[str] = None) -> AnalisePreparada:
+    """Valida o upload, monta o prompt e consulta o cache (exato e, se habilitado, por diagramas semelhantes)
+
+    Com `consultar_cache=False` (revisões incrementais) nenhum dos caches é consultado ou alimentado.
+    """
+    validar_tipo_imagem(imagem)
+
+    logger.info(f"Analisando imagem: {imagem.filename}")
+    logger.info(f"Tipo de aplicação: {formulario.tipo_aplicacao}")
+
+    with medir("upload"):
+        imagem_recebida = await ler_imagem(
+            imagem, STRIDE_MAX_UPLOAD_MB * 1024 * 1024, codificar=not STRIDE_PREPROCESSAMENTO_HABILITADO
+        )
+    IMAGEM_BYTES.labels("recebida").observe(imagem_recebida.tamanho)
+    logger.info(f"Imagem recebida: {imagem_recebida.tamanho} bytes ({imagem_recebida.mime})")
+
+    preparada = AnalisePreparada(
+        formulario=formulario, prompt="", imagem_recebida=imagem_recebida, fanout=fanout, projeto=projeto
+    )
+    # Revisões incrementais usam o prompt de delta, que não leva o texto do diagrama
+    if executor_ocr is not None and consultar_cache:
+        preparada.extracao = await extrair_texto_diagrama(imagem, imagem_recebida)
+    prompt = preparada.prompt = criar_prompt_modelo_ameacas(
+        **formulario.model_dump(), texto_diagrama=preparada.texto_diagrama
+    )
+    if not consultar_cache:
+        return preparada
+    if cache_resultados is not None:
+        preparada.chave_cache = chave_analise(imagem_recebida.sha256, prompt, fanout)
+        preparada.resultado_cache = cache_resultados.obter(preparada.chave_cache)
+        CACHE.labels("hit" if preparada.resultado_cache is not None else "miss").inc()
+        if preparada.resultado_cache is not None:
+            logger.info("Resultado encontrado no cache")
+            preparada.status_cache = "HIT"
+
+    if indice_diagramas is not None and preparada.resultado_cache is None:
+        preparada.hash_perceptual = await calcular_hash_imagem(imagem)
+        if preparada.hash_perceptual is not None:
+            await consultar_similar(preparada, reutilizar_similar)
+    return preparada
+
+async def preparar_envio_imagem(imagem: UploadFile, preparada: AnalisePreparada):
+    """Pré-processa e codifica a imagem uma única vez; devolve o image_url e as estatísticas da imagem"""
+    imagem_recebida = preparada.imagem_recebida
+    estatisticas_imagem = None
+    image_url = {}
+    # Com o texto do diagrama no prompt, a imagem só precisa dar o contexto visual
+    detail = STRIDE_OCR_DETAIL if preparada.texto_diagrama else STRIDE_IMAGEM_DETAIL
+    with medir("codificacao"):
+        if STRIDE_PREPROCESSAMENTO_HABILITADO:
+            imagem_recebida, estatisticas_imagem = await preparar_imagem(imagem, imagem_recebida, detail)
+            image_url["detail"] = estatisticas_imagem["detail"]
+            logger.info(f"Imagem pré-processada: {estatisticas_imagem['bytes_saved']} bytes economizados")
+        elif detail in ("low", "high", "auto"):
+            image_url["detail"] = detail
+        image_url["url"] = imagem_recebida.data_url()
+    if preparada.extracao is not None and estatisticas_imagem is not None:
+        estatisticas_imagem["diagram_text"] = preparada.extracao.resumo()
+    IMAGEM_BYTES.labels("enviada").observe(imagem_recebida.tamanho)
+    return image_url, estatisticas_imagem
+
+async def montar_mensagens(imagem: UploadFile, preparada: AnalisePreparada):
+    """Pré-processa a imagem e monta as mensagens do chat; devolve também as estatísticas da imagem"""
+    image_url, estatisticas_imagem = await preparar_envio_imagem(imagem, preparada)
+    return montar_mensagens_chat(preparada.prompt, image_url), estatisticas_imagem
+
+def estimar_tokens(chat_prompt, estatisticas_imagem) -> int:
+    """Tokens de prompt estimados (texto + imagem) para o limitador de TPM"""
+    largura = estatisticas_imagem["width"] if estatisticas_imagem else None
+    altura = estatisticas_imagem["height"] if estatisticas_imagem else None
+    return estimar_tokens_mensagens(chat_prompt, largura, altura)
+
+def orcamento_analise(preparada: AnalisePreparada, estatisticas_imagem) -> int:
+    """max_tokens da chamada única: estimado pela densidade de bordas do diagrama e pelos tokens
+    da descrição (STRIDE_ORCAMENTO_ADAPTATIVO) ou o valor fixo de PARAMETROS_MODELO"""
+    if not STRIDE_ORCAMENTO_ADAPTATIVO:
+        return PARAMETROS_MODELO["max_tokens"]
+    densidade = estatisticas_imagem["edge_density"] if estatisticas_imagem else None
+    max_tokens = orcamento_saida.estimar(densidade, contar_tokens(preparada.formulario.descricao_aplicacao))
+    ORCAMENTO_SAIDA.observe(max_tokens)
+    logger.info(f"Orçamento de saída: max_tokens={max_tokens}")
+    return max_tokens
+
+def chamada_modelo(estatisticas_imagem, parametros: dict):
+    """Função `chamar(mensagens)` usada na chamada principal e nas continuações"""
+    async def chamar(mensagens):
+        return await roteador_modelos.criar(
+            mensagens,
+            tokens_estimados=estimar_tokens(mensagens, estatisticas_imagem),
+            **parametros,
+            stop=None
+        )
+    return chamar
+
+def erro_http_modelo(falha: FalhaModelo) -> HTTPException:
+    headers = {"Retry-After": str(falha.retry_after)} if falha.retry_after else None
+    return HTTPException(status_code=falha.status_code, detail=str(falha), headers=headers)
+
+async def registrar_no_repositorio(formulario: FormularioAnalise, threat_data: dict, projeto: Optional[str] = None):
+    if repositorio_ameacas is not None:
+        # Inserts, índice FTS5 e rollups diários/mensais: fora do event loop
+        await asyncio.to_thread(repositorio_ameacas.registrar, formulario.model_dump(), threat_data, projeto)
+
+def anexar_grafo(threat_data: dict, formulario: FormularioAnalise):
+    """Campo graph: componentes, fluxos e ameaças já posicionados (vai para o cache junto com o resultado)"""
+    if STRIDE_GRAFO_HABILITADO:
+        threat_data["graph"] = construir_grafo(threat_data["threat_model"], formulario.acesso_internet).chunk()
+
+async def armazenar_resultado(preparada: AnalisePreparada, threat_data: dict):
+    """Guarda a análise completa no cache exato, no índice de diagramas semelhantes e no repositório de ameaças
+
+    As gravações (SQLite do cache, do índice e do repositório) rodam em uma thread; a resposta só
+    sai depois delas, então o próximo envio já encontra o resultado.
+    """
+    def gravar_caches():
+        if preparada.chave_cache is not None:
+            cache_resultados.armazenar(preparada.chave_cache, threat_data)
+        if preparada.hash_perceptual is not None:
+            indice_diagramas.adicionar(preparada.hash_perceptual, preparada.formulario.model_dump(), threat_data)
+
+    await asyncio.to_thread(gravar_caches)
+    await registrar_no_repositorio(preparada.formulario, threat_data, preparada.projeto)
+
+async def finalizar_resultado(response_content: str, preparada: AnalisePreparada, estatisticas_imagem,
+                        continuacao: Optional[RespostaContinuada] = None, max_tokens: Optional[int] = None) -> dict:
+    """Converte a resposta do modelo no corpo final (com summary) e guarda no cache
+
+    Resultados que continuaram incompletos depois das continuações não vão para o cache.
+    """
+    with medir("parse"):
+        try:
+            resposta, reparada = analisar_resposta(response_content)
+        except ValueError as ve:
+            PARSE.labels("falha").inc()
+            logger.warning(f"Erro ao fazer parse do JSON da resposta: {str(ve)}")
+            return {
+                "raw_response": response_content,
+                "warning": "Não foi possível fazer parse automático do JSON. Resposta bruta incluída."
+            }
+        PARSE.labels("reparado" if reparada else "ok").inc()
+        if reparada:
+            logger.warning("JSON da resposta reparado (cercas, vírgulas sobrando ou resposta cortada)")
+        threat_data = resposta.para_dict()
+        threat_data["summary"] = resposta.resumo(preparada.formulario)
+    anexar_grafo(threat_data, preparada.formulario)
+    if estatisticas_imagem is not None:
+        threat_data["image_processing"] = estatisticas_imagem
+    relatorio = continuacao.relatorio() if continuacao is not None else None
+    if relatorio is not None:
+        threat_data["continuation"] = {**relatorio, "max_tokens": max_tokens}
+
+    logger.info(f"Análise concluída com sucesso. Total de ameaças identificadas: {threat_data['summary']['total_threats']}")
+    if continuacao is None or continuacao.completa:
+        await armazenar_resultado(preparada, threat_data)
+    return threat_data
+
+async def executar_fanout(imagem: UploadFile, preparada: AnalisePreparada):
+    """Dispara as chamadas do fan-out reaproveitando a mesma imagem codificada
+
+    Devolve o MesclagemFanout (a ser alimentado com os ResultadoParte), as estatísticas da
+    imagem e o gerador que entrega cada parte assim que a chamada dela termina.
+    """
+    image_url, estatisticas_imagem = await preparar_envio_imagem(imagem, preparada)
+
+    async def chamar(parte):
+        mensagens = montar_mensagens_chat(
+            criar_prompt_parte(preparada.formulario, parte, preparada.analise_anterior, preparada.texto_diagrama), image_url
+        )
+        chamar_parte = chamada_modelo(estatisticas_imagem, PARAMETROS_FANOUT[parte])
+        response = await chamar_parte(mensagens)
+        escolha = response.choices[0]
+        continuada = await continuar_resposta(
+            chamar_parte, mensagens, escolha.message.content, escolha.finish_reason, response.usage,
+            STRIDE_CONTINUACOES_MAX
+        )
+        return continuada.texto
+
+    logger.info(f"Enviando {len(PARTES)} requisições em paralelo (fan-out) para Azure OpenAI...")
+    return MesclagemFanout(), estatisticas_imagem, executar_partes(chamar)
+
+async def finalizar_fanout(mesclagem: MesclagemFanout, preparada: AnalisePreparada, estatisticas_imagem) -> dict:
+    """Resposta no mesmo formato da chamada única, com a latência e o status de cada parte em fan_out"""
+    if mesclagem.bem_sucedidas() == 0:
+        falha = mesclagem.primeira_falha()
+        if falha is not None:
+            raise erro_http_modelo(falha)
+        raise HTTPException(status_code=502, detail="Nenhuma chamada do fan-out devolveu um resultado aproveitável")
+
+    threat_data = mesclagem.para_dict(preparada.formulario)
+    anexar_grafo(threat_data, preparada.formulario)
+    if estatisticas_imagem is not None:
+        threat_data["image_processing"] = estatisticas_imagem
+
+    relatorio = threat_data["fan_out"]
+    logger.info(f"Fan-out concluído em {relatorio['wall_clock_s']}s. "
+                f"Total de ameaças identificadas: {threat_data['summary']['total_threats']}")
+    # Resultado parcial não vai para o cache: o próximo envio tenta as categorias que falharam
+    if mesclagem.parcial:
+        falhas = [parte for parte, r in relatorio["requests"].items() if r["status"] != "ok"]
+        logger.warning(f"Fan-out parcial - partes com falha: {', '.join(falhas)}")
+    else:
+        await armazenar_resultado(preparada, threat_data)
+    return threat_data
+
+async def executar_analise(imagem: UploadFile, formulario: FormularioAnalise, fanout: Optional[bool] = None,
+                           reutilizar_similar: bool = True, projeto: Optional[str] = None):
+    """Pipeline completo de análise; devolve o resultado e o status do cache (HIT/SIMILAR/MISS)"""
+    preparada = await preparar_analise(
+        imagem, formulario, STRIDE_FANOUT_HABILITADO if fanout is None else fanout, reutilizar_similar,
+        projeto=projeto
+    )
+    return await analisar_preparada(imagem, preparada)
+
+async def analisar_preparada(imagem: UploadFile, preparada: AnalisePreparada):
+    """Chama o modelo (ou devolve o resultado do cache) para uma análise já preparada
+
+    Com o single-flight habilitado, análises idênticas (mesma imagem, prompt e parâmetros) que
+    chegam enquanto outra está em andamento recebem o resultado dela (X-Cache: COALESCED).
+    Revisões de projeto não são coalescidas: cada uma é registrada no próprio projeto.
+    """
+    if preparada.resultado_cache is not None:
+        return preparada.resultado_cache, preparada.status_cache
+
+    if chamadas_em_andamento is None or preparada.projeto is not None:
+        return await consultar_modelo(imagem, preparada), "MISS"
+
+    chave = chave_analise(preparada.imagem_recebida.sha256, preparada.prompt, preparada.fanout)
+    threat_data, coalescida = await chamadas_em_andamento.executar(chave, lambda: consultar_modelo(imagem, preparada))
+    if coalescida:
+        logger.info("Análise idêntica em andamento: resultado compartilhado")
+        CACHE.labels("coalescida").inc()
+        return threat_data, "COALESCED"
+    return threat_data, "MISS"
+
+async def consultar_modelo(imagem: UploadFile, preparada: AnalisePreparada) -> dict:
+    """Chamada ao modelo (única ou fan-out), com continuação das respostas cortadas"""
+    if preparada.fanout:
+        mesclagem, estatisticas_imagem, partes = await executar_fanout(imagem, preparada)
+        async for resultado in partes:
+            mesclagem.adicionar(resultado)
+        return await finalizar_fanout(mesclagem, preparada, estatisticas_imagem)
+
+    chat_prompt, estatisticas_imagem = await montar_mensagens(imagem, preparada)
+    max_tokens = orcamento_analise(preparada, estatisticas_imagem)
+    chamar = chamada_modelo(estatisticas_imagem, {**PARAMETROS_MODELO, "max_tokens": max_tokens})
+
+    # Chamar o modelo OpenAI
+    logger.info("Enviando requisição para Azure OpenAI...")
+    try:
+        response = await chamar(chat_prompt)
+    except FalhaModelo as fm:
+        raise erro_http_modelo(fm)
+
+    logger.info("Resposta recebida do Azure OpenAI")
+
+    escolha = response.choices[0]
+    continuada = await continuar_resposta(
+        chamar, chat_prompt, escolha.message.content, escolha.finish_reason, response.usage, STRIDE_CONTINUACOES_MAX
+    )
+    threat_data = await finalizar_resultado(continuada.texto, preparada, estatisticas_imagem, continuada, max_tokens)
+    if escolha.finish_reason == "stop" and response.usage is not None:
+        orcamento_saida.observar(response.usage.completion_tokens, len(threat_data.get("threat_model", [])))
+    return threat_data
+
+async def calcular_miniatura_imagem(imagem: UploadFile) -> Optional[bytes]:
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor_imagens, calcular_miniatura, imagem.file)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        logger.warning(f"Não foi possível calcular a miniatura do diagrama: {str(e)}")
+        return None
+
+async def analisar_delta(imagem: UploadFile, preparada: AnalisePreparada, anterior: Revisao, delta):
+    """Pede ao modelo só o delta em relação à revisão anterior e devolve o resultado mesclado
+
+    A imagem só é enviada quando alguma região do diagrama mudou. Devolve (resultado, contagens)
+    ou (None, None) se a resposta não puder ser aproveitada.
+    """
+    image_url, estatisticas_imagem = None, None
+    if delta.regioes:
+        image_url, estatisticas_imagem = await preparar_envio_imagem(imagem, preparada)
+    mensagens = montar_mensagens_chat(
+        criar_prompt_delta(preparada.formulario.model_dump(), delta, anterior.resultado.get("threat_model") or []),
+        image_url, INSTRUCAO_DELTA
+    )
+
+    logger.info(f"Enviando revisão incremental para Azure OpenAI (campos: {list(delta.campos)}, "
+                f"regiões: {delta.regioes})...")
+    try:
+        response = await roteador_modelos.criar(
+            mensagens,
+            tokens_estimados=estimar_tokens(mensagens, estatisticas_imagem),
+            **PARAMETROS_DELTA,
+            stop=None
+        )
+    except FalhaModelo as fm:
+        raise erro_http_modelo(fm)
+
+    with medir("parse"):
+        try:
+            resposta, reparada = analisar_resposta_delta(response.choices[0].message.content)
+        except ValueError as ve:
+            PARSE.labels("falha").inc()
+            logger.warning(f"Resposta da revisão incremental sem JSON aproveitável: {str(ve)}")
+            return None, None
+        PARSE.labels("reparado" if reparada else "ok").inc()
+        modelo, contagens = aplicar_delta(anterior.resultado, resposta)
+        threat_data = modelo.para_dict()
+        threat_data["summary"] = modelo.resumo(preparada.formulario)
+    anexar_grafo(threat_data, preparada.formulario)
+    if estatisticas_imagem is not None:
+        threat_data["image_processing"] = estatisticas_imagem
+    logger.info(f"Revisão incremental concluída: {contagens['added']} incluídas, {contagens['updated']} "
+                f"atualizadas, {contagens['retired']} retiradas")
+    return threat_data, contagens
+
+@asynccontextmanager
+async def trava_projeto(projeto: str):
+    entrada = travas_projetos.setdefault(projeto, [asyncio.Lock(), 0])
+    entrada[1] += 1
+    try:
+        async with entrada[0]:
+            yield
+    finally:
+        entrada[1] -= 1
+        if entrada[1] == 0:
+            del travas_projetos[projeto]
+
+async def executar_revisao(imagem: UploadFile, formulario: FormularioAnalise, projeto: str,
+                           fanout: Optional[bool] = None, reutilizar_similar: bool = True):
+    """Análise com histórico por projeto; devolve o resultado (com `revision`) e o status do cache
+
+    A primeira revisão é uma análise completa. Nas seguintes, campos do formulário e regiões do
+    diagrama são comparados com a última revisão: sem alterações, a revisão salva é devolvida;
+    com poucas regiões alteradas, o modelo recebe só o delta; acima de STRIDE_REVISOES_MAX_REGIOES
+    (ou se o delta não puder ser aproveitado) a análise volta a ser completa.
+    """
+    async with trava_projeto(projeto):
+        anterior = repositorio_revisoes.ultima(projeto)
+        if anterior is None:
+            resultado, status_cache = await executar_analise(imagem, formulario, fanout, reutilizar_similar, projeto)
+            miniatura = await calcular_miniatura_imagem(imagem)
+            modo, alteracoes = "completa", {}
+        else:
+            preparada = await preparar_analise(
+                imagem, formulario, STRIDE_FANOUT_HABILITADO if fanout is None else fanout, consultar_cache=False,
+                projeto=projeto
+            )
+            miniatura = await calcular_miniatura_imagem(imagem)
+            delta = calcular_delta(anterior, formulario.model_dump(), miniatura)
+            if delta.vazio:
+                logger.info(f"Projeto {projeto}: nada mudou desde a revisão {anterior.numero}")
+                return {**anterior.resultado, "revision": {**anterior.resumo(), "unchanged": True}}, "HIT"
+
+            resultado = None
+            alteracoes = {**delta.resumo(), "base_revision": anterior.numero}
+            if delta.fracao_regioes <= STRIDE_REVISOES_MAX_REGIOES:
+                resultado, contagens = await analisar_delta(imagem, preparada, anterior, delta)
+                modo, status_cache = "delta", "MISS"
+            if resultado is None:
+                logger.info(f"Projeto {projeto}: análise completa ({len(delta.regioes or [])} regiões alteradas)")
+                resultado, status_cache = await analisar_preparada(imagem, preparada)
+                modo = "completa"
+            else:
+                alteracoes.update(contagens)
+                await registrar_no_repositorio(formulario, resultado, projeto)
+
+        # Resultados incompletos não viram revisão: a próxima compara com a última revisão válida
+        if "raw_response" in resultado or (resultado.get("fan_out") or {}).get("partial"):
+            return resultado, status_cache
+        resultado = {chave: valor for chave, valor in resultado.items() if chave not in ("similar_match", "revision")}
+        revisao = await asyncio.to_thread(
+            repositorio_revisoes.salvar, projeto, formulario.model_dump(), miniatura, resultado, modo, alteracoes
+        )
+        return {**resultado, "revision": revisao.resumo()}, status_cache
+
+async def analisar_bytes(conteudo: bytes, nome_arquivo: str, formulario: dict):
+    """Executa o mesmo pipeline do endpoint a partir de bytes já em memória (lotes e jobs)"""
+    mime = mimetypes.guess_type(nome_arquivo)[0] or "application/octet-stream"
+    upload = UploadFile(
+        file=io.BytesIO(conteudo), size=len(conteudo), filename=nome_arquivo,
+        headers=Headers({"content-type": mime})
+    )
+    with EM_ANDAMENTO.labels("lotes_jobs").track_inprogress(), ANALISE_SEGUNDOS.labels("lotes_jobs").time():
+        return await executar_analise(upload, FormularioAnalise(**formulario))
+
+@app.post("/analisar_ameacas", responses={200: {"model": ThreatAnalysisResponse}})
 async def analisar_ameacas(
     imagem: UploadFile = File(..., description="Imagem do diagrama de arquitetura"),
     tipo_aplicacao: str = Form(..., description="Tipo da aplicação (ex: Web App, API, Mobile)"),
     autenticacao: str = Form(..., description="Métodos de autenticação utilizados"),
     acesso_internet: str = Form(..., description="Se a aplicação está exposta na internet (Sim/Não)"),
     dados_sensiveis: str = Form(..., description="Tipos de dados sensíveis manipulados"),
-    descricao_aplicacao: str = Form(..., description="Descrição detalhada da aplicação")
+    descricao_aplicacao: str = Form(..., description="Descrição detalhada da aplicação"),
+    fanout: Optional[bool] = Form(None, description="Uma chamada por categoria STRIDE em paralelo (padrão: STRIDE_FANOUT_HABILITADO)"),
+    reutilizar_similar: bool = Form(True, description="Reaproveitar a análise de um diagrama quase idêntico (false força uma nova análise)"),
+    projeto: Optional[str] = Form(None, description="Identificador do projeto: salva a revisão e, nas seguintes, analisa só o que mudou")
 ):
     """Análise de ameaças STRIDE em diagramas de arquitetura"""
     try:
-        allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp"]
-        if imagem.content_type not in allowed_types:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Tipo de arquivo não suportado. Use: {', '.join(allowed_types)}"
-            )
-        
-        logger.info(f"Analisando imagem: {imagem.filename}")
-        logger.info(f"Tipo de aplicação: {tipo_aplicacao}")
-        
-        prompt = criar_prompt_modelo_ameacas(
-            tipo_aplicacao, autenticacao, acesso_internet, dados_sensiveis, descricao_aplicacao
-        )
-        
-        content = await imagem.read()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(imagem.filename).suffix) as temp_file:
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-
-        with open(temp_file_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('ascii')
-
-        # Adicionar a imagem codificada ao prompt
-        chat_prompt = [
-            {
-                "role": "system", 
-                "content": "Você é uma IA especialista em cibersegurança, que analisa desenhos de arquitetura e aplica a metodologia STRIDE para identificar ameaças."
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/png;base64,{encoded_string}"}
-                    },
-                    {
-                        "type": "text", 
-                        "text": "Por favor, analise a imagem do diagrama de arquitetura e o texto acima e forneça um modelo de ameaças detalhado em formato JSON conforme especificado."
-                    }
-                ]
-            }
-        ]
-        
-        # Chamar o modelo OpenAI
-        logger.info("Enviando requisição para Azure OpenAI...")
-        response = client.chat.completions.create(
-            messages=chat_prompt,
-            temperature=0.7,
-            max_tokens=2000,
-            top_p=0.95,
-            frequency_penalty=0,
-            presence_penalty=0,
-            stop=None,
-            stream=False,
-            model=AZURE_OPENAI_DEPLOYMENT_NAME
+        formulario = FormularioAnalise(
+            tipo_aplicacao=tipo_aplicacao, autenticacao=autenticacao, acesso_internet=acesso_internet,
+            dados_sensiveis=dados_sensiveis, descricao_aplicacao=descricao_aplicacao
         )
-        
-        logger.info("Resposta recebida do Azure OpenAI")
-        
-        os.remove(temp_file_path)
-        logger.debug(f"Arquivo temporário removido: {temp_file_path}")
-        
-        response_content = response.choices[0].message.content
-        
-        try:
-            if "```json" in response_content:
-                response_content = response_content.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_content:
-                response_content = response_content.split("```")[1].split("```")[0].strip()
-            
-            threat_data = json.loads(response_content)
-            
-            threat_count = len(threat_data.get("threat_model", []))
-            threat_types = {}
-            for threat in threat_data.get("threat_model", []):
-                threat_type = threat.get("Threat Type", "Unknown")
-                threat_types[threat_type] = threat_types.get(threat_type, 0) + 1
-            
-            threat_data["summary"] = {
-                "total_threats": threat_count,
-                "threats_by_type": threat_types,
-                "application_type": tipo_aplicacao,
-                "has_internet_access": acesso_internet,
-                "authentication_method": autenticacao
-            }
-            
-            logger.info(f"Análise concluída com sucesso. Total de ameaças identificadas: {threat_count}")
-            return JSONResponse(content=threat_data, status_code=200)
-            
-        except json.JSONDecodeError as je:
-            logger.warning(f"Erro ao fazer parse do JSON da resposta: {str(je)}")
-            return JSONResponse(
-                content={
-                    "raw_response": response_content,
-                    "warning": "Não foi possível fazer parse automático do JSON. Resposta bruta incluída."
-                },
-                status_code=200
-            )
+        with EM_ANDAMENTO.labels("analisar_ameacas").track_inprogress(), \
+                ANALISE_SEGUNDOS.labels("analisar_ameacas").time():
+            if projeto:
+                resultado, status_cache = await executar_revisao(imagem, formulario, projeto, fanout, reutilizar_similar)
+            else:
+                resultado, status_cache = await executar_analise(imagem, formulario, fanout, reutilizar_similar)
+        return RespostaJSON(content=resultado, status_code=200, headers={"X-Cache": status_cache})
 
     except HTTPException as he:
         raise he
     except Exception as e:
         logger.error(f"Erro durante análise: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Erro ao processar análise: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Erro ao processar análise: {str(e)}")
+
+def evento_ndjson(evento: str, data=None) -> bytes:
+    return orjson.dumps({"event": evento, "data": data}) + b"\n"
+
+@app.post("/analisar_ameacas/stream")
+async def analisar_ameacas_stream(
+    imagem: UploadFile = File(..., description="Imagem do diagrama de arquitetura"),
+    tipo_aplicacao: str = Form(..., description="Tipo da aplicação (ex: Web App, API, Mobile)"),
+    autenticacao: str = Form(..., description="Métodos de autenticação utilizados"),
+    acesso_internet: str = Form(..., description="Se a aplicação está exposta na internet (Sim/Não)"),
+    dados_sensiveis: str = Form(..., description="Tipos de dados sensíveis manipulados"),
+    descricao_aplicacao: str = Form(..., description="Descrição detalhada da aplicação"),
+    fanout: Optional[bool] = Form(None, description="Uma chamada por categoria STRIDE em paralelo (padrão: STRIDE_FANOUT_HABILITADO)"),
+    reutilizar_similar: bool = Form(True, description="Reaproveitar a análise de um diagrama quase idêntico (false força uma nova análise)")
+):
+    """Análise STRIDE em streaming (NDJSON): emite cada ameaça e sugestão assim que fica completa
+
+    Eventos: threat, suggestion, graph, summary, warning, error e done (um objeto JSON por linha).
+    O graph (mesmo formato do campo graph da resposta) chega depois da última ameaça.
+    Com fan-out, as ameaças chegam por categoria e cada chamada concluída emite um evento
+    fan_out com status e latência; o summary inclui o relatório completo em fan_out.
+    """
+    inicio = time.perf_counter()
+    EM_ANDAMENTO.labels("stream").inc()
+    try:
+        formulario = FormularioAnalise(
+            tipo_aplicacao=tipo_aplicacao, autenticacao=autenticacao, acesso_internet=acesso_internet,
+            dados_sensiveis=dados_sensiveis, descricao_aplicacao=descricao_aplicacao
+        )
+        preparada = await preparar_analise(
+            imagem, formulario, STRIDE_FANOUT_HABILITADO if fanout is None else fanout, reutilizar_similar
+        )
+        if preparada.resultado_cache is None and preparada.fanout:
+            mesclagem, estatisticas_imagem, partes = await executar_fanout(imagem, preparada)
+        elif preparada.resultado_cache is None:
+            chat_prompt, estatisticas_imagem = await montar_mensagens(imagem, preparada)
+    except HTTPException as he:
+        EM_ANDAMENTO.labels("stream").dec()
+        raise he
+    except Exception as e:
+        EM_ANDAMENTO.labels("stream").dec()
+        logger.error(f"Erro durante análise: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Erro ao processar análise: {str(e)}")
+
+    async def gerar_eventos():
+        try:
+            async for evento in eventos_analise():
+                yield evento
+        finally:
+            EM_ANDAMENTO.labels("stream").dec()
+            ANALISE_SEGUNDOS.labels("stream").observe(time.perf_counter() - inicio)
+
+    async def eventos_analise():
+        if preparada.resultado_cache is not None:
+            resultado = preparada.resultado_cache
+            for threat in resultado.get("threat_model", []):
+                yield evento_ndjson("threat", threat)
+            for sugestao in resultado.get("improvement_suggestions", []):
+                yield evento_ndjson("suggestion", sugestao)
+            if "graph" in resultado:
+                yield evento_ndjson("graph", resultado["graph"])
+            yield evento_ndjson("summary", resultado.get("summary"))
+            yield evento_ndjson("done")
+            return
+
+        if preparada.fanout:
+            async for evento in eventos_fanout():
+                yield evento
+            return
+
+        parser = ParserIncremental()
+        try:
+            max_tokens = orcamento_analise(preparada, estatisticas_imagem)
+            parametros = {**PARAMETROS_MODELO, "max_tokens": max_tokens}
+            logger.info("Enviando requisição em streaming para Azure OpenAI...")
+            stream = roteador_modelos.criar_stream(
+                chat_prompt,
+                tokens_estimados=estimar_tokens(chat_prompt, estatisticas_imagem),
+                **parametros,
+                stop=None
+            )
+            motivo = uso = None
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    uso = chunk.usage
+                # O Azure envia um primeiro chunk sem choices (resultado do filtro de conteúdo)
+                if not chunk.choices:
+                    continue
+                motivo = chunk.choices[0].finish_reason or motivo
+                if not chunk.choices[0].delta.content:
+                    continue
+                for evento, data in parser.alimentar(chunk.choices[0].delta.content):
+                    yield evento_ndjson(evento, data)
+
+            # Continuação sem streaming: os itens novos são emitidos quando ela termina
+            continuada = await continuar_resposta(
+                chamada_modelo(estatisticas_imagem, parametros), chat_prompt, parser.texto, motivo, uso,
+                STRIDE_CONTINUACOES_MAX
+            )
+            resultado = await finalizar_resultado(continuada.texto, preparada, estatisticas_imagem, continuada, max_tokens)
+            if continuada.resultado is not None and "raw_response" not in resultado:
+                for threat in resultado["threat_model"][continuada.ameacas_iniciais:]:
+                    yield evento_ndjson("threat", threat)
+                for sugestao in resultado["improvement_suggestions"][continuada.sugestoes_iniciais:]:
+                    yield evento_ndjson("suggestion", sugestao)
+            elif motivo == "stop" and uso is not None and "raw_response" not in resultado:
+                orcamento_saida.observar(uso.completion_tokens, len(resultado["threat_model"]))
+            if "raw_response" in resultado:
+                yield evento_ndjson("warning", resultado)
+            else:
+                if "graph" in resultado:
+                    yield evento_ndjson("graph", resultado["graph"])
+                resumo = resultado["summary"]
+                if "continuation" in resultado:
+                    resumo = {**resumo, "continuation": resultado["continuation"]}
+                yield evento_ndjson("summary", resumo)
+            yield evento_ndjson("done")
+        except Exception as e:
+            logger.error(f"Erro durante análise em streaming: {str(e)}", exc_info=True)
+            yield evento_ndjson("error", f"Erro ao processar análise: {str(e)}")
+
+    async def eventos_fanout():
+        try:
+            async for resultado in partes:
+                novas_ameacas, novas_sugestoes = mesclagem.adicionar(resultado)
+                for ameaca in novas_ameacas:
+                    yield evento_ndjson("threat", ameaca.model_dump(by_alias=True))
+                for sugestao in novas_sugestoes:
+                    yield evento_ndjson("suggestion", sugestao)
+                yield evento_ndjson("fan_out", {"request": resultado.parte, **resultado.resumo()})
+
+            resultado = await finalizar_fanout(mesclagem, preparada, estatisticas_imagem)
+            if "graph" in resultado:
+                yield evento_ndjson("graph", resultado["graph"])
+            yield evento_ndjson("summary", {**resultado["summary"], "fan_out": resultado["fan_out"]})
+            yield evento_ndjson("done")
+        except HTTPException as he:
+            yield evento_ndjson("error", he.detail)
+        except Exception as e:
+            logger.error(f"Erro durante análise em streaming: {str(e)}", exc_info=True)
+            yield evento_ndjson("error", f"Erro ao processar análise: {str(e)}")
+        finally:
+            await partes.aclose()
+
+    return StreamingResponse(
+        gerar_eventos(),
+        media_type="application/x-ndjson",
+        headers={"X-Cache": preparada.status_cache}
+    )
+
+@app.post("/lotes")
+async def analisar_lote(
+    manifesto: UploadFile = File(..., description="Manifesto JSON ou CSV com os itens do lote"),
+    diagramas: UploadFile = File(..., description="Arquivo zip com as imagens referenciadas no manifesto"),
+    lote_id: Optional[str] = Form(None, description="Identificador do lote; reenviar o mesmo id retoma o lote"),
+    concorrencia: int = Form(4, ge=1, le=64, description="Análises simultâneas"),
+    limite_por_tenant: Optional[float] = Form(None, gt=0, description="Análises por minuto por tenant")
+):
+    """Análise em lote: responde em JSONL, uma linha por item concluído e um relatório ao final"""
+    try:
+        itens = carregar_manifesto(await manifesto.read(), manifesto.filename or "")
+        fonte = FonteDiagramas(diagramas.file)
+    except (ValueError, json.JSONDecodeError, zipfile.BadZipFile) as e:
+        raise HTTPException(status_code=400, detail=f"Lote inválido: {str(e)}")
+
+    caminho_saida = None
+    if lote_id:
+        if not lote_id.replace("-", "").replace("_", "").isalnum():
+            raise HTTPException(status_code=400, detail="lote_id deve conter apenas letras, números, - e _")
+        STRIDE_LOTES_DIR.mkdir(parents=True, exist_ok=True)
+        caminho_saida = STRIDE_LOTES_DIR / f"{lote_id}.jsonl"
+
+    logger.info(f"Lote recebido: {len(itens)} itens (lote_id={lote_id})")
+    execucao = ExecucaoLote(
+        itens=itens, fonte=fonte, analisar=analisar_bytes, caminho_saida=caminho_saida,
+        concorrencia=concorrencia, limite_por_tenant=limite_por_tenant
+    )
+
+    async def gerar_linhas():
+        try:
+            async for registro in execucao.executar():
+                yield orjson.dumps(registro) + b"\n"
+            relatorio = execucao.relatorio()
+            logger.info(f"Lote concluído: {relatorio}")
+            yield orjson.dumps({"relatorio": relatorio}) + b"\n"
+        finally:
+            fonte.fechar()
+
+    return StreamingResponse(gerar_linhas(), media_type="application/x-ndjson")
+
+@app.post("/jobs", status_code=202)
+async def criar_job(
+    imagem: UploadFile = File(..., description="Imagem do diagrama de arquitetura"),
+    tipo_aplicacao: str = Form(..., description="Tipo da aplicação (ex: Web App, API, Mobile)"),
+    autenticacao: str = Form(..., description="Métodos de autenticação utilizados"),
+    acesso_internet: str = Form(..., description="Se a aplicação está exposta na internet (Sim/Não)"),
+    dados_sensiveis: str = Form(..., description="Tipos de dados sensíveis manipulados"),
+    descricao_aplicacao: str = Form(..., description="Descrição detalhada da aplicação"),
+    webhook_url: Optional[str] = Form(None, description="URL que recebe um POST com o resultado ao final")
+):
+    """Enfileira a análise e responde imediatamente com o id do job"""
+    validar_tipo_imagem(imagem)
+    if webhook_url:
+        try:
+            await validar_webhook(webhook_url, STRIDE_WEBHOOK_HOSTS)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+
+    await ler_imagem(imagem, STRIDE_MAX_UPLOAD_MB * 1024 * 1024, codificar=False)
+    imagem.file.seek(0)
+    formulario = FormularioAnalise(
+        tipo_aplicacao=tipo_aplicacao, autenticacao=autenticacao, acesso_internet=acesso_internet,
+        dados_sensiveis=dados_sensiveis, descricao_aplicacao=descricao_aplicacao
+    )
+    job = await gerenciador_jobs.submeter(
+        imagem.file.read(), imagem.filename or "diagrama", formulario.model_dump(), webhook_url
+    )
+    return {"job_id": job.id, "status": job.status, "url": f"/jobs/{job.id}"}
+
+@app.get("/projetos/{projeto}/revisoes")
+async def listar_revisoes(projeto: str):
+    """Histórico de revisões do projeto: modo (completa ou delta) e o que mudou em cada uma"""
+    revisoes = repositorio_revisoes.listar(projeto)
+    if not revisoes:
+        raise HTTPException(status_code=404, detail="Projeto não encontrado")
+    return {"project": projeto, "revisions": revisoes}
+
+@app.get("/projetos/{projeto}/revisoes/{numero}")
+async def consultar_revisao(projeto: str, numero: int):
+    revisao = repositorio_revisoes.obter(projeto, numero)
+    if revisao is None:
+        raise HTTPException(status_code=404, detail="Revisão não encontrada")
+    return {**revisao.resultado, "revision": revisao.resumo()}
+
+def obter_repositorio() -> RepositorioAmeacas:
+    if repositorio_ameacas is None:
+        raise HTTPException(status_code=404, detail="Repositório de ameaças desabilitado (STRIDE_REPOSITORIO_HABILITADO)")
+    return repositorio_ameacas
+
+@app.get("/ameacas")
+def buscar_ameacas(
+    texto: Optional[str] = Query(None, description="Palavras que devem aparecer no cenário ou no impacto"),
+    tipo: Optional[str] = Query(None, description="Categoria STRIDE (ex: Spoofing, Repúdio)"),
+    tipo_aplicacao: Optional[str] = Query(None, description="Tipo da aplicação informado na análise"),
+    acesso_internet: Optional[str] = Query(None, description="Exposição na internet (Sim/Não)"),
+    projeto: Optional[str] = Query(None, description="Somente análises deste projeto"),
+    desde: Optional[date] = Query(None, description="Data inicial (AAAA-MM-DD, UTC)"),
+    ate: Optional[date] = Query(None, description="Data final (AAAA-MM-DD, UTC)"),
+    cursor: Optional[int] = Query(None, description="next_cursor da página anterior"),
+    limite: int = Query(50, ge=1, le=500, description="Ameaças por página")
+):
+    """Busca no histórico de ameaças, das mais recentes para as mais antigas, com paginação por cursor"""
+    return obter_repositorio().buscar(
+        texto, tipo, tipo_aplicacao, acesso_internet, projeto,
+        desde and desde.isoformat(), ate and ate.isoformat(), cursor, limite
+    )
+
+@lru_cache(maxsize=8)
+def grafo_portfolio(tipo_aplicacao, acesso_internet, projeto, desde, ate, versao: int, limite: int) -> Grafo:
+    """Grafo do portfólio com layout; a versão fixa o conjunto de análises, então o cache nunca fica velho"""
+    analises = obter_repositorio().listar_analises(tipo_aplicacao, acesso_internet, projeto, desde, ate, versao, limite)
+    inicio = time.perf_counter()
+    grafo = montar_portfolio(analises)
+    logger.info(f"Grafo do portfólio: {len(analises)} análises, {len(grafo.nos)} nós, {len(grafo.arestas)} arestas "
+                f"em {time.perf_counter() - inicio:.2f}s")
+    return grafo
+
+@app.get("/ameacas/grafo")
+def grafo_ameacas(
+    tipo_aplicacao: Optional[str] = Query(None, description="Tipo da aplicação informado na análise"),
+    acesso_internet: Optional[str] = Query(None, description="Exposição na internet (Sim/Não)"),
+    projeto: Optional[str] = Query(None, description="Somente análises deste projeto"),
+    desde: Optional[date] = Query(None, description="Data inicial (AAAA-MM-DD, UTC)"),
+    ate: Optional[date] = Query(None, description="Data final (AAAA-MM-DD, UTC)"),
+    versao: Optional[int] = Query(None, description="version do primeiro chunk (mantém o mesmo grafo entre os chunks)"),
+    chunk: int = Query(0, ge=0, description="Índice do chunk"),
+    tamanho_chunk: int = Query(STRIDE_GRAFO_TAMANHO_CHUNK, ge=100, le=50000, description="Nós por chunk"),
+    limite_analises: int = Query(500, ge=1, le=5000, description="Análises mais recentes incluídas")
+):
+    """Grafo de componentes e ameaças do portfólio, com layout pronto, em chunks para carga incremental"""
+    repositorio = obter_repositorio()
+    versao = repositorio.versao() if versao is None else versao
+    grafo = grafo_portfolio(
+        tipo_aplicacao, acesso_internet, projeto, desde and desde.isoformat(), ate and ate.isoformat(), versao,
+        limite_analises
+    )
+    try:
+        # RespostaJSON direto: sem a conversão do FastAPI, que percorreria cada nó do chunk
+        return RespostaJSON(content={**grafo.chunk(chunk, tamanho_chunk), "version": versao})
+    except ValueError as ve:
+        raise HTTPException(status_code=404, detail=str(ve))
+
+@app.get("/ameacas/agregados")
+def agregar_ameacas(
+    agrupar: str = Query("tipo", description=f"Dimensões separadas por vírgula: {', '.join(DIMENSOES)}"),
+    tipo: Optional[str] = Query(None, description="Categoria STRIDE"),
+    tipo_aplicacao: Optional[str] = Query(None, description="Tipo da aplicação informado na análise"),
+    acesso_internet: Optional[str] = Query(None, description="Exposição na internet (Sim/Não)"),
+    desde: Optional[date] = Query(None, description="Data inicial (AAAA-MM-DD, UTC)"),
+    ate: Optional[date] = Query(None, description="Data final (AAAA-MM-DD, UTC)")
+):
+    """Contagem de ameaças do portfólio (ex.: agrupar=mes,tipo para a tendência mensal por categoria)"""
+    try:
+        return obter_repositorio().agregar(
+            [dimensao.strip() for dimensao in agrupar.split(",") if dimensao.strip()], tipo, tipo_aplicacao,
+            acesso_internet, desde and desde.isoformat(), ate and ate.isoformat()
+        )
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+def resposta_exportacao(blocos, media_type: str, nome_arquivo: str, versao: Optional[int] = None) -> StreamingResponse:
+    headers = {"Content-Disposition": f'attachment; filename="{nome_arquivo}"'}
+    if versao is not None:
+        headers["X-Export-Version"] = str(versao)
+    # Gerador síncrono: o Starlette o consome em threads, fora do event loop (as leituras do SQLite bloqueiam)
+    return StreamingResponse(blocos, media_type=media_type, headers=headers)
+
+def analises_exportacao(tipo, tipo_aplicacao, acesso_internet, projeto, desde, ate, versao) -> tuple:
+    repositorio = obter_repositorio()
+    versao = repositorio.versao() if versao is None else versao
+    analises = repositorio.iterar_analises(
+        tipo, tipo_aplicacao, acesso_internet, projeto, desde and desde.isoformat(), ate and ate.isoformat(),
+        versao, STRIDE_EXPORTACAO_LOTE
+    )
+    return analises, versao
+
+@app.get("/ameacas/exportar")
+def exportar_ameacas(
+    formato: str = Query("csv", description=f"Formato do arquivo: {', '.join(FORMATOS)}"),
+    tipo: Optional[str] = Query(None, description="Somente ameaças desta categoria STRIDE"),
+    tipo_aplicacao: Optional[str] = Query(None, description="Tipo da aplicação informado na análise"),
+    acesso_internet: Optional[str] = Query(None, description="Exposição na internet (Sim/Não)"),
+    projeto: Optional[str] = Query(None, description="Somente análises deste projeto"),
+    desde: Optional[date] = Query(None, description="Data inicial (AAAA-MM-DD, UTC)"),
+    ate: Optional[date] = Query(None, description="Data final (AAAA-MM-DD, UTC)"),
+    versao: Optional[int] = Query(None, description="Somente análises até este id (X-Export-Version de uma exportação anterior)")
+):
+    """Exporta as análises do repositório (ameaças, sugestões e summary) em um único arquivo, em streaming"""
+    try:
+        validar_formatos([formato])
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    analises, versao = analises_exportacao(tipo, tipo_aplicacao, acesso_internet, projeto, desde, ate, versao)
+    return resposta_exportacao(
+        exportar_analises(formato, analises), FORMATOS[formato].media_type,
+        f"ameacas-{versao}.{FORMATOS[formato].extensao}", versao
+    )
+
+@app.get("/ameacas/exportar/arquivo")
+def exportar_arquivo_ameacas(
+    formatos: str = Query("csv,sarif,md", description=f"Formatos de cada análise, separados por vírgula: {', '.join(FORMATOS)}"),
+    tipo: Optional[str] = Query(None, description="Somente ameaças desta categoria STRIDE"),
+    tipo_aplicacao: Optional[str] = Query(None, description="Tipo da aplicação informado na análise"),
+    acesso_internet: Optional[str] = Query(None, description="Exposição na internet (Sim/Não)"),
+    projeto: Optional[str] = Query(None, description="Somente análises deste projeto"),
+    desde: Optional[date] = Query(None, description="Data inicial (AAAA-MM-DD, UTC)"),
+    ate: Optional[date] = Query(None, description="Data final (AAAA-MM-DD, UTC)"),
+    versao: Optional[int] = Query(None, description="Somente análises até este id (X-Export-Version de uma exportação anterior)")
+):
+    """Zip com um arquivo por análise em cada formato pedido, em streaming"""
+    lista_formatos = [formato.strip() for formato in formatos.split(",") if formato.strip()]
+    try:
+        validar_formatos(lista_formatos)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    analises, versao = analises_exportacao(tipo, tipo_aplicacao, acesso_internet, projeto, desde, ate, versao)
+    return resposta_exportacao(
+        exportar_arquivo(lista_formatos, analises), "application/zip", f"ameacas-{versao}.zip", versao
+    )
+
+@app.post("/exportar")
+def exportar_resultado(
+    resultado: ThreatAnalysisResponse,
+    formato: str = Query("csv", description=f"Formato do arquivo: {', '.join(FORMATOS)}")
+):
+    """Converte um resultado de /analisar_ameacas (corpo JSON) para o formato pedido, sem usar o repositório"""
+    try:
+        validar_formatos([formato])
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    analise = analise_de_resultado(resultado.model_dump(by_alias=True))
+    return resposta_exportacao(
+        exportar_analises(formato, [analise]), FORMATOS[formato].media_type, f"ameacas.{FORMATOS[formato].extensao}"
+    )
+
+@app.get("/jobs/metricas")
+async def metricas_jobs():
+    """Profundidade da fila, tempos de espera e de execução dos jobs"""
+    return await gerenciador_jobs.estatisticas()
+
+@app.get("/jobs/{job_id}")
+async def consultar_job(job_id: str):
+    job = await fila_jobs.obter(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job.para_resposta()
@@ -0,0 +1,174 @@
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+logger = logging.getLogger(__name__)
+
+# Etapas do pipeline de análise: upload, ocr (texto do diagrama, opcional), codificacao
+# (pré-processamento + base64), fila (semáforo e limitador de cota), modelo (chamada ao Azure OpenAI) e parse
+ETAPAS = ("upload", "ocr", "codificacao", "fila", "modelo", "parse")
+
+ETAPA_SEGUNDOS = Histogram(
+    "stride_etapa_segundos", "Duração de cada etapa da análise", ["etapa"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+ANALISE_SEGUNDOS = Histogram(
+    "stride_analise_segundos", "Duração total da análise por endpoint", ["endpoint"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+)
+EM_ANDAMENTO = Gauge("stride_requisicoes_em_andamento", "Análises em andamento", ["endpoint"],
+                     multiprocess_mode="livesum")
+TOKENS = Counter(
+    "stride_tokens_total", "Tokens informados em response.usage: prompt, prompt_cache (parte do prompt "
+    "servida pelo cache de prefixo do Azure) e completion", ["tipo"]
+)
+IMAGEM_BYTES = Histogram(
+    "stride_imagem_bytes", "Tamanho da imagem recebida e da enviada ao modelo", ["fase"],
+    buckets=(16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6)
+)
+PARSE = Counter(
+    "stride_parse_total", "Respostas do modelo convertidas em JSON: ok, reparado (JSON quase válido) ou falha",
+    ["resultado"]
+)
+CACHE = Counter(
+    "stride_cache_total",
+    "Consultas ao cache de resultados: hit, miss, similar (diagrama semelhante reaproveitado), semente ou "
+    "coalescida (mesma análise já em andamento, resultado compartilhado)", ["resultado"]
+)
+ADMISSAO = Counter(
+    "stride_admissao_total",
+    "Controle de admissão das análises: admitida (vaga livre), enfileirada (admitida depois de esperar), "
+    "recusada (fila cheia, 503) ou expirada (espera máxima esgotada, 503)", ["resultado"]
+)
+FILA_ADMISSAO = Gauge("stride_admissao_fila", "Requisições aguardando vaga no controle de admissão",
+                      multiprocess_mode="livesum")
+ESPERA_ADMISSAO = Histogram(
+    "stride_admissao_espera_segundos", "Tempo na fila do controle de admissão até receber a vaga",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+)
+CONTINUACOES = Counter(
+    "stride_continuacoes_total",
+    "Respostas cortadas por max_tokens (finish_reason=length) e o desfecho das continuações: completa, "
+    "cortada (ainda incompleta após o máximo de continuações) ou falha (chamada de continuação falhou)",
+    ["resultado"]
+)
+TOKENS_CONTINUACAO = Counter(
+    "stride_continuacao_tokens_total",
+    "Tokens das continuações: gastos (prompt fora do cache + completion das chamadas de continuação) e "
+    "economizados (estimativa do que uma nova análise completa custaria a mais)", ["tipo"]
+)
+ORCAMENTO_SAIDA = Histogram(
+    "stride_orcamento_saida_tokens", "max_tokens estimado para cada análise",
+    buckets=(500, 750, 1000, 1500, 2000, 2500, 3000, 4000, 6000, 8000, 16000)
+)
+EXPORTACOES = Counter(
+    "stride_exportacoes_total",
+    "Exportações por formato (csv, sarif, xlsx, md ou zip) e desfecho: concluida, interrompida (cliente "
+    "desconectou no meio do download) ou falha", ["formato", "resultado"]
+)
+OCR = Counter(
+    "stride_ocr_total",
+    "Extrações de texto do diagrama: extraida (componentes suficientes para enviar a imagem em detail "
+    "reduzido), vazia (poucos componentes lidos), cache (mesma imagem já extraída) ou falha", ["resultado"]
+)
+# A profundidade vem de fila.tamanho(): na fila SQLite todos os processos leem o mesmo total, por
+# isso o máximo (e não a soma) entre os workers vivos
+JOBS_FILA = Gauge("stride_jobs_fila", "Jobs pendentes na fila do modo job", multiprocess_mode="livemax")
+JOBS_EM_EXECUCAO = Gauge("stride_jobs_em_execucao", "Jobs sendo executados pelos workers da fila",
+                         multiprocess_mode="livesum")
+JOBS_ESPERA = Histogram(
+    "stride_jobs_espera_segundos", "Tempo do job na fila até um worker começar a executá-lo",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+JOBS_EXECUCAO = Histogram(
+    "stride_jobs_execucao_segundos", "Tempo de execução de cada job, por status final (concluido ou erro)",
+    ["status"], buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+)
+EXPORTACAO_BYTES = Counter("stride_exportacao_bytes_total", "Bytes enviados pelas exportações", ["formato"])
+
+# Séries com valor zero desde o início, para as razões (falhas/total, hits/total) não ficarem vazias
+for _rotulo in ("ok", "reparado", "falha"):
+    PARSE.labels(_rotulo)
+for _rotulo in ("hit", "miss", "similar", "semente", "coalescida"):
+    CACHE.labels(_rotulo)
+for _rotulo in ("admitida", "enfileirada", "recusada", "expirada"):
+    ADMISSAO.labels(_rotulo)
+for _rotulo in ("prompt", "prompt_cache", "completion"):
+    TOKENS.labels(_rotulo)
+for _rotulo in ("completa", "cortada", "falha"):
+    CONTINUACOES.labels(_rotulo)
+for _rotulo in ("extraida", "vazia", "cache", "falha"):
+    OCR.labels(_rotulo)
+for _rotulo in ("concluido", "erro"):
+    JOBS_EXECUCAO.labels(_rotulo)
+for _rotulo in ("gastos", "economizados"):
+    TOKENS_CONTINUACAO.labels(_rotulo)
+
+try:
+    from opentelemetry import trace
+    _tracer = trace.get_tracer("stride")
+except ImportError:
+    _tracer = None
+
+
+def configurar_tracing(endpoint: str, servico="stride-threat-modeling"):
+    """Exporta os spans via OTLP/HTTP (requer opentelemetry-sdk e opentelemetry-exporter-otlp)"""
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("OpenTelemetry não instalado: pip install opentelemetry-sdk opentelemetry-exporter-otlp")
+        return
+    provedor = TracerProvider(resource=Resource.create({"service.name": servico}))
+    provedor.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    trace.set_tracer_provider(provedor)
+    logger.info(f"Tracing OpenTelemetry exportando para {endpoint}")
+
+
+@contextmanager
+def medir(etapa: str):
+    """Observa a duração da etapa no histograma e abre um span OpenTelemetry com o mesmo nome"""
+    inicio = time.perf_counter()
+    with _tracer.start_as_current_span(f"stride.{etapa}") if _tracer is not None else nullcontext():
+        try:
+            yield
+        finally:
+            ETAPA_SEGUNDOS.labels(etapa).observe(time.perf_counter() - inicio)
+
+
+def observar_etapa(etapa: str, segundos: float):
+    ETAPA_SEGUNDOS.labels(etapa).observe(segundos)
+
+
+def tokens_em_cache(usage) -> int:
+    """usage.prompt_tokens_details.cached_tokens (ausente em versões antigas da API)"""
+    detalhes = getattr(usage, "prompt_tokens_details", None)
+    return getattr(detalhes, "cached_tokens", None) or 0
+
+
+def registrar_uso(usage):
+    """Soma os tokens de prompt, em cache e de completion de um response.usage (ou chunk final do stream)"""
+    if usage is None:
+        return
+    em_cache = tokens_em_cache(usage)
+    TOKENS.labels("prompt").inc(usage.prompt_tokens or 0)
+    TOKENS.labels("prompt_cache").inc(em_cache)
+    TOKENS.labels("completion").inc(usage.completion_tokens or 0)
+    logger.info(f"Tokens - prompt: {usage.prompt_tokens} ({em_cache} em cache), completion: {usage.completion_tokens}")
+
+
+def exportar() -> tuple:
+    """Corpo e content-type do /metrics; agrega os workers quando PROMETHEUS_MULTIPROC_DIR está definido"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+        return generate_latest(registro), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,311 @@
+"""
+Extração local do texto do diagrama (OCR) antes da chamada ao modelo
+
+Os rótulos dos componentes e as setas entre eles viram um bloco de texto estruturado que entra
+no prompt; com o texto já lido, a imagem pode ir ao modelo em detail "low" (85 tokens) em vez
+de "high" (85 + 170 por bloco de 512 px). O OCR é plugável:
+
+- tesseract: Tesseract local via pytesseract (requer o binário tesseract-ocr instalado)
+- teste: lê os rótulos gravados no chunk de texto "stride-ocr" do PNG; usado nos benchmarks
+  e em ambientes sem Tesseract
+
+As setas são detectadas na própria imagem, independentemente do backend: uma linha de tinta
+ligando as bordas de duas caixas com rótulo, na horizontal ou na vertical, com o sentido dado
+pela ponta mais larga. Roda de forma síncrona; a API chama `extrair_diagrama` em um pool de
+processos, com um prazo que o próprio processo respeita (cancelar o future não para o OCR).
+"""
+
+import io
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from PIL import Image, ImageFilter, ImageOps, ImageStat
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+logger = logging.getLogger(__name__)
+
+# O OCR roda no maior lado até este tamanho; diagramas maiores são reduzidos antes
+LADO_MAXIMO = 2048
+# Pixel com valor abaixo do limiar (em tons de cinza, fundo claro) é tinta
+LIMIAR_TINTA = 160
+CONFIANCA_MINIMA = 60
+# Até onde procurar a borda da caixa de um rótulo, em fração do lado da imagem
+ALCANCE_BORDA = 0.4
+# Meia altura da faixa em que a largura da linha é medida perto de cada ponta
+FAIXA_PONTA = 12
+COMPRIMENTO_PONTA = 10
+MAX_ITENS = 200
+
+CHAVE_METADADOS = "stride-ocr"
+
+
+@dataclass
+class Rotulo:
+    texto: str
+    caixa: tuple  # (x0, y0, x1, y1) em pixels da imagem analisada
+
+
+@dataclass
+class ExtracaoDiagrama:
+    backend: str
+    componentes: list = field(default_factory=list)
+    fluxos: list = field(default_factory=list)  # (origem, destino, direcionado)
+    textos_soltos: list = field(default_factory=list)
+
+    def bloco_texto(self) -> str:
+        """Componentes, fluxos e demais textos do diagrama, um por linha, para o prompt"""
+        linhas = ["COMPONENTES:"] + [f"- {nome}" for nome in self.componentes]
+        if self.fluxos:
+            linhas.append("FLUXOS:")
+            linhas += [f"- {origem} -> {destino}" if direcionado else f"- {origem} -- {destino} (sentido não identificado)"
+                       for origem, destino, direcionado in self.fluxos]
+        if self.textos_soltos:
+            linhas.append(f"OUTROS TEXTOS: {'; '.join(self.textos_soltos)}")
+        return "\n".join(linhas)
+
+    def resumo(self) -> dict:
+        return {"backend": self.backend, "components": len(self.componentes), "flows": len(self.fluxos)}
+
+
+def _verificar_prazo(prazo: Optional[float]):
+    """Interrompe a extração quando o prazo (time.time(), válido entre processos) já passou"""
+    if prazo is not None and time.time() > prazo:
+        raise TimeoutError("Prazo do OCR esgotado")
+
+
+def ler_tesseract(img: Image.Image, idioma: str, prazo: Optional[float] = None) -> list:
+    """Linhas de texto reconhecidas pelo Tesseract (modo de texto esparso, adequado a diagramas)"""
+    if pytesseract is None:
+        raise RuntimeError("Backend de OCR tesseract requer o pacote pytesseract (pip install pytesseract)")
+    _verificar_prazo(prazo)
+    # O pytesseract encerra o processo do tesseract ao fim do timeout (0 = sem limite)
+    restante = max(prazo - time.time(), 0.1) if prazo is not None else 0
+    try:
+        dados = pytesseract.image_to_data(img, lang=idioma, config="--psm 11", timeout=restante,
+                                          output_type=pytesseract.Output.DICT)
+    except RuntimeError as e:
+        if "timeout" in str(e).lower():
+            raise TimeoutError("Prazo do OCR esgotado no Tesseract") from e
+        raise
+    linhas = {}
+    for i, palavra in enumerate(dados["text"]):
+        palavra = palavra.strip()
+        if not palavra or float(dados["conf"][i]) < CONFIANCA_MINIMA or not any(c.isalnum() for c in palavra):
+            continue
+        x, y, largura, altura = dados["left"][i], dados["top"][i], dados["width"][i], dados["height"][i]
+        chave = (dados["block_num"][i], dados["par_num"][i], dados["line_num"][i])
+        if chave in linhas:
+            texto, (x0, y0, x1, y1) = linhas[chave]
+            linhas[chave] = (f"{texto} {palavra}", (min(x0, x), min(y0, y), max(x1, x + largura), max(y1, y + altura)))
+        else:
+            linhas[chave] = (palavra, (x, y, x + largura, y + altura))
+    return [Rotulo(texto, caixa) for texto, caixa in linhas.values()]
+
+
+def ler_metadados(img: Image.Image, idioma: str, prazo: Optional[float] = None) -> list:
+    """Rótulos gravados no PNG como {"largura": <largura original>, "rotulos": [[texto, x0, y0, x1, y1], ...]}"""
+    bruto = img.info.get(CHAVE_METADADOS)
+    if not bruto:
+        return []
+    dados = json.loads(bruto)
+    escala = img.width / dados.get("largura", img.width)
+    return [Rotulo(texto, tuple(round(v * escala) for v in caixa)) for texto, *caixa in dados["rotulos"]]
+
+
+BACKENDS = {
+    "tesseract": ler_tesseract,
+    "teste": ler_metadados,
+}
+
+
+def verificar_backend(nome: str):
+    """Falha cedo (na inicialização do worker) se o backend não existe ou não pode rodar aqui"""
+    if nome not in BACKENDS:
+        raise ValueError(f"Backend de OCR desconhecido: {nome}. Use: {', '.join(BACKENDS)}")
+    if nome == "tesseract":
+        if pytesseract is None:
+            raise RuntimeError("Backend de OCR tesseract requer o pacote pytesseract (pip install pytesseract)")
+        pytesseract.get_tesseract_version()
+
+
+def _carregar(conteudo: bytes) -> Image.Image:
+    """Imagem em tons de cinza com fundo claro, reduzida a LADO_MAXIMO; preserva img.info"""
+    with Image.open(io.BytesIO(conteudo)) as original:
+        original.seek(0)
+        info = dict(original.info)
+        img = ImageOps.exif_transpose(original)
+        if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+            # Transparência vira fundo branco, como o diagrama aparece na tela
+            fundo = Image.new("RGBA", img.size, "white")
+            img = Image.alpha_composite(fundo, img.convert("RGBA"))
+        cinza = img.convert("L")
+    if ImageStat.Stat(cinza).mean[0] < 128:
+        cinza = ImageOps.invert(cinza)
+    cinza.thumbnail((LADO_MAXIMO, LADO_MAXIMO), Image.LANCZOS)
+    cinza.info = {**info, **cinza.info}
+    return cinza
+
+
+def _mascara_tinta(cinza: Image.Image, rotulos: list) -> Image.Image:
+    """Tinta em 255 e fundo em 0, com o texto dos rótulos apagado (não conta como borda ou linha)"""
+    tinta = cinza.point(lambda v: 255 if v < LIMIAR_TINTA else 0)
+    for rotulo in rotulos:
+        tinta.paste(0, rotulo.caixa)
+    return tinta
+
+
+def _raio(pixels, x, y, dx, dy, limite_x, limite_y, alcance) -> Optional[int]:
+    """Primeira coordenada com tinta andando a partir de (x, y) na direção (dx, dy)"""
+    for _ in range(alcance):
+        x, y = x + dx, y + dy
+        if not (0 <= x < limite_x and 0 <= y < limite_y):
+            return None
+        if pixels[x, y]:
+            return x if dx else y
+    return None
+
+
+def _caixa_componente(pixels, tamanho, rotulo: Rotulo) -> Optional[tuple]:
+    """Borda da caixa que envolve o rótulo, procurada nas quatro direções a partir dele"""
+    largura, altura = tamanho
+    x0, y0, x1, y1 = rotulo.caixa
+    cx, cy = (x0 + x1) // 2, (y0 + y1) // 2
+    alcance_x, alcance_y = int(largura * ALCANCE_BORDA), int(altura * ALCANCE_BORDA)
+    esquerda = _raio(pixels, x0, cy, -1, 0, largura, altura, alcance_x)
+    direita = _raio(pixels, x1 - 1, cy, 1, 0, largura, altura, alcance_x)
+    topo = _raio(pixels, cx, y0, 0, -1, largura, altura, alcance_y)
+    base = _raio(pixels, cx, y1 - 1, 0, 1, largura, altura, alcance_y)
+    if None in (esquerda, direita, topo, base):
+        return None
+    return esquerda, topo, direita, base
+
+
+def _agrupar_componentes(rotulos: list, tinta: Image.Image, prazo: Optional[float] = None):
+    """Junta os rótulos de uma mesma caixa (ex: "Backend" e "API" em duas linhas) em um componente;
+    devolve [(nome, caixa)] e os rótulos que não estão dentro de nenhuma caixa"""
+    pixels = tinta.load()
+    caixas, soltos = {}, []
+    for rotulo in sorted(rotulos, key=lambda r: (r.caixa[1], r.caixa[0])):
+        _verificar_prazo(prazo)
+        caixa = _caixa_componente(pixels, tinta.size, rotulo)
+        if caixa is None:
+            soltos.append(rotulo.texto)
+            continue
+        # A mesma caixa encontrada a partir de rótulos diferentes pode diferir por 1-2 px na borda
+        existente = next((c for c in caixas if all(abs(a - b) <= 3 for a, b in zip(c, caixa))), None)
+        if existente is None:
+            caixas[caixa] = [rotulo.texto]
+        else:
+            caixas[existente].append(rotulo.texto)
+    componentes = [(" ".join(textos), caixa) for caixa, textos in caixas.items()]
+    componentes.sort(key=lambda c: (c[1][1], c[1][0]))
+    return componentes, soltos
+
+
+def _espessuras(tinta: Image.Image, x0: int, x1: int, y: int) -> list:
+    """Altura de tinta (em px) de cada coluna entre x0 e x1, na faixa de FAIXA_PONTA em torno de y"""
+    x0, x1 = max(x0, 0), min(x1, tinta.width)
+    if x1 <= x0:
+        return []
+    faixa = tinta.crop((x0, max(y - FAIXA_PONTA, 0), x1, min(y + FAIXA_PONTA + 1, tinta.height)))
+    colunas = faixa.resize((faixa.width, 1), Image.BOX)
+    return [media * faixa.height / 255 for media in colunas.getdata()]
+
+
+def _largura_ponta(espessuras: list) -> float:
+    """Maior altura da linha junto à caixa, ignorando as colunas da borda (tinta na faixa inteira)"""
+    cheia = 2 * FAIXA_PONTA * 0.95
+    while espessuras and espessuras[0] >= cheia:
+        espessuras = espessuras[1:]
+    return max(espessuras[:COMPRIMENTO_PONTA], default=0.0)
+
+
+def _conexoes_horizontais(tinta: Image.Image, dilatada: Image.Image, componentes: list,
+                          prazo: Optional[float] = None) -> list:
+    """Pares de caixas ligadas por uma linha de tinta contínua entre a borda direita de uma e a
+    esquerda da outra; a ponta da seta (mais larga) define o sentido"""
+    fluxos = []
+    for i, (nome_a, (ax0, ay0, ax1, ay1)) in enumerate(componentes):
+        # São até MAX_ITENS² pares: o prazo é conferido a cada componente de origem
+        _verificar_prazo(prazo)
+        for nome_b, (bx0, by0, bx1, by1) in componentes[i + 1:] + componentes[:i]:
+            topo, base = max(ay0, by0) + 2, min(ay1, by1) - 2
+            if bx0 - ax1 < 4 or base <= topo:
+                continue
+            # Média de cada linha da região entre as caixas: 255 onde a linha de tinta é contínua
+            regiao = dilatada.crop((ax1 + 1, topo, bx0, base))
+            medias = list(regiao.resize((1, regiao.height), Image.BOX).getdata())
+            continuas = [topo + j for j, media in enumerate(medias) if media >= 250]
+            if not continuas:
+                continue
+            y = continuas[len(continuas) // 2]
+            # Perto de cada caixa, a partir da borda dela: a ponta da seta é a extremidade mais larga
+            inicio = _largura_ponta(_espessuras(tinta, ax1, ax1 + 2 * COMPRIMENTO_PONTA, y))
+            fim = _largura_ponta(_espessuras(tinta, bx0 - 2 * COMPRIMENTO_PONTA + 1, bx0 + 1, y)[::-1])
+            if fim > inicio + 2:
+                fluxos.append((nome_a, nome_b, True))
+            elif inicio > fim + 2:
+                fluxos.append((nome_b, nome_a, True))
+            else:
+                fluxos.append((nome_a, nome_b, False))
+    return fluxos
+
+
+def detectar_fluxos(tinta: Image.Image, componentes: list, prazo: Optional[float] = None) -> list:
+    """Setas horizontais e verticais entre os componentes (as verticais na imagem transposta)"""
+    dilatada = tinta.filter(ImageFilter.MaxFilter(3))
+    fluxos = _conexoes_horizontais(tinta, dilatada, componentes, prazo)
+    transpostos = [(nome, (y0, x0, y1, x1)) for nome, (x0, y0, x1, y1) in componentes]
+    fluxos += _conexoes_horizontais(
+        tinta.transpose(Image.Transpose.TRANSPOSE), dilatada.transpose(Image.Transpose.TRANSPOSE), transpostos, prazo
+    )
+    return fluxos
+
+
+def extrair_diagrama(conteudo: bytes, backend: str, idioma: str = "eng",
+                     prazo: Optional[float] = None) -> ExtracaoDiagrama:
+    """Lê os rótulos com o backend de OCR e detecta os fluxos entre os componentes
+
+    Recebe os bytes da imagem (e não o arquivo do upload) para poder rodar em outro processo.
+    Com `prazo` (instante em time.time()), levanta TimeoutError assim que ele passa, inclusive
+    se a tarefa ficou esperando na fila do pool além dele.
+    """
+    _verificar_prazo(prazo)
+    cinza = _carregar(conteudo)
+    rotulos = BACKENDS[backend](cinza, idioma, prazo)[:MAX_ITENS]
+    tinta = _mascara_tinta(cinza, rotulos)
+    componentes, soltos = _agrupar_componentes(rotulos, tinta, prazo)
+    return ExtracaoDiagrama(
+        backend=backend,
+        componentes=[nome for nome, _ in componentes],
+        fluxos=detectar_fluxos(tinta, componentes, prazo)[:MAX_ITENS],
+        textos_soltos=soltos
+    )
+
+
+class CacheExtracoes:
+    """LRU das extrações por hash da imagem: o mesmo diagrama reenviado não passa de novo pelo OCR"""
+
+    def __init__(self, max_itens: int = 512):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+
+    def obter(self, chave: str) -> Optional[ExtracaoDiagrama]:
+        extracao = self._itens.get(chave)
+        if extracao is not None:
+            self._itens.move_to_end(chave)
+        return extracao
+
+    def armazenar(self, chave: str, extracao: ExtracaoDiagrama):
+        self._itens[chave] = extracao
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
@@ -0,0 +1,83 @@
+import json
+
+
+class ParserIncremental:
+    """Extrai entradas completas do JSON enquanto a resposta do modelo ainda está sendo gerada
+
+    Recebe pedaços de texto via alimentar() e devolve eventos ("threat", objeto) para cada item
+    fechado de "threat_model" e ("suggestion", texto) para cada string de "improvement_suggestions".
+    Texto antes do primeiro "{" (ex: cerca ```json) é ignorado.
+    """
+
+    ARRAYS = {"threat_model": "threat", "improvement_suggestions": "suggestion"}
+
+    def __init__(self):
+        self.texto = ""
+        self._posicao = 0
+        self._pilha = []
+        self._em_string = False
+        self._escape = False
+        self._inicio_string = None
+        self._inicio_item = None
+        self._ultima_chave = None
+        self._array_atual = None
+        self._terminado = False
+
+    def alimentar(self, pedaco: str) -> list:
+        self.texto += pedaco
+        eventos = []
+        texto = self.texto
+
+        for i in range(self._posicao, len(texto)):
+            c = texto[i]
+
+            if self._terminado:
+                break
+
+            if self._em_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._em_string = False
+                    self._fechar_string(texto, i, eventos)
+                continue
+
+            if not self._pilha and c != "{":
+                continue
+
+            if c == '"':
+                self._em_string = True
+                self._inicio_string = i
+            elif c in "{[":
+                if len(self._pilha) == 1 and c == "[":
+                    self._array_atual = self.ARRAYS.get(self._ultima_chave)
+                elif len(self._pilha) == 2 and c == "{" and self._array_atual == "threat":
+                    self._inicio_item = i
+                self._pilha.append(c)
+            elif c in "}]":
+                self._pilha.pop()
+                if len(self._pilha) == 2 and c == "}" and self._inicio_item is not None:
+                    self._emitir(eventos, "threat", texto[self._inicio_item:i + 1])
+                    self._inicio_item = None
+                elif len(self._pilha) == 1 and c == "]":
+                    self._array_atual = None
+                elif not self._pilha:
+                    self._terminado = True
+
+        self._posicao = len(texto)
+        return eventos
+
+    def _fechar_string(self, texto, fim, eventos):
+        literal = texto[self._inicio_string:fim + 1]
+        if len(self._pilha) == 1:
+            self._ultima_chave = json.loads(literal)
+        elif len(self._pilha) == 2 and self._array_atual == "suggestion":
+            self._emitir(eventos, "suggestion", literal)
+
+    def _emitir(self, eventos, tipo, literal):
+        try:
+            eventos.append((tipo, json.loads(literal)))
+        except json.JSONDecodeError:
+            pass
@@ -0,0 +1,89 @@
+import io
+import logging
+from dataclasses import dataclass
+
+from PIL import Image, ImageFilter, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMATOS = {
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+
+# Densidade de bordas medida em uma cópia reduzida, em tons de cinza
+LADO_DENSIDADE = 256
+LIMIAR_BORDA = 48
+
+
+@dataclass
+class ImagemProcessada:
+    conteudo: bytes
+    mime: str
+    largura: int
+    altura: int
+    bytes_originais: int
+    densidade_bordas: float = 0.0
+
+    @property
+    def bytes_economizados(self):
+        return self.bytes_originais - len(self.conteudo)
+
+
+def densidade_bordas(img: Image.Image) -> float:
+    """Fração dos pixels de borda na imagem reduzida a LADO_DENSIDADE
+
+    Cresce quase linearmente com o número de caixas, setas e rótulos do diagrama (~0,006 por
+    componente em um diagrama típico) e serve de medida barata da complexidade da arquitetura.
+    """
+    cinza = img.convert("L")
+    cinza.thumbnail((LADO_DENSIDADE, LADO_DENSIDADE))
+    histograma = cinza.filter(ImageFilter.FIND_EDGES).histogram()
+    return sum(histograma[LIMIAR_BORDA:]) / (cinza.width * cinza.height)
+
+
+def preprocessar_imagem(arquivo, lado_maximo=2048, formato="png", qualidade=90, cores=256) -> ImagemProcessada:
+    """Reduz o maior lado da imagem, remove metadados e recodifica em um formato compacto
+
+    Em PNG a imagem é quantizada para uma paleta de `cores` cores (0 desliga): diagramas
+    têm poucas cores e a paleta reduz bem mais o arquivo que o WebP com perdas.
+    Roda de forma síncrona; a API chama esta função dentro de um pool de threads.
+    """
+    arquivo.seek(0, io.SEEK_END)
+    bytes_originais = arquivo.tell()
+    arquivo.seek(0)
+
+    with Image.open(arquivo) as original:
+        # GIFs animados: apenas o primeiro quadro interessa para o diagrama
+        original.seek(0)
+        img = ImageOps.exif_transpose(original)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+        img.thumbnail((lado_maximo, lado_maximo), Image.LANCZOS)
+        densidade = densidade_bordas(img)
+
+        formato_pil, mime = FORMATOS[formato]
+        saida = io.BytesIO()
+        # Nenhum exif/icc_profile é repassado ao salvar: os metadados são descartados
+        if formato_pil == "WEBP":
+            img.save(saida, format="WEBP", quality=qualidade, method=4)
+        else:
+            if cores:
+                img = img.quantize(cores, method=Image.Quantize.FASTOCTREE)
+            img.save(saida, format="PNG", optimize=True)
+
+        return ImagemProcessada(
+            conteudo=saida.getvalue(),
+            mime=mime,
+            largura=img.width,
+            altura=img.height,
+            bytes_originais=bytes_originais,
+            densidade_bordas=densidade
+        )
+
+
+def escolher_detail(largura, altura, configurado="auto"):
+    """Nível de detalhe da visão do OpenAI; "adaptativo" usa low quando a imagem já é pequena"""
+    if configurado != "adaptativo":
+        return configurado
+    return "low" if max(largura, altura) <= 512 else "high"
@@ -0,0 +1,238 @@
+"""
+Templates do prompt STRIDE
+
+O prompt é dividido em um prefixo estático (instruções, categorias, formato e exemplo), enviado
+como mensagem de sistema e idêntico byte a byte em todas as chamadas, e uma parte variável
+(campos do formulário, escopo da chamada e imagem) na mensagem do usuário. O Azure OpenAI
+reaproveita o prefixo em cache quando ele tem 1024 tokens ou mais, cobrando menos por esses
+tokens e reduzindo o tempo até o primeiro token.
+"""
+
+import hashlib
+import json
+from typing import Optional
+
+from esquema import CATEGORIAS_STRIDE, NOMES_CATEGORIAS
+
+# O que procurar em cada categoria; também fixa os valores aceitos em "Threat Type"
+GUIA_CATEGORIAS = {
+    "Spoofing": "um agente se passa por outro usuário, serviço ou componente. Considere credenciais "
+                "fracas ou vazadas, tokens aceitos sem validar assinatura, emissor, audiência ou validade, "
+                "sessões sequestradas, ausência de autenticação mútua entre serviços e chamadas internas "
+                "aceitas apenas por virem da rede interna.",
+    "Tampering": "dados ou código são alterados sem autorização. Considere parâmetros e payloads não "
+                 "validados, tráfego sem TLS entre componentes, filas e arquivos de configuração sem "
+                 "controle de escrita, artefatos de build e dependências sem verificação de integridade e "
+                 "registros de banco alterados por contas com privilégio excessivo.",
+    "Repudiation": "um agente nega ter realizado uma ação e o sistema não consegue provar o contrário. "
+                   "Considere operações sensíveis sem log de auditoria, logs sem identidade do autor ou "
+                   "horário confiável, logs que podem ser apagados ou editados por quem gera o evento e "
+                   "ações administrativas sem trilha de aprovação.",
+    "Information Disclosure": "informações chegam a quem não deveria vê-las. Considere dados sensíveis "
+                              "em trânsito ou em repouso sem criptografia, mensagens de erro e logs com "
+                              "dados pessoais ou segredos, buckets e endpoints expostos, respostas de API "
+                              "que devolvem mais campos que o necessário e segredos no código ou em "
+                              "variáveis de ambiente sem cofre.",
+    "Denial of Service": "o sistema deixa de atender usuários legítimos. Considere endpoints públicos sem "
+                         "limite de taxa, uploads e consultas sem limite de tamanho ou tempo, dependências "
+                         "externas sem timeout ou circuit breaker, filas sem controle de crescimento e "
+                         "componentes sem redundância.",
+    "Elevation of Privilege": "um agente obtém permissões além das concedidas. Considere autorização "
+                              "verificada só no frontend, referências diretas a objetos sem checagem de "
+                              "dono (IDOR), papéis amplos demais em identidades de serviço, injeção de "
+                              "comandos ou consultas e caminhos administrativos expostos sem proteção "
+                              "adicional."
+}
+
+SUGESTOES_EXEMPLO = [
+    "Por favor, forneça mais detalhes sobre o fluxo de autenticação entre os componentes para permitir uma análise melhor de possíveis falhas de autenticação.",
+    "Considere adicionar informações sobre como os dados sensíveis são armazenados e transmitidos para permitir uma análise mais precisa de exposição de dados."
+]
+
+EXEMPLO_RESPOSTA = {
+    "threat_model": [
+        {
+            "Threat Type": "Spoofing",
+            "Scenario": "Cenário de exemplo 1",
+            "Potential Impact": "Impacto potencial de exemplo 1"
+        },
+        {
+            "Threat Type": "Spoofing",
+            "Scenario": "Cenário de exemplo 2",
+            "Potential Impact": "Impacto potencial de exemplo 2"
+        }
+    ],
+    "improvement_suggestions": SUGESTOES_EXEMPLO
+}
+
+_GUIA = "\n".join(
+    f'- "{categoria}" ({NOMES_CATEGORIAS[categoria]}): {GUIA_CATEGORIAS[categoria]}' for categoria in CATEGORIAS_STRIDE
+)
+
+# Mensagem de sistema: não pode conter nada que varie entre requisições
+PREFIXO_ESTATICO = f"""Aja como um especialista em cibersegurança com mais de 20 anos de experiência utilizando a metodologia de modelagem de ameaças STRIDE para produzir modelos de ameaças abrangentes para uma ampla gama de aplicações. Sua tarefa é analisar o diagrama de arquitetura enviado como imagem e as informações da aplicação fornecidas pelo usuário (tipo de aplicação, métodos de autenticação, exposição na internet, dados sensíveis e resumo do código, conteúdo do README e descrição da aplicação) para produzir uma lista de ameaças específicas para essa aplicação.
+
+Preste atenção na descrição da aplicação, nos componentes e fluxos do diagrama e nos detalhes técnicos fornecidos. Cada cenário de ameaça deve apresentar uma situação plausível em que a ameaça poderia ocorrer no contexto da aplicação, citando os componentes envolvidos. O impacto potencial deve descrever a consequência concreta para o negócio, para os usuários ou para os dados.
+
+CATEGORIAS STRIDE
+Use exatamente um destes valores em "Threat Type":
+{_GUIA}
+
+Salvo quando o usuário restringir o escopo, liste múltiplas (3 ou 4) ameaças reais para cada uma das seis categorias, se aplicável.
+
+FORMATO DA RESPOSTA
+Responda somente com um objeto JSON, sem texto antes ou depois e sem cercas Markdown, com as chaves "threat_model" e "improvement_suggestions". Quando o usuário pedir apenas parte da análise, inclua somente as chaves pedidas.
+
+Em "threat_model", inclua um array de objetos com as chaves "Threat Type" (Tipo de Ameaça), "Scenario" (Cenário) e "Potential Impact" (Impacto Potencial).
+
+Em "improvement_suggestions", inclua um array de strings que sugerem quais informações adicionais poderiam ser fornecidas para tornar o modelo de ameaças mais completo e preciso na próxima iteração. Foque em identificar lacunas na descrição da aplicação que, se preenchidas, permitiriam uma análise mais detalhada e precisa, como por exemplo:
+- Detalhes arquiteturais ausentes que ajudariam a identificar ameaças mais específicas
+- Fluxos de autenticação pouco claros que precisam de mais detalhes
+- Descrição incompleta dos fluxos de dados
+- Informações técnicas da stack não informadas
+- Fronteiras ou zonas de confiança do sistema não especificadas
+- Descrição incompleta do tratamento de dados sensíveis
+Não forneça recomendações de segurança genéricas — foque apenas no que ajudaria a criar um modelo de ameaças mais eficiente.
+
+Exemplo de formato esperado em JSON:
+
+{json.dumps(EXEMPLO_RESPOSTA, ensure_ascii=False, indent=2)}"""
+
+# Entra na chave do cache de resultados: mudar o prefixo invalida as análises antigas
+VERSAO_PREFIXO = hashlib.sha256(PREFIXO_ESTATICO.encode("utf-8")).hexdigest()[:12]
+
+INSTRUCAO_FINAL = ("Por favor, analise a imagem do diagrama de arquitetura e as informações acima e forneça "
+                   "o modelo de ameaças em formato JSON conforme especificado.")
+
+INSTRUCAO_DELTA = ("Por favor, avalie o impacto das alterações no modelo de ameaças atual e responda somente "
+                   "com o delta em formato JSON conforme especificado.")
+
+INSTRUCAO_CONTINUACAO = ("Sua resposta anterior foi interrompida pelo limite de tamanho. Continue a análise: responda "
+                         "com um novo objeto JSON no mesmo formato, contendo somente as ameaças que ainda não foram "
+                         "listadas e as sugestões de melhoria que ainda não foram dadas. Não repita nada do que já "
+                         "está na resposta anterior.")
+
+ROTULOS_CAMPOS = {
+    "tipo_aplicacao": "TIPO DE APLICAÇÃO",
+    "autenticacao": "MÉTODOS DE AUTENTICAÇÃO",
+    "acesso_internet": "EXPOSTA NA INTERNET",
+    "dados_sensiveis": "DADOS SENSÍVEIS",
+    "descricao_aplicacao": "RESUMO DE CÓDIGO, CONTEÚDO DO README E DESCRIÇÃO DA APLICAÇÃO"
+}
+
+FORMATO_DELTA = """FORMATO DA RESPOSTA DESTA REVISÃO
+Responda somente com um objeto JSON com as chaves "add_threats" (ameaças novas, com "Threat Type", "Scenario" e "Potential Impact"), "update_threats" (ameaças atuais que precisam mudar, com o "id" e os três campos já atualizados), "retire_threats" (ids das ameaças que deixaram de se aplicar) e "improvement_suggestions" (lista completa e atualizada). Não repita ameaças que continuam válidas sem mudança; se as alterações não afetam o modelo, devolva as listas de ameaças vazias."""
+
+
+def _campos_formulario(formulario: dict) -> str:
+    return "\n".join(f"{rotulo}: {formulario[campo]}" for campo, rotulo in ROTULOS_CAMPOS.items())
+
+
+def criar_prompt_modelo_ameacas(tipo_aplicacao, autenticacao, acesso_internet, dados_sensiveis, descricao_aplicacao,
+                                categorias=None, incluir_sugestoes=True, analise_anterior=None, texto_diagrama=None):
+    """Parte variável do prompt (mensagem do usuário): campos do formulário e escopo da chamada
+
+    Por padrão a resposta traz todas as categorias e as sugestões de melhoria. No fan-out cada
+    chamada pede uma parte: `categorias` restringe as ameaças (lista vazia: nenhuma) e
+    `incluir_sugestoes` controla as improvement_suggestions. `analise_anterior` (threat_model de
+    um diagrama quase idêntico) entra como ponto de partida da análise. `texto_diagrama` (bloco
+    de ocr.ExtracaoDiagrama) traz os componentes e fluxos lidos localmente do diagrama.
+    """
+    texto = _campos_formulario({
+        "tipo_aplicacao": tipo_aplicacao, "autenticacao": autenticacao, "acesso_internet": acesso_internet,
+        "dados_sensiveis": dados_sensiveis, "descricao_aplicacao": descricao_aplicacao
+    })
+
+    if texto_diagrama:
+        texto += f"""
+
+TEXTO DO DIAGRAMA (extraído localmente por OCR; pode conter erros, confira com a imagem):
+{texto_diagrama}"""
+
+    if analise_anterior:
+        if categorias is not None:
+            analise_anterior = [a for a in analise_anterior if a.get("Threat Type") in categorias]
+        if analise_anterior:
+            texto += f"""
+
+ANÁLISE ANTERIOR DE UM DIAGRAMA SEMELHANTE: o diagrama parece uma nova versão de outro já analisado. Use as ameaças abaixo como ponto de partida: mantenha as que continuam válidas, ajuste as que mudaram e inclua as novas.
+{json.dumps(analise_anterior, ensure_ascii=False)}"""
+
+    if categorias is None and incluir_sugestoes:
+        return texto
+    categorias = CATEGORIAS_STRIDE if categorias is None else list(categorias)
+    chaves = (['"threat_model"'] if categorias else []) + (['"improvement_suggestions"'] if incluir_sugestoes else [])
+    if not categorias:
+        escopo = "Nesta resposta, não liste ameaças"
+    else:
+        nomes = ", ".join(f"{NOMES_CATEGORIAS[c]} - {c}" for c in categorias)
+        escopo = f"Nesta resposta, liste apenas ameaças da categoria {nomes}"
+    return f"{texto}\n\nESCOPO: {escopo}; responda somente com {' e '.join(chaves)}."
+
+
+def criar_prompt_delta(formulario: dict, delta, ameacas: list) -> str:
+    """Parte variável do prompt de uma revisão incremental: campos atuais, o que mudou desde a
+    última revisão (`delta`, um revisoes.Delta) e as ameaças atuais numeradas pelo id"""
+    alteracoes = []
+    for campo, (antes, depois) in delta.campos.items():
+        if campo == "descricao_aplicacao" and (delta.trechos_removidos or delta.trechos_adicionados):
+            removidos = " | ".join(delta.trechos_removidos) or "nenhum"
+            adicionados = " | ".join(delta.trechos_adicionados) or "nenhum"
+            alteracoes.append(f"- {ROTULOS_CAMPOS[campo]}: trechos removidos: {removidos}; trechos adicionados: {adicionados}")
+        else:
+            alteracoes.append(f'- {ROTULOS_CAMPOS[campo]}: antes "{antes}"; agora "{depois}"')
+    if delta.regioes:
+        regioes = ", ".join(f"({linha}, {coluna})" for linha, coluna in delta.regioes)
+        alteracoes.append(f"- DIAGRAMA: regiões alteradas (linha, coluna), em uma grade 4x4 contada a partir do canto "
+                          f"superior esquerdo: {regioes}. A imagem anexada é a versão nova do diagrama.")
+    else:
+        alteracoes.append("- DIAGRAMA: sem alterações (a imagem não foi reenviada).")
+
+    lista_alteracoes = "\n".join(alteracoes)
+    # Só o cenário de cada ameaça: o impacto é reescrito pelo modelo quando a ameaça é atualizada
+    atuais = "\n".join(
+        f"{i}: [{ameaca['Threat Type']}] {ameaca['Scenario']}" for i, ameaca in enumerate(ameacas)
+    ) or "nenhuma"
+    return f"""{_campos_formulario(formulario)}
+
+REVISÃO INCREMENTAL: este projeto já tem um modelo de ameaças. Não refaça a análise; informe apenas o que muda com as alterações abaixo.
+
+ALTERAÇÕES DESDE A ÚLTIMA REVISÃO
+{lista_alteracoes}
+
+AMEAÇAS ATUAIS (id: [tipo] cenário)
+{atuais}
+
+{FORMATO_DELTA}"""
+
+
+def montar_mensagens_chat(texto_usuario: str, image_url: Optional[dict], instrucao_final: str = INSTRUCAO_FINAL) -> list:
+    """Prefixo estático primeiro; tudo o que varia (campos, escopo e imagem) vem depois dele.
+    Sem `image_url` (revisão incremental sem mudança no diagrama) a imagem não é enviada."""
+    conteudo = [{"type": "text", "text": texto_usuario}]
+    if image_url is not None:
+        conteudo.append({"type": "image_url", "image_url": image_url})
+    conteudo.append({"type": "text", "text": instrucao_final})
+    return [
+        {
+            "role": "system",
+            "content": PREFIXO_ESTATICO
+        },
+        {
+            "role": "user",
+            "content": conteudo
+        }
+    ]
+
+
+def montar_mensagens_continuacao(mensagens: list, parciais: list) -> list:
+    """Conversa original seguida de cada resposta cortada e do pedido de continuação
+
+    As mensagens originais ficam intactas no início, então o prefixo inteiro (inclusive a
+    imagem) pode ser servido pelo cache de prompt do Azure.
+    """
+    continuacao = list(mensagens)
+    for parcial in parciais:
+        continuacao.append({"role": "assistant", "content": parcial})
+        continuacao.append({"role": "user", "content": INSTRUCAO_CONTINUACAO})
+    return continuacao
@@ -0,0 +1,399 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from esquema import normalizar_categoria
+
+logger = logging.getLogger(__name__)
+
+# Dimensões aceitas nas agregações e a expressão de cada uma sobre as tabelas de rollup
+# ({periodo} é a coluna "dia" dos rollups diários ou "mes" dos mensais)
+DIMENSOES = {
+    "tipo": "tipo",
+    "tipo_aplicacao": "tipo_aplicacao",
+    "acesso_internet": "acesso_internet",
+    "dia": "{periodo}",
+    "mes": "substr({periodo}, 1, 7)",
+    "ano": "substr({periodo}, 1, 4)"
+}
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS analises (
+    id INTEGER PRIMARY KEY,
+    criado_em REAL NOT NULL,
+    dia TEXT NOT NULL,
+    tipo_aplicacao TEXT NOT NULL,
+    acesso_internet TEXT NOT NULL,
+    autenticacao TEXT NOT NULL,
+    dados_sensiveis TEXT NOT NULL,
+    projeto TEXT,
+    resumo TEXT NOT NULL,
+    sugestoes TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS ameacas (
+    id INTEGER PRIMARY KEY,
+    analise_id INTEGER NOT NULL REFERENCES analises (id),
+    tipo TEXT NOT NULL,
+    cenario TEXT NOT NULL,
+    impacto TEXT NOT NULL,
+    tipo_aplicacao TEXT NOT NULL COLLATE NOCASE,
+    acesso_internet TEXT NOT NULL COLLATE NOCASE,
+    dia TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_ameacas_tipo ON ameacas (tipo, id);
+CREATE INDEX IF NOT EXISTS ix_ameacas_aplicacao ON ameacas (tipo_aplicacao, id);
+CREATE INDEX IF NOT EXISTS ix_ameacas_internet ON ameacas (acesso_internet, id);
+CREATE INDEX IF NOT EXISTS ix_ameacas_dia ON ameacas (dia, id);
+CREATE INDEX IF NOT EXISTS ix_ameacas_analise ON ameacas (analise_id);
+CREATE INDEX IF NOT EXISTS ix_analises_projeto ON analises (projeto);
+CREATE VIRTUAL TABLE IF NOT EXISTS ameacas_fts USING fts5 (
+    cenario, impacto, content='ameacas', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+# Rollups por dia (consultas com período) e por mês (o restante, com ~30x menos linhas para somar)
+ESQUEMA_ROLLUP = """
+CREATE TABLE IF NOT EXISTS rollup_ameacas_{periodo} (
+    {periodo} TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    tipo_aplicacao TEXT NOT NULL COLLATE NOCASE,
+    acesso_internet TEXT NOT NULL COLLATE NOCASE,
+    total INTEGER NOT NULL,
+    PRIMARY KEY ({periodo}, tipo, tipo_aplicacao, acesso_internet)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_analises_{periodo} (
+    {periodo} TEXT NOT NULL,
+    tipo_aplicacao TEXT NOT NULL COLLATE NOCASE,
+    acesso_internet TEXT NOT NULL COLLATE NOCASE,
+    total INTEGER NOT NULL,
+    PRIMARY KEY ({periodo}, tipo_aplicacao, acesso_internet)
+) WITHOUT ROWID;
+"""
+PERIODOS = ("dia", "mes")
+
+
+def normalizar_acesso(valor: str) -> str:
+    """"sim", "Yes", "true" -> "Sim"; "não", "nao", "no" -> "Não"; outros valores ficam como vieram"""
+    chave = " ".join(str(valor).split()).lower()
+    if chave in ("sim", "s", "yes", "y", "true"):
+        return "Sim"
+    if chave in ("não", "nao", "n", "no", "false"):
+        return "Não"
+    return " ".join(str(valor).split())
+
+
+def consulta_fts(texto: str) -> str:
+    """Cada palavra vira um termo entre aspas (todas obrigatórias), sem expor a sintaxe do FTS5"""
+    termos = [termo.replace('"', '""') for termo in texto.split()]
+    return " ".join(f'"{termo}"' for termo in termos)
+
+
+class RepositorioAmeacas:
+    """Histórico de todas as análises em SQLite, com busca textual (FTS5) e agregações
+
+    Cada ameaça vira uma linha com os metadados do summary (tipo de aplicação, exposição na
+    internet e dia) para que os filtros usem índices. As agregações leem tabelas de rollup por
+    dia x categoria x tipo de aplicação x exposição, atualizadas na mesma transação da inclusão,
+    e por isso não dependem do número de ameaças armazenadas.
+    """
+
+    def __init__(self, caminho_sqlite: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(caminho_sqlite, check_same_thread=False)
+        if caminho_sqlite != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(ESQUEMA + "".join(ESQUEMA_ROLLUP.format(periodo=periodo) for periodo in PERIODOS))
+        # Bancos criados antes das exportações não têm a coluna de sugestões
+        if "sugestoes" not in {linha[1] for linha in self._db.execute("PRAGMA table_info(analises)")}:
+            self._db.execute("ALTER TABLE analises ADD COLUMN sugestoes TEXT NOT NULL DEFAULT '[]'")
+        self._db.commit()
+        logger.info(f"Repositório de ameaças: {caminho_sqlite}")
+
+    def registrar(self, formulario: dict, resultado: dict, projeto: Optional[str] = None,
+                  criado_em: Optional[float] = None) -> int:
+        """Guarda a análise e as ameaças dela e atualiza os rollups; devolve o id da análise"""
+        criado_em = time.time() if criado_em is None else criado_em
+        dia = time.strftime("%Y-%m-%d", time.gmtime(criado_em))
+        tipo_aplicacao = " ".join(str(formulario.get("tipo_aplicacao", "")).split())
+        acesso_internet = normalizar_acesso(formulario.get("acesso_internet", ""))
+        ameacas = [
+            (normalizar_categoria(a.get("Threat Type", "")), a.get("Scenario", ""), a.get("Potential Impact", ""))
+            for a in resultado.get("threat_model") or []
+        ]
+        por_tipo = Counter(tipo for tipo, _, _ in ameacas)
+
+        with self._lock, self._db:
+            analise_id = self._db.execute(
+                "INSERT INTO analises (criado_em, dia, tipo_aplicacao, acesso_internet, autenticacao, "
+                "dados_sensiveis, projeto, resumo, sugestoes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (criado_em, dia, tipo_aplicacao, acesso_internet, formulario.get("autenticacao", ""),
+                 formulario.get("dados_sensiveis", ""), projeto,
+                 json.dumps(resultado.get("summary") or {}, ensure_ascii=False),
+                 json.dumps(resultado.get("improvement_suggestions") or [], ensure_ascii=False))
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO ameacas (analise_id, tipo, cenario, impacto, tipo_aplicacao, acesso_internet, dia) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(analise_id, tipo, cenario, impacto, tipo_aplicacao, acesso_internet, dia)
+                 for tipo, cenario, impacto in ameacas]
+            )
+            self._db.execute(
+                "INSERT INTO ameacas_fts (rowid, cenario, impacto) "
+                "SELECT id, cenario, impacto FROM ameacas WHERE analise_id = ?", (analise_id,)
+            )
+            for periodo, valor in zip(PERIODOS, (dia, dia[:7])):
+                self._db.executemany(
+                    f"INSERT INTO rollup_ameacas_{periodo} VALUES (?, ?, ?, ?, ?) "
+                    f"ON CONFLICT ({periodo}, tipo, tipo_aplicacao, acesso_internet) "
+                    "DO UPDATE SET total = total + excluded.total",
+                    [(valor, tipo, tipo_aplicacao, acesso_internet, total) for tipo, total in por_tipo.items()]
+                )
+                self._db.execute(
+                    f"INSERT INTO rollup_analises_{periodo} VALUES (?, ?, ?, 1) "
+                    f"ON CONFLICT ({periodo}, tipo_aplicacao, acesso_internet) DO UPDATE SET total = total + 1",
+                    (valor, tipo_aplicacao, acesso_internet)
+                )
+        return analise_id
+
+    def buscar(self, texto: Optional[str] = None, tipo: Optional[str] = None, tipo_aplicacao: Optional[str] = None,
+               acesso_internet: Optional[str] = None, projeto: Optional[str] = None, desde: Optional[str] = None,
+               ate: Optional[str] = None, cursor: Optional[int] = None, limite: int = 50) -> dict:
+        """Ameaças que atendem a todos os filtros, das mais recentes para as mais antigas
+
+        Paginação por cursor: `next_cursor` da resposta é o `cursor` da próxima página, o que
+        mantém o custo de cada página constante mesmo no fim de milhões de resultados.
+        """
+        origem = "ameacas a JOIN analises an ON an.id = a.analise_id"
+        condicoes, parametros = [], []
+        coluna_id = "a.id"
+        if texto and texto.strip():
+            # CROSS JOIN fixa o FTS5 como laço externo: ele já devolve os ids em ordem decrescente e a
+            # consulta para no limite, em vez de testar o MATCH em cada ameaça que passa nos filtros
+            origem = ("ameacas_fts CROSS JOIN ameacas a ON a.id = ameacas_fts.rowid "
+                      "JOIN analises an ON an.id = a.analise_id")
+            coluna_id = "ameacas_fts.rowid"
+            condicoes.append("ameacas_fts MATCH ?")
+            parametros.append(consulta_fts(texto))
+        for coluna, valor in (("a.tipo", tipo and normalizar_categoria(tipo)),
+                              ("a.tipo_aplicacao", tipo_aplicacao and " ".join(tipo_aplicacao.split())),
+                              ("a.acesso_internet", acesso_internet and normalizar_acesso(acesso_internet)),
+                              ("an.projeto", projeto)):
+            if valor:
+                condicoes.append(f"{coluna} = ?")
+                parametros.append(valor)
+        self._filtro_periodo(condicoes, parametros, desde, ate, "a.dia")
+        if cursor is not None:
+            condicoes.append(f"{coluna_id} < ?")
+            parametros.append(cursor)
+
+        onde = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        with self._lock:
+            linhas = self._db.execute(
+                "SELECT a.id, a.analise_id, a.tipo, a.cenario, a.impacto, a.tipo_aplicacao, a.acesso_internet, "
+                f"an.autenticacao, an.projeto, an.criado_em FROM {origem} {onde} ORDER BY {coluna_id} DESC LIMIT ?",
+                (*parametros, limite + 1)
+            ).fetchall()
+
+        itens = [
+            {
+                "id": id_ameaca,
+                "analysis_id": analise_id,
+                "Threat Type": tipo_ameaca,
+                "Scenario": cenario,
+                "Potential Impact": impacto,
+                "application_type": aplicacao,
+                "has_internet_access": internet,
+                "authentication_method": autenticacao,
+                "project": projeto_analise,
+                "created_at": criado_em
+            }
+            for id_ameaca, analise_id, tipo_ameaca, cenario, impacto, aplicacao, internet, autenticacao,
+            projeto_analise, criado_em in linhas[:limite]
+        ]
+        return {"items": itens, "next_cursor": itens[-1]["id"] if len(linhas) > limite else None}
+
+    def agregar(self, agrupar: list, tipo: Optional[str] = None, tipo_aplicacao: Optional[str] = None,
+                acesso_internet: Optional[str] = None, desde: Optional[str] = None, ate: Optional[str] = None) -> dict:
+        """Contagem de ameaças agrupada pelas dimensões pedidas (ex.: ["mes", "tipo"] para a tendência
+        mensal por categoria), lida só das tabelas de rollup
+
+        O rollup mensal atende tudo que não agrupa por dia nem filtra por período; os demais usam o diário.
+        """
+        invalidas = [dimensao for dimensao in agrupar if dimensao not in DIMENSOES]
+        if invalidas or not agrupar:
+            raise ValueError(f"Agrupamento inválido: {', '.join(invalidas) or 'vazio'}. "
+                             f"Use: {', '.join(DIMENSOES)}")
+
+        condicoes, parametros = [], []
+        if tipo:
+            condicoes.append("tipo = ?")
+            parametros.append(normalizar_categoria(tipo))
+        filtros_analises, parametros_analises = [], []
+        for coluna, valor in (("tipo_aplicacao", tipo_aplicacao and " ".join(tipo_aplicacao.split())),
+                              ("acesso_internet", acesso_internet and normalizar_acesso(acesso_internet))):
+            if valor:
+                filtros_analises.append(f"{coluna} = ?")
+                parametros_analises.append(valor)
+        periodo = "dia" if "dia" in agrupar or desde or ate else "mes"
+        self._filtro_periodo(filtros_analises, parametros_analises, desde, ate, periodo)
+        condicoes += filtros_analises
+        parametros += parametros_analises
+
+        colunas = ", ".join(DIMENSOES[dimensao].format(periodo=periodo) for dimensao in agrupar)
+        onde = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        onde_analises = f"WHERE {' AND '.join(filtros_analises)}" if filtros_analises else ""
+        with self._lock:
+            linhas = self._db.execute(
+                f"SELECT {colunas}, SUM(total) FROM rollup_ameacas_{periodo} {onde} GROUP BY {colunas} ORDER BY {colunas}",
+                parametros
+            ).fetchall()
+            total_analises = self._db.execute(
+                f"SELECT COALESCE(SUM(total), 0) FROM rollup_analises_{periodo} {onde_analises}", parametros_analises
+            ).fetchone()[0]
+
+        itens = [{**dict(zip(agrupar, linha[:-1])), "threats": linha[-1]} for linha in linhas]
+        return {
+            "group_by": agrupar,
+            "items": itens,
+            "total_threats": sum(item["threats"] for item in itens),
+            "total_analyses": total_analises
+        }
+
+    def listar_analises(self, tipo_aplicacao: Optional[str] = None, acesso_internet: Optional[str] = None,
+                        projeto: Optional[str] = None, desde: Optional[str] = None, ate: Optional[str] = None,
+                        versao: Optional[int] = None, limite: int = 500) -> list:
+        """Análises mais recentes com as suas ameaças, para o grafo do portfólio
+
+        Só entram análises com id até `versao` (ver versao()): como as análises nunca mudam
+        depois de gravadas, a mesma versão e os mesmos filtros devolvem sempre o mesmo conjunto.
+        """
+        condicoes, parametros = [], []
+        for coluna, valor in (("tipo_aplicacao", tipo_aplicacao and " ".join(tipo_aplicacao.split())),
+                              ("acesso_internet", acesso_internet and normalizar_acesso(acesso_internet)),
+                              ("projeto", projeto)):
+            if valor:
+                condicoes.append(f"{coluna} = ?")
+                parametros.append(valor)
+        self._filtro_periodo(condicoes, parametros, desde, ate, "dia")
+
+        if versao is not None:
+            condicoes.append("id <= ?")
+            parametros.append(versao)
+        onde = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+
+        with self._lock:
+            linhas = self._db.execute(
+                f"SELECT id, projeto, tipo_aplicacao, acesso_internet FROM analises {onde} "
+                "ORDER BY id DESC LIMIT ?", (*parametros, limite)
+            ).fetchall()
+            analises = {
+                id_analise: {"id": id_analise, "projeto": projeto_analise, "tipo_aplicacao": aplicacao,
+                             "acesso_internet": internet, "threat_model": [], "ids_ameacas": []}
+                for id_analise, projeto_analise, aplicacao, internet in linhas
+            }
+            ameacas = self._db.execute(
+                "SELECT id, analise_id, tipo, cenario, impacto FROM ameacas WHERE analise_id IN "
+                f"(SELECT id FROM analises {onde} ORDER BY id DESC LIMIT ?) ORDER BY id", (*parametros, limite)
+            ).fetchall()
+
+        for id_ameaca, analise_id, tipo_ameaca, cenario, impacto in ameacas:
+            analise = analises.get(analise_id)
+            if analise is not None:
+                analise["threat_model"].append(
+                    {"Threat Type": tipo_ameaca, "Scenario": cenario, "Potential Impact": impacto}
+                )
+                analise["ids_ameacas"].append(id_ameaca)
+        return list(analises.values())
+
+    def iterar_analises(self, tipo: Optional[str] = None, tipo_aplicacao: Optional[str] = None,
+                        acesso_internet: Optional[str] = None, projeto: Optional[str] = None,
+                        desde: Optional[str] = None, ate: Optional[str] = None, versao: Optional[int] = None,
+                        tamanho_lote: int = 500):
+        """Gerador das análises completas (ameaças, sugestões e summary), da mais antiga para a mais
+        recente, para as exportações
+
+        Lê em lotes de `tamanho_lote` análises por id (keyset) e só segura o lock durante cada
+        consulta: a memória fica em um lote, não importa o tamanho da exportação, e as gravações
+        seguem enquanto o cliente baixa o arquivo. Com `tipo`, entram só as ameaças dessa categoria
+        (e só as análises que têm alguma). `versao` funciona como em listar_analises.
+        """
+        tipo = tipo and normalizar_categoria(tipo)
+        condicoes, parametros = [], []
+        for coluna, valor in (("tipo_aplicacao", tipo_aplicacao and " ".join(tipo_aplicacao.split())),
+                              ("acesso_internet", acesso_internet and normalizar_acesso(acesso_internet)),
+                              ("projeto", projeto)):
+            if valor:
+                condicoes.append(f"{coluna} = ?")
+                parametros.append(valor)
+        self._filtro_periodo(condicoes, parametros, desde, ate, "dia")
+        if tipo:
+            condicoes.append("EXISTS (SELECT 1 FROM ameacas WHERE analise_id = analises.id AND tipo = ?)")
+            parametros.append(tipo)
+        if versao is not None:
+            condicoes.append("id <= ?")
+            parametros.append(versao)
+        condicoes.append("id > ?")
+        onde = " AND ".join(condicoes)
+
+        ultimo = 0
+        while True:
+            with self._lock:
+                linhas = self._db.execute(
+                    "SELECT id, criado_em, projeto, tipo_aplicacao, acesso_internet, autenticacao, resumo, sugestoes "
+                    f"FROM analises WHERE {onde} ORDER BY id LIMIT ?", (*parametros, ultimo, tamanho_lote)
+                ).fetchall()
+                if not linhas:
+                    return
+                marcadores = ", ".join("?" * len(linhas))
+                ameacas = self._db.execute(
+                    f"SELECT id, analise_id, tipo, cenario, impacto FROM ameacas WHERE analise_id IN ({marcadores})"
+                    + (" AND tipo = ?" if tipo else "") + " ORDER BY id",
+                    (*(linha[0] for linha in linhas), *((tipo,) if tipo else ()))
+                ).fetchall()
+
+            analises = {
+                id_analise: {
+                    "id": id_analise, "created_at": criado_em, "project": projeto_analise,
+                    # Os campos do formulário vêm das colunas quando o summary gravado não os tem
+                    "summary": {"application_type": aplicacao, "has_internet_access": internet,
+                                "authentication_method": autenticacao, **json.loads(resumo)},
+                    "threat_model": [], "improvement_suggestions": json.loads(sugestoes)
+                }
+                for id_analise, criado_em, projeto_analise, aplicacao, internet, autenticacao, resumo, sugestoes
+                in linhas
+            }
+            for id_ameaca, analise_id, tipo_ameaca, cenario, impacto in ameacas:
+                analises[analise_id]["threat_model"].append(
+                    {"id": id_ameaca, "Threat Type": tipo_ameaca, "Scenario": cenario, "Potential Impact": impacto}
+                )
+            yield from analises.values()
+            ultimo = linhas[-1][0]
+
+    def versao(self) -> int:
+        """Id da análise mais recente (0 sem análises)"""
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(id), 0) FROM analises").fetchone()[0]
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            analises = self._db.execute("SELECT COALESCE(SUM(total), 0) FROM rollup_analises_mes").fetchone()[0]
+            ameacas = self._db.execute("SELECT COALESCE(SUM(total), 0) FROM rollup_ameacas_mes").fetchone()[0]
+        return {"analises": analises, "ameacas": ameacas}
+
+    def fechar(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _filtro_periodo(condicoes, parametros, desde, ate, coluna):
+        if desde:
+            condicoes.append(f"{coluna} >= ?")
+            parametros.append(desde)
+        if ate:
+            condicoes.append(f"{coluna} <= ?")
+            parametros.append(ate)
@@ -0,0 +1,214 @@
+import difflib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from esquema import CATEGORIAS_STRIDE, Ameaca, RespostaDelta, RespostaModelo
+from fanout import normalizar_texto
+from similaridade import COLUNAS_GRADE, LINHAS_GRADE, regioes_alteradas
+
+logger = logging.getLogger(__name__)
+
+CAMPO_DESCRICAO = "descricao_aplicacao"
+
+
+@dataclass
+class Revisao:
+    projeto: str
+    numero: int
+    formulario: dict
+    miniatura: Optional[bytes]
+    resultado: dict
+    modo: str
+    alteracoes: dict
+    criado_em: float
+
+    def resumo(self) -> dict:
+        return {
+            "project": self.projeto,
+            "revision": self.numero,
+            "mode": self.modo,
+            "changes": self.alteracoes,
+            "created_at": self.criado_em
+        }
+
+
+@dataclass
+class Delta:
+    """O que mudou entre a última revisão do projeto e o envio atual"""
+
+    campos: dict = field(default_factory=dict)
+    regioes: Optional[list] = field(default_factory=list)
+    trechos_removidos: list = field(default_factory=list)
+    trechos_adicionados: list = field(default_factory=list)
+
+    @property
+    def vazio(self) -> bool:
+        return not self.campos and self.regioes == []
+
+    @property
+    def fracao_regioes(self) -> float:
+        """Fração do diagrama alterada; 1.0 quando as miniaturas não puderam ser comparadas"""
+        if self.regioes is None:
+            return 1.0
+        return len(self.regioes) / (LINHAS_GRADE * COLUNAS_GRADE)
+
+    def resumo(self) -> dict:
+        return {
+            "changed_fields": list(self.campos),
+            "changed_regions": [list(regiao) for regiao in self.regioes or []]
+        }
+
+
+def dividir_trechos(texto: str) -> list:
+    return [trecho for trecho in re.split(r"(?<=[.!?;])\s+|\n+", texto.strip()) if trecho]
+
+
+def diferenca_texto(antes: str, depois: str):
+    """Frases removidas e adicionadas entre duas versões da descrição"""
+    trechos_antes, trechos_depois = dividir_trechos(antes), dividir_trechos(depois)
+    removidos, adicionados = [], []
+    comparador = difflib.SequenceMatcher(None, trechos_antes, trechos_depois, autojunk=False)
+    for operacao, i1, i2, j1, j2 in comparador.get_opcodes():
+        if operacao != "equal":
+            removidos.extend(trechos_antes[i1:i2])
+            adicionados.extend(trechos_depois[j1:j2])
+    return removidos, adicionados
+
+
+def calcular_delta(anterior: Revisao, formulario: dict, miniatura: Optional[bytes]) -> Delta:
+    delta = Delta()
+    for campo, valor in formulario.items():
+        valor_anterior = anterior.formulario.get(campo, "")
+        if " ".join(str(valor_anterior).split()) != " ".join(str(valor).split()):
+            delta.campos[campo] = (valor_anterior, valor)
+    if CAMPO_DESCRICAO in delta.campos:
+        delta.trechos_removidos, delta.trechos_adicionados = diferenca_texto(*delta.campos[CAMPO_DESCRICAO])
+
+    if miniatura is None or anterior.miniatura is None:
+        delta.regioes = None
+    else:
+        delta.regioes = regioes_alteradas(anterior.miniatura, miniatura)
+    return delta
+
+
+def aplicar_delta(resultado_anterior: dict, resposta: RespostaDelta):
+    """Aplica as ameaças incluídas, atualizadas e retiradas ao modelo da revisão anterior
+
+    Os ids são as posições em threat_model da revisão anterior; ids fora da lista são ignorados.
+    As sugestões de melhoria são substituídas pelas da resposta (ou mantidas, se ela não trouxer
+    nenhuma). Devolve o RespostaModelo resultante e a contagem de cada operação.
+    """
+    ameacas = [Ameaca.model_validate(ameaca) for ameaca in resultado_anterior.get("threat_model") or []]
+
+    atualizadas = set()
+    for atualizacao in resposta.update_threats:
+        if 0 <= atualizacao.id < len(ameacas):
+            ameacas[atualizacao.id] = Ameaca.model_validate(atualizacao.model_dump(exclude={"id"}))
+            atualizadas.add(atualizacao.id)
+    retiradas = {i for i in resposta.retire_threats if 0 <= i < len(ameacas)}
+    mantidas = [ameaca for i, ameaca in enumerate(ameacas) if i not in retiradas]
+
+    vistas = {(ameaca.threat_type, normalizar_texto(ameaca.scenario)) for ameaca in mantidas}
+    novas = []
+    for ameaca in resposta.add_threats:
+        chave = (ameaca.threat_type, normalizar_texto(ameaca.scenario))
+        if chave not in vistas:
+            vistas.add(chave)
+            novas.append(ameaca)
+
+    # Ordem estável por categoria: as ameaças novas entram no fim da própria categoria
+    modelo = sorted(
+        mantidas + novas,
+        key=lambda a: CATEGORIAS_STRIDE.index(a.threat_type) if a.threat_type in CATEGORIAS_STRIDE else len(CATEGORIAS_STRIDE)
+    )
+    sugestoes = resposta.improvement_suggestions or list(resultado_anterior.get("improvement_suggestions") or [])
+    contagens = {"added": len(novas), "updated": len(atualizadas - retiradas), "retired": len(retiradas)}
+    return RespostaModelo(threat_model=modelo, improvement_suggestions=sugestoes), contagens
+
+
+class RepositorioRevisoes:
+    """Revisões do modelo de ameaças de cada projeto, em SQLite (em disco com `caminho_sqlite`, senão em memória)
+
+    Cada revisão guarda o formulário, a miniatura do diagrama (para localizar as regiões
+    alteradas na revisão seguinte) e o resultado completo já mesclado. O arquivo pode ser
+    compartilhado pelos workers do uvicorn: o número da revisão é calculado e gravado na mesma
+    transação de escrita.
+    """
+
+    def __init__(self, caminho_sqlite=None):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(caminho_sqlite or ":memory:", check_same_thread=False)
+        if caminho_sqlite:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS revisoes ("
+            "projeto TEXT NOT NULL, numero INTEGER NOT NULL, formulario TEXT NOT NULL, miniatura BLOB, "
+            "resultado BLOB NOT NULL, modo TEXT NOT NULL, alteracoes TEXT NOT NULL, criado_em REAL NOT NULL, "
+            "PRIMARY KEY (projeto, numero))"
+        )
+        self._db.commit()
+
+    def salvar(self, projeto: str, formulario: dict, miniatura: Optional[bytes], resultado: dict,
+               modo: str, alteracoes: dict) -> Revisao:
+        with self._lock:
+            # BEGIN IMMEDIATE reserva a escrita antes do MAX: outro processo com o mesmo arquivo
+            # espera o commit em vez de calcular o mesmo número
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                numero = self._db.execute(
+                    "SELECT COALESCE(MAX(numero), 0) + 1 FROM revisoes WHERE projeto = ?", (projeto,)
+                ).fetchone()[0]
+                revisao = Revisao(projeto, numero, formulario, miniatura, resultado, modo, alteracoes, time.time())
+                self._db.execute(
+                    "INSERT INTO revisoes (projeto, numero, formulario, miniatura, resultado, modo, alteracoes, "
+                    "criado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (projeto, numero, json.dumps(formulario, ensure_ascii=False), miniatura,
+                     json.dumps(resultado, ensure_ascii=False).encode("utf-8"), modo,
+                     json.dumps(alteracoes, ensure_ascii=False), revisao.criado_em)
+                )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+        logger.info(f"Projeto {projeto}: revisão {numero} salva ({modo})")
+        return revisao
+
+    def ultima(self, projeto: str) -> Optional[Revisao]:
+        return self._consultar("WHERE projeto = ? ORDER BY numero DESC LIMIT 1", (projeto,))
+
+    def obter(self, projeto: str, numero: int) -> Optional[Revisao]:
+        return self._consultar("WHERE projeto = ? AND numero = ?", (projeto, numero))
+
+    def listar(self, projeto: str) -> list:
+        """Histórico do projeto sem os resultados, da primeira à última revisão"""
+        with self._lock:
+            linhas = self._db.execute(
+                "SELECT numero, modo, alteracoes, criado_em FROM revisoes WHERE projeto = ? ORDER BY numero",
+                (projeto,)
+            ).fetchall()
+        return [
+            {"revision": numero, "mode": modo, "changes": json.loads(alteracoes), "created_at": criado_em}
+            for numero, modo, alteracoes, criado_em in linhas
+        ]
+
+    def _consultar(self, filtro: str, parametros: tuple) -> Optional[Revisao]:
+        with self._lock:
+            linha = self._db.execute(
+                "SELECT projeto, numero, formulario, miniatura, resultado, modo, alteracoes, criado_em "
+                f"FROM revisoes {filtro}", parametros
+            ).fetchone()
+        if linha is None:
+            return None
+        projeto, numero, formulario, miniatura, resultado, modo, alteracoes, criado_em = linha
+        return Revisao(projeto, numero, json.loads(formulario), miniatura, json.loads(resultado), modo,
+                       json.loads(alteracoes), criado_em)
+
+    def fechar(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from cliente_openai import ClienteResiliente, FalhaModelo
+
+logger = logging.getLogger(__name__)
+
+ESTRATEGIAS = ("menor_carga", "latencia")
+
+
+def carregar_configuracao(valor: str, padrao: dict) -> list:
+    """Lê a lista de backends de AZURE_OPENAI_BACKENDS (JSON inline ou caminho de um arquivo JSON)
+
+    Cada item aceita nome, endpoint, deployment, api_key (ou api_key_env), api_version, peso,
+    prioridade (PTU antes de PAYG: menor valor é preferido), rpm, tpm e max_concorrencia.
+    Campos ausentes herdam de `padrao` (as variáveis AZURE_OPENAI_* de um único deployment).
+    """
+    texto = valor if valor.lstrip().startswith("[") else Path(valor).read_text(encoding="utf-8")
+    configs = []
+    for posicao, item in enumerate(json.loads(texto), start=1):
+        config = {**padrao, **item}
+        if "api_key_env" in item:
+            config["api_key"] = os.getenv(item["api_key_env"])
+        faltando = [c for c in ("endpoint", "deployment", "api_key") if not config.get(c)]
+        if faltando:
+            raise ValueError(f"Backend {posicao} de AZURE_OPENAI_BACKENDS sem os campos: {', '.join(faltando)}")
+        config.setdefault("nome", f"{config['deployment']}@{config['endpoint']}")
+        config["peso"] = float(config.get("peso", 1))
+        config["prioridade"] = int(config.get("prioridade", 0))
+        configs.append(config)
+    if not configs:
+        raise ValueError("AZURE_OPENAI_BACKENDS não contém nenhum backend")
+    return configs
+
+
+@dataclass
+class Backend:
+    nome: str
+    cliente: ClienteResiliente
+    peso: float = 1.0
+    prioridade: int = 0
+    em_andamento: int = 0
+    latencia_ewma: float = None
+    indisponivel_ate: float = 0.0
+    ultimo_erro: str = None
+    ultimo_status: int = None
+    contadores: dict = field(default_factory=lambda: {"requisicoes": 0, "sucessos": 0, "falhas": 0, "throttled": 0})
+
+    def disponivel_em(self) -> float:
+        """Instante (monotonic) a partir do qual o backend pode receber chamadas"""
+        fim = self.indisponivel_ate
+        if self.cliente.circuito.estado == "aberto":
+            fim = max(fim, time.monotonic() + self.cliente.circuito.restante_aberto())
+        return fim
+
+    def saturado(self) -> bool:
+        return self.em_andamento >= self.cliente.max_concorrencia
+
+    def estado(self) -> dict:
+        agora = time.monotonic()
+        if self.cliente.circuito.estado == "aberto":
+            situacao = "circuito_aberto"
+        elif self.indisponivel_ate > agora:
+            situacao = "throttled" if self.ultimo_status == 429 else "instavel"
+        else:
+            situacao = "saudavel"
+        return {
+            "nome": self.nome,
+            "deployment": self.cliente.deployment,
+            "estado": situacao,
+            "peso": self.peso,
+            "prioridade": self.prioridade,
+            "em_andamento": self.em_andamento,
+            "latencia_media_s": round(self.latencia_ewma, 3) if self.latencia_ewma is not None else None,
+            "disponivel_em_s": round(max(self.indisponivel_ate - agora, 0), 1),
+            "ultimo_erro": self.ultimo_erro,
+            "circuito": self.cliente.circuito.estado,
+            **self.contadores
+        }
+
+
+class RoteadorModelos:
+    """Distribui as chamadas entre vários deployments do Azure OpenAI
+
+    Escolhe o backend pela menor carga ponderada pelo peso (ou, na estratégia "latencia",
+    pela carga multiplicada pela latência média) entre os de melhor prioridade que não
+    estão saturados, em throttling ou com o circuit breaker aberto. Quando um backend
+    responde 429/5xx a chamada é refeita em outro, até `max_tentativas` trocas ou o prazo.
+    """
+
+    def __init__(self, backends: list, estrategia="menor_carga", max_tentativas=4, prazo=180.0,
+                 suavizacao=0.2):
+        if estrategia not in ESTRATEGIAS:
+            raise ValueError(f"Estratégia de roteamento inválida: {estrategia}. Use: {', '.join(ESTRATEGIAS)}")
+        self.backends = backends
+        self.estrategia = estrategia
+        self.max_tentativas = max_tentativas
+        self.prazo = prazo
+        self.suavizacao = suavizacao
+        self.failovers = 0
+
+    async def criar(self, messages, tokens_estimados=0, prazo=None, **parametros):
+        limite = time.monotonic() + (prazo or self.prazo)
+        tentativa = 0
+        while True:
+            backend = await self._escolher(limite)
+            backend.em_andamento += 1
+            backend.contadores["requisicoes"] += 1
+            inicio = time.monotonic()
+            try:
+                resposta = await backend.cliente.criar(
+                    messages, tokens_estimados, prazo=limite - time.monotonic(), **parametros
+                )
+                self._registrar_sucesso(backend, time.monotonic() - inicio)
+                return resposta
+            except FalhaModelo as fm:
+                tentativa = self._registrar_falha(backend, fm, tentativa, limite)
+            finally:
+                backend.em_andamento -= 1
+
+    async def criar_stream(self, messages, tokens_estimados=0, prazo=None, **parametros):
+        """O failover só é possível até o primeiro chunk; depois disso o erro vai para o chamador"""
+        limite = time.monotonic() + (prazo or self.prazo)
+        tentativa = 0
+        while True:
+            backend = await self._escolher(limite)
+            backend.em_andamento += 1
+            backend.contadores["requisicoes"] += 1
+            inicio = time.monotonic()
+            stream = backend.cliente.criar_stream(
+                messages, tokens_estimados, prazo=limite - time.monotonic(), **parametros
+            )
+            try:
+                try:
+                    primeiro = await stream.__anext__()
+                except StopAsyncIteration:
+                    return
+                except FalhaModelo as fm:
+                    tentativa = self._registrar_falha(backend, fm, tentativa, limite)
+                    continue
+                yield primeiro
+                async for chunk in stream:
+                    yield chunk
+                self._registrar_sucesso(backend, time.monotonic() - inicio)
+                return
+            finally:
+                backend.em_andamento -= 1
+                await stream.aclose()
+
+    def estado(self) -> list:
+        return [backend.estado() for backend in self.backends]
+
+    def disponiveis(self) -> int:
+        agora = time.monotonic()
+        return sum(1 for backend in self.backends if backend.disponivel_em() <= agora)
+
+    async def fechar(self):
+        for backend in self.backends:
+            await backend.cliente.client.close()
+
+    def _pontuacao(self, backend: Backend) -> float:
+        carga = (backend.em_andamento + 1) / backend.peso
+        if self.estrategia == "latencia":
+            # Backends ainda sem medição recebem a próxima chamada para serem medidos
+            return carga * (backend.latencia_ewma or 0.0)
+        return carga
+
+    async def _escolher(self, limite) -> Backend:
+        while True:
+            agora = time.monotonic()
+            candidatos = [b for b in self.backends if b.disponivel_em() <= agora]
+            if candidatos:
+                # Prioridade (ex.: PTU antes de PAYG) só transborda quando o backend preferido satura
+                return min(candidatos, key=lambda b: (b.saturado(), b.prioridade, self._pontuacao(b), random.random()))
+
+            # Throttling passa em segundos e vale esperar; com todos os circuitos abertos, falha rápido
+            espera = min(b.disponivel_em() for b in self.backends) - agora
+            circuitos_abertos = all(b.cliente.circuito.estado == "aberto" for b in self.backends)
+            if circuitos_abertos or agora + espera >= limite:
+                raise FalhaModelo(
+                    "Nenhum deployment do Azure OpenAI disponível (throttling ou circuit breaker aberto)",
+                    status_code=503, retry_after=max(int(espera) + 1, 1)
+                )
+            await asyncio.sleep(espera)
+
+    def _registrar_sucesso(self, backend: Backend, duracao: float):
+        backend.contadores["sucessos"] += 1
+        backend.ultimo_erro = None
+        backend.ultimo_status = None
+        if backend.latencia_ewma is None:
+            backend.latencia_ewma = duracao
+        else:
+            backend.latencia_ewma += self.suavizacao * (duracao - backend.latencia_ewma)
+
+    def _registrar_falha(self, backend: Backend, falha: FalhaModelo, tentativa: int, limite) -> int:
+        """Tira o backend de rotação pelo tempo sugerido e devolve o número da próxima tentativa"""
+        backend.ultimo_erro = str(falha)
+        backend.ultimo_status = falha.status_code
+        if falha.status_code == 429:
+            backend.contadores["throttled"] += 1
+        else:
+            backend.contadores["falhas"] += 1
+        backend.indisponivel_ate = time.monotonic() + (falha.retry_after or 1)
+
+        if tentativa >= self.max_tentativas or time.monotonic() >= limite or falha.status_code == 504:
+            raise falha
+        self.failovers += 1
+        logger.warning(f"Backend {backend.nome} falhou ({falha.status_code}); redirecionando a chamada")
+        return tentativa + 1
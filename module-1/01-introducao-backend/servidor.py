@@ -0,0 +1,88 @@
+"""
+Ponto de entrada de produção da API
+
+    python servidor.py
+
+Sobe o uvicorn com STRIDE_WORKERS processos, cada um com os próprios clientes e bancos (criados
+no lifespan de main.py). Usa uvloop e httptools quando instalados. Para desenvolvimento continue
+com `uvicorn main:app --reload`.
+"""
+
+import logging
+import os
+import tempfile
+from importlib.util import find_spec
+from pathlib import Path
+
+import uvicorn
+from dotenv import load_dotenv
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("servidor")
+
+DIRETORIO = Path(__file__).resolve().parent
+load_dotenv(dotenv_path=DIRETORIO / ".env")
+
+
+def nucleos_disponiveis() -> int:
+    """Núcleos que o processo pode usar (respeita o cpuset do container, quando houver)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+STRIDE_HOST = os.getenv("STRIDE_HOST", "0.0.0.0")
+# PORT é a variável usada pelo App Service e pela maioria das plataformas de container
+STRIDE_PORTA = int(os.getenv("STRIDE_PORTA") or os.getenv("PORT") or "8000")
+STRIDE_WORKERS = int(os.getenv("STRIDE_WORKERS") or nucleos_disponiveis())
+STRIDE_LOG_LEVEL = os.getenv("STRIDE_LOG_LEVEL", "info").lower()
+STRIDE_ACCESS_LOG = os.getenv("STRIDE_ACCESS_LOG", "false").lower() == "true"
+# Maior que o tempo ocioso do balanceador, para ele não reaproveitar uma conexão que o uvicorn já fechou
+STRIDE_KEEPALIVE = int(os.getenv("STRIDE_KEEPALIVE", "75"))
+STRIDE_SHUTDOWN_TIMEOUT = int(os.getenv("STRIDE_SHUTDOWN_TIMEOUT", "30"))
+
+
+def avisar_estado_por_worker():
+    """Com vários workers, o que fica em memória não é compartilhado entre eles"""
+    if STRIDE_WORKERS < 2:
+        return
+    if os.getenv("STRIDE_JOBS_BACKEND", "memoria").lower() != "sqlite":
+        logger.warning("Jobs em memória com vários workers: GET /jobs/{id} pode cair em outro processo. "
+                       "Use STRIDE_JOBS_BACKEND=sqlite")
+    if os.getenv("STRIDE_REVISOES_SQLITE", "revisoes.db") in ("", ":memory:"):
+        logger.warning("Revisões em memória com vários workers: cada worker terá o próprio histórico. "
+                       "Aponte STRIDE_REVISOES_SQLITE para um arquivo")
+
+
+def main():
+    loop = "uvloop" if find_spec("uvloop") else "asyncio"
+    http = "httptools" if find_spec("httptools") else "h11"
+
+    # O /metrics agrega os workers pelo diretório multiprocess do prometheus_client
+    if STRIDE_WORKERS > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="stride-metricas-")
+
+    avisar_estado_por_worker()
+    logger.info(f"Iniciando {STRIDE_WORKERS} worker(s) em {STRIDE_HOST}:{STRIDE_PORTA} (loop {loop}, http {http})")
+    uvicorn.run(
+        "main:app",
+        app_dir=str(DIRETORIO),
+        host=STRIDE_HOST,
+        port=STRIDE_PORTA,
+        workers=STRIDE_WORKERS,
+        loop=loop,
+        http=http,
+        log_level=STRIDE_LOG_LEVEL,
+        access_log=STRIDE_ACCESS_LOG,
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "*"),
+        timeout_keep_alive=STRIDE_KEEPALIVE,
+        timeout_graceful_shutdown=STRIDE_SHUTDOWN_TIMEOUT
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import difflib
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from itertools import combinations
+from typing import Optional
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps, ImageStat
+
+logger = logging.getLogger(__name__)
+
+# pHash: DCT da imagem reduzida a 32x32, bloco 8x8 de baixa frequência comparado com a mediana
+LADO_DCT = 32
+LADO_HASH = 8
+BITS_HASH = LADO_HASH * LADO_HASH
+
+_COSSENOS = [
+    [math.cos((2 * x + 1) * u * math.pi / (2 * LADO_DCT)) for x in range(LADO_DCT)]
+    for u in range(LADO_HASH)
+]
+
+# Miniatura e grade de regiões usadas para localizar o que mudou entre duas revisões do mesmo diagrama
+LADO_MINIATURA = 128
+LINHAS_GRADE = 4
+COLUNAS_GRADE = 4
+LIMIAR_REGIAO = 1.0
+
+CAMPOS_FORMULARIO = {
+    "tipo_aplicacao": 1.0,
+    "autenticacao": 1.0,
+    "acesso_internet": 1.0,
+    "dados_sensiveis": 1.0,
+    "descricao_aplicacao": 2.0
+}
+
+
+def _carregar_cinza(arquivo, lado_minimo: int) -> Image.Image:
+    """Imagem em tons de cinza, reduzida para perto de `lado_minimo` e com fundo claro"""
+    arquivo.seek(0)
+    with Image.open(arquivo) as img:
+        img.draft("L", (lado_minimo, lado_minimo))
+        img = ImageOps.exif_transpose(img)
+        # Redução por média antes do LANCZOS: o custo passa a depender pouco da resolução
+        fator = max(min(img.size) // lado_minimo, 1)
+        cinza = (img.reduce(fator) if fator > 1 else img).convert("L")
+    arquivo.seek(0)
+    if ImageStat.Stat(cinza).mean[0] < 128:
+        cinza = ImageOps.invert(cinza)
+    return cinza
+
+
+def calcular_phash(arquivo) -> int:
+    """Hash perceptual de 64 bits do diagrama
+
+    Insensível a escala (DPI), compressão e pequenas alterações como um carimbo de data. Diagramas
+    de tema escuro são invertidos antes do cálculo para coincidir com a versão de fundo claro.
+    """
+    cinza = _carregar_cinza(arquivo, LADO_DCT * 4)
+    pixels = list(cinza.resize((LADO_DCT, LADO_DCT), Image.LANCZOS).getdata())
+
+    # DCT separável calculada só para as frequências usadas no hash
+    linhas = [
+        [sum(c * p for c, p in zip(cossenos, pixels[y * LADO_DCT:(y + 1) * LADO_DCT])) for cossenos in _COSSENOS]
+        for y in range(LADO_DCT)
+    ]
+    coeficientes = [
+        sum(_COSSENOS[v][y] * linhas[y][u] for y in range(LADO_DCT))
+        for v in range(LADO_HASH) for u in range(LADO_HASH)
+    ]
+    # O componente DC (brilho médio) fica fora da mediana
+    mediana = sorted(coeficientes[1:])[len(coeficientes[1:]) // 2]
+    valor = 0
+    for coeficiente in coeficientes:
+        valor = (valor << 1) | (coeficiente > mediana)
+    return valor
+
+
+def calcular_miniatura(arquivo) -> bytes:
+    """Miniatura quadrada em tons de cinza (fundo claro, levemente borrada) usada para comparar
+    duas revisões do mesmo diagrama região a região"""
+    cinza = _carregar_cinza(arquivo, LADO_MINIATURA * 2)
+    miniatura = cinza.resize((LADO_MINIATURA, LADO_MINIATURA), Image.LANCZOS)
+    return miniatura.filter(ImageFilter.BoxBlur(1)).tobytes()
+
+
+def regioes_alteradas(antes: bytes, depois: bytes, limiar=LIMIAR_REGIAO) -> list:
+    """Regiões (linha, coluna), a partir de 1 no canto superior esquerdo, em que a diferença média
+    entre as miniaturas passa de `limiar` (escala de 0 a 255)"""
+    tamanho = (LADO_MINIATURA, LADO_MINIATURA)
+    diferenca = ImageChops.difference(Image.frombytes("L", tamanho, antes), Image.frombytes("L", tamanho, depois))
+    altura, largura = LADO_MINIATURA // LINHAS_GRADE, LADO_MINIATURA // COLUNAS_GRADE
+    alteradas = []
+    for linha in range(LINHAS_GRADE):
+        for coluna in range(COLUNAS_GRADE):
+            regiao = diferenca.crop((coluna * largura, linha * altura, (coluna + 1) * largura, (linha + 1) * altura))
+            if ImageStat.Stat(regiao).mean[0] > limiar:
+                alteradas.append((linha + 1, coluna + 1))
+    return alteradas
+
+
+def distancia_hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _normalizar(texto) -> str:
+    return " ".join(str(texto or "").casefold().split())
+
+
+def similaridade_formulario(a: dict, b: dict) -> float:
+    """Média ponderada da similaridade de cada campo (a descrição pesa o dobro), entre 0 e 1"""
+    total = peso_total = 0.0
+    for campo, peso in CAMPOS_FORMULARIO.items():
+        x, y = _normalizar(a.get(campo)), _normalizar(b.get(campo))
+        total += peso * (1.0 if x == y else difflib.SequenceMatcher(None, x, y).ratio())
+        peso_total += peso
+    return total / peso_total
+
+
+class IndiceHamming:
+    """Multi-index hashing: busca por distância de Hamming sem percorrer todos os hashes
+
+    O hash é dividido em `blocos` pedaços, cada um indexado em uma tabela. Se dois hashes estão a
+    distância <= r, algum pedaço difere em no máximo r // blocos bits (princípio da casa dos
+    pombos), então basta consultar as variações de cada pedaço com esse raio e conferir a
+    distância real apenas dos candidatos encontrados.
+    """
+
+    def __init__(self, bits=BITS_HASH, blocos=4):
+        self.bits = bits
+        self.blocos = blocos
+        self.largura = bits // blocos
+        self._mascara = (1 << self.largura) - 1
+        self._tabelas = [{} for _ in range(blocos)]
+        self._hashes = {}
+        self._mascaras = {}
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def adicionar(self, valor: int, identificador):
+        self._hashes[identificador] = valor
+        for bloco, tabela in enumerate(self._tabelas):
+            tabela.setdefault(self._pedaco(valor, bloco), []).append(identificador)
+
+    def buscar(self, valor: int, raio: int) -> list:
+        """Lista (distancia, identificador) dos hashes a no máximo `raio` bits, do mais próximo ao mais distante"""
+        mascaras = self._mascaras_raio(raio // self.blocos)
+        hashes = self._hashes
+        encontrados = {}
+        for bloco, tabela in enumerate(self._tabelas):
+            pedaco = (valor >> (bloco * self.largura)) & self._mascara
+            for mascara in mascaras:
+                for identificador in tabela.get(pedaco ^ mascara, ()):
+                    distancia = (hashes[identificador] ^ valor).bit_count()
+                    if distancia <= raio:
+                        encontrados[identificador] = distancia
+        return sorted(((d, i) for i, d in encontrados.items()), key=lambda item: item[0])
+
+    def _pedaco(self, valor, bloco):
+        return (valor >> (bloco * self.largura)) & self._mascara
+
+    def _mascaras_raio(self, raio):
+        """Máscaras XOR de todas as variações de um pedaço com até `raio` bits trocados (calculadas uma vez)"""
+        if raio not in self._mascaras:
+            mascaras = [0]
+            for distancia in range(1, raio + 1):
+                for posicoes in combinations(range(self.largura), distancia):
+                    mascaras.append(sum(1 << posicao for posicao in posicoes))
+            self._mascaras[raio] = mascaras
+        return self._mascaras[raio]
+
+
+@dataclass
+class Correspondencia:
+    id: int
+    distancia: int
+    similaridade_formulario: float
+    resultado: dict
+
+    def resumo(self) -> dict:
+        return {
+            "analysis_id": self.id,
+            "distance": self.distancia,
+            "form_similarity": round(self.similaridade_formulario, 3)
+        }
+
+
+class IndiceDiagramas:
+    """Índice local dos diagramas já analisados, por hash perceptual + campos do formulário
+
+    Os resultados ficam em SQLite (em memória, ou em disco com `caminho_sqlite`); em memória
+    ficam apenas os hashes e as tabelas do multi-index hashing. Com o arquivo compartilhado entre
+    workers, cada consulta carrega antes as análises gravadas pelos outros processos.
+    """
+
+    def __init__(self, caminho_sqlite=None, max_candidatos=20):
+        self.max_candidatos = max_candidatos
+        self.indice = IndiceHamming()
+        self._lock = threading.Lock()
+        self.contadores = {"consultas": 0, "correspondencias": 0, "armazenados": 0}
+        self._ultimo_id = 0
+        self._db = sqlite3.connect(caminho_sqlite or ":memory:", timeout=30, check_same_thread=False)
+        if caminho_sqlite:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS diagramas ("
+            "id INTEGER PRIMARY KEY, phash TEXT NOT NULL, formulario TEXT NOT NULL, "
+            "resultado BLOB NOT NULL, criado_em REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._carregar_novos()
+        if caminho_sqlite:
+            logger.info(f"Índice de diagramas carregado: {len(self.indice)} análises ({caminho_sqlite})")
+
+    def adicionar(self, phash: int, formulario: dict, resultado: dict) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO diagramas (phash, formulario, resultado, criado_em) VALUES (?, ?, ?, ?)",
+                (f"{phash:016x}", json.dumps(formulario, ensure_ascii=False),
+                 json.dumps(resultado, ensure_ascii=False).encode("utf-8"), time.time())
+            )
+            self._db.commit()
+            self._carregar_novos()
+            self.contadores["armazenados"] += 1
+            return cursor.lastrowid
+
+    def buscar(self, phash: int, formulario: dict, distancia_maxima: int,
+               similaridade_minima: float) -> Optional[Correspondencia]:
+        """Diagrama mais próximo cujo formulário também é parecido, ou None"""
+        with self._lock:
+            self.contadores["consultas"] += 1
+            self._carregar_novos()
+            for distancia, identificador in self.indice.buscar(phash, distancia_maxima)[:self.max_candidatos]:
+                linha = self._db.execute(
+                    "SELECT formulario FROM diagramas WHERE id = ?", (identificador,)
+                ).fetchone()
+                similaridade = similaridade_formulario(formulario, json.loads(linha[0]))
+                if similaridade < similaridade_minima:
+                    continue
+                resultado = self._db.execute(
+                    "SELECT resultado FROM diagramas WHERE id = ?", (identificador,)
+                ).fetchone()[0]
+                self.contadores["correspondencias"] += 1
+                return Correspondencia(identificador, distancia, similaridade, json.loads(resultado))
+            return None
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {**self.contadores, "diagramas": len(self.indice)}
+
+    def _carregar_novos(self):
+        """Adiciona ao índice em memória as linhas gravadas desde a última leitura (por este ou por outro worker)"""
+        for identificador, phash in self._db.execute(
+            "SELECT id, phash FROM diagramas WHERE id > ? ORDER BY id", (self._ultimo_id,)
+        ):
+            self.indice.adicionar(int(phash, 16), identificador)
+            self._ultimo_id = identificador
+
+    def fechar(self):
+        with self._lock:
+            self._db.close()
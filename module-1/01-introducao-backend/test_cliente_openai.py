@@ -0,0 +1,178 @@
+"""
+Testes do circuit breaker e do token bucket usados pelo ClienteResiliente
+
+Uso:
+    cd module-1/01-introducao-backend && python -m pytest -q test_cliente_openai.py
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APIStatusError
+
+from cliente_openai import CircuitBreaker, ClienteResiliente, FalhaModelo
+from limites import BaldeTokens
+
+
+def erro_http(status):
+    requisicao = httpx.Request("POST", "https://exemplo.openai.azure.com/chat/completions")
+    return APIStatusError(f"status {status}", response=httpx.Response(status, request=requisicao), body=None)
+
+
+class ClienteFalso:
+    """Imita client.chat.completions.create: cada chamada consome o próximo item de `respostas`
+    (exceção é lançada, "pendurar" espera até ser cancelada, o resto é devolvido)"""
+
+    def __init__(self, respostas):
+        self.respostas = list(respostas)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **parametros):
+        resposta = self.respostas.pop(0)
+        if resposta == "pendurar":
+            await asyncio.Event().wait()
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta
+
+
+RESPOSTA_OK = SimpleNamespace(usage=None, choices=[])
+
+
+def criar_cliente(respostas, limiar_falhas=2):
+    # tempo_circuito=0: o circuito aberto passa a meio-aberto na chamada seguinte
+    return ClienteResiliente(ClienteFalso(respostas), "gpt-4o-teste", max_tentativas=0, prazo=5,
+                             limiar_falhas=limiar_falhas, tempo_circuito=0)
+
+
+async def abrir_circuito(cliente):
+    for _ in range(cliente.circuito.limiar_falhas):
+        with pytest.raises(FalhaModelo):
+            await cliente.criar([])
+    assert cliente.circuito.estado == "aberto"
+
+
+def test_circuito_abre_apos_falhas_consecutivas_e_fecha_com_sucesso_no_teste():
+    circuito = CircuitBreaker(limiar_falhas=3, tempo_aberto=60)
+    for _ in range(2):
+        assert circuito.permitir()
+        circuito.registrar_falha()
+    assert circuito.estado == "fechado"
+    circuito.registrar_falha()
+    assert circuito.estado == "aberto"
+    assert not circuito.permitir()
+
+    circuito._aberto_em -= 60
+    assert circuito.permitir()
+    assert circuito.estado == "meio_aberto"
+    # Só uma chamada de teste por vez
+    assert not circuito.permitir()
+    circuito.registrar_sucesso()
+    assert circuito.estado == "fechado"
+    assert circuito.falhas_consecutivas == 0
+    assert circuito.permitir()
+
+
+def test_falha_no_teste_reabre_o_circuito():
+    circuito = CircuitBreaker(limiar_falhas=1, tempo_aberto=60)
+    circuito.registrar_falha()
+    circuito._aberto_em -= 60
+    assert circuito.permitir()
+    circuito.registrar_falha()
+    assert circuito.estado == "aberto"
+    assert not circuito.permitir()
+
+
+def test_liberar_teste_devolve_a_vaga_sem_fechar_o_circuito():
+    circuito = CircuitBreaker(limiar_falhas=1, tempo_aberto=0)
+    circuito.registrar_falha()
+    assert circuito.permitir()
+    assert not circuito.permitir()
+    circuito.liberar_teste()
+    assert circuito.estado == "meio_aberto"
+    assert circuito.permitir()
+
+
+def test_4xx_na_chamada_de_teste_fecha_o_circuito():
+    cliente = criar_cliente([erro_http(500), erro_http(500), erro_http(400), RESPOSTA_OK])
+
+    async def cenario():
+        await abrir_circuito(cliente)
+        with pytest.raises(APIStatusError):
+            await cliente.criar([])
+        assert cliente.circuito.estado == "fechado"
+        assert await cliente.criar([]) is RESPOSTA_OK
+
+    asyncio.run(cenario())
+
+
+def test_429_final_na_chamada_de_teste_libera_a_vaga():
+    cliente = criar_cliente([erro_http(500), erro_http(500), erro_http(429), RESPOSTA_OK])
+
+    async def cenario():
+        await abrir_circuito(cliente)
+        with pytest.raises(FalhaModelo) as erro:
+            await cliente.criar([])
+        assert erro.value.status_code == 429
+        assert cliente.circuito.estado == "meio_aberto"
+        assert await cliente.criar([]) is RESPOSTA_OK
+        assert cliente.circuito.estado == "fechado"
+
+    asyncio.run(cenario())
+
+
+def test_chamada_de_teste_cancelada_libera_a_vaga():
+    cliente = criar_cliente([erro_http(500), erro_http(500), "pendurar", RESPOSTA_OK])
+
+    async def cenario():
+        await abrir_circuito(cliente)
+        tarefa = asyncio.create_task(cliente.criar([]))
+        await asyncio.sleep(0.01)
+        tarefa.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarefa
+        assert await cliente.criar([]) is RESPOSTA_OK
+
+    asyncio.run(cenario())
+
+
+def test_circuito_aberto_rejeita_sem_chamar_o_deployment():
+    cliente = ClienteResiliente(ClienteFalso([erro_http(500)]), "gpt-4o-teste", max_tentativas=0,
+                                limiar_falhas=1, tempo_circuito=60)
+
+    async def cenario():
+        with pytest.raises(FalhaModelo):
+            await cliente.criar([])
+        with pytest.raises(FalhaModelo) as erro:
+            await cliente.criar([])
+        assert erro.value.status_code == 503
+        assert cliente.contadores["rejeitadas_circuito"] == 1
+        assert cliente.contadores["chamadas"] == 1
+
+    asyncio.run(cenario())
+
+
+def test_balde_entrega_a_rajada_e_depois_limita_pela_taxa():
+    async def cenario():
+        balde = BaldeTokens(taxa=20, capacidade=2)
+        inicio = time.monotonic()
+        await balde.adquirir()
+        await balde.adquirir()
+        assert time.monotonic() - inicio < 0.02
+        await balde.adquirir()
+        assert time.monotonic() - inicio >= 0.04
+
+    asyncio.run(cenario())
+
+
+def test_balde_pedido_maior_que_a_capacidade_consome_o_balde_cheio():
+    async def cenario():
+        balde = BaldeTokens(taxa=1000, capacidade=10)
+        await asyncio.wait_for(balde.adquirir(50), timeout=1)
+        assert balde.tokens < 1
+        assert balde.tempo_ate(10) > 0
+
+    asyncio.run(cenario())
@@ -0,0 +1,45 @@
+"""
+Testes do parse das respostas do modelo (analisar_resposta)
+
+Uso:
+    cd module-1/01-introducao-backend && python -m pytest -q test_esquema.py
+"""
+
+import pytest
+
+from esquema import RespostaParcial, RespostaSugestoes, analisar_resposta
+
+AMEACA = ('{"Threat Type": "Spoofing", "Scenario": "Token roubado", '
+          '"Potential Impact": "Acesso indevido", "Mitigation": "MFA"}')
+
+
+@pytest.mark.parametrize("texto", ["{}", '{"threats": []}', '{"improvement_suggestions": ["x"]}',
+                                   '```json\n{"threats": [' + AMEACA + ']}\n```', '{"threat'])
+def test_resposta_sem_threat_model_e_falha_de_parse(texto):
+    with pytest.raises(ValueError):
+        analisar_resposta(texto)
+
+
+def test_resposta_valida_nao_passa_pelo_reparo():
+    resposta, reparada = analisar_resposta('{"threat_model": [' + AMEACA + '], "improvement_suggestions": ["x"]}')
+    assert not reparada
+    assert resposta.threat_model[0].threat_type == "Spoofing"
+    assert resposta.improvement_suggestions == ["x"]
+
+
+def test_resposta_cortada_e_reparada():
+    resposta, reparada = analisar_resposta('{"threat_model": [' + AMEACA + ', {"Threat Type": "Tamp')
+    assert reparada
+    assert len(resposta.threat_model) == 1
+
+
+def test_parte_de_sugestoes_exige_so_improvement_suggestions():
+    resposta, _ = analisar_resposta('{"improvement_suggestions": ["x"]}', RespostaSugestoes)
+    assert resposta.improvement_suggestions == ["x"]
+    with pytest.raises(ValueError):
+        analisar_resposta("{}", RespostaSugestoes)
+
+
+def test_continuacao_aceita_trecho_sem_threat_model():
+    resposta, _ = analisar_resposta('{"improvement_suggestions": ["x"]}', RespostaParcial)
+    assert resposta.threat_model == []
@@ -0,0 +1,107 @@
+"""
+Testes das exportações em CSV e XLSX (sem servidor nem Azure)
+
+Uso:
+    cd module-1/01-introducao-backend && python -m pytest -q test_exportacao.py
+"""
+
+import csv
+import io
+import random
+import zipfile
+from xml.etree import ElementTree
+
+import pytest
+
+import exportacao
+from exportacao import COLUNAS, analise_de_resultado, gerar_csv, gerar_xlsx
+
+NS = {"s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+
+def criar_analise(id_analise, cenarios, sugestoes=()):
+    resultado = {
+        "summary": {"application_type": "=HYPERLINK(\"http://x\")", "has_internet_access": "Sim",
+                    "authentication_method": "OAuth"},
+        "threat_model": [{"Threat Type": "Tampering", "Scenario": cenario, "Potential Impact": "Alto"}
+                         for cenario in cenarios],
+        "improvement_suggestions": list(sugestoes)
+    }
+    return analise_de_resultado(resultado, id_analise, "p", 1_700_000_000)
+
+
+def ler_csv(blocos):
+    texto = b"".join(blocos).decode("utf-8")
+    assert texto.startswith("\ufeff")
+    return list(csv.reader(io.StringIO(texto[1:])))
+
+
+def ler_planilhas(blocos):
+    """Abre o XLSX gerado em fluxo com o zipfile e devolve {nome da planilha: linhas de texto}"""
+    with zipfile.ZipFile(io.BytesIO(b"".join(blocos))) as arquivo:
+        assert arquivo.testzip() is None
+        assert "[Content_Types].xml" in arquivo.namelist()
+        livro = ElementTree.fromstring(arquivo.read("xl/workbook.xml"))
+        planilhas = {}
+        for indice, planilha in enumerate(livro.iterfind("s:sheets/s:sheet", NS), start=1):
+            raiz = ElementTree.fromstring(arquivo.read(f"xl/worksheets/sheet{indice}.xml"))
+            planilhas[planilha.get("name")] = [
+                [celula.findtext("s:is/s:t", default=None, namespaces=NS) for celula in linha.iterfind("s:c", NS)]
+                for linha in raiz.iterfind("s:sheetData/s:row", NS)
+            ]
+    return planilhas
+
+
+@pytest.mark.parametrize("cenario", ["=1+1", "+SOMA(A1)", "-2", "@cmd", "\tTAB", "\rCR"])
+def test_csv_neutraliza_celulas_que_viram_formula(cenario):
+    linhas = ler_csv(gerar_csv([criar_analise(1, [cenario])]))
+    assert linhas[0] == COLUNAS
+    registro = dict(zip(COLUNAS, linhas[1]))
+    assert registro["scenario"] == "'" + cenario
+    assert registro["application_type"] == "'=HYPERLINK(\"http://x\")"
+
+
+def test_csv_mantem_textos_comuns_e_uma_linha_por_registro():
+    linhas = ler_csv(gerar_csv([criar_analise(1, ["Token, roubado", 'Aspas "duplas"'], ["Usar MFA"]),
+                                criar_analise(2, ["Linha\nquebrada"])]))
+    registros = [dict(zip(COLUNAS, linha)) for linha in linhas[1:]]
+    assert [(r["analysis_id"], r["record"]) for r in registros] == [
+        ("1", "threat"), ("1", "threat"), ("1", "suggestion"), ("2", "threat")
+    ]
+    assert [r["scenario"] for r in registros] == ["Token, roubado", 'Aspas "duplas"', "", "Linha\nquebrada"]
+    assert registros[2]["suggestion"] == "Usar MFA"
+    assert registros[0]["created_at"] == "2023-11-14T22:13:20Z"
+
+
+def test_xlsx_em_fluxo_abre_com_o_zipfile():
+    planilhas = ler_planilhas(gerar_xlsx([criar_analise(1, ["=1+1", "Texto <com> & XML\x01"], ["Usar MFA"])]))
+    assert list(planilhas) == ["Ameacas"]
+    cabecalho, *linhas = planilhas["Ameacas"]
+    assert cabecalho == COLUNAS
+    registros = [dict(zip(COLUNAS, linha)) for linha in linhas]
+    # String inline nunca é avaliada como fórmula; caracteres de controle saem do XML
+    assert [r["scenario"] for r in registros] == ["=1+1", "Texto <com> & XML", None]
+    assert registros[2]["suggestion"] == "Usar MFA"
+
+
+def test_xlsx_continua_em_outra_planilha_acima_do_limite_de_linhas(monkeypatch):
+    monkeypatch.setattr(exportacao, "LIMITE_LINHAS_XLSX", 4)
+    planilhas = ler_planilhas(gerar_xlsx([criar_analise(i, [f"c{i}"]) for i in range(7)]))
+    assert list(planilhas) == ["Ameacas", "Ameacas 2", "Ameacas 3"]
+    # Cabeçalho + 3 ameaças por planilha
+    assert [len(linhas) for linhas in planilhas.values()] == [4, 4, 2]
+    cenarios = [linha[COLUNAS.index("scenario")] for linhas in planilhas.values() for linha in linhas[1:]]
+    assert cenarios == [f"c{i}" for i in range(7)]
+
+
+def test_xlsx_sem_analises_tem_uma_planilha_so_com_o_cabecalho():
+    assert ler_planilhas(gerar_xlsx([])) == {"Ameacas": [COLUNAS]}
+
+
+def test_xlsx_grande_sai_em_varios_blocos_e_continua_valido():
+    # Texto que não se comprime a quase nada, para o zip passar de um bloco
+    aleatorio = random.Random(0)
+    analises = [criar_analise(i, [aleatorio.randbytes(100).hex() for _ in range(5)]) for i in range(500)]
+    blocos = list(gerar_xlsx(analises))
+    assert len(blocos) > 1
+    assert len(ler_planilhas(blocos)["Ameacas"]) == 1 + 500 * 5
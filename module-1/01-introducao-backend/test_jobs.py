@@ -0,0 +1,227 @@
+"""
+Testes da fila de jobs e do pool de workers (sem servidor nem Azure)
+
+Uso:
+    cd module-1/01-introducao-backend && python -m pytest -q test_jobs.py
+"""
+
+import asyncio
+import socket
+import sqlite3
+import time
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from jobs import FilaJobs, FilaMemoria, FilaSQLite, GerenciadorJobs, Job, validar_webhook
+
+
+async def analisar_ok(conteudo, nome_arquivo, formulario):
+    return {"threat_model": []}, None
+
+
+class FilaInstavel(FilaMemoria):
+    """Falha nas primeiras `falhas` chamadas de atualizar"""
+
+    def __init__(self, falhas):
+        super().__init__()
+        self.falhas = falhas
+
+    async def atualizar(self, job):
+        if self.falhas > 0:
+            self.falhas -= 1
+            raise RuntimeError("disco cheio")
+        await super().atualizar(job)
+
+
+class FilaSemInicio(FilaMemoria):
+    """Entrega o job sem iniciado_em: _executar falha antes de chamar a análise"""
+
+    async def proximo(self):
+        job, conteudo = await super().proximo()
+        job.iniciado_em = None
+        return job, conteudo
+
+
+async def aguardar_status(fila, job_id, status, timeout=2):
+    async def aguardar():
+        while (await fila.obter(job_id)).status != status:
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(aguardar(), timeout)
+
+
+def test_fila_sem_todos_os_metodos_nao_instancia():
+    class FilaIncompleta(FilaJobs):
+        async def enfileirar(self, job, conteudo):
+            pass
+
+    with pytest.raises(TypeError):
+        FilaIncompleta()
+
+
+def test_worker_sobrevive_a_falha_fora_da_analise():
+    async def cenario():
+        fila = FilaInstavel(falhas=1)
+        gerenciador = GerenciadorJobs(fila, analisar_ok, workers=1)
+        await gerenciador.iniciar()
+        try:
+            primeiro = await gerenciador.submeter(b"a", "a.png", {})
+            segundo = await gerenciador.submeter(b"b", "b.png", {})
+            await aguardar_status(fila, segundo.id, "concluido")
+            # A gravação que falhou é refeita pelo worker com o status final
+            assert (await fila.obter(primeiro.id)).status == "concluido"
+        finally:
+            await gerenciador.parar()
+
+    asyncio.run(cenario())
+
+
+def test_job_que_falha_antes_da_analise_fica_com_erro():
+    async def cenario():
+        fila = FilaSemInicio()
+        gerenciador = GerenciadorJobs(fila, analisar_ok, workers=1)
+        await gerenciador.iniciar()
+        try:
+            job = await gerenciador.submeter(b"a", "a.png", {})
+            await aguardar_status(fila, job.id, "erro")
+            assert gerenciador.metricas["erros"] == 1
+            assert "Erro interno" in (await fila.obter(job.id)).erro
+        finally:
+            await gerenciador.parar()
+
+    asyncio.run(cenario())
+
+
+def test_sqlite_nao_retoma_job_com_lease_valido_de_outro_worker(tmp_path):
+    async def cenario():
+        caminho = tmp_path / "jobs.db"
+        primeira = FilaSQLite(caminho, intervalo_consulta=0.01, lease=60)
+        await primeira.enfileirar(Job(id="a", formulario={}, nome_arquivo="a.png"), b"a")
+        job, _ = await primeira.proximo()
+        assert job.id == "a"
+
+        # Outro worker sobe com o job ainda em execução na primeira fila
+        segunda = FilaSQLite(caminho, intervalo_consulta=0.01, lease=60)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(segunda.proximo(), 0.1)
+
+        # O lease venceu (o processo da primeira fila caiu): o job é retomado
+        primeira._db.execute("UPDATE jobs SET lease_ate = 0 WHERE id = 'a'")
+        primeira._db.commit()
+        job, conteudo = await asyncio.wait_for(segunda.proximo(), 1)
+        assert (job.id, conteudo) == ("a", b"a")
+        await primeira.fechar()
+        await segunda.fechar()
+
+    asyncio.run(cenario())
+
+
+def test_sqlite_renova_o_lease_dos_proprios_jobs(tmp_path):
+    async def cenario():
+        fila = FilaSQLite(tmp_path / "jobs.db", lease=0.3)
+        await fila.enfileirar(Job(id="a", formulario={}, nome_arquivo="a.png"), b"a")
+        await fila.proximo()
+        await asyncio.sleep(0.5)
+        lease_ate = fila._db.execute("SELECT lease_ate FROM jobs WHERE id = 'a'").fetchone()[0]
+        assert lease_ate > time.time()
+        await fila.fechar()
+
+    asyncio.run(cenario())
+
+
+def test_sqlite_ocupado_nao_trava_o_event_loop(tmp_path):
+    async def cenario():
+        caminho = tmp_path / "jobs.db"
+        fila = FilaSQLite(caminho)
+        # Outro processo segura a escrita no arquivo
+        outro = sqlite3.connect(caminho, isolation_level=None)
+        outro.execute("BEGIN EXCLUSIVE")
+        enfileirar = asyncio.create_task(fila.enfileirar(Job(id="a", formulario={}, nome_arquivo="a.png"), b"a"))
+        inicio = time.monotonic()
+        await asyncio.sleep(0.2)
+        assert time.monotonic() - inicio < 0.5
+        assert not enfileirar.done()
+        outro.execute("COMMIT")
+        await asyncio.wait_for(enfileirar, 5)
+        assert await fila.tamanho() == 1
+        outro.close()
+        await fila.fechar()
+
+    asyncio.run(cenario())
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://exemplo.com/x", "http://127.0.0.1:8000/webhook", "http://localhost/webhook", "http://10.0.0.5/",
+    "http://169.254.169.254/latest/meta-data/", "http://[::1]/", "http://[::ffff:127.0.0.1]/", "http://0.0.0.0/"
+])
+def test_webhook_para_rede_interna_e_recusado(url):
+    with pytest.raises(ValueError):
+        asyncio.run(validar_webhook(url))
+
+
+def test_webhook_com_endereco_publico_e_aceito():
+    asyncio.run(validar_webhook("https://93.184.216.34/webhook"))
+
+
+def test_lista_de_hosts_permitidos_substitui_a_checagem_de_endereco():
+    permitidos = frozenset({"127.0.0.1"})
+    asyncio.run(validar_webhook("http://127.0.0.1:8000/webhook", permitidos))
+    with pytest.raises(ValueError):
+        asyncio.run(validar_webhook("https://93.184.216.34/webhook", permitidos))
+
+
+def test_metricas_do_modo_job_chegam_ao_prometheus():
+    def amostra(nome, rotulos=None):
+        return REGISTRY.get_sample_value(nome, rotulos or {}) or 0
+
+    async def cenario():
+        fila = FilaMemoria()
+        gerenciador = GerenciadorJobs(fila, analisar_ok, workers=1)
+        antes = amostra("stride_jobs_execucao_segundos_count", {"status": "concluido"})
+        await gerenciador.submeter(b"a", "a.png", {})
+        assert amostra("stride_jobs_fila") == 1
+        await gerenciador.iniciar()
+        try:
+            await gerenciador.submeter(b"b", "b.png", {})
+            await asyncio.sleep(0.1)
+        finally:
+            await gerenciador.parar()
+        assert amostra("stride_jobs_execucao_segundos_count", {"status": "concluido"}) - antes == 2
+        assert amostra("stride_jobs_fila") == 0
+        assert amostra("stride_jobs_espera_segundos_count") >= 2
+
+    asyncio.run(cenario())
+
+
+def test_webhook_conecta_no_endereco_conferido():
+    enviados = []
+
+    def receber(requisicao):
+        enviados.append(requisicao)
+        return httpx.Response(200)
+
+    async def cenario():
+        respostas_dns = ["93.184.216.34", "169.254.169.254"]
+
+        async def resolver(host, porta, **kwargs):
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (respostas_dns.pop(0), porta))]
+
+        asyncio.get_running_loop().getaddrinfo = resolver
+        gerenciador = GerenciadorJobs(FilaMemoria(), analisar_ok)
+        gerenciador._http = httpx.AsyncClient(transport=httpx.MockTransport(receber))
+        job = Job(id="a", formulario={}, nome_arquivo="a.png", webhook_url="https://hooks.exemplo.com:8443/job")
+
+        # Primeiro envio: o nome resolve para o endereço público e a conexão vai direto para ele
+        await gerenciador._notificar(job)
+        # Segundo envio: o DNS passou a apontar para o endpoint de metadados (rebinding)
+        await gerenciador._notificar(job)
+        await gerenciador._http.aclose()
+        return gerenciador.metricas
+
+    metricas = asyncio.run(cenario())
+    assert len(enviados) == 1
+    assert enviados[0].url.host == "93.184.216.34"
+    assert enviados[0].headers["Host"] == "hooks.exemplo.com:8443"
+    assert enviados[0].extensions["sni_hostname"] == "hooks.exemplo.com"
+    assert (metricas["webhooks_enviados"], metricas["webhooks_falhos"]) == (1, 1)
@@ -0,0 +1,104 @@
+"""
+Testes da análise em lote (sem servidor nem Azure)
+
+Uso:
+    cd module-1/01-introducao-backend && python -m pytest -q test_lote.py
+"""
+
+import asyncio
+import json
+import threading
+
+from lote import ExecucaoLote, ItemLote, ler_concluidos
+
+FORMULARIO = {"tipo_aplicacao": "API", "autenticacao": "OAuth", "acesso_internet": "Sim",
+              "dados_sensiveis": "Nenhum", "descricao_aplicacao": "Serviço de teste"}
+
+
+class FonteMemoria:
+    """Imita FonteDiagramas e conta quantas imagens lidas ainda não foram liberadas pela análise"""
+
+    def __init__(self, imagens):
+        self.imagens = imagens
+        self.lidas = []
+        self.em_memoria = 0
+        self.pico = 0
+        self._lock = threading.Lock()
+
+    def ler(self, nome):
+        with self._lock:
+            self.lidas.append(nome)
+            self.em_memoria += 1
+            self.pico = max(self.pico, self.em_memoria)
+        return self.imagens[nome]
+
+    def liberar(self):
+        with self._lock:
+            self.em_memoria -= 1
+
+
+def criar_itens(nomes):
+    return [ItemLote(id=f"item-{i}", imagem=nome, formulario=dict(FORMULARIO)) for i, nome in enumerate(nomes)]
+
+
+def executar(execucao):
+    async def consumir():
+        return [registro async for registro in execucao.executar()]
+    return asyncio.run(consumir())
+
+
+def test_concorrencia_limita_as_imagens_em_memoria():
+    nomes = [f"d{i}.png" for i in range(30)]
+    fonte = FonteMemoria({nome: nome.encode() for nome in nomes})
+
+    async def analisar(conteudo, nome_arquivo, formulario):
+        await asyncio.sleep(0.01)
+        fonte.liberar()
+        return {"threat_model": []}, "MISS"
+
+    execucao = ExecucaoLote(itens=criar_itens(nomes), fonte=fonte, analisar=analisar, concorrencia=3)
+    registros = executar(execucao)
+    assert len(registros) == 30
+    assert all(registro["status"] == "ok" for registro in registros)
+    assert fonte.pico <= 3
+
+
+def test_diagramas_identicos_sao_analisados_uma_vez():
+    fonte = FonteMemoria({"a.png": b"igual", "b.png": b"igual", "c.png": b"outro"})
+    chamadas = []
+
+    async def analisar(conteudo, nome_arquivo, formulario):
+        chamadas.append(nome_arquivo)
+        await asyncio.sleep(0.05)
+        return {"threat_model": [], "origem": nome_arquivo}, "MISS"
+
+    execucao = ExecucaoLote(itens=criar_itens(["a.png", "b.png", "c.png"]), fonte=fonte, analisar=analisar,
+                            concorrencia=1)
+    registros = {registro["id"]: registro for registro in executar(execucao)}
+    assert sorted(chamadas) == ["a.png", "c.png"]
+    assert registros["item-1"]["status"] == "duplicado"
+    assert registros["item-1"]["duplicado_de"] == "item-0"
+    assert registros["item-1"]["resultado"] == registros["item-0"]["resultado"]
+    assert execucao.relatorio()["duplicados"] == 1
+
+
+def test_retomada_pula_os_itens_ja_concluidos(tmp_path):
+    saida = tmp_path / "resultados.jsonl"
+    registros = [{"id": "item-0", "status": "ok"}, {"id": "item-1", "status": "erro"},
+                 {"id": "item-2", "status": "duplicado"}]
+    # A última linha ficou truncada pela interrupção
+    saida.write_text("".join(json.dumps(r) + "\n" for r in registros) + '{"id": "item-3", "sta', encoding="utf-8")
+    assert ler_concluidos(saida) == {"item-0", "item-2"}
+
+    nomes = [f"d{i}.png" for i in range(4)]
+    fonte = FonteMemoria({nome: nome.encode() for nome in nomes})
+
+    async def analisar(conteudo, nome_arquivo, formulario):
+        return {"threat_model": []}, "MISS"
+
+    execucao = ExecucaoLote(itens=criar_itens(nomes), fonte=fonte, analisar=analisar, caminho_saida=saida)
+    novos = executar(execucao)
+    assert sorted(registro["id"] for registro in novos) == ["item-1", "item-3"]
+    assert sorted(fonte.lidas) == ["d1.png", "d3.png"]
+    assert execucao.relatorio()["retomados"] == 2
+    assert ler_concluidos(saida) == {"item-0", "item-1", "item-2", "item-3"}
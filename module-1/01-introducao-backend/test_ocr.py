@@ -0,0 +1,58 @@
+"""
+Testes do prazo da extração do diagrama (sem servidor nem Azure)
+
+Uso:
+    cd module-1/01-introducao-backend && python -m pytest -q test_ocr.py
+"""
+
+import io
+import time
+
+import pytest
+from PIL import Image, ImageDraw
+
+import ocr
+from ocr import extrair_diagrama
+
+
+def criar_diagrama():
+    img = Image.new("L", (400, 200), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((20, 50, 140, 150), outline="black", width=2)
+    draw.rectangle((260, 50, 380, 150), outline="black", width=2)
+    draw.line([(140, 100), (260, 100)], fill="black", width=2)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def ler_rotulos(img, idioma, prazo=None):
+    return [ocr.Rotulo("Frontend", (40, 90, 100, 105)), ocr.Rotulo("Backend", (280, 90, 340, 105))]
+
+
+def test_sem_prazo_a_extracao_conclui(monkeypatch):
+    monkeypatch.setitem(ocr.BACKENDS, "fixo", ler_rotulos)
+    extracao = extrair_diagrama(criar_diagrama(), "fixo")
+    assert extracao.componentes == ["Frontend", "Backend"]
+    assert [fluxo[:2] for fluxo in extracao.fluxos] == [("Frontend", "Backend")]
+
+
+def test_tarefa_que_saiu_da_fila_depois_do_prazo_nao_roda(monkeypatch):
+    chamadas = []
+    monkeypatch.setitem(ocr.BACKENDS, "fixo", lambda *args: chamadas.append(args) or [])
+    with pytest.raises(TimeoutError):
+        extrair_diagrama(criar_diagrama(), "fixo", prazo=time.time() - 1)
+    assert chamadas == []
+
+
+def test_prazo_vencido_na_leitura_dos_rotulos_interrompe_a_extracao(monkeypatch):
+    prazo = time.time() + 60
+
+    def ler_e_atrasar(img, idioma, prazo_backend):
+        # O OCR consumiu o prazo inteiro: o agrupamento e a detecção de fluxos não devem rodar
+        monkeypatch.setattr(ocr.time, "time", lambda: prazo + 1)
+        return ler_rotulos(img, idioma)
+
+    monkeypatch.setitem(ocr.BACKENDS, "lento", ler_e_atrasar)
+    with pytest.raises(TimeoutError):
+        extrair_diagrama(criar_diagrama(), "lento", prazo=prazo)
@@ -0,0 +1,115 @@
+"""
+Testes das revisões por projeto (sem servidor nem Azure)
+
+Uso:
+    cd module-1/01-introducao-backend && python -m pytest -q test_revisoes.py
+"""
+
+import threading
+
+from esquema import RespostaDelta
+from revisoes import RepositorioRevisoes, Revisao, aplicar_delta, calcular_delta
+from similaridade import LADO_MINIATURA
+
+FORMULARIO = {"tipo_aplicacao": "API", "autenticacao": "OAuth", "acesso_internet": "Sim",
+              "dados_sensiveis": "Nenhum", "descricao_aplicacao": "Recebe pedidos. Grava no banco."}
+BRANCA = bytes([255]) * (LADO_MINIATURA * LADO_MINIATURA)
+
+
+def ameaca(tipo, cenario):
+    return {"Threat Type": tipo, "Scenario": cenario, "Potential Impact": "Impacto"}
+
+
+def revisao(formulario=FORMULARIO, miniatura=BRANCA, resultado=None):
+    return Revisao("p", 1, formulario, miniatura, resultado or {}, "completa", {}, 0.0)
+
+
+def test_workers_com_o_mesmo_arquivo_numeram_as_revisoes_sem_colisao(tmp_path):
+    caminho = str(tmp_path / "revisoes.db")
+    repositorios = [RepositorioRevisoes(caminho) for _ in range(4)]
+    erros = []
+
+    def salvar(repositorio):
+        try:
+            for _ in range(10):
+                repositorio.salvar("p", {}, None, {"threat_model": []}, "completa", {})
+        except Exception as e:
+            erros.append(e)
+
+    threads = [threading.Thread(target=salvar, args=(repositorio,)) for repositorio in repositorios]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert erros == []
+    assert [revisao["revision"] for revisao in repositorios[0].listar("p")] == list(range(1, 41))
+    for repositorio in repositorios:
+        repositorio.fechar()
+
+
+def test_envio_igual_a_revisao_anterior_tem_delta_vazio():
+    # Espaços a mais na descrição não contam como mudança
+    formulario = {**FORMULARIO, "descricao_aplicacao": "Recebe  pedidos.\nGrava no banco. "}
+    delta = calcular_delta(revisao(), formulario, BRANCA)
+    assert delta.vazio
+    assert delta.fracao_regioes == 0.0
+
+
+def test_delta_traz_campos_frases_e_regioes_alteradas():
+    formulario = {**FORMULARIO, "acesso_internet": "Não",
+                  "descricao_aplicacao": "Recebe pedidos. Publica eventos na fila."}
+    # Um retângulo escuro no canto superior esquerdo da miniatura (região 1, 1)
+    miniatura = bytearray(BRANCA)
+    for y in range(LADO_MINIATURA // 8):
+        inicio = y * LADO_MINIATURA
+        miniatura[inicio:inicio + LADO_MINIATURA // 8] = bytes(LADO_MINIATURA // 8)
+
+    delta = calcular_delta(revisao(), formulario, bytes(miniatura))
+    assert set(delta.campos) == {"acesso_internet", "descricao_aplicacao"}
+    assert delta.trechos_removidos == ["Grava no banco."]
+    assert delta.trechos_adicionados == ["Publica eventos na fila."]
+    assert delta.resumo()["changed_regions"] == [[1, 1]]
+
+
+def test_sem_miniatura_anterior_o_diagrama_conta_como_todo_alterado():
+    delta = calcular_delta(revisao(miniatura=None), FORMULARIO, BRANCA)
+    assert delta.regioes is None
+    assert delta.fracao_regioes == 1.0
+    assert not delta.vazio
+
+
+def test_aplicar_delta_inclui_atualiza_e_retira_por_posicao():
+    anterior = {
+        "threat_model": [ameaca("Spoofing", "Token roubado"), ameaca("Tampering", "Pedido alterado"),
+                         ameaca("Denial of Service", "Excesso de pedidos")],
+        "improvement_suggestions": ["Usar MFA"]
+    }
+    resposta = RespostaDelta.model_validate({
+        "add_threats": [ameaca("Spoofing", "Chave de API vazada"),
+                        # Igual a uma ameaça mantida (caixa e espaços à parte): não entra de novo
+                        ameaca("Spoofing", "token  ROUBADO")],
+        "update_threats": [{**ameaca("Tampering", "Pedido alterado em trânsito"), "id": 1},
+                           {**ameaca("Tampering", "Fora da lista"), "id": 9}],
+        "retire_threats": [2, 7]
+    })
+
+    modelo, contagens = aplicar_delta(anterior, resposta)
+    assert [(a.threat_type, a.scenario) for a in modelo.threat_model] == [
+        ("Spoofing", "Token roubado"), ("Spoofing", "Chave de API vazada"), ("Tampering", "Pedido alterado em trânsito")
+    ]
+    assert contagens == {"added": 1, "updated": 1, "retired": 1}
+    # A resposta não trouxe sugestões: as da revisão anterior são mantidas
+    assert modelo.improvement_suggestions == ["Usar MFA"]
+
+
+def test_ameaca_atualizada_e_retirada_conta_so_como_retirada():
+    anterior = {"threat_model": [ameaca("Spoofing", "Token roubado")]}
+    resposta = RespostaDelta.model_validate({
+        "update_threats": [{**ameaca("Spoofing", "Token reutilizado"), "id": 0}], "retire_threats": [0],
+        "improvement_suggestions": ["Rotacionar tokens"]
+    })
+    modelo, contagens = aplicar_delta(anterior, resposta)
+    assert modelo.threat_model == []
+    assert contagens == {"added": 0, "updated": 0, "retired": 1}
+    assert modelo.improvement_suggestions == ["Rotacionar tokens"]
@@ -0,0 +1,50 @@
+"""
+Testes do índice de diagramas semelhantes (sem servidor nem Azure)
+
+Uso:
+    cd module-1/01-introducao-backend && python -m pytest -q test_similaridade.py
+"""
+
+import pytest
+
+from similaridade import IndiceDiagramas, IndiceHamming
+
+BASE = 0x0123456789ABCDEF
+FORMULARIO = {"tipo_aplicacao": "API", "autenticacao": "OAuth", "acesso_internet": "Sim",
+              "dados_sensiveis": "Nenhum", "descricao_aplicacao": "Serviço de teste"}
+
+
+def trocar_bits(valor, quantidade, blocos=4, largura=16):
+    """Troca `quantidade` bits espalhados o mais igualmente possível entre os blocos"""
+    for i in range(quantidade):
+        valor ^= 1 << ((i % blocos) * largura + i // blocos)
+    return valor
+
+
+@pytest.mark.parametrize("raio", [0, 3, 4, 7, 8, 11])
+def test_busca_inclui_a_distancia_do_raio_e_exclui_a_seguinte(raio):
+    indice = IndiceHamming()
+    indice.adicionar(trocar_bits(BASE, raio), "no_limite")
+    indice.adicionar(trocar_bits(BASE, raio + 1), "fora")
+    assert indice.buscar(BASE, raio) == [(raio, "no_limite")]
+
+
+def test_busca_ordena_do_mais_proximo_ao_mais_distante():
+    indice = IndiceHamming()
+    for distancia in (5, 0, 2):
+        indice.adicionar(trocar_bits(BASE, distancia), distancia)
+    assert indice.buscar(BASE, 7) == [(0, 0), (2, 2), (5, 5)]
+
+
+def test_worker_encontra_analise_gravada_por_outro(tmp_path):
+    caminho = str(tmp_path / "similares.db")
+    primeiro, segundo = IndiceDiagramas(caminho), IndiceDiagramas(caminho)
+    identificador = primeiro.adicionar(BASE, FORMULARIO, {"threat_model": []})
+
+    correspondencia = segundo.buscar(trocar_bits(BASE, 2), FORMULARIO, 4, 0.9)
+    assert (correspondencia.id, correspondencia.distancia) == (identificador, 2)
+    # A própria gravação não entra duas vezes no índice em memória
+    segundo.adicionar(BASE, FORMULARIO, {"threat_model": []})
+    assert segundo.estatisticas()["diagramas"] == 2
+    primeiro.fechar()
+    segundo.fechar()